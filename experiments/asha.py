@@ -0,0 +1,268 @@
+from context import utils
+
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from sweep import JobRunner, MAIN_SCRIPT, get_available_cores
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-base_config', type=str, help='path to base configuration file for maml experiment', default='configs/base_config.yaml')
+parser.add_argument('-asha_config', type=str, help='path to successive halving configuration file (search space, budgets, resources)', default='configs/asha_config.yaml')
+parser.add_argument('-asha_dir', type=str, help='folder of existing search to resume (its ledger and configuration are used)', default=None)
+parser.add_argument('-workers', type=int, help='number of trials trained concurrently (overrides asha config)', default=None)
+
+LEDGER_FILE = "asha_ledger.json"
+
+# trial statuses: paused trials wait at their last completed rung for promotion
+RUNNING, PAUSED, INTERRUPTED, COMPLETED, FAILED = "running", "paused", "interrupted", "completed", "failed"
+
+
+def sample_configuration(search_space: Dict[str, Any], random_state: np.random.RandomState) -> Dict[str, Any]:
+    """
+    Sample configuration from search space. Values of search space are either lists (sampled uniformly),
+    or dictionaries {uniform: [low, high]} / {log_uniform: [low, high]} for continuous ranges.
+
+    :param search_space: mapping from (dotted) configuration key to its range
+    :param random_state: numpy random state used for sampling
+
+    :return configuration: mapping from (dotted) configuration key to a single value
+    """
+    configuration = {}
+    for key in sorted(search_space.keys()):
+        value_range = search_space[key]
+        if isinstance(value_range, list):
+            configuration[key] = value_range[random_state.randint(len(value_range))]
+        elif "uniform" in value_range:
+            configuration[key] = float(random_state.uniform(*value_range["uniform"]))
+        elif "log_uniform" in value_range:
+            low, high = value_range["log_uniform"]
+            configuration[key] = float(math.exp(random_state.uniform(math.log(low), math.log(high))))
+        else:
+            raise ValueError("Range of {} not recognised. Use list of values, uniform or log_uniform".format(key))
+    return configuration
+
+def get_rung_budgets(min_iterations: int, max_iterations: int, reduction_factor: int) -> List[int]:
+    """
+    Training iterations (total) after which trials are compared at each rung: min_iterations,
+    min_iterations * reduction_factor, ... up to max_iterations
+
+    :param min_iterations: budget of first rung
+    :param max_iterations: budget of last rung
+    :param reduction_factor: ratio of budgets of consecutive rungs (and inverse of fraction of trials promoted)
+
+    :return budgets: budget of each rung
+    """
+    budgets = [min_iterations]
+    while budgets[-1] * reduction_factor < max_iterations:
+        budgets.append(budgets[-1] * reduction_factor)
+    if budgets[-1] < max_iterations:
+        budgets.append(max_iterations)
+    return budgets
+
+
+class AshaScheduler(JobRunner):
+    """
+    Asynchronous successive halving (ASHA). Each trial (sampled configuration) is trained for the budget of the
+    first rung and its validation loss (MAML.validate at the end of the rung) recorded. Whenever a worker is free,
+    a trial in the best 1/reduction_factor of the losses recorded at its rung is promoted: its run is resumed from
+    its run state and trained on to the budget of the next rung. Otherwise a new trial is started. Trials that
+    are not promoted stay paused (their run state is kept, they may still be promoted as further trials complete).
+    """
+    def __init__(self, asha_dir: str, base_config: str, asha_params: Dict, workers: int, cores_per_job: int):
+        super().__init__(base_config=base_config, workers=workers, cores_per_job=cores_per_job)
+        self.asha_dir = asha_dir
+        self.asha_params = asha_params
+        self.reduction_factor = asha_params["reduction_factor"]
+        self.num_trials = asha_params["num_trials"]
+        self.budgets = get_rung_budgets(asha_params["min_iterations"], asha_params["max_iterations"], self.reduction_factor)
+
+        self.path = os.path.join(asha_dir, LEDGER_FILE)
+        self._condition = threading.Condition()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self._ledger = json.load(f)
+            # trials running when search was stopped are continued (from their run state) first
+            for trial in self._ledger["trials"].values():
+                if trial["status"] == RUNNING:
+                    trial["status"] = INTERRUPTED
+        else:
+            self._ledger = {"asha": asha_params, "budgets": self.budgets, "trials": {}}
+        self._random_state = np.random.RandomState(asha_params.get("seed", 0))
+        # advance sampler past trials already started, so that a resumed search samples the same configurations
+        for _ in range(len(self._ledger["trials"])):
+            sample_configuration(asha_params["search_space"], self._random_state)
+        self._write()
+
+    def _write(self) -> None:
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self._ledger, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def _get_promotable_trial(self) -> Optional[Tuple[Dict[str, Any], int]]:
+        """paused trial in best 1/reduction_factor of losses at its rung (highest rung first)"""
+        trials = self._ledger["trials"].values()
+        for rung in reversed(range(len(self.budgets) - 1)):
+            rung_losses = sorted((trial["losses"][rung], trial["trial_id"]) for trial in trials if len(trial["losses"]) > rung)
+            for _, trial_id in rung_losses[:len(rung_losses) // self.reduction_factor]:
+                trial = self._ledger["trials"][trial_id]
+                if trial["status"] == PAUSED and trial["rung"] == rung:
+                    return trial, rung + 1
+        return None
+
+    def _get_job(self) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Next (trial, rung) to train: interrupted trials, then promotions, then new trials (None if none available now)
+        """
+        for trial in self._ledger["trials"].values():
+            if trial["status"] == INTERRUPTED:
+                return trial, trial["rung"] + 1
+        promotion = self._get_promotable_trial()
+        if promotion is not None:
+            return promotion
+        if len(self._ledger["trials"]) < self.num_trials:
+            trial_id = "trial_{}".format(len(self._ledger["trials"]))
+            trial = {
+                "trial_id": trial_id, "configuration": sample_configuration(self.asha_params["search_space"], self._random_state),
+                "rung": -1, "losses": [], "status": PAUSED
+                }
+            self._ledger["trials"][trial_id] = trial
+            return trial, 0
+        return None
+
+    def _get_command(self, trial: Dict[str, Any], rung: int, trial_dir: str) -> List[str]:
+        if os.path.exists(os.path.join(trial_dir, utils.run_state.RUN_STATE_FILE)):
+            # continue training of paused (or interrupted) trial from its run state
+            command = [sys.executable, MAIN_SCRIPT, "-resume", trial_dir]
+        else:
+            job_config = self.write_job_config(self.asha_params["config"], trial["configuration"], trial_dir)
+            command = [
+                sys.executable, MAIN_SCRIPT, "-base_config", self.base_config, "-config", job_config,
+                "-framework", self.asha_params.get("framework", "jax"), "-checkpoint_path", trial_dir
+                ]
+        return command + ["-training_iterations", str(self.budgets[rung]), "-final_validation"]
+
+    def _run_trial(self, trial: Dict[str, Any], rung: int) -> None:
+        """train trial to budget of rung and record its validation loss"""
+        trial_id = trial["trial_id"]
+        trial_dir = os.path.join(self.asha_dir, trial_id, '')
+        os.makedirs(trial_dir, exist_ok=True)
+
+        # metrics of previous rung must not be mistaken for those of this one
+        metrics_path = os.path.join(trial_dir, utils.run_state.METRICS_FILE)
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+
+        return_code = self.run_process("{} (rung {}, {} iterations)".format(trial_id, rung, self.budgets[rung]), self._get_command(trial, rung, trial_dir), trial_dir)
+
+        with self._condition:
+            if return_code == 0 and os.path.exists(metrics_path):
+                with open(metrics_path, 'r') as f:
+                    loss = json.load(f)["final_validation_loss"]
+                trial["losses"].append(loss)
+                trial["rung"] = rung
+                trial["status"] = COMPLETED if rung == len(self.budgets) - 1 else PAUSED
+                print("--- {} rung {}: validation loss {:.4f}".format(trial_id, rung, loss))
+            elif return_code is None or self.stop_requested:
+                # stopped by search (not started or forwarded SIGTERM), continued when search is resumed
+                trial["status"] = INTERRUPTED
+            else:
+                trial["status"] = FAILED
+                print("--- {} failed (return code {}, see {})".format(trial_id, return_code, os.path.join(trial_dir, "log.txt")))
+            self._write()
+            self._condition.notify_all()
+
+    def _worker(self) -> None:
+        while not self.stop_requested:
+            with self._condition:
+                job = self._get_job()
+                while job is None:
+                    # nothing to start until a running trial completes its rung (or no work is left at all)
+                    if not any(trial["status"] == RUNNING for trial in self._ledger["trials"].values()) or self.stop_requested:
+                        return
+                    self._condition.wait(timeout=1.)
+                    job = self._get_job()
+                trial, rung = job
+                trial["status"] = RUNNING
+                self._write()
+            self._run_trial(trial, rung)
+
+    def run(self) -> None:
+        """Run search until all trials are completed or paused without prospect of promotion"""
+        print("Successive halving: {} trials, rung budgets {}, {} workers ({} core(s) each)".format(
+            self.num_trials, self.budgets, self.workers, self.cores_per_job
+            ))
+        self.install_signal_handlers()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._worker) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+
+    def trials(self) -> List[Dict[str, Any]]:
+        """trials ordered by rung reached (highest first) and loss at that rung"""
+        trials = list(self._ledger["trials"].values())
+        return sorted(trials, key=lambda trial: (-trial["rung"], trial["losses"][-1] if trial["losses"] else float("inf")))
+
+    def iterations_trained(self) -> int:
+        """total training iterations over all trials"""
+        return sum(self.budgets[trial["rung"]] for trial in self._ledger["trials"].values() if trial["rung"] >= 0)
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.asha_dir:
+        # resume search with configuration stored in its ledger
+        asha_dir = args.asha_dir
+        with open(os.path.join(asha_dir, LEDGER_FILE), 'r') as f:
+            asha_params = json.load(f)["asha"]
+    else:
+        with open(args.asha_config, 'r') as yaml_file:
+            asha_params = yaml.load(yaml_file, yaml.SafeLoader)
+        exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        asha_dir = os.path.abspath('results/asha/{}/'.format(exp_timestamp))
+    os.makedirs(asha_dir, exist_ok=True)
+
+    cores_per_job = asha_params.get("cores_per_job") or 1
+    workers = args.workers or asha_params.get("workers") or max(len(get_available_cores()) // cores_per_job, 1)
+
+    scheduler = AshaScheduler(asha_dir, base_config=args.base_config, asha_params=asha_params, workers=workers, cores_per_job=cores_per_job)
+    t0 = time.time()
+    scheduler.run()
+    search_time = time.time() - t0
+
+    trials = scheduler.trials()
+    full_budget = scheduler.num_trials * scheduler.budgets[-1]
+    with open(os.path.join(asha_dir, "asha_results.json"), 'w') as f:
+        json.dump({
+            "asha": asha_params, "budgets": scheduler.budgets, "search_time": search_time,
+            "iterations_trained": scheduler.iterations_trained(), "full_budget": full_budget, "trials": trials
+            }, f, indent=2)
+
+    print("\n{:<12}{:>6}{:>12}{:>12}  {}".format("trial", "rung", "iterations", "val loss", "configuration"))
+    for trial in trials:
+        print("{:<12}{:>6}{:>12}{:>12}  {}".format(
+            trial["trial_id"], trial["rung"], scheduler.budgets[trial["rung"]] if trial["rung"] >= 0 else 0,
+            "{:.4f}".format(trial["losses"][-1]) if trial["losses"] else "-",
+            ",".join("{}={}".format(key, value) for key, value in sorted(trial["configuration"].items()))
+            ))
+    print("Trained {} iterations ({:.0f}% of training every trial to {} iterations) in {:.1f}s, results written to {}".format(
+        scheduler.iterations_trained(), 100 * scheduler.iterations_trained() / full_budget, scheduler.budgets[-1], search_time, asha_dir
+        ))
+    if any(trial["status"] in (INTERRUPTED, RUNNING) for trial in trials) or len(trials) < scheduler.num_trials:
+        print("Search not finished, resume with: python asha.py -asha_dir {}".format(asha_dir))
+        sys.exit(1)
@@ -0,0 +1,256 @@
+from context import maml, utils, jax_maml
+
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+import datetime
+
+import numpy as np
+import torch
+import yaml
+
+from typing import Any, Dict, List
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-base_config', type=str, help='path to base configuration file for maml experiment', default='configs/base_config.yaml')
+parser.add_argument('-benchmark_config', type=str, help='path to benchmark configuration file (grid and iteration counts)', default='configs/benchmark_config.yaml')
+parser.add_argument('-output', type=str, help='path to which json results are written (default results/benchmarks/benchmark_<timestamp>.json)', default=None)
+parser.add_argument('-baseline', type=str, help='path to stored json results against which to check for regressions', default=None)
+parser.add_argument('-tolerance', type=float, help='fractional drop in steps/s flagged as regression (overrides benchmark config)', default=None)
+
+# sample_type grid value denoting vanilla (uniform) maml without priority queue
+UNIFORM_SAMPLE_TYPE = 'uniform'
+
+
+def get_run_id(run: Dict[str, Any]) -> str:
+    """
+    Unique, human readable identifier of benchmark configuration (used to match against baseline)
+
+    :param run: mapping from grid key to value for this run
+    :return run_id: identifier string
+    """
+    return ",".join("{}={}".format(key, run[key]) for key in sorted(run.keys()))
+
+def get_run_parameters(base_params: Dict, run: Dict[str, Any], seed: int, checkpoint_path: str) -> utils.parameters.MAMLParameters:
+    """
+    Construct experiment parameters for a single benchmark run
+
+    :param base_params: base configuration dictionary
+    :param run: mapping from grid key to value for this run
+    :param seed: random seed
+    :param checkpoint_path: path to which run outputs (logs, configuration) are written
+
+    :return maml_parameters: parameters object for run
+    """
+    run = dict(run)
+    framework = run.pop("framework", "jax")
+    sample_type = run.pop("sample_type", UNIFORM_SAMPLE_TYPE)
+
+    maml_parameters = utils.parameters.MAMLParameters(copy.deepcopy(base_params))
+    maml_parameters.update(utils.parameters.nested_dict_from_dotted(run))
+
+    specific_params = {
+        "seed": seed,
+        "validation_frequency": sys.maxsize, # no validation/checkpointing during benchmark
+        "profiling": {"enabled": True, "summary_frequency": sys.maxsize, "trace": False}
+        }
+    if sample_type == UNIFORM_SAMPLE_TYPE:
+        specific_params["priority_sample"] = False
+    else:
+        specific_params["priority_sample"] = True
+        specific_params["priority_queue"] = {"sample_type": sample_type, "epsilon_decay_start": 0}
+    maml_parameters.update(specific_params)
+
+    maml_parameters.set_property("checkpoint_path", checkpoint_path)
+    maml_parameters.set_property("framework", framework)
+    maml_parameters.set_property("device", "cpu")
+
+    return maml_parameters
+
+def get_model(maml_parameters: utils.parameters.MAMLParameters):
+    """
+    Instantiate model of framework given in parameters
+
+    :param maml_parameters: parameters object for run
+    :return model: MAML model
+    """
+    device = torch.device("cpu")
+    framework = maml_parameters.get("framework")
+    if framework not in ['jax', 'pytorch']:
+        raise ValueError("Invalid framework {}. Use 'jax' or 'pytorch'".format(framework))
+    if maml_parameters.get("task_type") == 'quadratic':
+        if framework == 'pytorch':
+            raise NotImplementedError("Quadratic tasks are only benchmarked with the jax framework")
+        return jax_maml.jax_quadratic.QuadraticMAML(maml_parameters, device)
+    if framework == 'pytorch':
+        return maml.sinusoid.SineMAML(maml_parameters, device)
+    return jax_maml.jax_sinusoid.SineMAML(maml_parameters, device)
+
+def benchmark_run(maml_parameters: utils.parameters.MAMLParameters, warmup_iterations: int, timed_iterations: int) -> Dict[str, Any]:
+    """
+    Run short training with fixed seed: warm-up steps (including compilation) followed by timed steady-state steps
+    and a final (untimed) validation.
+
+    :param maml_parameters: parameters object for run
+    :param warmup_iterations: number of warm-up training steps
+    :param timed_iterations: number of training steps to measure steady state throughput over
+
+    :return result: timing metrics of run
+    """
+    seed_value = maml_parameters.get("seed")
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+    torch.manual_seed(seed_value)
+
+    # runs are sequential in this process, each sets jax x64 mode of its precision before its model is built
+    if maml_parameters.get("framework") == 'jax':
+        jax_maml.jax_model.MAML.configure_process(maml_parameters)
+
+    t0 = time.perf_counter()
+    model = get_model(maml_parameters)
+    initialisation_time = time.perf_counter() - t0
+
+    # start from step 1 so that no step-0 validation is triggered
+    model.start_iteration = 1
+    model.training_iterations = warmup_iterations
+    t0 = time.perf_counter()
+    model.train()
+    warmup_time = time.perf_counter() - t0
+    warmup_phases = model.profiler.last_summary["phases"] if model.profiler.last_summary else {}
+
+    model.start_iteration = 1 + warmup_iterations
+    model.training_iterations = timed_iterations
+    t0 = time.perf_counter()
+    model.train()
+    steady_time = time.perf_counter() - t0
+    steady_phases = model.profiler.last_summary["phases"] if model.profiler.last_summary else {}
+
+    steady_step_time = steady_time / timed_iterations
+
+    # quality of model trained at this setting (e.g. precision), not included in timings
+    model.validate(step_count=model.start_iteration + timed_iterations, visualise=False)
+
+    return {
+        "initialisation_time": initialisation_time,
+        "warmup_time": warmup_time,
+        # time spent in warm-up in excess of steady state (tracing/compilation, caches, allocation)
+        "compile_time": max(warmup_time - warmup_iterations * steady_step_time, 0.),
+        "compile_phase_time": warmup_phases.get("compile", {}).get("total", 0.),
+        "steady_time": steady_time,
+        "steady_step_time": steady_step_time,
+        "steady_steps_per_second": timed_iterations / steady_time,
+        "steady_phase_means": {name: phase["mean"] for name, phase in steady_phases.items()},
+        "final_validation_loss": model.last_validation_loss
+        }
+
+def check_regressions(results: List[Dict], baseline_results: List[Dict], tolerance: float) -> List[Dict]:
+    """
+    Compare steady state throughput against baseline
+
+    :param results: results of this benchmark
+    :param baseline_results: stored results of a previous benchmark
+    :param tolerance: fractional drop in steps/s flagged as regression
+
+    :return regressions: list of runs slower than baseline by more than tolerance
+    """
+    baseline_by_id = {result["run_id"]: result for result in baseline_results if result.get("status") == "ok"}
+    regressions = []
+    for result in results:
+        baseline = baseline_by_id.get(result["run_id"])
+        if baseline is None or result.get("status") != "ok":
+            continue
+        ratio = result["steady_steps_per_second"] / baseline["steady_steps_per_second"]
+        result["baseline_ratio"] = ratio
+        if ratio < 1. - tolerance:
+            regressions.append({"run_id": result["run_id"], "ratio": ratio})
+    return regressions
+
+def get_environment() -> Dict[str, str]:
+    """versions of interpreter and frameworks used in benchmark"""
+    environment = {"python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__, "torch": torch.__version__}
+    try:
+        import jax
+        environment["jax"] = jax.__version__
+    except ImportError:
+        pass
+    return environment
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    # base parameters common to all configs
+    with open(args.base_config, 'r') as base_yaml_file:
+        base_params = yaml.load(base_yaml_file, yaml.SafeLoader)
+
+    # benchmark specification
+    with open(args.benchmark_config, 'r') as yaml_file:
+        benchmark_params = yaml.load(yaml_file, yaml.SafeLoader)
+
+    tolerance = args.tolerance if args.tolerance is not None else benchmark_params.get("tolerance", 0.1)
+
+    exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+    results_path = 'results/benchmarks/{}/'.format(exp_timestamp)
+    output_path = args.output or os.path.join('results/benchmarks', 'benchmark_{}.json'.format(exp_timestamp))
+
+    runs = utils.parameters.expand_grid(benchmark_params["grid"])
+    results = []
+
+    for r, run in enumerate(runs):
+        run_id = get_run_id(run)
+        print("=== benchmark run {}/{}: {}".format(r + 1, len(runs), run_id))
+        result = {"run_id": run_id, "configuration": run}
+        try:
+            maml_parameters = get_run_parameters(
+                base_params, run, seed=benchmark_params["seed"], checkpoint_path=os.path.join(results_path, str(r), '')
+                )
+            result.update(benchmark_run(
+                maml_parameters, warmup_iterations=benchmark_params["warmup_iterations"], timed_iterations=benchmark_params["timed_iterations"]
+                ))
+            result["status"] = "ok"
+            print("--- {:.2f} steps/s (compile {:.2f}s), validation loss {:.4f}".format(
+                result["steady_steps_per_second"], result["compile_time"], result["final_validation_loss"]
+                ))
+        except Exception as e:
+            # record failure and continue with remaining configurations
+            result["status"] = "error"
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+            print("--- failed: {}".format(result["error"]))
+        results.append(result)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline_results = json.load(f)["results"]
+        regressions = check_regressions(results, baseline_results, tolerance)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump({
+            "timestamp": exp_timestamp, "environment": get_environment(), "benchmark": benchmark_params,
+            "baseline": args.baseline, "tolerance": tolerance, "regressions": regressions, "results": results
+            }, f, indent=2)
+
+    print("\n{:<100}{:>12}{:>12}{:>12}{:>10}".format("run", "steps/s", "compile (s)", "val loss", "vs base"))
+    for result in results:
+        if result["status"] == "ok":
+            print("{:<100}{:>12.2f}{:>12.2f}{:>12.4f}{:>10}".format(
+                result["run_id"], result["steady_steps_per_second"], result["compile_time"], result["final_validation_loss"],
+                "{:.2f}".format(result["baseline_ratio"]) if "baseline_ratio" in result else "-"
+                ))
+        else:
+            print("{:<100}{:>12}".format(result["run_id"], "error"))
+    print("Results written to {}".format(output_path))
+
+    if regressions:
+        print("Regressions (> {:.0f}% slower than baseline):".format(100 * tolerance))
+        for regression in regressions:
+            print("  {} ({:.2f}x)".format(regression["run_id"], regression["ratio"]))
+        sys.exit(1)
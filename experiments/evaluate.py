@@ -0,0 +1,185 @@
+from context import utils, jax_maml
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+import datetime
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import yaml
+
+from typing import Dict, List, Tuple
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-checkpoints', type=str, nargs='+', help='jax model checkpoints (model_checkpoint_*.npy) or results folders (all checkpoints of run) to evaluate', required=True)
+parser.add_argument('-config', type=str, help='configuration of run that produced checkpoints (default config.yaml next to first checkpoint)', default=None)
+parser.add_argument('-resolution', type=int, nargs='+', help='number of grid points along each task parameter axis (amplitude, phase[, frequency] or quadratic, linear, constant)', default=[100, 100])
+parser.add_argument('-chunk_size', type=int, help='number of tasks adapted per compiled call (bounds memory)', default=4096)
+parser.add_argument('-k', type=int, nargs='+', help='numbers of examples for fine-tuning on each task, several evaluated in one pass on the same examples (default validation_k of run)', default=None)
+parser.add_argument('-num_inner_updates', type=int, help='number of fine-tuning steps (default validation_num_inner_updates of run)', default=None)
+parser.add_argument('-seed', type=int, help='seed from which examples of tasks are sampled (same tasks and examples for every checkpoint)', default=0)
+parser.add_argument('-slice_axis', type=str, help='task parameter along which 3d loss grids are sliced into heatmaps (default last, e.g. frequency or constant)', default=None)
+parser.add_argument('-num_slices', type=int, help='number of heatmap slices of 3d loss grids', default=4)
+parser.add_argument('-output_dir', type=str, help='folder to which losses and heatmaps are written (default results/evaluations/<timestamp>/)', default=None)
+
+# parameters of model used for evaluation: checkpoint parameters are passed to evaluate_task_grid, no training-only work
+EVALUATION_PARAMETERS = {
+    "priority_sample": False,
+    "resume": {"model": None, "priority_queue": None, "queue_counts": None, "run_state": None},
+    "async_validation": {"enabled": False},
+    "profiling": {"enabled": False},
+    "compilation": {"warm_up": False},
+    "population": {"enabled": False}
+    }
+
+
+def get_checkpoint_paths(paths: List[str]) -> List[str]:
+    """
+    Expand results folders into their model checkpoints (ordered by step)
+
+    :param paths: checkpoint files or folders
+    :return checkpoint_paths: checkpoint files
+    """
+    checkpoint_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            run_checkpoints = glob.glob(os.path.join(path, "model_checkpoint_*.npy"))
+            if not run_checkpoints:
+                raise FileNotFoundError("No model checkpoints in {}".format(path))
+            checkpoint_paths.extend(sorted(run_checkpoints, key=lambda p: int(re.findall(r"_(\d+)\.npy$", p)[0])))
+        elif os.path.isfile(path):
+            checkpoint_paths.append(path)
+        else:
+            raise FileNotFoundError("Checkpoint {} does not exist".format(path))
+    return checkpoint_paths
+
+def plot_heatmap(losses: np.ndarray, axes: Dict[str, np.ndarray], axis_names: Tuple[str, str], title: str):
+    """
+    Heatmap of 2d loss grid with task parameter values on axes (colour scale capped at 99th percentile of losses,
+    so that the few tasks on which fine-tuning diverges do not hide the structure of the rest)
+
+    :param losses: loss grid (first axis along axis_names[0])
+    :param axes: grid values of each task parameter
+    :param axis_names: names of task parameters along rows and columns of losses
+    :param title: title of figure
+
+    :return fig: matplotlib figure
+    """
+    row_values, column_values = axes[axis_names[0]], axes[axis_names[1]]
+    fig = plt.figure()
+    plt.imshow(
+        losses, origin='lower', aspect='auto', vmax=np.percentile(losses, 99),
+        extent=(column_values[0], column_values[-1], row_values[0], row_values[-1])
+        )
+    plt.colorbar(label="test loss after fine-tuning")
+    plt.xlabel(axis_names[1])
+    plt.ylabel(axis_names[0])
+    plt.title(title)
+    return fig
+
+def get_heatmaps(losses: np.ndarray, axes: Dict[str, np.ndarray], title: str, slice_axis: str, num_slices: int) -> Dict[str, object]:
+    """
+    Heatmaps of loss grid: the grid itself if 2d, otherwise num_slices slices at evenly spaced values of
+    slice_axis and the mean over slice_axis
+
+    :return figures: mapping from name to matplotlib figure
+    """
+    axis_names = list(axes.keys())
+    if losses.ndim == 2:
+        return {"heatmap": plot_heatmap(losses, axes, axis_names, title)}
+    if slice_axis not in axis_names:
+        raise ValueError("Slice axis {} is not a task parameter ({})".format(slice_axis, ", ".join(axis_names)))
+
+    dimension = axis_names.index(slice_axis)
+    heatmap_axes = [name for name in axis_names if name != slice_axis]
+    figures = {
+        "heatmap_{}_mean".format(slice_axis): plot_heatmap(losses.mean(axis=dimension), axes, heatmap_axes, "{} (mean over {})".format(title, slice_axis))
+        }
+    for index in np.unique(np.linspace(0, losses.shape[dimension] - 1, num_slices).round().astype(int)):
+        value = axes[slice_axis][index]
+        figures["heatmap_{}_{:.3f}".format(slice_axis, value)] = plot_heatmap(
+            np.take(losses, index, axis=dimension), axes, heatmap_axes, "{} ({} = {:.3f})".format(title, slice_axis, value)
+            )
+    return figures
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    checkpoint_paths = get_checkpoint_paths(args.checkpoints)
+    config_path = args.config or os.path.join(os.path.dirname(checkpoint_paths[0]), "config.yaml")
+    with open(config_path, 'r') as yaml_file:
+        maml_parameters = utils.parameters.MAMLParameters(yaml.load(yaml_file, yaml.SafeLoader))
+    if 'sin' in maml_parameters.get("task_type"):
+        model_class = jax_maml.jax_sinusoid.SineMAML
+    elif maml_parameters.get("task_type") == 'quadratic':
+        model_class = jax_maml.jax_quadratic.QuadraticMAML
+    else:
+        raise NotImplementedError("Dense task grid evaluation implemented for sinusoid and quadratic tasks only")
+
+    output_dir = args.output_dir or os.path.join(
+        "results", "evaluations", datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        )
+    maml_parameters.update(EVALUATION_PARAMETERS)
+    maml_parameters.update({"checkpoint_path": os.path.join(output_dir, '')})
+    k_values = args.k or [maml_parameters.get("validation_k")]
+
+    model_class.configure_process(maml_parameters)
+    model = model_class(maml_parameters, "cpu")
+    axes, task_parameters = model.get_task_parameter_grid(args.resolution)
+    slice_axis = args.slice_axis or list(axes.keys())[-1]
+    grid_shape = tuple(len(values) for values in axes.values())
+    print("Evaluating {} checkpoint(s) on grid of {} tasks ({}), k = {}".format(
+        len(checkpoint_paths), len(task_parameters), " x ".join("{} {}".format(n, name) for name, n in zip(axes.keys(), grid_shape)),
+        ", ".join(map(str, k_values))
+        ))
+    # every task once per k, padded to largest k in shared chunks; equal task indices give the same examples, so
+    # losses of different k differ by number of fine-tuning examples only
+    task_indices = np.repeat(np.arange(len(task_parameters)), len(k_values))
+    support_counts = np.tile(np.array(k_values, dtype=np.int32), len(task_parameters)) if args.k else None
+
+    summary = []
+    for checkpoint_path in checkpoint_paths:
+        model_checkpoint = np.load(checkpoint_path, allow_pickle=True)[()]
+        step = model_checkpoint["step"]
+        name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+
+        t0 = time.time()
+        # (last axis over k)
+        losses = model.evaluate_task_grid(
+            model_checkpoint["network_parameters"], np.repeat(task_parameters, len(k_values), axis=0), seed=args.seed,
+            chunk_size=args.chunk_size, num_inner_updates=args.num_inner_updates, support_counts=support_counts, task_indices=task_indices
+            ).reshape(grid_shape + (len(k_values),))
+        evaluation_time = time.time() - t0
+
+        np.savez(os.path.join(output_dir, "{}_losses.npz".format(name)), losses=losses, step=step, k=np.array(k_values), **axes)
+        checkpoint_summary = {
+            "checkpoint": checkpoint_path, "step": int(step), "evaluation_time": evaluation_time, "tasks_per_second": losses.size / evaluation_time
+            }
+        for i, k in enumerate(k_values):
+            k_losses = losses[..., i]
+            suffix = "_k{}".format(k) if len(k_values) > 1 else ""
+            for figure_name, fig in get_heatmaps(k_losses, axes, "step {}, k = {}".format(step, k), slice_axis, args.num_slices).items():
+                fig.savefig(os.path.join(output_dir, "{}_{}{}.png".format(name, figure_name, suffix)))
+                model.writer.add_figure("evaluation/{}{}".format(figure_name, suffix), fig, step)
+            model.writer.add_scalar('evaluation/grid_loss_mean{}'.format(suffix), float(k_losses.mean()), step)
+            checkpoint_summary["k{}".format(k)] = {
+                "loss_mean": float(k_losses.mean()), "loss_std": float(k_losses.std()), "loss_max": float(k_losses.max())
+                }
+            print("step {:>8}, k = {:>3}: mean loss {:.4f} (std {:.4f}, max {:.4f})".format(
+                step, k, k_losses.mean(), k_losses.std(), k_losses.max()
+                ))
+        summary.append(checkpoint_summary)
+        print("step {:>8}: {:.1f}s ({:.0f} tasks/s)".format(step, evaluation_time, checkpoint_summary["tasks_per_second"]))
+
+    model.writer.close()
+    with open(os.path.join(output_dir, "evaluation_summary.json"), 'w') as f:
+        json.dump({"resolution": list(grid_shape), "k": k_values, "seed": args.seed, "checkpoints": summary}, f, indent=2)
@@ -0,0 +1,123 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+
+from typing import Any, Dict, List
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-host', type=str, help='address of adaptation server (serve.py)', default='127.0.0.1')
+parser.add_argument('-port', type=int, help='port of adaptation server', default=8080)
+parser.add_argument('-concurrency', type=int, nargs='+', help='numbers of concurrent clients to measure (one after the other)', default=[1, 4, 16, 64])
+parser.add_argument('-duration', type=float, help='measured time (s) per concurrency level', default=10.)
+parser.add_argument('-warm_up', type=float, help='unmeasured time (s) before first level (compilation of executables)', default=5.)
+parser.add_argument('-k', type=int, nargs='+', help='numbers of support points of requests (drawn uniformly per request, several for mixed support set sizes)', default=[10])
+parser.add_argument('-num_queries', type=int, help='number of query points per request', default=100)
+parser.add_argument('-num_steps', type=int, help='number of fine-tuning steps per request', default=5)
+parser.add_argument('-support_pool', type=int, help='number of distinct support sets resent by clients (new query points each time), 0 for a new support set per request', default=0)
+parser.add_argument('-amplitude_bounds', type=float, nargs=2, help='range of amplitudes of requested sines', default=[0.1, 5.])
+parser.add_argument('-phase_bounds', type=float, nargs=2, help='range of phases (radians) of requested sines', default=[0., np.pi])
+parser.add_argument('-domain_bounds', type=float, nargs=2, help='range of support and query points', default=[-5., 5.])
+parser.add_argument('-seed', type=int, default=0)
+parser.add_argument('-output', type=str, help='path to which json results are written', default=None)
+
+
+def get_request(rng: np.random.RandomState, args) -> Dict[str, Any]:
+    """
+    Request for random sine task: support and query points with the true values at the query points (not sent).
+    With a support pool, task and support points are one of support_pool fixed sets (e.g. repeatedly sent sensor windows).
+    """
+    task_rng = np.random.RandomState([args.seed, rng.randint(args.support_pool)]) if args.support_pool else rng
+    amplitude = task_rng.uniform(*args.amplitude_bounds)
+    phase = task_rng.uniform(*args.phase_bounds)
+    support_x = task_rng.uniform(*args.domain_bounds, size=(task_rng.choice(args.k), 1))
+    query_x = rng.uniform(*args.domain_bounds, size=(args.num_queries, 1))
+    return {
+        "support_x": support_x.tolist(), "support_y": (amplitude * np.sin(phase + support_x)).tolist(), "query_x": query_x.tolist(),
+        "num_steps": args.num_steps, "query_y_true": amplitude * np.sin(phase + query_x)
+        }
+
+def client(args, seed: int, stop_time: float, latencies: List[float], errors: List[float]) -> None:
+    """send requests one after the other on one connection until stop_time, recording latency and prediction error of each"""
+    rng = np.random.RandomState(seed)
+    connection = http.client.HTTPConnection(args.host, args.port)
+    while time.perf_counter() < stop_time:
+        request = get_request(rng, args)
+        query_y_true = request.pop("query_y_true")
+        t0 = time.perf_counter()
+        # (body as bytes is sent in the same packet as the headers)
+        connection.request("POST", "/predict", body=json.dumps(request).encode(), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        content = json.loads(response.read())
+        latencies.append(time.perf_counter() - t0)
+        if response.status != 200:
+            raise RuntimeError("Request failed ({}): {}".format(response.status, content.get("error")))
+        errors.append(float(np.mean((np.array(content["query_y"]) - query_y_true) ** 2)))
+    connection.close()
+
+def run_level(args, concurrency: int, duration: float, seed: int) -> Dict[str, Any]:
+    """
+    Load server with concurrency clients for duration seconds
+
+    :return results: client side latency percentiles (ms), throughput (requests/s) and mean squared prediction
+                     error, with server side statistics (e.g. mean batch size) of the same period
+    """
+    latencies, errors = [], []
+    stop_time = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(args, seed + i, stop_time, latencies, errors)) for i in range(concurrency)
+        ]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies = 1000 * np.array(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p90_ms": float(np.percentile(latencies, 90)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+        "prediction_mse": float(np.mean(errors)),
+        "server": get_server_statistics(args, reset=True)
+        }
+
+def get_server_statistics(args, reset: bool=False) -> Dict[str, Any]:
+    connection = http.client.HTTPConnection(args.host, args.port)
+    connection.request("GET", "/stats?reset={}".format(int(reset)))
+    statistics = json.loads(connection.getresponse().read())
+    connection.close()
+    return statistics
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.warm_up:
+        run_level(args, concurrency=max(args.concurrency), duration=args.warm_up, seed=args.seed)
+
+    results = []
+    print("{:>11} {:>9} {:>10} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}".format(
+        "concurrency", "requests", "req/s", "p50 ms", "p90 ms", "p99 ms", "batch size", "cache hits", "mse"
+        ))
+    for level, concurrency in enumerate(args.concurrency):
+        result = run_level(args, concurrency, args.duration, seed=args.seed + 1000 * (level + 1))
+        results.append(result)
+        print("{:>11} {:>9} {:>10.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f} {:>10.2f} {:>10.4f}".format(
+            concurrency, result["requests"], result["throughput"], result["latency_p50_ms"], result["latency_p90_ms"],
+            result["latency_p99_ms"], result["server"].get("mean_batch_size", float("nan")),
+            result["server"].get("cache_hit_rate") or 0., result["prediction_mse"]
+            ))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
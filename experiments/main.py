@@ -2,6 +2,7 @@
 from context import maml, utils, jax_maml
 
 import argparse
+import os
 import torch
 import yaml
 import time
@@ -12,37 +13,58 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-base_config', type=str, help='path to base configuration file for maml experiment', default='configs/base_config.yaml')
 parser.add_argument('-config', type=str, help='path to specific configuration file for maml experiment')
 parser.add_argument('-framework', type=str, help='jax or pytorch model', default='jax')
+parser.add_argument('-checkpoint_path', type=str, help='folder to which results are written (default results/<timestamp>/<experiment_name>/)', default=None)
+parser.add_argument('-final_validation', action='store_true', help='validate (without visualisation) once more at the end of training')
+parser.add_argument('-training_iterations', type=int, help='total number of training iterations (overrides config, also when resuming)', default=None)
+parser.add_argument('-resume', type=str, help='results folder of (pre-empted) run to resume from its run state (config and framework of that run are used)', default=None)
 
 args = parser.parse_args()
 
 if __name__ == "__main__":
 
-    # base parameters common to all configs
-    with open(args.base_config, 'r') as base_yaml_file:
-        base_params = yaml.load(base_yaml_file, yaml.SafeLoader)
+    if args.resume:
+        # configuration of run to resume, results continue to be written to its folder
+        with open(os.path.join(args.resume, 'config.yaml'), 'r') as resume_yaml_file:
+            resume_params = yaml.load(resume_yaml_file, yaml.SafeLoader)
 
-    # specific parameters
-    with open(args.config, 'r') as yaml_file:
-        specific_params = yaml.load(yaml_file, yaml.SafeLoader)
+        maml_parameters = utils.parameters.MAMLParameters(resume_params)
+        maml_parameters.update({"resume": {"run_state": os.path.join(args.resume, utils.run_state.RUN_STATE_FILE)}})
+        args.framework = maml_parameters.get("framework")
 
-    maml_parameters = utils.parameters.MAMLParameters(base_params) # create object in which to store experiment parameters
+    else:
+        # base parameters common to all configs
+        with open(args.base_config, 'r') as base_yaml_file:
+            base_params = yaml.load(base_yaml_file, yaml.SafeLoader)
 
-    # update base maml parameters with specific parameters
-    maml_parameters.update(specific_params)
+        # specific parameters
+        with open(args.config, 'r') as yaml_file:
+            specific_params = yaml.load(yaml_file, yaml.SafeLoader)
 
-    exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
-    experiment_name = maml_parameters.get("experiment_name")
-    if experiment_name:
-        checkpoint_path = 'results/{}/{}/'.format(exp_timestamp, experiment_name)
-    else:
-        checkpoint_path = 'results/{}/'.format(exp_timestamp)
-    maml_parameters.set_property("checkpoint_path", checkpoint_path)
-    maml_parameters.set_property("experiment_timestamp", exp_timestamp)
-    maml_parameters.set_property("framework", args.framework)
+        maml_parameters = utils.parameters.MAMLParameters(base_params) # create object in which to store experiment parameters
+
+        # update base maml parameters with specific parameters
+        maml_parameters.update(specific_params)
+
+        exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        experiment_name = maml_parameters.get("experiment_name")
+        if args.checkpoint_path:
+            checkpoint_path = os.path.join(args.checkpoint_path, '')
+        elif experiment_name:
+            checkpoint_path = 'results/{}/{}/'.format(exp_timestamp, experiment_name)
+        else:
+            checkpoint_path = 'results/{}/'.format(exp_timestamp)
+        maml_parameters.set_property("checkpoint_path", checkpoint_path)
+        maml_parameters.set_property("experiment_timestamp", exp_timestamp)
+        maml_parameters.set_property("framework", args.framework)
+
+    # e.g. budget of successive-halving rung, a resumed run continues until this total
+    if args.training_iterations is not None:
+        maml_parameters.update({"training_iterations": args.training_iterations})
 
     seed_value = maml_parameters.get("seed")
     
-    # TODO: set seeds correctly, does it need to be done separately for each script? Look at script dependencies
+    # global generators (pytorch models and any code without generator of its own); jax models draw from
+    # counter-based streams of the seed instead (see utils.prng)
     import random
     import numpy as np
     import torch
@@ -53,25 +75,64 @@ if __name__ == "__main__":
     
     if torch.cuda.is_available() and maml_parameters.get('use_gpu'):
         print("Using the GPU")
-        maml_parameters.set_property("device", "cuda")
+        maml_parameters.update({"device": "cuda"})
         experiment_device = torch.device("gpu")
     else:
         print("Using the CPU")
-        maml_parameters.set_property("device", "cpu")
+        maml_parameters.update({"device": "cpu"})
         experiment_device = torch.device("cpu")
 
+    # process-wide settings (jax x64 mode of precision) before any model is constructed
+    if args.framework == 'jax':
+        jax_maml.jax_model.MAML.configure_process(maml_parameters)
+
     task = maml_parameters.get("task_type")
     if 'sin' in task:
-        if args.framework == 'pytorch':
-            SM = maml.sinusoid.SineMAML(maml_parameters, experiment_device)
-        elif args.framework == 'jax':
-            SM = jax_maml.jax_sinusoid.SineMAML(maml_parameters, experiment_device)
+        if args.framework == 'pytorch' and maml_parameters.get(["pytorch", "world_size"]) > 1:
+            maml.distributed.launch(
+                maml.sinusoid.SineMAML, maml_parameters, experiment_device, 
+                world_size=maml_parameters.get(["pytorch", "world_size"]), master_port=maml_parameters.get(["pytorch", "master_port"]),
+                final_validation=args.final_validation
+                )
         else:
-            raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
-        SM.train()
+            if args.framework == 'pytorch':
+                SM = maml.sinusoid.SineMAML(maml_parameters, experiment_device)
+            elif args.framework == 'jax' and maml_parameters.get(["population", "enabled"]):
+                SM = jax_maml.jax_sinusoid.SinePopulationMAML(maml_parameters, experiment_device)
+            elif args.framework == 'jax':
+                SM = jax_maml.jax_sinusoid.SineMAML(maml_parameters, experiment_device)
+            else:
+                raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
+            utils.run_state.train_and_write_metrics(SM, maml_parameters.get("checkpoint_path"), args.final_validation)
     elif task == 'quadratic':
-        QM = maml.quadratic.QuadraticMAML(maml_parameters)
-        QM.train()
+        if args.framework == 'jax':
+            QM = jax_maml.jax_quadratic.QuadraticMAML(maml_parameters, experiment_device)
+            utils.run_state.train_and_write_metrics(QM, maml_parameters.get("checkpoint_path"), args.final_validation)
+        elif args.framework == 'pytorch':
+            raise NotImplementedError("Quadratic regression is only implemented for the jax framework")
+        else:
+            raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
+    elif task in ['point_navigation', 'velocity_target']:
+        if args.framework == 'jax':
+            RM = jax_maml.jax_rl.RLMAML(maml_parameters, experiment_device)
+        elif args.framework == 'pytorch':
+            raise NotImplementedError("Reinforcement learning tasks are only implemented for the jax framework")
+        else:
+            raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
+        utils.run_state.train_and_write_metrics(RM, maml_parameters.get("checkpoint_path"), args.final_validation)
     elif task == 'image_classification':
-        IM = maml.image_classification.ClassificationMAML(maml_parameters)
-        IM.train()
\ No newline at end of file
+        if args.framework == 'jax':
+            IM = jax_maml.jax_classification.ClassificationMAML(maml_parameters, experiment_device)
+        elif args.framework == 'pytorch':
+            raise NotImplementedError("Image classification is only implemented for the jax framework")
+        else:
+            raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
+        utils.run_state.train_and_write_metrics(IM, maml_parameters.get("checkpoint_path"), args.final_validation)
+    elif task == 'series':
+        if args.framework == 'jax':
+            TM = jax_maml.jax_series.SeriesMAML(maml_parameters, experiment_device)
+        elif args.framework == 'pytorch':
+            raise NotImplementedError("Series forecasting is only implemented for the jax framework")
+        else:
+            raise ValueError("Invalid framework argument. Use 'jax' or 'pytorch'")
+        utils.run_state.train_and_write_metrics(TM, maml_parameters.get("checkpoint_path"), args.final_validation)
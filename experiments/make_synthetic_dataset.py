@@ -0,0 +1,23 @@
+from context import utils
+
+import argparse
+
+import utils.episodes
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-output', type=str, help='folder to which episode dataset is written', default='data/synthetic_omniglot')
+parser.add_argument('-num_classes', type=int, help='number of classes (Omniglot: 1623)', default=1623)
+parser.add_argument('-examples_per_class', type=int, help='number of images per class (Omniglot: 20)', default=20)
+parser.add_argument('-image_size', type=int, help='height and width of images', default=28)
+parser.add_argument('-seed', type=int, help='seed of glyphs and examples', default=0)
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    utils.episodes.make_synthetic_dataset(
+        args.output, num_classes=args.num_classes, examples_per_class=args.examples_per_class, image_size=args.image_size, seed=args.seed
+        )
+    dataset = utils.episodes.EpisodeDataset(args.output)
+    print("Wrote episode dataset of {} classes, images of shape {} to {}".format(dataset.num_classes, dataset.image_shape, args.output))
@@ -0,0 +1,30 @@
+from context import utils
+
+import argparse
+
+import utils.series
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-output', type=str, help='folder to which series dataset is written', default='data/series')
+parser.add_argument('-num_series', type=int, help='number of series', default=10000)
+parser.add_argument('-min_length', type=int, help='minimum number of samples of series', default=200)
+parser.add_argument('-max_length', type=int, help='maximum number of samples of series', default=400)
+parser.add_argument('-num_buckets', type=int, help='number of metadata buckets (frequency bands)', default=8)
+parser.add_argument('-channels', type=int, help='number of channels of series', default=1)
+parser.add_argument('-shard_size', type=int, help='number of samples per shard file', default=2 ** 22)
+parser.add_argument('-validation_fraction', type=float, help='fraction of series held out for validation', default=0.1)
+parser.add_argument('-seed', type=int, help='seed of series', default=0)
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    utils.series.make_synthetic_series_dataset(
+        args.output, num_series=args.num_series, length_range=(args.min_length, args.max_length), num_buckets=args.num_buckets,
+        channels=args.channels, shard_size=args.shard_size, validation_fraction=args.validation_fraction, seed=args.seed
+        )
+    dataset = utils.series.SeriesDataset(args.output, context_length=1, forecast_length=1)
+    print("Wrote series dataset of {num_series} series ({num_shards} shards, {channels} channels, {num_buckets} buckets) to {path}".format(
+        path=args.output, **dataset.metadata
+        ))
@@ -0,0 +1,166 @@
+from context import utils
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import datetime
+import tracemalloc
+
+import numpy as np
+import yaml
+
+from typing import Any, Callable, Dict, List, Tuple
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-config', type=str, help='path to queue benchmark configuration file', default='configs/queue_benchmark_config.yaml')
+parser.add_argument('-output', type=str, help='path to which json results are written (default results/benchmarks/queue_benchmark_<timestamp>.json)', default=None)
+
+
+class BenchmarkPriorityQueue(utils.priority.PriorityQueue):
+    """
+    Priority queue over a unit-block grid of given shape (no task-specific parameter conversions or plotting)
+    """
+    def __init__(self, shape: Tuple[int], sample_type: str, epsilon: float, save_path: str):
+        super().__init__(
+            block_sizes=[1. for _ in shape], param_ranges=[[0., float(s)] for s in shape], sample_type=sample_type,
+            epsilon_start=epsilon, epsilon_final=epsilon, epsilon_decay_rate=0., epsilon_decay_start=0,
+            queue_resume=None, counts_resume=None, save_path=save_path
+        )
+
+    def visualise_priority_queue(self, feature='losses'):
+        return None
+
+    def visualise_priority_queue_loss_distribution(self):
+        return None
+
+
+def time_operation(operation: Callable, repeats: int, minimum_repeats: int, time_budget: float) -> Dict[str, float]:
+    """
+    Time repeated calls of operation
+
+    :param operation: function to time; called with call index
+    :param repeats: maximum number of calls
+    :param minimum_repeats: minimum number of calls
+    :param time_budget: stop after this many seconds (once minimum_repeats calls have been made)
+
+    :return latency_statistics: latency percentiles/mean/max in microseconds
+    """
+    latencies = []
+    start = time.perf_counter()
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - t0)
+        if i + 1 >= minimum_repeats and time.perf_counter() - start > time_budget:
+            break
+    latencies = 1e6 * np.array(latencies)
+    return {
+        "calls": len(latencies), "mean_us": float(np.mean(latencies)), "p50_us": float(np.percentile(latencies, 50)),
+        "p90_us": float(np.percentile(latencies, 90)), "p99_us": float(np.percentile(latencies, 99)), "max_us": float(np.max(latencies))
+        }
+
+def trace_memory(operation: Callable, repeats: int) -> int:
+    """
+    Peak memory (bytes) allocated by python/numpy during calls of operation
+
+    :param operation: function to trace; called with call index
+    :param repeats: number of calls
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for i in range(repeats):
+        operation(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return int(peak - baseline)
+
+def benchmark_queue(shape: Tuple[int], sample_type: str, benchmark_params: Dict[str, Any], save_path: str) -> List[Dict[str, Any]]:
+    """
+    Benchmark query, insert, compute_count_loss_correlation, save_queue and sample_nd_array for one queue
+
+    :param shape: shape of priority queue grid
+    :param sample_type: sample type of priority queue
+    :param benchmark_params: benchmark configuration
+    :param save_path: (temporary) directory to which queues are saved
+
+    :return results: one result per operation
+    """
+    queue = BenchmarkPriorityQueue(shape=shape, sample_type=sample_type, epsilon=benchmark_params["epsilon"], save_path=save_path)
+    num_cells = int(np.prod(shape))
+    queue_bytes = int(queue.get_queue().nbytes + queue.sample_counts.nbytes + queue._queue_delta.nbytes)
+
+    random_keys = [[np.random.randint(s) for s in shape] for _ in range(benchmark_params["repeats"])]
+    random_losses = np.abs(np.random.normal(0, 1, benchmark_params["repeats"]))
+
+    sample_array = queue._queue_delta if 'delta' in sample_type else queue.get_queue()
+
+    operations = {
+        "query": lambda i: queue.query(step=i),
+        "insert": lambda i: queue.insert(key=random_keys[i % len(random_keys)], data=random_losses[i % len(random_losses)]),
+        "compute_count_loss_correlation": lambda i: queue.compute_count_loss_correlation(),
+        "save_queue": lambda i: queue.save_queue(step_count=i),
+        "sample_nd_array": lambda i: utils.custom_functions.sample_nd_array(nd_array=sample_array)
+        }
+
+    results = []
+    for operation_name, operation in operations.items():
+        latency_statistics = time_operation(
+            operation, repeats=benchmark_params["repeats"], minimum_repeats=benchmark_params["minimum_repeats"],
+            time_budget=benchmark_params["time_budget"]
+            )
+        peak_memory = trace_memory(operation, repeats=benchmark_params["memory_repeats"])
+
+        result = {
+            "operation": operation_name, "sample_type": sample_type, "shape": list(shape), "cells": num_cells,
+            "queue_bytes": queue_bytes, "peak_memory_bytes": peak_memory
+            }
+        result.update(latency_statistics)
+        results.append(result)
+
+        # saved queues can be large, do not accumulate them
+        for f in os.listdir(save_path):
+            os.remove(os.path.join(save_path, f))
+
+    return results
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as yaml_file:
+        benchmark_params = yaml.load(yaml_file, yaml.SafeLoader)
+
+    random.seed(benchmark_params["seed"])
+    np.random.seed(benchmark_params["seed"])
+
+    exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+    output_path = args.output or os.path.join('results/benchmarks', 'queue_benchmark_{}.json'.format(exp_timestamp))
+
+    save_path = tempfile.mkdtemp() + os.sep
+    results = []
+    try:
+        for shape in benchmark_params["grid_shapes"]:
+            for sample_type in benchmark_params["sample_types"]:
+                print("=== queue shape {} ({} cells), sample type {}".format(shape, int(np.prod(shape)), sample_type))
+                results.extend(benchmark_queue(tuple(shape), sample_type, benchmark_params, save_path))
+    finally:
+        shutil.rmtree(save_path, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump({"timestamp": exp_timestamp, "benchmark": benchmark_params, "results": results}, f, indent=2)
+
+    print("\n{:<32}{:<30}{:>16}{:>12}{:>12}{:>12}{:>14}".format("operation", "sample type", "shape", "p50 (us)", "p90 (us)", "p99 (us)", "peak mem (MB)"))
+    for result in results:
+        print("{:<32}{:<30}{:>16}{:>12.1f}{:>12.1f}{:>12.1f}{:>14.2f}".format(
+            result["operation"], result["sample_type"], "x".join(str(s) for s in result["shape"]),
+            result["p50_us"], result["p90_us"], result["p99_us"], result["peak_memory_bytes"] / 2 ** 20
+            ))
+    print("Results written to {}".format(output_path))
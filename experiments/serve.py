@@ -0,0 +1,151 @@
+from context import utils, jax_maml
+
+import argparse
+import json
+import os
+import signal
+import time
+import datetime
+
+import numpy as np
+import yaml
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from evaluate import EVALUATION_PARAMETERS
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-checkpoint', type=str, help='jax model checkpoint (model_checkpoint_*.npy) to serve', required=True)
+parser.add_argument('-config', type=str, help='configuration of run that produced checkpoint (default config.yaml next to checkpoint)', default=None)
+parser.add_argument('-host', type=str, help='address on which to listen', default='127.0.0.1')
+parser.add_argument('-port', type=int, help='port on which to listen', default=8080)
+parser.add_argument('-max_batch_size', type=int, help='maximum number of requests adapted in one call', default=32)
+parser.add_argument('-batch_timeout', type=float, help='maximum time (ms) a batch waits for further requests after its first arrived', default=5.)
+parser.add_argument('-max_num_steps', type=int, help='maximum number of fine-tuning steps of a request', default=100)
+parser.add_argument('-cache_entries', type=int, help='maximum number of cached adapted parameter sets (0 for no cache)', default=10000)
+parser.add_argument('-cache_memory', type=float, help='maximum memory (MB) of cached adapted parameters', default=256.)
+parser.add_argument('-output_dir', type=str, help='folder to which configuration and logs are written (default results/serving/<timestamp>/)', default=None)
+
+
+class AdaptationRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with json {"support_x": [...], "support_y": [...], "query_x": [...], "num_steps": n}
+    returns {"query_y": [...]}; POST /reload with json {"checkpoint": path} replaces the meta parameters (and
+    invalidates cached adapted parameters); GET /stats (optionally ?reset=1) returns latency, throughput and cache statistics
+    """
+    # keep connections open between requests of a client, send responses without waiting for (delayed) acks
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status: int, content) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/predict":
+            handle = self._predict
+        elif self.path == "/reload":
+            handle = self._reload
+        else:
+            self._send_json(404, {"error": "unknown path {}".format(self.path)})
+            return
+        try:
+            response = handle(json.loads(body))
+        except (ValueError, KeyError, TypeError, FileNotFoundError) as e:
+            self._send_json(400, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        except Exception as e:
+            # (e.g. adaptation failed or service closed) client gets an error response rather than a dropped connection
+            self._send_json(500, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        self._send_json(200, response)
+
+    def _predict(self, request):
+        query_y = self.server.adapter.predict(
+            request["support_x"], request["support_y"], request["query_x"], request.get("num_steps", self.server.default_num_steps)
+            )
+        return {"query_y": query_y.tolist()}
+
+    def _reload(self, request):
+        model_checkpoint = np.load(request["checkpoint"], allow_pickle=True)[()]
+        num_invalidated = self.server.adapter.set_network_parameters(model_checkpoint["network_parameters"])
+        print("Serving checkpoint of step {} ({} cached adaptations invalidated)".format(model_checkpoint["step"], num_invalidated))
+        return {"step": int(model_checkpoint["step"]), "invalidated": num_invalidated}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/stats":
+            self._send_json(404, {"error": "unknown path {}".format(url.path)})
+            return
+        reset = parse_qs(url.query).get("reset", ["0"])[0] == "1"
+        self._send_json(200, self.server.adapter.get_statistics(reset=reset))
+
+    def log_message(self, format, *args):
+        # no line per request
+        pass
+
+
+class AdaptationServer(ThreadingHTTPServer):
+    """http server with one thread per connection, holding the adaptation service used by its handlers"""
+    daemon_threads = True
+    # many clients may connect at once (e.g. load generator)
+    request_queue_size = 1024
+
+    def __init__(self, address, adapter, default_num_steps: int):
+        super().__init__(address, AdaptationRequestHandler)
+        self.adapter = adapter
+        self.default_num_steps = default_num_steps
+
+def _stop_serving(signum, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    config_path = args.config or os.path.join(os.path.dirname(args.checkpoint), "config.yaml")
+    with open(config_path, 'r') as yaml_file:
+        maml_parameters = utils.parameters.MAMLParameters(yaml.load(yaml_file, yaml.SafeLoader))
+    if 'sin' not in maml_parameters.get("task_type"):
+        raise NotImplementedError("Adaptation service implemented for sinusoid tasks only")
+
+    output_dir = args.output_dir or os.path.join(
+        "results", "serving", datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        )
+    maml_parameters.update(EVALUATION_PARAMETERS)
+    maml_parameters.update({"checkpoint_path": os.path.join(output_dir, '')})
+
+    jax_maml.jax_sinusoid.SineMAML.configure_process(maml_parameters)
+    model = jax_maml.jax_sinusoid.SineMAML(maml_parameters, "cpu")
+    model_checkpoint = np.load(args.checkpoint, allow_pickle=True)[()]
+
+    adapter = jax_maml.jax_inference.BatchedAdapter(
+        model, model_checkpoint["network_parameters"], max_batch_size=args.max_batch_size,
+        batch_timeout=args.batch_timeout / 1000, max_num_steps=args.max_num_steps,
+        cache_entries=args.cache_entries, cache_bytes=int(args.cache_memory * 2 ** 20)
+        )
+
+    server = AdaptationServer((args.host, args.port), adapter, default_num_steps=model.validation_num_inner_updates)
+    # statistics are written on ctrl-c and SIGTERM
+    signal.signal(signal.SIGTERM, _stop_serving)
+
+    print("Serving checkpoint of step {} on http://{}:{}/predict (max batch size {}, batch timeout {}ms)".format(
+        model_checkpoint["step"], args.host, args.port, args.max_batch_size, args.batch_timeout
+        ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        adapter.close()
+        with open(os.path.join(output_dir, "serving_statistics.json"), 'w') as f:
+            json.dump(adapter.get_statistics(), f, indent=2)
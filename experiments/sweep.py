@@ -0,0 +1,395 @@
+from context import utils
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Dict, List
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('-base_config', type=str, help='path to base configuration file for maml experiment', default='configs/base_config.yaml')
+parser.add_argument('-sweep_config', type=str, help='path to sweep configuration file (configs, frameworks, seeds, grid, resources)', default='configs/sweep_config.yaml')
+parser.add_argument('-sweep_dir', type=str, help='folder of existing sweep to resume (its ledger and sweep configuration are used)', default=None)
+parser.add_argument('-workers', type=int, help='number of runs executed concurrently (overrides sweep config)', default=None)
+
+LEDGER_FILE = "ledger.json"
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# job statuses recorded in ledger, only done jobs are skipped when a sweep is resumed
+PENDING, RUNNING, DONE, INTERRUPTED, FAILED = "pending", "running", "done", "interrupted", "failed"
+
+
+def get_job_id(config: str, framework: str, run: Dict[str, Any], seed: int) -> str:
+    """
+    Unique, human readable (and file system safe) identifier of a sweep job, used as its results folder
+
+    :param config: path to specific configuration file
+    :param framework: jax or pytorch
+    :param run: mapping from (dotted) grid key to value for this job
+    :param seed: random seed
+
+    :return job_id: identifier string
+    """
+    parts = [os.path.splitext(os.path.basename(config))[0], framework]
+    parts.extend("{}={}".format(key, run[key]) for key in sorted(run.keys()))
+    parts.append("seed={}".format(seed))
+    return re.sub(r'[^A-Za-z0-9_.=,-]', '', "__".join(parts))
+
+def expand_jobs(sweep_params: Dict) -> List[Dict[str, Any]]:
+    """
+    Expand sweep specification into list of jobs (every config x framework x grid point x seed)
+
+    :param sweep_params: sweep configuration
+    :return jobs: list of job specifications
+    """
+    runs = utils.parameters.expand_grid(sweep_params.get("grid") or {})
+    jobs = []
+    for config in sweep_params["configs"]:
+        for framework in sweep_params.get("frameworks", ["jax"]):
+            for run in runs:
+                for seed in sweep_params.get("seeds", [0]):
+                    jobs.append({
+                        "job_id": get_job_id(config, framework, run, seed), "config": config,
+                        "framework": framework, "run": run, "seed": seed
+                        })
+    return jobs
+
+def get_available_cores() -> List[int]:
+    """cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def get_core_slots(cores_per_job: int, workers: int) -> List[List[int]]:
+    """
+    Partition cores available to this process into one set per worker. If there are more workers than
+    core sets, sets are shared round robin (oversubscription).
+
+    :param cores_per_job: number of cores pinned to each run
+    :param workers: number of concurrent runs
+
+    :return core_slots: list of core sets, one per worker
+    """
+    cores = get_available_cores()
+    num_sets = max(len(cores) // cores_per_job, 1)
+    core_sets = [cores[i * cores_per_job: (i + 1) * cores_per_job] or cores for i in range(num_sets)]
+    return [core_sets[w % num_sets] for w in range(workers)]
+
+# run in job process before the command is executed (in place of the process), so that every thread the command
+# starts (e.g. intra-op pools of framework imports) inherits the affinity
+PIN_CORES_SCRIPT = (
+    "import os, sys\n"
+    "try:\n"
+    "    os.sched_setaffinity(0, [int(core) for core in sys.argv[1].split(',')])\n"
+    "except OSError:\n"
+    "    pass\n"
+    "os.execvp(sys.argv[2], sys.argv[2:])\n"
+    )
+
+def get_pinned_command(command: List[str], cores: List[int]) -> List[str]:
+    """
+    Command pinned to cores: a python shim sets the affinity of the job process, then executes the command.
+    (Pinning in the child with preexec_fn is not safe when processes are started from several threads.)
+
+    :param command: command to run
+    :param cores: cores the process may run on
+
+    :return pinned_command: command run on cores (unchanged if affinity is not supported on this platform)
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return command
+    return [sys.executable, "-c", PIN_CORES_SCRIPT, ",".join(str(core) for core in cores)] + list(command)
+
+def get_job_environment(threads: int) -> Dict[str, str]:
+    """
+    Environment of job process, limiting intra-op thread pools of BLAS/OpenMP (torch) and XLA (jax)
+    to the number of cores pinned to the job so that concurrent runs do not oversubscribe cores.
+
+    :param threads: number of threads each library may use
+    :return environment: environment variables for job process
+    """
+    environment = dict(os.environ)
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        environment[variable] = str(threads)
+    if threads == 1:
+        environment["XLA_FLAGS"] = (environment.get("XLA_FLAGS", "") + " --xla_cpu_multi_thread_eigen=false").strip()
+    # jax should not pre-allocate (GPU) memory when runs share a device
+    environment["XLA_PYTHON_CLIENT_PREALLOCATE"] = "false"
+    return environment
+
+
+class SweepLedger(object):
+    """
+    Record of status and metrics of every job of a sweep, written to the sweep folder after each change
+    so that an interrupted sweep can be resumed (completed jobs are skipped, pre-empted ones resumed from run state).
+    """
+    def __init__(self, sweep_dir: str, sweep_params: Dict, jobs: List[Dict[str, Any]]):
+        self.path = os.path.join(sweep_dir, LEDGER_FILE)
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self._ledger = json.load(f)
+        else:
+            self._ledger = {"sweep": sweep_params, "jobs": {}}
+        for job in jobs:
+            self._ledger["jobs"].setdefault(job["job_id"], dict(job, status=PENDING))
+        self._write()
+
+    def _write(self) -> None:
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self._ledger, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def update(self, job_id: str, **entries) -> None:
+        with self._lock:
+            self._ledger["jobs"][job_id].update(entries)
+            self._write()
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return copy.deepcopy(self._ledger["jobs"][job_id])
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return copy.deepcopy(list(self._ledger["jobs"].values()))
+
+
+class JobRunner(object):
+    """
+    Runs main.py processes on sets of cores, at most one per worker at a time. Each worker owns a set
+    of cores to which its processes are pinned. On SIGTERM/SIGINT no further jobs are started and
+    running jobs are forwarded SIGTERM, so that they save their run state and can be resumed.
+    """
+    def __init__(self, base_config: str, workers: int, cores_per_job: int):
+        self.base_config = os.path.abspath(base_config)
+        self.workers = workers
+        self.cores_per_job = cores_per_job
+
+        self._core_slots = Queue()
+        for core_slot in get_core_slots(cores_per_job, workers):
+            self._core_slots.put(core_slot)
+
+        self._processes = {}
+        self._processes_lock = threading.Lock()
+        self.stop_requested = False
+
+    def _handle_signal(self, signal_number, frame) -> None:
+        print("Received signal {}, stopping (running jobs save their run state)".format(signal_number))
+        self.stop_requested = True
+        with self._processes_lock:
+            for process in self._processes.values():
+                process.send_signal(signal.SIGTERM)
+
+    def install_signal_handlers(self) -> None:
+        for signal_number in [signal.SIGTERM, signal.SIGINT]:
+            signal.signal(signal_number, self._handle_signal)
+
+    def run_process(self, job_id: str, command: List[str], job_dir: str) -> int:
+        """
+        Run command (main.py invocation) on a free core set, output appended to log.txt of job folder
+
+        :param job_id: identifier of job
+        :param command: command to run
+        :param job_dir: results folder of job
+
+        :return return_code: return code of process (None if not started as stop was requested)
+        """
+        cores = self._core_slots.get()
+        try:
+            print("--- starting {} on cores {}".format(job_id, cores))
+            with open(os.path.join(job_dir, "log.txt"), 'a') as log_file:
+                with self._processes_lock:
+                    if self.stop_requested:
+                        return None
+                    process = subprocess.Popen(
+                        get_pinned_command(command, cores), stdout=log_file, stderr=subprocess.STDOUT,
+                        env=get_job_environment(self.cores_per_job), cwd=os.path.dirname(MAIN_SCRIPT),
+                        # own session, so that e.g. ctrl-c reaches jobs only as forwarded SIGTERM (saving run state)
+                        start_new_session=True
+                        )
+                    self._processes[job_id] = process
+                return_code = process.wait()
+            with self._processes_lock:
+                self._processes.pop(job_id)
+            return return_code
+        finally:
+            self._core_slots.put(cores)
+
+    def write_job_config(self, config: str, overrides: Dict[str, Any], job_dir: str) -> str:
+        """
+        Write specific configuration of job: config file updated with (dotted key) overrides
+
+        :param config: path to specific configuration file
+        :param overrides: mapping from (dotted) configuration key to value
+        :param job_dir: results folder of job
+
+        :return job_config: path of job configuration file
+        """
+        with open(config, 'r') as yaml_file:
+            job_parameters = utils.parameters.MAMLParameters(yaml.load(yaml_file, yaml.SafeLoader) or {})
+        job_parameters.update(utils.parameters.nested_dict_from_dotted(overrides))
+        job_config = os.path.join(job_dir, "job_config.yaml")
+        with open(job_config, 'w') as f:
+            yaml.dump(job_parameters._config, f)
+        return job_config
+
+
+class SweepRunner(JobRunner):
+    """
+    Runs jobs of sweep, recording their status and final metrics in the sweep ledger
+    """
+    def __init__(self, sweep_dir: str, base_config: str, ledger: SweepLedger, workers: int, cores_per_job: int, final_validation: bool):
+        super().__init__(base_config=base_config, workers=workers, cores_per_job=cores_per_job)
+        self.sweep_dir = sweep_dir
+        self.ledger = ledger
+        self.final_validation = final_validation
+
+    def _get_command(self, job: Dict[str, Any], job_dir: str) -> List[str]:
+        if os.path.exists(os.path.join(job_dir, utils.run_state.RUN_STATE_FILE)):
+            command = [sys.executable, MAIN_SCRIPT, "-resume", job_dir]
+        else:
+            job_config = self.write_job_config(job["config"], dict(job["run"], seed=job["seed"]), job_dir)
+            command = [
+                sys.executable, MAIN_SCRIPT, "-base_config", self.base_config, "-config", job_config,
+                "-framework", job["framework"], "-checkpoint_path", job_dir
+                ]
+        if self.final_validation:
+            command.append("-final_validation")
+        return command
+
+    def run_job(self, job: Dict[str, Any]) -> None:
+        """
+        Run single job, recording its status (and metrics once complete) in ledger
+
+        :param job: job specification
+        """
+        if self.stop_requested:
+            return
+        job_id = job["job_id"]
+        job_dir = os.path.join(self.sweep_dir, job_id, '')
+        os.makedirs(job_dir, exist_ok=True)
+
+        command = self._get_command(job, job_dir)
+        self.ledger.update(job_id, status=RUNNING, command=command)
+
+        t0 = time.time()
+        return_code = self.run_process(job_id, command, job_dir)
+
+        metrics_path = os.path.join(job_dir, utils.run_state.METRICS_FILE)
+        if return_code == 0 and os.path.exists(metrics_path):
+            with open(metrics_path, 'r') as f:
+                metrics = json.load(f)
+            self.ledger.update(job_id, status=DONE, return_code=return_code, wall_time=time.time() - t0, metrics=metrics)
+            print("--- finished {} in {:.1f}s".format(job_id, time.time() - t0))
+        else:
+            # jobs stopped by sweep (run state written, no metrics) are resumed when the sweep is resumed, a job that
+            # exited without metrics otherwise has failed (it is run again, from its run state if any, on resume too)
+            status = INTERRUPTED if return_code is None or self.stop_requested else FAILED
+            self.ledger.update(job_id, status=status, return_code=return_code)
+            print("--- {} {} (return code {}, see {})".format(job_id, status, return_code, os.path.join(job_dir, "log.txt")))
+
+    def run(self, jobs: List[Dict[str, Any]]) -> None:
+        """
+        Run all jobs not yet completed
+
+        :param jobs: job specifications
+        """
+        pending_jobs = [job for job in jobs if self.ledger.get(job["job_id"])["status"] != DONE]
+        print("{} of {} jobs to run with {} workers ({} core(s) each)".format(len(pending_jobs), len(jobs), self.workers, self.cores_per_job))
+
+        self.install_signal_handlers()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_job, job) for job in pending_jobs]
+            for future in futures:
+                future.result()
+
+def summarise(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Aggregate final metrics of completed jobs over seeds
+
+    :param jobs: ledger entries of jobs
+    :return summary: one entry per configuration (config, framework, grid point) with mean and std over seeds
+    """
+    groups = {}
+    for job in jobs:
+        key = (job["config"], job["framework"], json.dumps(job["run"], sort_keys=True))
+        groups.setdefault(key, []).append(job)
+
+    summary = []
+    for (config, framework, run), group_jobs in groups.items():
+        done_jobs = [job for job in group_jobs if job["status"] == DONE]
+        losses = [job["metrics"]["final_validation_loss"] for job in done_jobs if job["metrics"].get("final_validation_loss") is not None]
+        summary.append({
+            "config": config, "framework": framework, "run": json.loads(run),
+            "num_seeds": len(group_jobs), "num_done": len(done_jobs),
+            "final_validation_loss_mean": float(np.mean(losses)) if losses else None,
+            "final_validation_loss_std": float(np.std(losses)) if losses else None,
+            "training_time_mean": float(np.mean([job["metrics"]["training_time"] for job in done_jobs])) if done_jobs else None
+            })
+    return summary
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.sweep_dir:
+        # resume sweep with configuration stored in its ledger
+        sweep_dir = args.sweep_dir
+        with open(os.path.join(sweep_dir, LEDGER_FILE), 'r') as f:
+            sweep_params = json.load(f)["sweep"]
+    else:
+        with open(args.sweep_config, 'r') as yaml_file:
+            sweep_params = yaml.load(yaml_file, yaml.SafeLoader)
+        exp_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
+        sweep_dir = os.path.abspath('results/sweeps/{}/'.format(exp_timestamp))
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    cores_per_job = sweep_params.get("cores_per_job") or 1
+    workers = args.workers or sweep_params.get("workers")
+    if not workers:
+        workers = max(len(get_available_cores()) // cores_per_job, 1)
+
+    jobs = expand_jobs(sweep_params)
+    ledger = SweepLedger(sweep_dir, sweep_params, jobs)
+    runner = SweepRunner(
+        sweep_dir, base_config=args.base_config, ledger=ledger, workers=workers, cores_per_job=cores_per_job,
+        final_validation=sweep_params.get("final_validation", True)
+        )
+    t0 = time.time()
+    runner.run(jobs)
+    sweep_time = time.time() - t0
+
+    job_records = [ledger.get(job["job_id"]) for job in jobs]
+    summary = summarise(job_records)
+    with open(os.path.join(sweep_dir, "sweep_results.json"), 'w') as f:
+        json.dump({"sweep": sweep_params, "sweep_time": sweep_time, "summary": summary, "jobs": job_records}, f, indent=2)
+
+    print("\n{:<40}{:<10}{:>8}{:>22}{:>12}  {}".format("config", "framework", "done", "val loss (mean+-std)", "time (s)", "grid point"))
+    for entry in summary:
+        loss = "{:.4f}+-{:.4f}".format(entry["final_validation_loss_mean"], entry["final_validation_loss_std"]) if entry["final_validation_loss_mean"] is not None else "-"
+        training_time = "{:.1f}".format(entry["training_time_mean"]) if entry["training_time_mean"] is not None else "-"
+        print("{:<40}{:<10}{:>8}{:>22}{:>12}  {}".format(
+            os.path.basename(entry["config"]), entry["framework"], "{}/{}".format(entry["num_done"], entry["num_seeds"]), loss, training_time,
+            ",".join("{}={}".format(key, value) for key, value in sorted(entry["run"].items())) or "-"
+            ))
+    print("Sweep took {:.1f}s, results written to {}".format(sweep_time, sweep_dir))
+    if any(job["status"] != DONE for job in job_records):
+        print("Not all jobs completed, resume with: python sweep.py -sweep_dir {}".format(sweep_dir))
+        sys.exit(1)
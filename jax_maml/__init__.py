@@ -1 +1,6 @@
-from .jax_sinusoid import SineMAML, SinePriorityQueue
\ No newline at end of file
+from .jax_sinusoid import SineMAML, SinePopulationMAML, SinePriorityQueue
+from .jax_inference import BatchedAdapter
+from .jax_classification import ClassificationMAML
+from .jax_rl import RLMAML
+from .jax_quadratic import QuadraticMAML
+from .jax_series import SeriesMAML
@@ -0,0 +1,234 @@
+from .jax_model import MAML
+from utils.episodes import EpisodeDataset
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from typing import Any, Dict, List, Tuple
+
+import jax
+import jax.numpy as jnp
+
+from jax.experimental import stax # neural network library
+from jax.experimental import optimizers
+from jax.experimental.stax import BatchNorm, Conv, Dense, MaxPool, Relu, Flatten
+
+class ClassificationMAML(MAML):
+    """
+    MAML for N-way K-shot image classification. Each task is an episode of n_way classes of an episode dataset
+    (utils.episodes), with inner_update_k images per class for the inner update and as many (disjoint) images per class
+    for the meta update; validation episodes (validation_k fine-tuning and test_k test images per class) are drawn from
+    classes held out of meta-training.
+    """
+    def __init__(self, params, device):
+        self.device = device
+        self.task_type = params.get('task_type')
+
+        # extract relevant task-specific parameters
+        self.dataset = EpisodeDataset(params.get(['image_classification', 'dataset_path']), mmap=params.get(['image_classification', 'mmap']))
+        self.n_way = params.get(['image_classification', 'n_way'])
+        self.num_filters = params.get(['image_classification', 'num_filters'])
+        self.num_conv_layers = params.get(['image_classification', 'num_conv_layers'])
+
+        # first training_classes classes for meta-training, rest for validation
+        num_training_classes = params.get(['image_classification', 'training_classes'])
+        if not 0 < num_training_classes < self.dataset.num_classes:
+            raise ValueError("Number of meta-training classes must be between 1 and {}, got {}".format(self.dataset.num_classes - 1, num_training_classes))
+        self.training_classes = np.arange(num_training_classes)
+        self.validation_classes = np.arange(num_training_classes, self.dataset.num_classes)
+
+        if params.get('priority_sample'):
+            raise NotImplementedError("Priority queue sampling not implemented for image classification")
+
+        MAML.__init__(self, params)
+
+    def _get_input_shape(self) -> Tuple[int, ...]:
+        return (-1,) + self.dataset.image_shape
+
+    def _get_model(self):
+        """
+        Return jax network initialisation and forward method: num_conv_layers blocks of 3x3 convolution, batch norm
+        (statistics of batch, i.e. of the images of a task), relu and 2x2 max pooling, then linear layer to n_way logits
+        """
+        layers = []
+        for _ in range(self.num_conv_layers):
+            layers.extend([
+                Conv(self.num_filters, (3, 3), padding='SAME'), BatchNorm(axis=(0, 1, 2)), Relu,
+                MaxPool((2, 2), strides=(2, 2), padding='SAME')
+                ])
+        layers.extend([Flatten, Dense(self.n_way)])
+
+        model = stax.serial(*layers)
+
+        return model
+
+    def _get_optimiser(self):
+        """
+        Return jax optimiser: initialisation, update method and parameter getter method.
+        Optimiser learning rate is given by config (meta_lr).
+        """
+        return optimizers.adam(step_size=self.meta_lr)
+
+    def _get_priority_queue(self):
+        raise NotImplementedError("Priority queue sampling not implemented for image classification")
+
+    def _sample_task(self, batch_size, validate=False, step_count=None):
+        """
+        Sample classes of batch_size episodes (meta-training classes, or held-out classes if validate)
+
+        :return tasks: classes of each episode (batch_size x n_way), label of class is its position
+        :return task_indices: None (no priority queue)
+        :return task_probabilities: probabilities of tasks (uniform)
+        """
+        rngs = self.random_streams.generators("validation_task" if validate else "task", step_count or 0, range(batch_size))
+        episode_classes = self.dataset.sample_classes(rngs, self.n_way, self.validation_classes if validate else self.training_classes)
+        return episode_classes, None, [1.] * batch_size
+
+    def _get_task_from_params(self, parameters: List) -> Any:
+        """classes of episode (label of class is its position)"""
+        return np.asarray(parameters, dtype=np.int64)
+
+    def _generate_batch(self, tasks: List, rngs: List=None, num_shots: int=None):
+        """
+        Obtain batch of images and labels of episodes
+
+        :param tasks: classes of each episode
+        :param rngs: random generator of each episode (default global numpy generator)
+        :param num_shots: images per class (default inner_update_k)
+
+        :return x_batch: images of each episode (episodes x n_way * num_shots x image shape)
+        :return y_batch: labels of images
+        """
+        if rngs is None:
+            rngs = [np.random] * len(tasks)
+        (x_batch, y_batch), = self.dataset.sample_episodes(rngs, np.stack(tasks), [num_shots or self.inner_update_k])
+        return x_batch.astype(self.compute_dtype), y_batch
+
+    def _prepare_training_batch(self, step_count: int) -> Tuple[Tuple, List]:
+        """
+        Sample episodes of training step, with disjoint images for inner and meta update (gathered in one read)
+
+        :param step_count: training step of batch
+
+        :return batch: inner update images and labels, meta update images and labels and task importance weights (None)
+        :return max_indices: None (no priority queue)
+        """
+        with self.profiler.phase('sample'):
+            episode_classes, _, _ = self._sample_task(batch_size=self.task_batch_size, step_count=step_count)
+
+        with self.profiler.phase('batch'):
+            rngs = self.random_streams.generators("support", step_count, range(self.task_batch_size))
+            (x_train, y_train), (x_meta, y_meta) = self.dataset.sample_episodes(
+                rngs, episode_classes, [self.inner_update_k, self.inner_update_k]
+                )
+
+        return (x_train.astype(self.compute_dtype), y_train, x_meta.astype(self.compute_dtype), y_meta, None), None
+
+    def _get_example_batch(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        x_batch = np.zeros((batch_size, self.n_way * self.inner_update_k) + self.dataset.image_shape, dtype=self.compute_dtype)
+        y_batch = np.zeros((batch_size, self.n_way * self.inner_update_k), dtype=np.int32)
+        return x_batch, y_batch
+
+    def _get_warm_up_executables(self, parameters: List) -> Dict[str, Tuple]:
+        executables = MAML._get_warm_up_executables(self, parameters)
+
+        # validation fine-tunes all episodes in one vmapped call (see validate)
+        del executables["inner_loop_update"], executables["compute_loss"]
+        num_episodes = self.validation_task_batch_size
+        x_support = np.zeros((num_episodes, self.n_way * self.validation_k) + self.dataset.image_shape, dtype=self.compute_dtype)
+        y_support = np.zeros((num_episodes, self.n_way * self.validation_k), dtype=np.int32)
+        x_test = np.zeros((num_episodes, self.n_way * self.test_k) + self.dataset.image_shape, dtype=self.compute_dtype)
+        num_steps = np.full(num_episodes, self.validation_num_inner_updates, dtype=np.int32)
+        executables["adapt_and_predict"] = (self._jit_adapt_and_predict, (parameters, x_support, y_support, x_test, num_steps))
+
+        return executables
+
+    def _compute_point_losses(self, parameters, inputs, ground_truth):
+        """cross entropy of network logits and integer labels of each image"""
+        log_probabilities = jax.nn.log_softmax(self._forward(parameters, inputs))
+        return -jnp.take_along_axis(log_probabilities, ground_truth.astype(jnp.int32)[:, None], axis=-1)[:, 0]
+
+    def _compute_loss(self, parameters, inputs, ground_truth):
+        """
+        Computes loss of network
+
+        :param parameters: current weights of model
+        :param inputs: images
+        :param ground_truth: labels of images
+
+        :return loss: mean cross entropy of network logits and labels
+        """
+        return jnp.mean(self._compute_point_losses(parameters, inputs, ground_truth))
+
+    def validate(self, step_count: int, visualise: bool=True) -> None:
+        """
+        Fine-tune on validation_task_batch_size episodes of held-out classes (in one vmapped call) and log
+        test loss and accuracy. With fixed validation, the same episodes are used at every step.
+
+        :param step_count: number of steps in training undergone
+        :param visualise: whether or not to visualise predictions on first episode
+        """
+        episode_step = 0 if self.fixed_validation else step_count
+        with self.profiler.phase('validation/fine_tune'):
+            episode_classes, _, _ = self._sample_task(batch_size=self.validation_task_batch_size, validate=True, step_count=episode_step)
+            rngs = self.random_streams.generators("validation_support", episode_step, range(self.validation_task_batch_size))
+            (x_support, y_support), (x_test, y_test) = self.dataset.sample_episodes(rngs, episode_classes, [self.validation_k, self.test_k])
+
+            network_parameters = self.get_params_from_optimiser(self.optimiser_state)
+            num_steps = np.full(len(episode_classes), self.validation_num_inner_updates, dtype=np.int32)
+            logits, _ = self._jit_adapt_and_predict(
+                network_parameters, x_support.astype(self.compute_dtype), y_support, x_test.astype(self.compute_dtype), num_steps
+                )
+            logits = np.asarray(logits, dtype=np.float64)
+
+            log_probabilities = logits - np.log(np.sum(np.exp(logits - logits.max(axis=-1, keepdims=True)), axis=-1, keepdims=True)) - logits.max(axis=-1, keepdims=True)
+            validation_losses = -np.take_along_axis(log_probabilities, y_test[..., None], axis=-1)[..., 0].mean(axis=1)
+            validation_accuracies = (logits.argmax(axis=-1) == y_test).mean(axis=1)
+
+        self.last_validation_loss = float(np.mean(validation_losses))
+
+        with self.profiler.phase('validation/figures'):
+            self.writer.add_figure("validation_loss_distribution", self._get_validation_loss_distribution_plot(validation_losses), step_count)
+            if visualise:
+                save_name = 'validation_step_{}.png'.format(step_count)
+                self.writer.add_figure(
+                    "vadliation_plots/episode_0", self._visualise([network_parameters], episode_classes[0], x_test[0], y_test[0], save_name, logits[0]), step_count
+                    )
+
+            print('--- validation loss @ step {}: {} (accuracy {:.3f})'.format(step_count, self.last_validation_loss, np.mean(validation_accuracies)))
+            self.writer.add_scalar('meta_metrics/validation_loss_mean', self.last_validation_loss, step_count)
+            self.writer.add_scalar('meta_metrics/validation_loss_std', float(np.std(validation_losses)), step_count)
+            self.writer.add_scalar('meta_metrics/validation_accuracy_mean', float(np.mean(validation_accuracies)), step_count)
+            self.writer.add_scalar('meta_metrics/validation_accuracy_std', float(np.std(validation_accuracies)), step_count)
+
+    def _visualise(self, model_iterations, task, validation_x, validation_y, save_name, logits=None):
+        """
+        Test images of an episode with their labels (and predicted labels of fine-tuned network)
+
+        :param model_iterations: parameters of model (unused, predictions are given by logits)
+        :param task: classes of episode
+        :param validation_x: test images of episode
+        :param validation_y: labels of test images
+        :param save_name: name of file to be saved
+        :param logits: logits of fine-tuned network at test images
+        """
+        num_images = min(len(validation_x), 25)
+        columns = min(num_images, 5)
+        rows = int(np.ceil(num_images / columns))
+
+        fig, axes = plt.subplots(rows, columns, figsize=(2 * columns, 2 * rows), squeeze=False)
+        for i, ax in enumerate(axes.flatten()):
+            ax.axis('off')
+            if i >= num_images:
+                continue
+            ax.imshow(np.asarray(validation_x[i], dtype=np.float32)[..., 0], cmap='gray_r')
+            title = "label {}".format(validation_y[i])
+            if logits is not None:
+                title += ", predicted {}".format(int(np.argmax(logits[i])))
+            ax.set_title(title, fontsize=8)
+        fig.suptitle("Validation episode (classes {})".format(", ".join(map(str, task))))
+
+        return fig
+
+    def _get_fixed_validation_tasks(self):
+        raise NotImplementedError("Fixed validation of image classification uses the same sampled episodes at every step (see validate)")
@@ -0,0 +1,107 @@
+import os
+import time
+import warnings
+import concurrent.futures
+
+from typing import Any, Callable, Dict, Tuple
+
+import jax
+
+
+def initialise_compilation_cache(cache_dir: str) -> bool:
+    """
+    Point jax at a persistent, on-disk compilation cache shared between runs. Executables
+    compiled for the same computation (and shapes) in previous runs are then loaded from
+    disk rather than recompiled.
+
+    :param cache_dir: directory of compilation cache (created if it does not exist)
+    :return enabled: whether the installed jax version supports a persistent cache
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        jax.config.update("jax_compilation_cache_dir", cache_dir)
+    except Exception:
+        try:
+            from jax.experimental.compilation_cache import compilation_cache
+            compilation_cache.initialize_cache(cache_dir)
+        except (ImportError, AttributeError):
+            warnings.warn("Persistent compilation cache not supported by installed jax version, compiling without cache", Warning)
+            return False
+    # small networks compile quickly, by default these executables would not be written to cache
+    for option, value in (("jax_persistent_cache_min_compile_time_secs", 0.), ("jax_persistent_cache_min_entry_size_bytes", -1)):
+        try:
+            jax.config.update(option, value)
+        except Exception:
+            pass
+    return True
+
+
+class _CacheEventCounter(object):
+    """
+    Counts persistent cache hits/misses via jax monitoring events (where supported by jax version)
+    """
+    HIT_EVENT = '/jax/compilation_cache/cache_hits'
+    MISS_EVENT = '/jax/compilation_cache/cache_misses'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.supported = False
+        try:
+            jax.monitoring.register_event_listener(self._listen)
+            self.supported = True
+        except AttributeError:
+            pass
+
+    def _listen(self, event: str, **kwargs) -> None:
+        if event == self.HIT_EVENT:
+            self.hits += 1
+        elif event == self.MISS_EVENT:
+            self.misses += 1
+
+
+def _count_cache_entries(cache_dir: str) -> int:
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return 0
+    return len(os.listdir(cache_dir))
+
+def warm_up(executables: Dict[str, Tuple[Callable, Tuple]], num_workers: int=4, cache_dir: str=None) -> Dict[str, Any]:
+    """
+    Compile jitted functions ahead of training by calling them (in parallel threads) on example
+    inputs of the shapes/dtypes used during training. Subsequent calls with the same shapes
+    dispatch straight to the compiled executables.
+
+    :param executables: mapping from name to (jitted function, example arguments)
+    :param num_workers: number of compilation threads
+    :param cache_dir: persistent compilation cache directory (used to report cache hits)
+
+    :return report: compile time per executable, total warm-up time and cache hits (if known)
+    """
+    counter = _CacheEventCounter()
+    entries_before = _count_cache_entries(cache_dir)
+
+    def _compile(name: str, function: Callable, arguments: Tuple) -> float:
+        t0 = time.perf_counter()
+        outputs = function(*arguments)
+        for leaf in jax.tree_util.tree_leaves(outputs):
+            if hasattr(leaf, "block_until_ready"):
+                leaf.block_until_ready()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        futures = {name: executor.submit(_compile, name, function, arguments) for name, (function, arguments) in executables.items()}
+        compile_times = {name: future.result() for name, future in futures.items()}
+    total_time = time.perf_counter() - t0
+
+    report = {"compile_times": compile_times, "total_time": total_time}
+    if counter.supported:
+        report["cache_hits"] = counter.hits
+        report["cache_misses"] = counter.misses
+    elif cache_dir:
+        # each executable not found in the cache writes a new entry
+        report["cache_misses"] = _count_cache_entries(cache_dir) - entries_before
+        report["cache_hits"] = max(len(executables) - report["cache_misses"], 0)
+
+    return report
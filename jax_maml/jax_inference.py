@@ -0,0 +1,347 @@
+import collections
+import hashlib
+import queue
+import threading
+import time
+
+import numpy as onp
+
+from concurrent.futures import Future
+from typing import Any, Dict, Hashable, List, Optional
+
+import jax
+
+from .jax_model import pad_sets
+
+
+class _AdaptationRequest(object):
+    """support set, query points and number of fine-tuning steps of one request, with future of its predictions"""
+    def __init__(self, support_x: onp.ndarray, support_y: onp.ndarray, query_x: onp.ndarray, num_steps: int, fingerprint: str):
+        self.support_x = support_x
+        self.support_y = support_y
+        self.query_x = query_x
+        self.num_steps = num_steps
+        self.fingerprint = fingerprint
+        self.arrival_time = time.perf_counter()
+        self.future = Future()
+
+
+def _next_power_of_two(n: int) -> int:
+    return 1 << max(n - 1, 0).bit_length()
+
+def get_fingerprint(*arrays: onp.ndarray) -> str:
+    """hash of shapes, dtypes and contents of arrays"""
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = onp.ascontiguousarray(array)
+        digest.update("{}{}".format(array.shape, array.dtype).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class AdaptedParameterCache(object):
+    """
+    Least recently used cache of adapted network parameters, bounded in number of entries and in memory
+    (bytes of parameter arrays). Safe to use from several threads.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        :param max_entries: maximum number of cached parameter sets
+        :param max_bytes: maximum total size (bytes) of cached parameter arrays
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[List]:
+        """cached parameters of key (marked most recently used), None if not cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, parameters: List) -> None:
+        """cache parameters under key, evicting least recently used entries beyond the bounds"""
+        size = sum(leaf.nbytes for leaf in jax.tree_util.tree_leaves(parameters))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (parameters, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> int:
+        """remove all entries (e.g. when meta parameters change), returns number of entries removed"""
+        with self._lock:
+            num_entries = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += num_entries
+        return num_entries
+
+    def get_statistics(self, reset: bool=False) -> Dict[str, Any]:
+        """
+        Size of cache and hits, misses, evictions and invalidations (since last reset)
+
+        :param reset: whether to reset counts after this call
+        :return statistics: dictionary of statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            statistics = {
+                "cache_entries": len(self._entries), "cache_bytes": self._bytes, "cache_hits": self.hits, "cache_misses": self.misses,
+                "cache_hit_rate": self.hits / lookups if lookups else None, "cache_evictions": self.evictions,
+                "cache_invalidations": self.invalidations
+                }
+            if reset:
+                self.hits, self.misses, self.evictions, self.invalidations = 0, 0, 0, 0
+        return statistics
+
+
+class BatchedAdapter(object):
+    """
+    Fast adaptation service of a meta-learned jax model: each request (support set, query points, number of steps)
+    fine-tunes the meta parameters on its support set and returns predictions at its query points.
+
+    Requests are collected by a worker thread and adapted together in one vmapped, compiled call. A batch is
+    dispatched once it holds max_batch_size requests or batch_timeout seconds after its first request arrived,
+    whichever is first. Support sets of different sizes share a batch: they are padded to a common size and
+    masked in fine-tuning. Batch, support and query sizes are padded to powers of two, so that few executables
+    are compiled.
+
+    Adapted parameters are optionally cached, keyed by fingerprint of support set, number of steps and fingerprint
+    of meta parameters: a request whose support set was adapted before is answered in the calling thread by a
+    single forward pass, without waiting for a batch.
+    """
+    def __init__(
+        self, model, network_parameters: List, max_batch_size: int=32, batch_timeout: float=0.005, max_num_steps: int=100,
+        cache_entries: int=0, cache_bytes: int=256 * 2 ** 20, statistics_window: int=100000
+        ):
+        """
+        :param model: jax MAML model (network, loss and inner learning rate used for adaptation)
+        :param network_parameters: meta parameters to adapt (e.g. loaded from model checkpoint)
+        :param max_batch_size: maximum number of requests adapted per call
+        :param batch_timeout: maximum time (s) a batch waits for further requests after its first arrived
+        :param max_num_steps: maximum number of fine-tuning steps of a request
+        :param cache_entries: maximum number of cached adapted parameter sets (0 for no cache)
+        :param cache_bytes: maximum memory (bytes) of cached adapted parameters
+        :param statistics_window: number of most recent requests over which latency statistics are computed
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.max_num_steps = max_num_steps
+        self.cache = AdaptedParameterCache(cache_entries, cache_bytes) if cache_entries else None
+
+        # meta parameters and their fingerprint are replaced together (see set_network_parameters)
+        self._parameters_lock = threading.Lock()
+        self.set_network_parameters(network_parameters)
+
+        self._requests = queue.Queue()
+        # no requests are accepted once closed (checked and set under lock, so none are queued after the stop marker)
+        self._closed_lock = threading.Lock()
+        self._closed = False
+
+        self._statistics_lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=statistics_window)
+        self._batch_sizes = collections.deque(maxlen=statistics_window)
+        self._statistics_start = None
+        self._num_completed = 0
+
+        self._thread = threading.Thread(target=self._run, name="adaptation_batcher", daemon=True)
+        self._thread.start()
+
+    def set_network_parameters(self, network_parameters: List) -> int:
+        """
+        Replace meta parameters (e.g. by those of a newer checkpoint), invalidating cached adapted parameters
+
+        :param network_parameters: new meta parameters
+        :return num_invalidated: number of cache entries removed
+        """
+        network_parameters = jax.tree_util.tree_map(lambda p: onp.asarray(p, dtype=self.model.parameter_dtype), network_parameters)
+        fingerprint = get_fingerprint(*jax.tree_util.tree_leaves(network_parameters))
+        with self._parameters_lock:
+            self._network_parameters = (jax.tree_util.tree_map(jax.numpy.asarray, network_parameters), fingerprint)
+            return self.cache.clear() if self.cache is not None else 0
+
+    @property
+    def parameters_fingerprint(self) -> str:
+        """fingerprint of current meta parameters (part of cache keys)"""
+        return self._network_parameters[1]
+
+    def submit(self, support_x, support_y, query_x, num_steps: int) -> Future:
+        """
+        Queue request for adaptation (or answer it straight away from cache)
+
+        :param support_x: support inputs (k x input dimension)
+        :param support_y: support targets (k x output dimension)
+        :param query_x: inputs at which to predict (number of queries x input dimension)
+        :param num_steps: number of fine-tuning steps on support set
+
+        :return future: future of predictions at query points (number of queries x output dimension)
+        """
+        if self._closed:
+            raise RuntimeError("Adaptation service is closed")
+        dtype = self.model.compute_dtype
+        support_x = onp.asarray(support_x, dtype=dtype).reshape(-1, self.model.input_dimension)
+        support_y = onp.asarray(support_y, dtype=dtype).reshape(-1, self.model.output_dimension)
+        query_x = onp.asarray(query_x, dtype=dtype).reshape(-1, self.model.input_dimension)
+        if len(support_x) != len(support_y) or len(support_x) == 0:
+            raise ValueError("Support set needs equal (non-zero) numbers of inputs and targets, got {} and {}".format(len(support_x), len(support_y)))
+        if len(query_x) == 0:
+            raise ValueError("At least one query point is required")
+        if not 0 <= num_steps <= self.max_num_steps:
+            raise ValueError("Number of fine-tuning steps must be between 0 and {}, got {}".format(self.max_num_steps, num_steps))
+
+        request = _AdaptationRequest(support_x, support_y, query_x, int(num_steps), fingerprint=get_fingerprint(support_x, support_y))
+        if self.cache is not None:
+            adapted_parameters = self.cache.get((request.fingerprint, request.num_steps, self.parameters_fingerprint))
+            if adapted_parameters is not None:
+                self._predict_from_cache(request, adapted_parameters)
+                return request.future
+        with self._closed_lock:
+            if self._closed:
+                raise RuntimeError("Adaptation service is closed")
+            self._requests.put(request)
+        return request.future
+
+    def predict(self, support_x, support_y, query_x, num_steps: int) -> onp.ndarray:
+        """blocking version of submit, returns predictions at query points"""
+        return self.submit(support_x, support_y, query_x, num_steps).result()
+
+    def _predict_from_cache(self, request: _AdaptationRequest, adapted_parameters: List) -> None:
+        """predictions of cached adapted parameters at query points of request (queries padded to power of two)"""
+        query_x = onp.zeros((_next_power_of_two(len(request.query_x)), self.model.input_dimension), dtype=self.model.compute_dtype)
+        query_x[:len(request.query_x)] = request.query_x
+        query_y = onp.asarray(self.model._jit_forward(adapted_parameters, query_x))
+        request.future.set_result(query_y[:len(request.query_x)])
+        self._record_statistics([request], time.perf_counter(), batch=False)
+
+    def _collect_batch(self) -> Optional[List[_AdaptationRequest]]:
+        """next batch of requests in order of arrival (None once closed)"""
+        first_request = self._requests.get()
+        if first_request is None:
+            return None
+        deadline = first_request.arrival_time + self.batch_timeout
+
+        batch = [first_request]
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._requests.get(timeout=max(deadline - time.perf_counter(), 0.))
+            except queue.Empty:
+                break
+            if request is None:
+                # finish batch, then stop
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _adapt_batch(self, batch: List[_AdaptationRequest]) -> None:
+        """adapt and predict for batch of requests in one compiled call (padded) and resolve their futures"""
+        batch_size = min(_next_power_of_two(len(batch)), self.max_batch_size)
+        support_size = _next_power_of_two(max(len(request.support_x) for request in batch))
+        num_queries = _next_power_of_two(max(len(request.query_x) for request in batch))
+        # padding tasks repeat first request, without fine-tuning steps
+        padded_batch = batch + [batch[0]] * (batch_size - len(batch))
+
+        support_x, support_mask = pad_sets([request.support_x for request in padded_batch], support_size)
+        support_y, _ = pad_sets([request.support_y for request in padded_batch], support_size)
+        query_x, _ = pad_sets([request.query_x for request in padded_batch], num_queries)
+        num_steps = onp.array([request.num_steps for request in batch] + [0] * (batch_size - len(batch)), dtype=onp.int32)
+        support_mask = support_mask.astype(self.model.compute_dtype)
+
+        network_parameters, parameters_fingerprint = self._network_parameters
+        query_y, adapted_parameters = self.model._jit_adapt_and_predict(
+            network_parameters, support_x, support_y, query_x, num_steps, support_mask
+            )
+        query_y = onp.asarray(query_y)
+
+        completion_time = time.perf_counter()
+        for i, request in enumerate(batch):
+            request.future.set_result(query_y[i, :len(request.query_x)])
+        self._record_statistics(batch, completion_time, batch=True)
+
+        if self.cache is not None:
+            # split on host, cached on device (saves transfer of parameters on each hit)
+            adapted_parameters = jax.tree_util.tree_map(onp.asarray, adapted_parameters)
+            request_parameters = [jax.device_put(jax.tree_util.tree_map(lambda p: p[i].copy(), adapted_parameters)) for i in range(len(batch))]
+            # entries adapted from meta parameters replaced meanwhile would never be looked up, checked under lock
+            # of meta parameters so that none is put after the cache was cleared by set_network_parameters
+            with self._parameters_lock:
+                if parameters_fingerprint == self._network_parameters[1]:
+                    for request, parameters in zip(batch, request_parameters):
+                        self.cache.put((request.fingerprint, request.num_steps, parameters_fingerprint), parameters)
+
+    def _record_statistics(self, requests: List[_AdaptationRequest], completion_time: float, batch: bool) -> None:
+        with self._statistics_lock:
+            if self._statistics_start is None:
+                self._statistics_start = min(request.arrival_time for request in requests)
+            self._latencies.extend(completion_time - request.arrival_time for request in requests)
+            if batch:
+                self._batch_sizes.append(len(requests))
+            self._num_completed += len(requests)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            try:
+                self._adapt_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def get_statistics(self, reset: bool=False) -> Dict[str, Any]:
+        """
+        Latency (arrival to predictions, ms) percentiles, throughput and mean batch size of completed requests
+        and cache statistics
+
+        :param reset: whether to start statistics afresh after this call
+        :return statistics: dictionary of statistics
+        """
+        with self._statistics_lock:
+            latencies = 1000 * onp.array(self._latencies)
+            statistics = {"requests": self._num_completed}
+            if len(latencies):
+                statistics.update({
+                    "latency_p50_ms": float(onp.percentile(latencies, 50)),
+                    "latency_p99_ms": float(onp.percentile(latencies, 99)),
+                    "throughput": self._num_completed / (time.perf_counter() - self._statistics_start)
+                    })
+            if len(self._batch_sizes):
+                statistics["mean_batch_size"] = float(onp.mean(self._batch_sizes))
+            if reset:
+                self._latencies.clear()
+                self._batch_sizes.clear()
+                self._statistics_start = None
+                self._num_completed = 0
+        if self.cache is not None:
+            statistics.update(self.cache.get_statistics(reset=reset))
+        return statistics
+
+    def close(self) -> None:
+        """adapt requests already queued, then stop worker thread (later requests raise RuntimeError)"""
+        with self._closed_lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._thread.join()
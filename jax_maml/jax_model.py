@@ -1,5 +1,7 @@
 import random
 import copy
+import collections
+import contextlib
 import time
 import os
 import datetime
@@ -15,11 +17,20 @@ from typing import Any, Tuple, List, Dict
 from abc import ABC, abstractmethod
 
 from utils.priority import PriorityQueue
+from utils.profiler import PhaseProfiler
+from utils.precision import PrecisionPolicy
+from utils.async_validation import AsyncValidator
+from utils.prefetch import BatchPrefetcher
+from utils.prng import RandomStreams
+from utils import run_state
+
+from .jax_compilation import initialise_compilation_cache, warm_up
 
 # jax imports
 import jax.numpy as np
 import jax
 from jax import vmap # for auto-vectorizing functions
+from jax import lax
 from jax import jit # for compiling functions for speedup
 from jax.experimental import stax # neural network library
 from jax.experimental.stax import Conv, Dense, MaxPool, Relu, Flatten, LogSoftmax
@@ -29,12 +40,57 @@ from jax.experimental import optimizers
 from functools import partial # for use with vmap
 
 
+def pad_sets(sets: List[onp.ndarray], size: int=None) -> Tuple[onp.ndarray, onp.ndarray]:
+    """
+    Stack sets of examples with different numbers of examples (e.g. support sets of different k) into one array
+    padded with zeros, with mask of valid examples (for use with masked losses/adaptation)
+
+    :param sets: arrays of examples (number of examples x dimension) of each set
+    :param size: number of examples to pad to (default largest set)
+
+    :return padded_sets: padded sets (sets x size x dimension)
+    :return mask: 1 for examples of each set, 0 for padding (sets x size)
+    """
+    size = size or max(len(examples) for examples in sets)
+    padded_sets = onp.zeros((len(sets), size) + sets[0].shape[1:], dtype=sets[0].dtype)
+    mask = onp.zeros((len(sets), size), dtype=onp.float32)
+    for i, examples in enumerate(sets):
+        padded_sets[i, :len(examples)] = examples
+        mask[i, :len(examples)] = 1.
+    return padded_sets, mask
+
+def _block_until_ready(pytree) -> None:
+    """blocks until all (asynchronously dispatched) arrays in pytree have been computed"""
+    for leaf in jax.tree_util.tree_leaves(pytree):
+        if hasattr(leaf, "block_until_ready"):
+            leaf.block_until_ready()
+
+def _check_precision_mode(precision: PrecisionPolicy) -> None:
+    """raise if (process-wide) jax x64 mode does not match precision of model (see MAML.configure_process)"""
+    x64_required = precision.precision == "fp64"
+    if jax.config.read("jax_enable_x64") != x64_required:
+        raise ValueError(
+            "Precision {} requires jax x64 mode to be {}abled, configure process for it (MAML.configure_process) "
+            "before constructing models".format(precision.precision, "en" if x64_required else "dis")
+            )
+
+
 class MAML(ABC):
     """
     Base class for the MAML algorithm.
 
     Includes training and validation loop methods.
     """
+    @staticmethod
+    def configure_process(params) -> None:
+        """
+        Apply process-wide settings required by models of given parameters: jax x64 mode (needed for fp64).
+        Call once at process start, before models are constructed (constructors raise if the mode does not match).
+
+        :param params: parameters of run
+        """
+        jax.config.update("jax_enable_x64", PrecisionPolicy.from_params(params).precision == "fp64")
+
     def __init__(self, params):
         self.params = params
 
@@ -61,10 +117,36 @@ class MAML(ABC):
         self.output_dimension = self.params.get("output_dimension")
         self.sample_type = self.params.get(["priority_queue", "sample_type"])
 
+        # dtypes of parameters, computation and data (float64 requires jax x64 mode, see configure_process)
+        self.precision = PrecisionPolicy.from_params(self.params)
+        _check_precision_mode(self.precision)
+        self.parameter_dtype = getattr(np, self.precision.parameter_dtype)
+        self.compute_dtype = getattr(np, self.precision.compute_dtype)
+        self.loss_scale = self.precision.loss_scale
+
         # initialise tensorboard writer
         self.writer = SummaryWriter(self.checkpoint_path)
         # 'results/{}/{}'.format(self.params.get("experiment_name"), self.params.get("experiment_timestamp"))
 
+        # initialise profiler for phases of training loop (no-op unless enabled in config)
+        self.profiler = PhaseProfiler(
+            enabled=self.params.get(["profiling", "enabled"]),
+            summary_frequency=self.params.get(["profiling", "summary_frequency"]),
+            trace=self.params.get(["profiling", "trace"]),
+            save_path=self.checkpoint_path,
+            writer=self.writer,
+            synchronise_fn=_block_until_ready
+            )
+        self._outer_loop_compiled = False
+
+        # mean loss of most recent in-process validation (None until first validation, not updated by asynchronous
+        # validation, whose losses only reach the event log; see utils.run_state.train_and_write_metrics)
+        self.last_validation_loss = None
+
+        # every random draw (initialisation, tasks, examples, queue sampling) from counter-based streams of run seed,
+        # indexed by step and task slot, so that draws do not depend on order or thread of sampling
+        self.random_streams = RandomStreams(self.params.get("seed"))
+
         # if using priority queue for inner loop sampling, initialise 
         if self.params.get("priority_sample"):
             self.priority_queue = self._get_priority_queue()
@@ -74,8 +156,7 @@ class MAML(ABC):
 
         # initialise jax model
         self.network_initialisation, self.network_forward = self._get_model()
-        input_shape = (-1, self.input_dimension,)
-        random_initialisation = random.PRNGKey(0)
+        input_shape = self._get_input_shape()
 
         # load previously trained model to continue with
         if self.params.get(["resume", "model"]):
@@ -89,12 +170,50 @@ class MAML(ABC):
                 raise FileNotFoundError("Resume checkpoint specified in config does not exist.")
         else:
             self.start_iteration = 0
-            output_shape, network_parameters = self.network_initialisation(random_initialisation, input_shape)
+            network_parameters = self._initialise_network_parameters(input_shape)
+
+        network_parameters = jax.tree_util.tree_map(lambda p: np.asarray(p, dtype=self.parameter_dtype), network_parameters)
 
         # initialise jax optimiser
         self.optimier_initialisation, self.optimiser_update, self.get_params_from_optimiser = self._get_optimiser()
         self.optimiser_state = self.optimier_initialisation(network_parameters)
 
+        # jit compiled versions of training/validation functions (compiled once per input shape, on first call)
+        self._jit_outer_training_loop = jit(self.outer_training_loop)
+        self._jit_batch_maml_task_losses = jit(self.batch_maml_task_losses)
+        self._jit_inner_loop_update = jit(self._inner_loop_update)
+        self._jit_compute_loss = jit(self._compute_loss)
+        self._jit_task_grid_losses = jit(self._task_grid_losses, static_argnums=(5, 6, 7))
+        self._jit_adapt_and_predict = jit(self._adapt_and_predict)
+        self._jit_forward = jit(self._forward)
+
+        # queue updates of resumed run made after its saved queue state (replayed in train, see get_run_state)
+        self._pending_queue_updates = []
+        # prefetcher of batches while training (its snapshots of queue state are saved in run state)
+        self._prefetcher = None
+
+        # restore full run state (parameters, optimiser, rngs, queue and step) of pre-empted run
+        resume_path = run_state.get_resume_path(self.params)
+        if resume_path is not None:
+            self.set_run_state(run_state.load_run_state(resume_path))
+
+        # write run state periodically and when terminated (e.g. pre-emption of spot instance)
+        self.run_state_frequency = self.params.get(["run_state", "save_frequency"])
+        self.preemption_handler = run_state.PreemptionHandler()
+
+        # validate parameter snapshots in separate process (during train) rather than pausing training
+        self.async_validation = self.params.get(["async_validation", "enabled"])
+
+        # prepare batches of upcoming steps in background thread while current step runs
+        self.prefetch = self.params.get(["prefetch", "enabled"])
+
+        # share compiled executables across runs via persistent cache, optionally compile before training
+        self.compilation_cache_dir = self.params.get(["compilation", "cache_dir"])
+        if self.compilation_cache_dir:
+            initialise_compilation_cache(self.compilation_cache_dir)
+        if self.params.get(["compilation", "warm_up"]):
+            self.warm_up()
+
     @abstractmethod
     def _get_model(self):
         """
@@ -102,6 +221,16 @@ class MAML(ABC):
         """
         raise NotImplementedError("Base class method")
 
+    def _initialise_network_parameters(self, input_shape: Tuple[int, ...]) -> List:
+        """
+        Initial network parameters, drawn from initialisation stream of run
+
+        :param input_shape: shape of network inputs (batch dimension -1)
+        :return network_parameters: parameters of network
+        """
+        _, network_parameters = self.network_initialisation(self.random_streams.jax_key("init"), input_shape)
+        return network_parameters
+
     def _checkpoint_model(self, step_count: int, network_parameters: List) -> None:
         """
         Save a copy of the network parameters up to this point in training
@@ -165,11 +294,12 @@ class MAML(ABC):
         raise NotImplementedError("Base class abstract method")
 
     @abstractmethod
-    def _generate_batch(self, tasks: List):
+    def _generate_batch(self, tasks: List, rngs: List=None):
         """
         Obtain batch of training examples from a list of tasks
 
         :param tasks: list of tasks for which data points need to be sampled
+        :param rngs: random generator of each task (see utils.prng), default global numpy generator
         
         :return x_batch: x points sampled from data
         :return y_batch: y points associated with x_batch
@@ -187,23 +317,84 @@ class MAML(ABC):
         """
         raise NotImplementedError("Base class abstract method")
 
-    def _inner_loop_update(self, parameters: List, x_batch: np.ndarray, y_batch: np.ndarray) -> List:
+    def _compute_point_losses(self, parameters, inputs, ground_truth):
+        """
+        Compute loss of each example (loss of _compute_loss before mean over examples), needed for masked losses
+
+        :param parameters: current parameters of model
+        :param inputs: x values on which to compute predictions and compute loss
+        :param ground_truth: y value ground truth associated with inputs
+
+        :return point_losses: loss of each example
+        """
+        raise NotImplementedError("Per-example losses not implemented for this task family")
+
+    def _compute_masked_loss(self, parameters, inputs: np.ndarray, ground_truth: np.ndarray, mask: np.ndarray):
+        """
+        Mean loss over valid examples of padded set (equal to _compute_loss of set without padding)
+
+        :param mask: 1 for valid examples, 0 for padding
+        """
+        point_losses = self._compute_point_losses(parameters, inputs, ground_truth)
+        return np.sum(mask * point_losses) / np.maximum(np.sum(mask), 1.)
+
+    def _generate_task_batch(self, key, task_parameters: np.ndarray, num_points: int=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Obtain batch of training examples of tasks given by their parameters, sampled on device 
+        (used in dense evaluation of task grids)
+
+        :param key: PRNG key from which examples are sampled
+        :param task_parameters: parameters of tasks (tasks x 1 x number of task parameters)
+        :param num_points: number of examples per task (default inner_update_k)
+
+        :return x_batch: x points sampled for each task
+        :return y_batch: y points associated with x_batch
+        """
+        raise NotImplementedError("On-device batch generation not implemented for this task family")
+
+    def _forward(self, parameters: List, inputs: np.ndarray) -> np.ndarray:
+        """
+        Forward pass of network in compute dtype (parameters cast from parameter dtype), 
+        outputs returned in parameter dtype
+
+        :param parameters: current parameters of model
+        :param inputs: x values on which to compute predictions
+        """
+        compute_parameters = jax.tree_util.tree_map(lambda p: p.astype(self.compute_dtype), parameters)
+        return self.network_forward(compute_parameters, inputs.astype(self.compute_dtype)).astype(self.parameter_dtype)
+
+    def _scaled_loss(self, parameters: List, inputs: np.ndarray, ground_truth: np.ndarray, mask: np.ndarray=None) -> np.ndarray:
+        """loss (masked if mask given) multiplied by loss scale (to be differentiated, gradients divided by loss scale after)"""
+        if mask is not None:
+            return self.loss_scale * self._compute_masked_loss(parameters, inputs, ground_truth, mask)
+        return self.loss_scale * self._compute_loss(parameters, inputs, ground_truth)
+
+    def _inner_loop_update(
+        self, parameters: List, x_batch: np.ndarray, y_batch: np.ndarray, mask: np.ndarray=None, inner_update_lr=None
+        ) -> List:
         """
         Inner loop of MAML algorithm, consists of optimisation steps on sampled tasks
 
         :param parameters: current parameters of model
         :param x_batch: batch of sampled data for each task
         :param y_batch: ground truth y points associated with x_batch
+        :param mask: mask of valid examples if x_batch/y_batch are padded (None if not)
+        :param inner_update_lr: learning rate of inner update (default inner_update_lr of config)
 
         :return updated_inner_parameters: updated inner network parameters
         """
-        gradients = jax.grad(self._compute_loss)(parameters, x_batch, y_batch)
-        inner_sgd_fn = lambda g, state: (state - self.inner_update_lr * g)
+        if inner_update_lr is None:
+            inner_update_lr = self.inner_update_lr
+        gradients = jax.grad(self._scaled_loss)(parameters, x_batch, y_batch, mask)
+        inner_sgd_fn = lambda g, state: (state - inner_update_lr * g / self.loss_scale)
         updated_inner_parameters = jax.tree_util.tree_multimap(inner_sgd_fn, gradients, parameters)
 
         return updated_inner_parameters
 
-    def _maml_loss(self, parameters: List, x_batch: np.ndarray, y_batch: np.ndarray, x_meta, y_meta, task_probability_weights: List):
+    def _maml_loss(
+        self, parameters: List, x_batch: np.ndarray, y_batch: np.ndarray, x_meta, y_meta, task_probability_weights: List, 
+        support_mask: np.ndarray=None, query_mask: np.ndarray=None, inner_update_lr=None
+        ):
         """
         Calculates loss to be backpropagated through meta network.
 
@@ -213,28 +404,49 @@ class MAML(ABC):
         :param x_meta: batch of sampled data to be used for meta update (i.e. to compute loss after fine-tuning)
         :param y_meta: ground truth y points associated with x_meta
         :param task_probability_weights: importance weights to be used in importance sampling regime (None if not being used)
+        :param support_mask: mask of valid examples of (padded) x_batch (None if not padded)
+        :param query_mask: mask of valid examples of (padded) x_meta (None if not padded)
+        :param inner_update_lr: learning rate of inner updates (default inner_update_lr of config)
         """
         for _ in range(self.num_inner_updates):
-            parameters = self._inner_loop_update(parameters, x_batch, y_batch)
-        if task_probability_weights is not None:
-            loss_for_meta_update = task_probability_weights * self._compute_loss(parameters, x_meta, y_meta)
+            parameters = self._inner_loop_update(parameters, x_batch, y_batch, support_mask, inner_update_lr)
+        if query_mask is not None:
+            loss_for_meta_update = self._compute_masked_loss(parameters, x_meta, y_meta, query_mask)
         else:
             loss_for_meta_update = self._compute_loss(parameters, x_meta, y_meta)
+        if task_probability_weights is not None:
+            loss_for_meta_update = task_probability_weights * loss_for_meta_update
         return loss_for_meta_update
 
-    def batch_maml_loss(self, parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights, get_all_losses=False):
+    def batch_maml_loss(
+        self, parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights, get_all_losses=False, support_mask=None, query_mask=None,
+        inner_update_lr=None
+        ):
         """
-        Batched version of _maml_loss method.
+        Batched version of _maml_loss method. Tasks with different numbers of support/query examples share
+        one batch if their sets are padded to a common size (see pad_sets) and masks are given.
 
         :param get_all_losses: whether or not to return list of losses or mean over losses. If using priority queue, 
                                we require individual task losses.
+        :param support_mask: mask of valid examples of each task in x_batch (tasks x k, None if not padded)
+        :param query_mask: mask of valid examples of each task in x_meta (None if not padded)
+        :param inner_update_lr: learning rate of inner updates (default inner_update_lr of config)
         """
-        task_losses = vmap(partial(self._maml_loss, parameters))(x_batch, y_batch, x_meta, y_meta, task_probability_weights)
+        task_losses = vmap(partial(self._maml_loss, parameters, inner_update_lr=inner_update_lr))(
+            x_batch, y_batch, x_meta, y_meta, task_probability_weights, support_mask, query_mask
+            )
         if get_all_losses:
             return task_losses
         return np.mean(task_losses)
 
-    def outer_training_loop(self, step_count: int, optimiser_state, x_batch: np.array, y_batch: np.array, x_meta: np.array, y_meta: np.array, task_probability_weights: np.array):
+    def batch_maml_task_losses(self, parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights):
+        """loss of each task of batch (see batch_maml_loss), logged and inserted in priority queue after each step"""
+        return self.batch_maml_loss(parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights, get_all_losses=True)
+
+    def outer_training_loop(
+        self, step_count: int, optimiser_state, x_batch: np.array, y_batch: np.array, x_meta: np.array, y_meta: np.array, task_probability_weights: np.array,
+        inner_update_lr=None, optimiser_update=None
+        ):
         """
         Outer loop of MAML algorithm, consists of multiple inner loops and a meta update step
 
@@ -245,75 +457,334 @@ class MAML(ABC):
         :param x_meta: extra input data sample for meta backprop
         :param y_meta: labels for extra input data
         :param task_probability_weights: weights for individual task losses
+        :param inner_update_lr: learning rate of inner updates (default inner_update_lr of config)
+        :param optimiser_update: update method of optimiser (default that of _get_optimiser)
 
         :return updated_optimiser: new optimiser state
         :return parameters: parameters after outer loop step
         """
+        if optimiser_update is None:
+            optimiser_update = self.optimiser_update
+
         # get parameters of current state of outer model
         parameters = self.get_params_from_optimiser(optimiser_state)
 
         # take derivative of inner loss term wrt outer model parameters (automatically wrt 'parameters' via jax.grad as 'parameters' is 1st arg of maml_loss)
-        derivative_fn = jax.grad(self.batch_maml_loss)
+        derivative_fn = jax.grad(lambda *args: self.loss_scale * self.batch_maml_loss(*args, inner_update_lr=inner_update_lr))
 
-        # evaluate derivative fn
+        # evaluate derivative fn (and undo loss scaling)
         gradients = derivative_fn(parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights)
+        gradients = jax.tree_util.tree_map(lambda g: g / self.loss_scale, gradients)
 
         # make step in outer model optimiser
-        updated_optimiser = self.optimiser_update(step_count, gradients, optimiser_state)
+        updated_optimiser = optimiser_update(step_count, gradients, optimiser_state)
 
         return updated_optimiser, parameters
 
+    def _get_input_shape(self) -> Tuple[int, ...]:
+        """shape of network inputs (batch dimension -1), used to initialise network. Override if inputs are not vectors."""
+        return (-1, self.input_dimension,)
+
     def fast_outer_training_loop(self):
         """
         jit accelerated outer loop method
         """
-        return jit(self.outer_training_loop)
+        return self._jit_outer_training_loop
 
-    def train(self):
+    def _get_example_batch(self, batch_size: int) -> Tuple[onp.ndarray, onp.ndarray]:
         """
-        Training orchestration method, calls outer loop and validation methods
+        Arrays with the shape and dtype of the output of _generate_batch for batch_size tasks
+        (used to compile executables ahead of training). Override if task family differs.
+
+        :param batch_size: number of tasks in batch
+        :return x_batch: example input batch
+        :return y_batch: example ground truth batch
         """
-        print("Training starting...")
-        for step_count in range(self.start_iteration, self.start_iteration + self.training_iterations):
-            # print("Training Step: {}".format(step_count))
-            if step_count % self.validation_frequency == 0 and step_count != 0:
-                if self.checkpoint_path:
-                    current_network_parameters = self.get_params_from_optimiser(self.optimiser_state)
-                    self._checkpoint_model(step_count=step_count, network_parameters=current_network_parameters)
-                if self.priority_sample:
-                    self.priority_queue.save_queue(step_count=step_count)
-                if step_count % self.visualisation_frequency == 0:
-                    vis = True
-                else:
-                    vis = False
-                self.validate(step_count=step_count, visualise=vis)
+        x_batch = onp.zeros((batch_size, self.inner_update_k, self.input_dimension), dtype=self.compute_dtype)
+        y_batch = onp.zeros((batch_size, self.inner_update_k, self.output_dimension), dtype=self.compute_dtype)
+        return x_batch, y_batch
+
+    def _get_warm_up_executables(self, parameters: List) -> Dict[str, Tuple]:
+        """
+        Jitted functions compiled in warm-up, with example arguments of the configured shapes. Override if 
+        validation of task family uses other executables than the single task ones of validate.
+
+        :param parameters: meta parameters of network
+        :return executables: (jitted function, example arguments) keyed by name
+        """
+        x_batch, y_batch = self._get_example_batch(self.task_batch_size)
+        x_validation, y_validation = self._get_example_batch(1)
+
+        if self.priority_sample and 'importance' in self.sample_type:
+            task_probability_weights = onp.ones(self.task_batch_size, dtype=self.parameter_dtype)
+        else:
+            task_probability_weights = None
+
+        return {
+            "outer_training_loop": (
+                self._jit_outer_training_loop, (self.start_iteration, self.optimiser_state, x_batch, y_batch, x_batch, y_batch, task_probability_weights)
+                ),
+            "batch_maml_task_losses": (self._jit_batch_maml_task_losses, (parameters, x_batch, y_batch, x_batch, y_batch, None)),
+            "inner_loop_update": (self._jit_inner_loop_update, (parameters, x_validation, y_validation)),
+            "compute_loss": (self._jit_compute_loss, (parameters, x_validation, y_validation))
+            }
+
+    def warm_up(self) -> None:
+        """
+        Compile train and validation executables for the configured shapes ahead of training
+        (in parallel), so that the first training step does not pay for compilation.
+        """
+        parameters = self.get_params_from_optimiser(self.optimiser_state)
+        executables = self._get_warm_up_executables(parameters)
+
+        report = warm_up(
+            executables, num_workers=self.params.get(["compilation", "warm_up_workers"]), cache_dir=self.compilation_cache_dir
+            )
+        self._outer_loop_compiled = True
+
+        print("Compiled {} executables in {:.2f}s ({})".format(
+            len(executables), report["total_time"], ", ".join("{}: {:.2f}s".format(k, v) for k, v in report["compile_times"].items())
+            ))
+        if "cache_hits" in report:
+            print("Compilation cache: {} hits, {} misses".format(report["cache_hits"], report["cache_misses"]))
+            self.writer.add_scalar('compilation/cache_hits', report["cache_hits"], self.start_iteration)
+        self.writer.add_scalar('compilation/warm_up_time', report["total_time"], self.start_iteration)
+
+    def _prepare_training_batch(self, step_count: int) -> Tuple[Tuple, List]:
+        """
+        Sample tasks of training step and generate inner and meta update examples for them on the host
+        (run in background thread if prefetching, see utils.prefetch)
+
+        :param step_count: training step of batch
 
+        :return batch: inner update inputs and ground truth, meta update inputs and ground truth and task importance weights (None if not used)
+        :return max_indices: priority queue indices of sampled tasks (None if not priority sampling)
+        """
+        with self.profiler.phase('sample'):
             batch_of_tasks, max_indices, task_probabilities = self._sample_task(batch_size=self.task_batch_size, step_count=step_count)
 
-            if 'importance' in self.sample_type:
+            if self.priority_sample and 'importance' in self.sample_type:
                 standard_task_probability = 1. / onp.prod(self.priority_queue.get_queue().shape)
-                task_importance_weights = standard_task_probability / task_probabilities
-                self.writer.add_scalar('queue_metrics/importance_weights_mean', float(onp.mean(task_importance_weights)), step_count)
+                task_importance_weights = (standard_task_probability / onp.array(task_probabilities)).astype(self.parameter_dtype)
             else:
                 task_importance_weights = None
 
-            x_train, y_train = self._generate_batch(batch_of_tasks)
-            x_meta, y_meta = self._generate_batch(batch_of_tasks)
-
-            self.optimiser_state, parameters = self.fast_outer_training_loop()(step_count, self.optimiser_state, x_train, y_train, x_meta, y_meta, task_probability_weights=task_importance_weights)
-            
-            # get a validation loss (mostly for logging purposes)
-            meta_loss = onp.asarray(self.batch_maml_loss(parameters, x_train, y_train, x_meta, y_meta, task_probability_weights=None, get_all_losses=True))
+        with self.profiler.phase('batch'):
+            slots = range(len(batch_of_tasks))
+            x_train, y_train = self._generate_batch(batch_of_tasks, rngs=self.random_streams.generators("support", step_count, slots))
+            x_meta, y_meta = self._generate_batch(batch_of_tasks, rngs=self.random_streams.generators("query", step_count, slots))
 
-            if self.priority_sample:
-                for t in range(len(meta_loss)):
-                    self.priority_queue.insert(key=max_indices[t], data=meta_loss[t])
+        return (x_train, y_train, x_meta, y_meta, task_importance_weights), max_indices
 
-            self.writer.add_scalar('meta_metrics/meta_update_loss_mean', float(np.mean(meta_loss)), step_count)
-            self.writer.add_scalar('meta_metrics/meta_update_loss_std', float(np.std(meta_loss)), step_count)
+    def train(self):
+        """
+        Training orchestration method, calls outer loop and validation methods
+        """
+        print("Training starting...")
+        async_validator = None
+        if self.async_validation:
+            async_validator = AsyncValidator(
+                type(self), self.params, self.device, max_pending=self.params.get(["async_validation", "max_pending"])
+                )
+
+        # queue updates of recent steps, those made after the queue state of a prefetched batch are saved with it
+        pending_queue_updates, self._pending_queue_updates = self._pending_queue_updates, []
+        max_staleness = self.params.get(["prefetch", "max_staleness"]) if self.priority_sample else None
+        self._queue_updates = collections.deque(maxlen=(max_staleness or 0) + 1)
+
+        prefetcher = None
+        step_count = self.start_iteration
+        try:
+            if self.prefetch:
+                prefetcher = BatchPrefetcher(
+                    self._prepare_training_batch, self.start_iteration, self.start_iteration + self.training_iterations,
+                    depth=self.params.get(["prefetch", "depth"]), max_staleness=max_staleness,
+                    stage_fn=lambda batch: (jax.device_put(batch[0]), batch[1]),
+                    snapshot_fn=self.priority_queue.get_state if self.priority_sample else None,
+                    last_update=pending_queue_updates[0][0] - 1 if pending_queue_updates else None
+                    )
+            self._prefetcher = prefetcher
+            # priority queue is read by prefetch thread while batches are prepared
+            queue_lock = prefetcher.lock if prefetcher is not None else contextlib.nullcontext()
+
+            for update_step, max_indices, meta_loss in pending_queue_updates:
+                self._update_priority_queue(update_step, max_indices, meta_loss, prefetcher)
+
+            for step_count in range(self.start_iteration, self.start_iteration + self.training_iterations):
+                # print("Training Step: {}".format(step_count))
+                if step_count % self.validation_frequency == 0 and step_count != 0:
+                    with self.profiler.phase('checkpoint'), queue_lock:
+                        if self.checkpoint_path:
+                            current_network_parameters = self.get_params_from_optimiser(self.optimiser_state)
+                            self._checkpoint_model(step_count=step_count, network_parameters=current_network_parameters)
+                        if self.priority_sample:
+                            self.priority_queue.save_queue(step_count=step_count)
+                    if step_count % self.visualisation_frequency == 0:
+                        vis = True
+                    else:
+                        vis = False
+                    with self.profiler.phase('validation'):
+                        if async_validator is not None:
+                            async_validator.submit(step_count, self.get_validation_snapshot(), visualise=vis)
+                        else:
+                            self.validate(step_count=step_count, visualise=vis)
+
+                if prefetcher is not None:
+                    with self.profiler.phase('prefetch_wait'):
+                        (x_train, y_train, x_meta, y_meta, task_importance_weights), max_indices = prefetcher.get(step_count)
+                else:
+                    (x_train, y_train, x_meta, y_meta, task_importance_weights), max_indices = self._prepare_training_batch(step_count)
+
+                # first call of jitted outer loop triggers tracing and compilation
+                with self.profiler.phase('device_step' if self._outer_loop_compiled else 'compile'):
+                    self.optimiser_state, parameters = self.fast_outer_training_loop()(step_count, self.optimiser_state, x_train, y_train, x_meta, y_meta, task_importance_weights)
+                    self.profiler.synchronise(self.optimiser_state)
+                self._outer_loop_compiled = True
+
+                with self.profiler.phase('queue_update'):
+                    # get a validation loss (mostly for logging purposes)
+                    meta_loss = onp.asarray(self._jit_batch_maml_task_losses(parameters, x_train, y_train, x_meta, y_meta, None))
+
+                    if self.priority_sample:
+                        self._update_priority_queue(step_count, max_indices, meta_loss, prefetcher)
+
+                with self.profiler.phase('logging'):
+                    self._log_training_step(step_count, meta_loss, task_importance_weights)
+
+                self.profiler.step(step_count)
+
+                if self.preemption_handler.requested:
+                    with queue_lock:
+                        self.save_run_state(step_count=step_count + 1)
+                    print("Run state saved after step {}, stopping".format(step_count))
+                    break
+                if self.run_state_frequency and (step_count + 1) % self.run_state_frequency == 0:
+                    with self.profiler.phase('checkpoint'), queue_lock:
+                        self.save_run_state(step_count=step_count + 1)
+            else:
+                with queue_lock:
+                    self.save_run_state(step_count=self.start_iteration + self.training_iterations)
+        except BaseException:
+            # do not leave prefetch thread and validation process running (e.g. when runs of a benchmark fail)
+            if prefetcher is not None:
+                prefetcher.close()
+            self._prefetcher = None
+            if async_validator is not None:
+                async_validator.close(wait=False)
+            raise
+
+        if prefetcher is not None:
+            prefetcher.close()
+        self._prefetcher = None
+
+        if async_validator is not None:
+            # finish outstanding validations, unless pre-empted
+            async_validator.close(wait=not self.preemption_handler.requested)
+
+        self.profiler.summarise(step_count)
+        self.profiler.close()
 
         net_params = self.get_params_from_optimiser(self.optimiser_state)
 
+    def _update_priority_queue(self, step_count: int, max_indices: List, meta_loss: onp.ndarray, prefetcher=None) -> None:
+        """
+        Update priority queue with losses of tasks of training step (once batches not to see the update are prepared)
+
+        :param step_count: iteration number
+        :param max_indices: queue indices of tasks of batch
+        :param meta_loss: loss of each task of batch (see batch_maml_task_losses)
+        :param prefetcher: batch prefetcher of training (None if batches are not prefetched)
+        """
+        with prefetcher.updating(step_count) if prefetcher is not None else contextlib.nullcontext():
+            for t in range(len(meta_loss)):
+                self.priority_queue.insert(key=max_indices[t], data=meta_loss[t])
+            self._queue_updates.append((step_count, max_indices, meta_loss))
+
+    def _log_training_step(self, step_count: int, meta_loss: onp.ndarray, task_importance_weights: onp.ndarray) -> None:
+        """
+        Write metrics of training step to tensorboard
+
+        :param step_count: iteration number
+        :param meta_loss: loss of each task of batch (see batch_maml_task_losses)
+        :param task_importance_weights: importance weights of tasks of batch (None if not used)
+        """
+        if task_importance_weights is not None:
+            self.writer.add_scalar('queue_metrics/importance_weights_mean', float(onp.mean(task_importance_weights)), step_count)
+        self.writer.add_scalar('meta_metrics/meta_update_loss_mean', float(onp.mean(meta_loss)), step_count)
+        self.writer.add_scalar('meta_metrics/meta_update_loss_std', float(onp.std(meta_loss)), step_count)
+
+    def get_validation_snapshot(self) -> Dict[str, Any]:
+        """state needed to validate current meta parameters in another process (see utils.async_validation)"""
+        network_parameters = jax.tree_util.tree_map(onp.asarray, self.get_params_from_optimiser(self.optimiser_state))
+        snapshot = {"network_parameters": network_parameters}
+        if self.priority_sample:
+            snapshot["priority_queue"] = self.priority_queue.get_state()
+        return snapshot
+
+    def set_validation_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        """load meta parameters (and priority queue) of snapshot returned by get_validation_snapshot"""
+        network_parameters = jax.tree_util.tree_map(lambda p: np.asarray(p, dtype=self.parameter_dtype), snapshot["network_parameters"])
+        # (optimiser moments are not needed for validation)
+        self.optimiser_state = self.optimier_initialisation(network_parameters)
+        if self.priority_sample:
+            self.priority_queue.set_state(snapshot["priority_queue"])
+
+    def get_run_state(self, step_count: int) -> Dict[str, Any]:
+        """
+        Full state of run needed to resume training exactly: meta parameters and optimiser state, 
+        random number generator states, priority queue state and step counter. If batches of the next steps
+        have been prefetched, the queue state is that before the next batch was sampled, followed by the queue
+        updates made since (replayed when training resumes).
+
+        :param step_count: next training step to run
+        :return state: dictionary of run state
+        """
+        # optimiser state is a pytree over its arrays, copy these to host before unpacking into picklable form
+        optimiser_state = jax.tree_util.tree_map(onp.asarray, self.optimiser_state)
+        state = {
+            "framework": "jax",
+            "step": step_count,
+            "optimiser_state": optimizers.unpack_optimizer_state(optimiser_state),
+            "rng_states": run_state.get_rng_states()
+            }
+        if self.priority_sample:
+            queue_state, pending_queue_updates = self.priority_queue.get_state(), []
+            snapshot = self._prefetcher.get_snapshot(step_count) if self._prefetcher is not None else None
+            if snapshot is not None:
+                # batch of step (and later ones) already prefetched: queue state before it was sampled, with updates made since
+                last_update, queue_state = snapshot
+                pending_queue_updates = [update for update in self._queue_updates if update[0] > last_update]
+            state["priority_queue"] = queue_state
+            state["pending_queue_updates"] = pending_queue_updates
+        return state
+
+    def set_run_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore run from state returned by get_run_state. Training continues from saved step
+        (the total number of training iterations is unchanged).
+
+        :param state: dictionary of run state
+        """
+        if state["framework"] != "jax":
+            raise ValueError("Run state saved by {} model cannot be restored in jax model".format(state["framework"]))
+        self.optimiser_state = optimizers.pack_optimizer_state(state["optimiser_state"])
+        run_state.set_rng_states(state["rng_states"])
+        if self.priority_sample:
+            self.priority_queue.set_state(state["priority_queue"])
+            self._pending_queue_updates = list(state.get("pending_queue_updates", []))
+        self.training_iterations = max(self.start_iteration + self.training_iterations - state["step"], 0)
+        self.start_iteration = state["step"]
+        print("Resuming training from run state @ step {}".format(self.start_iteration))
+
+    def save_run_state(self, step_count: int) -> None:
+        """
+        Write run state bundle to checkpoint path
+
+        :param step_count: next training step to run
+        """
+        if self.checkpoint_path:
+            run_state.save_run_state(self.checkpoint_path, self.get_run_state(step_count))
+
     def validate(self, step_count: int, visualise: bool=True) -> None:
         """
         Performs a validation step for loss during training. Also makes plots for tensorboard.
@@ -324,80 +795,208 @@ class MAML(ABC):
         validation_losses = []
         validation_figures = []
 
-        validation_parameter_tuples, validation_tasks = self._get_validation_tasks()
+        validation_parameter_tuples, validation_tasks = self._get_validation_tasks(step_count=step_count)
 
         for r, val_task in enumerate(validation_tasks):
 
-            # initialise list of model iterations (used for visualisation of fine-tuning)
-            validation_model_iterations = []
+            with self.profiler.phase('validation/fine_tune'):
+                # initialise list of model iterations (used for visualisation of fine-tuning)
+                validation_model_iterations = []
 
-            # make copy of current state of outer model to fine tune for validation
-            network_parameters = copy.deepcopy(self.get_params_from_optimiser(self.optimiser_state))
+                # make copy of current state of outer model to fine tune for validation
+                network_parameters = copy.deepcopy(self.get_params_from_optimiser(self.optimiser_state))
 
-            # sample a task for validation fine-tuning
-            validation_x_batch, validation_y_batch = self._generate_batch(tasks=[val_task])
+                # sample a task for validation fine-tuning
+                validation_x_batch, validation_y_batch = self._generate_batch(
+                    tasks=[val_task], rngs=[self.random_streams.generator("validation_support", step_count, r)]
+                    )
 
-            validation_model_iterations.append(copy.deepcopy(network_parameters))
+                validation_model_iterations.append(copy.deepcopy(network_parameters))
 
-            # inner loop update
-            for _ in range(self.validation_num_inner_updates):
+                # inner loop update
+                for _ in range(self.validation_num_inner_updates):
 
-                network_parameters = self._inner_loop_update(network_parameters, validation_x_batch, validation_y_batch)
+                    network_parameters = self._jit_inner_loop_update(network_parameters, validation_x_batch, validation_y_batch)
+                    
+                    validation_model_iterations.append(copy.deepcopy(network_parameters))
                 
-                validation_model_iterations.append(copy.deepcopy(network_parameters))
-            
-            # sample a new batch from same validation task for testing fine-tuned model
-            test_x_batch, test_y_batch = self._generate_batch(tasks=[val_task])
+                # sample a new batch from same validation task for testing fine-tuned model
+                test_x_batch, test_y_batch = self._generate_batch(
+                    tasks=[val_task], rngs=[self.random_streams.generator("validation_query", step_count, r)]
+                    )
 
-            test_loss = self._compute_loss(network_parameters, test_x_batch, test_y_batch)
+                test_loss = self._jit_compute_loss(network_parameters, test_x_batch, test_y_batch)
 
-            validation_losses.append(float(test_loss))
+                validation_losses.append(float(test_loss))
 
             if visualise:
-                save_name = 'validation_step_{}_rep_{}.png'.format(step_count, r)
-                validation_fig = self._visualise(
-                    validation_model_iterations, val_task, validation_x_batch, validation_y_batch, save_name=save_name, visualise_all=self.visualise_all
-                    )
-                validation_figures.append(validation_fig)
-                self.writer.add_figure("vadliation_plots/repeat_{}".format(r), validation_fig, step_count)
+                with self.profiler.phase('validation/visualise'):
+                    save_name = 'validation_step_{}_rep_{}.png'.format(step_count, r)
+                    validation_fig = self._visualise(
+                        validation_model_iterations, val_task, validation_x_batch, validation_y_batch, save_name=save_name, visualise_all=self.visualise_all
+                        )
+                    validation_figures.append(validation_fig)
+                    self.writer.add_figure("vadliation_plots/repeat_{}".format(r), validation_fig, step_count)
 
         mean_validation_loss = onp.mean(validation_losses)
         var_validation_loss = onp.std(validation_losses)
+        self.last_validation_loss = float(mean_validation_loss)
         
-        # get validation loss distribution
-        validation_loss_distribution_fig = self._get_validation_loss_distribution_plot(validation_losses)
-        # write validation loss distribution figure to tensorboard
-        self.writer.add_figure("validation_loss_distribution", validation_loss_distribution_fig, step_count)
-
-        print('--- validation loss @ step {}: {}'.format(step_count, mean_validation_loss))
-        self.writer.add_scalar('meta_metrics/validation_loss_mean', mean_validation_loss, step_count)
-        self.writer.add_scalar('meta_metrics/validation_loss_std', var_validation_loss, step_count)
-
-        # get validation loss heatmap as function of parameters governing validation task
-        if self.fixed_validation and len(validation_parameter_tuples[0]) == 2:
-            validation_loss_heatmap_fig = self._get_validation_loss_heatmap(validation_parameter_tuples, validation_losses)
-            self.writer.add_figure("validation_loss_heatmap", validation_loss_heatmap_fig, step_count)
-        else:
-            warnings.warn("Visualisation of validation losses with parameter space dimension > 2 not supported", Warning)
+        with self.profiler.phase('validation/figures'):
+            # get validation loss distribution
+            validation_loss_distribution_fig = self._get_validation_loss_distribution_plot(validation_losses)
+            # write validation loss distribution figure to tensorboard
+            self.writer.add_figure("validation_loss_distribution", validation_loss_distribution_fig, step_count)
+
+            print('--- validation loss @ step {}: {}'.format(step_count, mean_validation_loss))
+            self.writer.add_scalar('meta_metrics/validation_loss_mean', mean_validation_loss, step_count)
+            self.writer.add_scalar('meta_metrics/validation_loss_std', var_validation_loss, step_count)
+
+            # get validation loss heatmap as function of parameters governing validation task
+            if self.fixed_validation and len(validation_parameter_tuples[0]) == 2:
+                validation_loss_heatmap_fig = self._get_validation_loss_heatmap(validation_parameter_tuples, validation_losses)
+                self.writer.add_figure("validation_loss_heatmap", validation_loss_heatmap_fig, step_count)
+            else:
+                warnings.warn("Visualisation of validation losses with parameter space dimension > 2 not supported", Warning)
 
-        if self.priority_sample:
-            # get figures from priority queue
-            priority_queue_fig = self.priority_queue.visualise_priority_queue(feature='losses')
-            priority_queue_count_fig = self.priority_queue.visualise_priority_queue(feature='counts')
-            priority_queue_loss_dist_fig = self.priority_queue.visualise_priority_queue_loss_distribution()
-            
-            # write figures from priority queue to tensorboard
-            if priority_queue_fig:
-                self.writer.add_figure("priority_queue", priority_queue_fig, step_count)
-            if priority_queue_count_fig:
-                self.writer.add_figure("queue_counts", priority_queue_count_fig, step_count)
-            if priority_queue_loss_dist_fig:
-                self.writer.add_figure("queue_loss_dist", priority_queue_loss_dist_fig, step_count)
+            if self.priority_sample:
+                self._log_priority_queue_figures(step_count)
+
+    def _log_priority_queue_figures(self, step_count: int) -> None:
+        """write figures of priority queue (losses, counts and loss distribution) to tensorboard"""
+        # get figures from priority queue
+        priority_queue_fig = self.priority_queue.visualise_priority_queue(feature='losses')
+        priority_queue_count_fig = self.priority_queue.visualise_priority_queue(feature='counts')
+        priority_queue_loss_dist_fig = self.priority_queue.visualise_priority_queue_loss_distribution()
+    
+        # write figures from priority queue to tensorboard
+        if priority_queue_fig:
+            self.writer.add_figure("priority_queue", priority_queue_fig, step_count)
+        if priority_queue_count_fig:
+            self.writer.add_figure("queue_counts", priority_queue_count_fig, step_count)
+        if priority_queue_loss_dist_fig:
+            self.writer.add_figure("queue_loss_dist", priority_queue_loss_dist_fig, step_count)
+
+    def _task_grid_losses(
+        self, parameters: List, task_parameters: np.ndarray, task_indices: np.ndarray, support_counts: np.ndarray, key, 
+        num_points: int, num_test_points: int, num_inner_updates: int
+        ):
+        """
+        Test losses of tasks after fine-tuning (vmapped over tasks). Examples of each task are sampled from key 
+        folded with index of task in grid, so that they do not depend on how the grid is chunked.
+
+        :param parameters: meta parameters of network
+        :param task_parameters: parameters of tasks (tasks x 1 x number of task parameters)
+        :param task_indices: index of each task in grid
+        :param support_counts: number of examples used for fine-tuning on each task, first support_counts of 
+                               num_points sampled examples (None for num_points on every task)
+        :param key: PRNG key of evaluation
+        :param num_points: number of examples used for fine-tuning (k for k-shot, largest k if support_counts given)
+        :param num_test_points: number of examples on which fine-tuned network is tested
+        :param num_inner_updates: number of fine-tuning steps
+
+        :return task_losses: test loss of each task
+        """
+        def task_loss(task_parameter, task_index, support_count):
+            adapt_key, test_key = random.split(random.fold_in(key, task_index))
+            x_task, y_task = self._generate_task_batch(adapt_key, task_parameter[None], num_points)
+            x_test, y_test = self._generate_task_batch(test_key, task_parameter[None], num_test_points)
+            support_mask = None if support_count is None else (np.arange(num_points) < support_count).astype(self.parameter_dtype)
+            adapted_parameters = parameters
+            for _ in range(num_inner_updates):
+                adapted_parameters = self._inner_loop_update(adapted_parameters, x_task[0], y_task[0], support_mask)
+            return self._compute_loss(adapted_parameters, x_test[0], y_test[0])
+
+        return vmap(task_loss)(task_parameters, task_indices, support_counts)
+
+    def evaluate_task_grid(
+        self, network_parameters: List, task_parameters: onp.ndarray, seed: int=0, chunk_size: int=4096, num_inner_updates: int=None,
+        support_counts: onp.ndarray=None, task_indices: onp.ndarray=None
+        ) -> onp.ndarray:
+        """
+        Fine-tune network on every task of a (dense) grid of tasks and compute test losses (validation_k examples for
+        fine-tuning, test_k for testing). The grid is processed in chunks of chunk_size tasks, each adapted in one 
+        compiled, vmapped call, so that memory is bounded independent of grid size (last chunk is padded).
+
+        :param network_parameters: meta parameters to evaluate (e.g. loaded from model checkpoint)
+        :param task_parameters: parameters of tasks to evaluate (tasks x number of task parameters)
+        :param seed: seed from which examples of tasks are sampled
+        :param chunk_size: number of tasks adapted per call
+        :param num_inner_updates: number of fine-tuning steps (default validation_num_inner_updates)
+        :param support_counts: number of fine-tuning examples of each task, if tasks differ in k (padded and masked,
+                               so tasks of any k share one compiled call)
+        :param task_indices: index of each task from which its examples are sampled (default position of task), 
+                             tasks of equal index get the same examples (the first k of them for fine-tuning)
+
+        :return task_losses: test loss of each task after fine-tuning
+        """
+        if num_inner_updates is None:
+            num_inner_updates = self.validation_num_inner_updates
+        num_points = self.validation_k if support_counts is None else int(onp.max(support_counts))
+        if task_indices is None:
+            task_indices = onp.arange(len(task_parameters))
+        network_parameters = jax.tree_util.tree_map(lambda p: np.asarray(p, dtype=self.parameter_dtype), network_parameters)
+        key = random.PRNGKey(seed)
+
+        def pad(array, num_padding):
+            return None if array is None else onp.pad(array, [(0, num_padding)] + [(0, 0)] * (array.ndim - 1), mode='edge')
+
+        num_tasks = len(task_parameters)
+        chunk_size = min(chunk_size, num_tasks)
+        task_losses = onp.empty(num_tasks, dtype=onp.float32)
+        for start in range(0, num_tasks, chunk_size):
+            end = min(start + chunk_size, num_tasks)
+            num_padding = chunk_size - (end - start)
+            chunk = pad(task_parameters[start:end], num_padding)
+            chunk_support_counts = pad(None if support_counts is None else support_counts[start:end], num_padding)
+            chunk_losses = self._jit_task_grid_losses(
+                network_parameters, np.asarray(chunk[:, None, :], dtype=self.parameter_dtype), pad(task_indices[start:end], num_padding),
+                chunk_support_counts, key, num_points, self.test_k, num_inner_updates
+                )
+            task_losses[start:end] = onp.asarray(chunk_losses)[:end - start]
+        return task_losses
+
+    def _adapt(self, parameters: List, support_x: np.ndarray, support_y: np.ndarray, num_steps: np.ndarray, support_mask: np.ndarray=None) -> List:
+        """
+        Fine-tune network on support set of each task for its own number of steps (vmapped over tasks, 
+        steps beyond those of a task leave its parameters unchanged)
+
+        :param parameters: meta parameters of network
+        :param support_x: support inputs of each task (tasks x k x input dimension)
+        :param support_y: support targets of each task (tasks x k x output dimension)
+        :param num_steps: number of fine-tuning steps of each task
+        :param support_mask: mask of valid examples of each task if support sets of different sizes are padded (tasks x k)
+
+        :return adapted_parameters: fine-tuned parameters of each task (stacked along first axis)
+        """
+        max_num_steps = np.max(num_steps)
+
+        def task_adaptation(task_support_x, task_support_y, task_num_steps, task_support_mask):
+            def fine_tune_step(step, adapted_parameters):
+                updated_parameters = self._inner_loop_update(adapted_parameters, task_support_x, task_support_y, task_support_mask)
+                return jax.tree_util.tree_multimap(lambda u, a: np.where(step < task_num_steps, u, a), updated_parameters, adapted_parameters)
+            return lax.fori_loop(0, max_num_steps, fine_tune_step, parameters)
+
+        return vmap(task_adaptation)(support_x, support_y, num_steps, support_mask)
+
+    def _adapt_and_predict(
+        self, parameters: List, support_x: np.ndarray, support_y: np.ndarray, query_x: np.ndarray, num_steps: np.ndarray, support_mask: np.ndarray=None
+        ):
+        """
+        Fine-tune network on support set of each task (see _adapt) and predict at its query points
+
+        :param query_x: inputs at which to predict (tasks x number of queries x input dimension)
+
+        :return query_y: predictions of fine-tuned network of each task at its query points
+        :return adapted_parameters: fine-tuned parameters of each task (stacked along first axis)
+        """
+        adapted_parameters = self._adapt(parameters, support_x, support_y, num_steps, support_mask)
+        return vmap(self._forward)(adapted_parameters, query_x), adapted_parameters
 
     @abstractmethod
     def _visualise(
         self, validation_model_iterations: List, val_task, validation_x_batch: np.ndarray, validation_y_batch: np.ndarray, 
-        save_name: str=save_name, visualise_all: bool=self.visualise_all
+        save_name: str, visualise_all: bool=True
         ):
         """
         Visualise qualitative run.
@@ -411,12 +1010,12 @@ class MAML(ABC):
         """
         raise NotImplementedError("Base class method")
 
-    def _get_validation_tasks(self):
-        """produces set of tasks for use in validation"""
+    def _get_validation_tasks(self, step_count: int=0):
+        """produces set of tasks for use in validation (of training step step_count)"""
         if self.fixed_validation:
             return self._get_fixed_validation_tasks()
         else:
-            return None, self._sample_task(batch_size=self.validation_task_batch_size, validate=True)[0]
+            return None, self._sample_task(batch_size=self.validation_task_batch_size, validate=True, step_count=step_count)[0]
 
     @abstractmethod
     def _get_fixed_validation_tasks(self):
@@ -0,0 +1,229 @@
+import os
+import json
+import threading
+import contextlib
+import numpy as onp
+
+from tensorboardX import SummaryWriter
+
+from typing import Dict, List, Tuple
+
+from abc import abstractmethod
+
+from utils.parameters import expand_grid
+from utils.prng import RandomStreams
+
+from .jax_model import MAML
+
+# jax imports
+import jax.numpy as np
+from jax import vmap
+from jax import jit
+
+
+class PopulationMAML(MAML):
+    """
+    MAML meta-trained for a population of members at once, one member for every combination of the seeds and
+    meta/inner learning rates given in the population section of the config. The network parameters and optimiser
+    state of all members are stacked along a leading population axis and one compiled step, vmapped over that axis,
+    updates every member; everything else (task sampling, prefetching, run state, validation scaffolding) is that of
+    the task family.
+
+    Mixed in before a task family, e.g. SinePopulationMAML(PopulationMAML, SineMAML). Each member draws its
+    initialisation and training tasks from the random streams of its own seed (so that a member trains exactly as
+    the single model of its seed and learning rates), validation tasks are drawn from the streams of the run seed and
+    shared by all members. Tasks are sampled uniformly (the priority queue is not supported).
+    """
+    def __init__(self, params, device):
+        if params.get("priority_sample"):
+            raise NotImplementedError("Priority queue sampling not implemented for population training")
+
+        # members of population: every combination of seed and learning rates
+        self.members = expand_grid({
+            "seed": params.get(["population", "seeds"]),
+            "meta_lr": params.get(["population", "meta_lr"]),
+            "inner_update_lr": params.get(["population", "inner_update_lr"])
+            })
+        self.population_size = len(self.members)
+        self.member_streams = [RandomStreams(member["seed"]) for member in self.members]
+        # member whose batch is prepared in current thread (see random_streams)
+        self._member_context = threading.local()
+
+        # one tensorboard writer (sub-folder of checkpoint path) per member, so members show up as separate runs
+        self.member_writers = [
+            SummaryWriter(os.path.join(params.get("checkpoint_path"), self._get_member_name(m))) for m in range(self.population_size)
+            ]
+
+        # mean validation loss of each member (None until first validation), mean over population in last_validation_loss
+        self.last_validation_losses = None
+
+        # (cast to parameter dtype when passed to jitted functions)
+        self.meta_lrs = onp.array([member["meta_lr"] for member in self.members])
+        self.inner_update_lrs = onp.array([member["inner_update_lr"] for member in self.members])
+
+        self._jit_population_validation_losses = jit(self._population_validation_losses)
+
+        super().__init__(params, device)
+
+    @property
+    def random_streams(self) -> RandomStreams:
+        """streams of member whose batch is prepared in calling thread, otherwise those of run (e.g. for validation)"""
+        member_streams = getattr(self._member_context, "streams", None)
+        return member_streams if member_streams is not None else self._run_streams
+
+    @random_streams.setter
+    def random_streams(self, streams: RandomStreams) -> None:
+        self._run_streams = streams
+
+    @contextlib.contextmanager
+    def _member_random_streams(self, member_index: int):
+        """draws of task family (in calling thread) from streams of member within context"""
+        self._member_context.streams = self.member_streams[member_index]
+        try:
+            yield
+        finally:
+            self._member_context.streams = None
+
+    def _get_member_name(self, member_index: int) -> str:
+        """name (and tensorboard sub-folder) of population member"""
+        member = self.members[member_index]
+        return "member_{}_seed_{}_meta_lr_{}_inner_lr_{}".format(member_index, member["seed"], member["meta_lr"], member["inner_update_lr"])
+
+    @abstractmethod
+    def _get_member_optimiser(self, meta_lr):
+        """
+        Return jax optimiser of member (that of task family with learning rate of member): initialisation,
+        update method and parameter getter method
+
+        :param meta_lr: learning rate of optimiser (traced value of member inside vmapped step)
+        """
+        raise NotImplementedError("Base class method")
+
+    def _initialise_network_parameters(self, input_shape: Tuple[int, ...]) -> List:
+        """initial network parameters of every member (stacked), each drawn from initialisation stream of its seed"""
+        keys = np.stack([streams.jax_key("init") for streams in self.member_streams])
+        return vmap(lambda key: self.network_initialisation(key, input_shape)[1])(keys)
+
+    def _prepare_training_batch(self, step_count: int) -> Tuple[Tuple, List]:
+        """
+        Batch of training step of every member (stacked), each prepared by task family from streams of member
+
+        :param step_count: training step of batch
+
+        :return batch: inner update inputs and ground truth, meta update inputs and ground truth (population x tasks x ...)
+                       and task importance weights (None)
+        :return max_indices: None (no priority queue)
+        """
+        member_batches = []
+        for m in range(self.population_size):
+            with self._member_random_streams(m):
+                member_batch, _ = super()._prepare_training_batch(step_count)
+            member_batches.append(member_batch[:4])
+        return tuple(onp.stack(arrays) for arrays in zip(*member_batches)) + (None,), None
+
+    def _member_outer_training_loop(
+        self, step_count: int, optimiser_state, x_batch, y_batch, x_meta, y_meta, task_probability_weights, meta_lr, inner_update_lr
+        ):
+        """outer loop step (see MAML.outer_training_loop) of single member with its learning rates"""
+        _, optimiser_update, _ = self._get_member_optimiser(meta_lr)
+        return super().outer_training_loop(
+            step_count, optimiser_state, x_batch, y_batch, x_meta, y_meta, task_probability_weights,
+            inner_update_lr=inner_update_lr, optimiser_update=optimiser_update
+            )
+
+    def outer_training_loop(self, step_count: int, optimiser_state, x_batch, y_batch, x_meta, y_meta, task_probability_weights):
+        """
+        Outer loop step of every member (vmapped over population axis of optimiser state and batch)
+
+        :return updated_optimiser: new (stacked) optimiser state
+        :return parameters: (stacked) parameters before step
+        """
+        return vmap(self._member_outer_training_loop, in_axes=(None, 0, 0, 0, 0, 0, None, 0, 0))(
+            step_count, optimiser_state, x_batch, y_batch, x_meta, y_meta, task_probability_weights, self.meta_lrs, self.inner_update_lrs
+            )
+
+    def batch_maml_task_losses(self, parameters, x_batch, y_batch, x_meta, y_meta, task_probability_weights):
+        """loss of each task of batch of every member (population x tasks)"""
+        def member_task_losses(member_parameters, inner_update_lr, member_x_batch, member_y_batch, member_x_meta, member_y_meta):
+            return self.batch_maml_loss(
+                member_parameters, member_x_batch, member_y_batch, member_x_meta, member_y_meta, task_probability_weights,
+                get_all_losses=True, inner_update_lr=inner_update_lr
+                )
+        return vmap(member_task_losses)(parameters, self.inner_update_lrs, x_batch, y_batch, x_meta, y_meta)
+
+    def _population_validation_losses(self, parameters, inner_update_lrs, x_batch, y_batch, x_test, y_test):
+        """
+        Test losses of every member on validation tasks after validation_num_inner_updates fine-tuning steps
+
+        :return validation_losses: losses of each member and task (population size x number of tasks)
+        """
+        def task_loss(member_parameters, inner_update_lr, x_task, y_task, x_task_test, y_task_test):
+            for _ in range(self.validation_num_inner_updates):
+                member_parameters = self._inner_loop_update(member_parameters, x_task, y_task, inner_update_lr=inner_update_lr)
+            return self._compute_loss(member_parameters, x_task_test, y_task_test)
+
+        def member_losses(member_parameters, inner_update_lr):
+            return vmap(lambda *task: task_loss(member_parameters, inner_update_lr, *task))(x_batch, y_batch, x_test, y_test)
+
+        return vmap(member_losses)(parameters, inner_update_lrs)
+
+    def _get_validation_batch(self, step_count: int) -> Tuple[onp.ndarray, onp.ndarray, onp.ndarray, onp.ndarray]:
+        """fine-tuning and test examples of validation tasks of step (as in MAML.validate, stacked over tasks)"""
+        _, validation_tasks = self._get_validation_tasks(step_count=step_count)
+        x_batch, y_batch, x_test, y_test = [], [], [], []
+        for r, val_task in enumerate(validation_tasks):
+            x_task, y_task = self._generate_batch(tasks=[val_task], rngs=[self.random_streams.generator("validation_support", step_count, r)])
+            x_task_test, y_task_test = self._generate_batch(tasks=[val_task], rngs=[self.random_streams.generator("validation_query", step_count, r)])
+            x_batch.append(x_task)
+            y_batch.append(y_task)
+            x_test.append(x_task_test)
+            y_test.append(y_task_test)
+        return tuple(onp.stack(arrays) for arrays in (x_batch, y_batch, x_test, y_test))
+
+    def _get_warm_up_executables(self, parameters: List) -> Dict[str, Tuple]:
+        """population step, task losses and validation executables with example arguments of the configured shapes"""
+        x_batch, y_batch = (onp.stack([array] * self.population_size) for array in self._get_example_batch(self.task_batch_size))
+        x_validation, y_validation = self._get_example_batch(len(self._get_validation_tasks()[1]))
+        x_validation, y_validation = x_validation[:, None], y_validation[:, None]
+        return {
+            "outer_training_loop": (self._jit_outer_training_loop, (self.start_iteration, self.optimiser_state, x_batch, y_batch, x_batch, y_batch, None)),
+            "batch_maml_task_losses": (self._jit_batch_maml_task_losses, (parameters, x_batch, y_batch, x_batch, y_batch, None)),
+            "population_validation_losses": (
+                self._jit_population_validation_losses, (parameters, self.inner_update_lrs, x_validation, y_validation, x_validation, y_validation)
+                )
+            }
+
+    def _log_training_step(self, step_count: int, meta_loss: onp.ndarray, task_importance_weights: onp.ndarray) -> None:
+        """write metrics of training step of each member to its tensorboard sub-folder"""
+        for m, member_writer in enumerate(self.member_writers):
+            member_writer.add_scalar('meta_metrics/meta_update_loss_mean', float(onp.mean(meta_loss[m])), step_count)
+            member_writer.add_scalar('meta_metrics/meta_update_loss_std', float(onp.std(meta_loss[m])), step_count)
+
+    def validate(self, step_count: int, visualise: bool=False) -> None:
+        """
+        Validation of all members on the same validation tasks (in one vmapped call), losses logged per member
+
+        :param step_count: number of steps in training undergone
+        :param visualise: not supported for populations (no figures are made)
+        """
+        with self.profiler.phase('validation/fine_tune'):
+            x_batch, y_batch, x_test, y_test = self._get_validation_batch(step_count)
+            validation_losses = onp.asarray(self._jit_population_validation_losses(
+                self.get_params_from_optimiser(self.optimiser_state), self.inner_update_lrs, x_batch, y_batch, x_test, y_test
+                ))
+
+        self.last_validation_losses = [float(loss) for loss in validation_losses.mean(axis=1)]
+        self.last_validation_loss = float(onp.mean(self.last_validation_losses))
+
+        print('--- validation losses @ step {}:'.format(step_count))
+        for m, member_writer in enumerate(self.member_writers):
+            print("    {:<70}{:.4f}".format(self._get_member_name(m), self.last_validation_losses[m]))
+            member_writer.add_scalar('meta_metrics/validation_loss_mean', self.last_validation_losses[m], step_count)
+            member_writer.add_scalar('meta_metrics/validation_loss_std', float(onp.std(validation_losses[m])), step_count)
+
+        if self.checkpoint_path:
+            with open(os.path.join(self.checkpoint_path, 'population_validation.json'), 'w') as f:
+                json.dump({
+                    "step": step_count,
+                    "members": [dict(member, validation_loss=loss) for member, loss in zip(self.members, self.last_validation_losses)]
+                    }, f, indent=2)
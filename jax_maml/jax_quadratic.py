@@ -0,0 +1,304 @@
+from .jax_model import MAML
+from utils.priority import PriorityQueue
+
+import numpy as np
+import matplotlib.pyplot as plt
+import warnings
+
+from typing import Any, Dict, List, Tuple
+
+import jax.numpy as jnp
+
+from jax import random as jax_random
+from jax.experimental import stax # neural network library
+from jax.experimental import optimizers
+from jax.experimental.stax import Dense, Relu
+
+# names of parameters of quadratic tasks, in order of parameter arrays
+QUADRATIC_PARAMETER_NAMES = ("quadratic", "linear", "constant")
+
+
+def evaluate_quadratic(task_parameters, x):
+    """
+    Quadratic functions at x, for numpy or jax arrays
+
+    :param task_parameters: quadratic, linear and constant coefficient of each task (... x 3), broadcast against x
+    :param x: inputs (... x 1)
+    """
+    return task_parameters[..., 0:1] * x ** 2 + task_parameters[..., 1:2] * x + task_parameters[..., 2:3]
+
+
+class QuadraticMAML(MAML):
+    """
+    MAML for regression of quadratic functions a x^2 + b x + c, with coefficients sampled uniformly from the bounds
+    of the quadratic config section (or from a 3D priority queue over them). Tasks are arrays of their coefficients,
+    examples of a whole task batch are generated in one vectorised evaluation.
+    """
+    def __init__(self, params, device):
+        self.device = device
+        self.task_type = params.get('task_type')
+
+        # extract relevant task-specific parameters
+        self.domain_bounds = params.get(['quadratic', 'domain_bounds'])
+        self.parameter_bounds = [params.get(['quadratic', '{}_bounds'.format(name)]) for name in QUADRATIC_PARAMETER_NAMES]
+        self.validation_block_sizes = params.get(['quadratic', 'fixed_val_blocks'])
+
+        MAML.__init__(self, params)
+
+    def _get_model(self):
+        """
+        Return jax network initialisation and forward method.
+        """
+        layers = []
+
+        # inner / hidden network layers + non-linearities
+        for l in self.network_layers:
+            layers.append(Dense(l))
+            layers.append(Relu)
+
+        # output layer (no non-linearity)
+        layers.append(Dense(self.output_dimension))
+
+        # make jax stax object
+        model = stax.serial(*layers)
+
+        return model
+
+    def _get_optimiser(self):
+        """
+        Return jax optimiser: initialisation, update method and parameter getter method.
+        Optimiser learning rate is given by config (meta_lr).
+        """
+        return optimizers.adam(step_size=self.meta_lr)
+
+    def _get_priority_queue(self):
+        """Initiate priority queue over quadratic, linear and constant coefficients"""
+        return QuadraticPriorityQueue(
+                    queue_resume=self.params.get(["resume", "priority_queue"]),
+                    counts_resume=self.params.get(["resume", "queue_counts"]),
+                    sample_type=self.params.get(["priority_queue", "sample_type"]),
+                    block_sizes=self.params.get(["priority_queue", "block_sizes_quadratic"]),
+                    param_ranges=self.parameter_bounds,
+                    initial_value=self.params.get(["priority_queue", "initial_value"]),
+                    epsilon_start=self.params.get(["priority_queue", "epsilon_start"]),
+                    epsilon_final=self.params.get(["priority_queue", "epsilon_final"]),
+                    epsilon_decay_start=self.params.get(["priority_queue", "epsilon_decay_start"]),
+                    epsilon_decay_rate=self.params.get(["priority_queue", "epsilon_decay_rate"]),
+                    burn_in=self.params.get(["priority_queue", "burn_in"]),
+                    save_path=self.checkpoint_path,
+                    rng=self.random_streams.generator("queue_init")
+                    )
+
+    def _sample_task(self, batch_size, validate=False, step_count=None):
+        """
+        Sample specific task(s) from defined distribution of tasks, i.e. coefficients of quadratic functions
+
+        :param batch_size: number of tasks to sample
+        :param validate: whether or not tasks are being used for validation
+        :param step_count: step count during training
+
+        :return tasks: coefficients of each task (array of quadratic, linear and constant coefficient)
+        :return task_indices: indices of priority queue associated with batch of tasks
+        :return task_probabilities: probabilities of tasks sampled being chosen a priori
+        """
+        tasks = []
+        task_probabilities = []
+        all_max_indices = [] if self.priority_sample else None
+
+        # generator of each task slot of step
+        task_generators = self.random_streams.generators("validation_task" if validate else "task", step_count or 0, range(batch_size))
+
+        for rng in task_generators:
+
+            if self.priority_sample and not validate:
+
+                # query queue for next task parameters
+                max_indices, task_parameters, task_probability = self.priority_queue.query(step=step_count, rng=rng)
+                all_max_indices.append(max_indices)
+                task_probabilities.append(task_probability)
+
+                # compute metrics for tb logging
+                epsilon = self.priority_queue.get_epsilon()
+                if epsilon:
+                    self.writer.add_scalar('queue_metrics/epsilon', epsilon, step_count)
+                self.writer.add_scalar('queue_metrics/queue_correlation', self.priority_queue.compute_count_loss_correlation(), step_count)
+                self.writer.add_scalar('queue_metrics/queue_mean', np.mean(self.priority_queue.get_queue()), step_count)
+                self.writer.add_scalar('queue_metrics/queue_std', np.std(self.priority_queue.get_queue()), step_count)
+
+            else:
+                # sample randomly (vanilla maml)
+                task_parameters = [rng.uniform(bounds[0], bounds[1]) for bounds in self.parameter_bounds]
+                task_probabilities.append(1.)
+
+            tasks.append(self._get_task_from_params(parameters=task_parameters))
+
+        return tasks, all_max_indices, task_probabilities
+
+    def _get_task_from_params(self, parameters: List) -> Any:
+        """quadratic, linear and constant coefficient of task (array)"""
+        return np.asarray(parameters, dtype=np.float64)
+
+    def _generate_batch(self, tasks: List, rngs: List=None):
+        """
+        Obtain batch of training examples from a list of tasks (targets of all tasks in one evaluation)
+
+        :param tasks: coefficients of each task
+        :param rngs: random generator of each task (default global numpy generator)
+
+        :return x_batch: x points sampled from data (tasks x k x 1)
+        :return y_batch: y points associated with x_batch
+        """
+        if rngs is None:
+            rngs = [np.random] * len(tasks)
+        x_batch = np.stack([rng.uniform(low=self.domain_bounds[0], high=self.domain_bounds[1], size=(self.inner_update_k, 1)) for rng in rngs])
+        y_batch = evaluate_quadratic(np.stack(tasks)[:, None, :], x_batch)
+
+        return x_batch.astype(self.compute_dtype), y_batch.astype(self.compute_dtype)
+
+    def _generate_task_batch(self, key, task_parameters: jnp.ndarray, num_points: int=None) -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+        num_points (default inner_update_k) points uniformly sampled on device from domain of each task (tasks x k x 1)
+        and quadratic values at them. Task parameters are quadratic, linear and constant coefficient (tasks x 1 x 3).
+        """
+        if num_points is None:
+            num_points = self.inner_update_k
+        x_batch = jax_random.uniform(
+            key, (task_parameters.shape[0], num_points, 1), minval=self.domain_bounds[0], maxval=self.domain_bounds[1], dtype=self.parameter_dtype
+            )
+        y_batch = evaluate_quadratic(task_parameters, x_batch)
+        return x_batch.astype(self.compute_dtype), y_batch.astype(self.compute_dtype)
+
+    def get_task_parameter_grid(self, resolution: List[int]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Dense grid of quadratic tasks spanning the task distribution (bounds inclusive)
+
+        :param resolution: number of grid points along each task parameter axis (quadratic, linear and constant)
+
+        :return axes: grid values along each task parameter axis, keyed by parameter name
+        :return task_parameters: coefficients of every task of grid (tasks x 3, in C order of axes)
+        """
+        if len(resolution) != len(QUADRATIC_PARAMETER_NAMES):
+            raise ValueError("Grid of quadratic tasks needs a resolution for each of {}".format(", ".join(QUADRATIC_PARAMETER_NAMES)))
+
+        axes = {
+            name: np.linspace(bounds[0], bounds[1], num_points) for name, bounds, num_points in zip(QUADRATIC_PARAMETER_NAMES, self.parameter_bounds, resolution)
+            }
+        meshes = np.meshgrid(*axes.values(), indexing='ij')
+        task_parameters = np.stack([mesh.flatten() for mesh in meshes], axis=1)
+        return axes, task_parameters
+
+    def _compute_loss(self, parameters, inputs, ground_truth):
+        """
+        Computes loss of network
+
+        :param parameters: current weights of model
+        :param inputs: x data
+        :param ground_truth: y_data
+
+        :return loss: loss on ground truth vs output of network applied to inputs
+        """
+        predictions = self._forward(parameters, inputs)
+        loss = jnp.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2)
+        return loss
+
+    def _compute_point_losses(self, parameters, inputs, ground_truth):
+        """squared error of network at each input (k), mean of which is _compute_loss"""
+        predictions = self._forward(parameters, inputs)
+        return jnp.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2, axis=-1)
+
+    def _visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
+        """
+        Visualise qualitative run.
+
+        :param validation_model_iterations: parameters of model after successive fine-tuning steps
+        :param val_task: coefficients of task being evaluated
+        :param validation_x_batch: k data points fed to model for finetuning
+        :param validation_y_batch: ground truth data associated with validation_x_batch
+        :param save_name: name of file to be saved
+        :param visualise_all: whether to visualise all fine-tuning steps or just final
+        """
+        # ground truth
+        plot_x = np.linspace(self.domain_bounds[0], self.domain_bounds[1], 100).reshape(-1, 1)
+
+        fig = plt.figure()
+        plt.plot(plot_x, evaluate_quadratic(task, plot_x), label="Ground Truth")
+
+        final_plot_y_prediction = self.network_forward(model_iterations[-1], plot_x)
+        plt.plot(plot_x, final_plot_y_prediction, linestyle='dashed', linewidth=3.0, label='Fine-tuned MAML final update')
+
+        no_tuning_y_prediction = self.network_forward(model_iterations[0], plot_x)
+        plt.plot(plot_x, no_tuning_y_prediction, linestyle='dashed', linewidth=3.0, label='Untuned MAML prediction')
+
+        if visualise_all:
+            for model_iteration in model_iterations[1:-1]:
+                plt.plot(plot_x, self.network_forward(model_iteration, plot_x), linestyle='dashed')
+
+        plt.scatter(validation_x.astype(np.float32), validation_y.astype(np.float32), marker='o', label='K Points')
+
+        plt.title("Validation of Quadratic Meta-Regression")
+        plt.xlabel(r"x")
+        plt.ylabel(r"$ax^2 + bx + c$")
+        plt.legend()
+
+        plt.close()
+
+        return fig
+
+    def _get_fixed_validation_tasks(self):
+        """
+        If using fixed validation this method returns a set of tasks that are
+        equally spread across the task distribution space (grid over the three coefficients).
+        """
+        spectra = np.mgrid[tuple(slice(bounds[0], bounds[1], block) for bounds, block in zip(self.parameter_bounds, self.validation_block_sizes))]
+        parameter_space_tuples = np.vstack([spectrum.flatten() for spectrum in spectra]).T
+        fixed_validation_tasks = [self._get_task_from_params(parameters) for parameters in parameter_space_tuples]
+
+        return parameter_space_tuples, fixed_validation_tasks
+
+
+class QuadraticPriorityQueue(PriorityQueue):
+    """Priority queue over quadratic, linear and constant coefficient of quadratic tasks"""
+
+    def visualise_priority_queue(self, feature='losses'):
+        """
+        Produces heatmap of priority queue (losses or counts) over quadratic and linear coefficient,
+        mean over constant coefficient
+
+        :param feature: which aspect of queue to visualise. 'losses' or 'counts'
+        :return fig: matplotlib figure showing heatmap of priority queue feature
+        """
+        if feature == 'losses':
+            values = self.get_queue()
+        elif feature == 'counts':
+            values = self.sample_counts
+        else:
+            raise ValueError("feature type not recognised. Use 'losses' or 'counts'")
+
+        if values.ndim != 3:
+            warnings.warn("Visualisation of quadratic priority queue expects 3 dimensions, got {}".format(values.ndim), Warning)
+            return None
+
+        fig = plt.figure()
+        plt.imshow(
+            values.mean(axis=2), origin='lower', aspect='auto',
+            extent=(self.param_ranges[1][0], self.param_ranges[1][1], self.param_ranges[0][0], self.param_ranges[0][1])
+            )
+        plt.colorbar()
+        plt.xlabel("Linear coefficient")
+        plt.ylabel("Quadratic coefficient")
+        plt.title("mean over constant coefficient")
+
+        return fig
+
+    def visualise_priority_queue_loss_distribution(self):
+        """
+        Produces probability distribution plot of losses in the priority queue
+        """
+        all_losses = self.get_queue().flatten()
+
+        hist, bin_edges = np.histogram(all_losses, bins=int(0.1 * len(all_losses)))
+        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+        fig = plt.figure()
+        plt.plot(bin_centers, hist)
+        return fig
@@ -1,71 +1,156 @@
 from .jax_model import MAML
 from utils.priority import PriorityQueue
 
-import copy
-import math
-import random
 import numpy as np
 import matplotlib.pyplot as plt
 import warnings
 
 from typing import Any, Dict, List, Tuple
 
+import jax
+import jax.numpy as jnp
+
+from jax import jit, lax, vmap
+from jax import random as jax_random
 from jax.experimental import stax # neural network library
 from jax.experimental import optimizers
-from jax.experimental.stax import Conv, Dense, MaxPool, Relu, Flatten, LogSoftmax
+from jax.experimental.stax import Dense, Relu
+
+
+class PointNavigation(object):
+    """
+    2D point navigation: point starts at the origin, each action moves it by at most max_action per coordinate,
+    reward is negative distance to goal position of task
+    """
+    goal_names = ["goal x", "goal y"]
+    observation_dimension = 2
+    action_dimension = 2
+
+    def __init__(self, max_action: float):
+        self.max_action = max_action
+
+    def reset(self, dtype):
+        """initial state (position)"""
+        return jnp.zeros(2, dtype=dtype)
+
+    def observe(self, state):
+        return state
+
+    def step(self, state, action, goal):
+        """
+        :return next_state: position after displacement by (clipped) action
+        :return reward: negative distance of next position to goal
+        """
+        next_state = state + jnp.clip(action, -self.max_action, self.max_action)
+        return next_state, -jnp.sqrt(jnp.sum((next_state - goal) ** 2))
+
+    def plot_rollouts(self, ax, states: np.ndarray, goal: np.ndarray) -> None:
+        """paths of rollouts (rollouts x horizon x 2) and goal"""
+        for path in states:
+            ax.plot(np.concatenate([[0.], path[:, 0]]), np.concatenate([[0.], path[:, 1]]), alpha=0.5)
+        ax.scatter([goal[0]], [goal[1]], marker='*', s=200, c='k', label='Goal')
+        ax.set_xlabel("x")
+        ax.set_ylabel("y")
+
+
+class VelocityTarget(object):
+    """
+    Point mass on a line (a minimal stand-in for velocity-target locomotion tasks): actions are forces
+    (clipped to max_action) accelerating it, reward is negative distance of its velocity to the target
+    velocity of task minus a control cost
+    """
+    goal_names = ["target velocity"]
+    observation_dimension = 2
+    action_dimension = 1
+    time_step = 0.1
+
+    def __init__(self, max_action: float, control_cost: float):
+        self.max_action = max_action
+        self.control_cost = control_cost
+
+    def reset(self, dtype):
+        """initial state (position and velocity)"""
+        return jnp.zeros(2, dtype=dtype)
+
+    def observe(self, state):
+        return state
+
+    def step(self, state, action, goal):
+        """
+        :return next_state: position and velocity after one time step of (clipped) force
+        :return reward: negative distance of velocity to target velocity minus control cost
+        """
+        force = jnp.clip(action, -self.max_action, self.max_action)
+        velocity = state[1] + self.time_step * force[0]
+        position = state[0] + self.time_step * velocity
+        reward = -jnp.abs(velocity - goal[0]) - self.control_cost * jnp.sum(force ** 2)
+        return jnp.stack([position, velocity]), reward
+
+    def plot_rollouts(self, ax, states: np.ndarray, goal: np.ndarray) -> None:
+        """velocity over time of rollouts (rollouts x horizon x 2) and target velocity"""
+        for path in states:
+            ax.plot(path[:, 1], alpha=0.5)
+        ax.axhline(goal[0], c='k', linestyle='dashed', label='Target velocity')
+        ax.set_xlabel("step")
+        ax.set_ylabel("velocity")
 
-class RLMAML(MAML):
 
+class RLMAML(MAML):
+    """
+    MAML for reinforcement learning with environments written as pure jax step functions. A task is a goal
+    of the environment (task_type: point_navigation or velocity_target); rollouts of the whole task batch
+    run on device (lax.scan over the horizon, vmapped over rollouts and tasks) inside the compiled training
+    step, and the inner and meta updates are REINFORCE policy gradient steps.
+
+    The inputs of a task are its goal and its 'ground truth' is one PRNG key per rollout, so that k (e.g.
+    inner_update_k) is the number of rollouts of a policy gradient and the training loop, inner loop and
+    fine-tuning of the base class apply unchanged. The loss of a task is the negative mean return of its
+    rollouts (the value that is logged and inserted into the priority queue), with the gradient of the
+    REINFORCE surrogate. As in the original MAML for RL, the dependence of the sampled inner update rollouts
+    on the meta parameters is not differentiated.
+    """
     def __init__(self, params, device):
         self.device = device
         self.task_type = params.get('task_type')
 
         # extract relevant task-specific parameters
-        self.amplitude_bounds = params.get(['sin2d', 'amplitude_bounds'])
-        self.domain_bounds = params.get(['sin2d', 'domain_bounds'])
-        degree_phase_bounds = params.get(['sin2d', 'phase_bounds']) # phase given in degrees
-
-        if self.task_type == 'sin3d':
-            self.frequency_bounds = params.get(['sin3d', 'frequency_bounds'])
-            block_sizes = params.get(['sin3d', 'fixed_val_blocks']) 
+        if self.task_type == 'point_navigation':
+            self.environment = PointNavigation(max_action=params.get(['point_navigation', 'max_action']))
+        elif self.task_type == 'velocity_target':
+            self.environment = VelocityTarget(
+                max_action=params.get(['velocity_target', 'max_action']), control_cost=params.get(['velocity_target', 'control_cost'])
+                )
         else:
-            block_sizes = params.get(['sin2d', 'fixed_val_blocks'])
+            raise ValueError("No RL environment named {}. Use 'point_navigation' or 'velocity_target'".format(self.task_type))
+
+        self.goal_bounds = params.get([self.task_type, 'goal_bounds'])
+        self.validation_block_sizes = params.get([self.task_type, 'fixed_val_blocks'])
+        if len(self.goal_bounds) != len(self.environment.goal_names):
+            raise ValueError("Goals of {} have {} dimensions, got bounds of {}".format(self.task_type, len(self.environment.goal_names), len(self.goal_bounds)))
 
-        # convert phase bounds/ fixed_val_interval from degrees to radians
-        self.phase_bounds = [
-            degree_phase_bounds[0] * (2 * np.pi) / 360, degree_phase_bounds[1] * (2 * np.pi) / 360
-            ]
-        
-        block_sizes[1] = block_sizes[1] * (2 * np.pi) / 360
-        self.validation_block_sizes = block_sizes
+        self.horizon = params.get(['rl', 'horizon'])
+        self.discount = params.get(['rl', 'discount'])
+        self.initial_log_std = params.get(['rl', 'initial_log_std'])
+
+        # discounted returns-to-go of rewards r (rollouts x horizon) are r @ discount_matrix
+        time_steps = np.arange(self.horizon)
+        self.discount_matrix = np.where(
+            time_steps[:, None] >= time_steps[None, :], self.discount ** (time_steps[:, None] - time_steps[None, :]), 0.
+            )
+
+        self._jit_rollouts = jit(self._rollouts)
+        self._jit_adapted_task_losses = jit(self._adapted_task_losses)
 
         MAML.__init__(self, params)
 
-    def _get_priority_queue(self):
-        if self.task_type == 'sin3d':
-            param_ranges = self.params.get(["priority_queue", "param_ranges_3d"])
-            block_sizes = self.params.get(["priority_queue", "block_sizes_3d"])
-        elif self.task_type == 'sin2d':
-            param_ranges = self.params.get(["priority_queue", "param_ranges_2d"])
-            block_sizes = self.params.get(["priority_queue", "block_sizes_2d"])
-        return  SinePriorityQueue(
-                    queue_resume=self.params.get(["resume", "priority_queue"]),
-                    counts_resume=self.params.get(["resume", "queue_counts"]),
-                    sample_type=self.params.get(["priority_queue", "sample_type"]),
-                    block_sizes=block_sizes,
-                    param_ranges=param_ranges,
-                    initial_value=self.params.get(["priority_queue", "initial_value"]),
-                    epsilon_start=self.params.get(["priority_queue", "epsilon_start"]),
-                    epsilon_final=self.params.get(["priority_queue", "epsilon_final"]),
-                    epsilon_decay_start=self.params.get(["priority_queue", "epsilon_decay_start"]),
-                    epsilon_decay_rate=self.params.get(["priority_queue", "epsilon_decay_rate"]),
-                    burn_in=self.params.get(["priority_queue", "burn_in"]),
-                    save_path=self.checkpoint_path
-                    )
+    def _get_input_shape(self) -> Tuple[int, ...]:
+        return (-1, self.environment.observation_dimension)
 
     def _get_model(self):
         """
-        Returns policy network
+        Return jax initialisation and forward method of gaussian policy: network (layers given by config) outputs
+        the mean action, log standard deviations are separate parameters. The forward method returns mean and
+        log standard deviation of actions concatenated (last axis).
         """
         layers = []
 
@@ -75,264 +160,334 @@ class RLMAML(MAML):
             layers.append(Relu)
 
         # output layer (no non-linearity)
-        layers.append(Dense(self.output_dsimension))
-        
-        return stax.serial(*layers)
-
-        raise NotImplementedError
-    def __init__(self, input_size, output_size, hidden_sizes=(),
-                 nonlinearity=F.relu, init_std=1.0, min_std=1e-6):
-        super(NormalMLPPolicy, self).__init__(input_size=input_size, output_size=output_size)
-        self.hidden_sizes = hidden_sizes
-        self.nonlinearity = nonlinearity
-        self.min_log_std = math.log(min_std)
-        self.num_layers = len(hidden_sizes) + 1
-
-        layer_sizes = (input_size,) + hidden_sizes
-        for i in range(1, self.num_layers):
-            self.add_module('layer{0}'.format(i),
-                            nn.Linear(layer_sizes[i - 1], layer_sizes[i]))
-        self.mu = nn.Linear(layer_sizes[-1], output_size)
-
-        self.sigma = nn.Parameter(torch.Tensor(output_size))
-        self.sigma.data.fill_(math.log(init_std))
-        self.apply(weight_init)
-
-    def forward(self, input, params=None):
-
-        if params is None:
-            params = OrderedDict(self.named_parameters())
-
-        output = input
-        for i in range(1, self.num_layers):
-            output = F.linear(output,
-                              weight=params['layer{0}.weight'.format(i)],
-                              bias=params['layer{0}.bias'.format(i)])
-            output = self.nonlinearity(output)
-        mu = F.linear(output, weight=params['mu.weight'],
-                      bias=params['mu.bias'])
-        scale = torch.exp(torch.clamp(params['sigma'], min=self.min_log_std))
-
-        return Normal(loc=mu, scale=scale)
-    
+        layers.append(Dense(self.environment.action_dimension))
+
+        mean_initialisation, mean_forward = stax.serial(*layers)
+
+        def initialisation(rng, input_shape):
+            output_shape, mean_parameters = mean_initialisation(rng, input_shape)
+            log_std = jnp.full((self.environment.action_dimension,), self.initial_log_std)
+            return output_shape[:-1] + (2 * self.environment.action_dimension,), [mean_parameters, log_std]
+
+        def forward(parameters, inputs):
+            mean_parameters, log_std = parameters
+            mean = mean_forward(mean_parameters, inputs)
+            return jnp.concatenate([mean, jnp.broadcast_to(log_std, mean.shape).astype(mean.dtype)], axis=-1)
+
+        return initialisation, forward
+
     def _get_optimiser(self):
+        """
+        Return jax optimiser: initialisation, update method and parameter getter method.
+        Optimiser learning rate is given by config (meta_lr).
+        """
         return optimizers.adam(step_size=self.meta_lr)
 
-    def _sample_task(self, batch_size, plot=False, validate=False, step_count=None):
-        """
-        returns batch of RL gym environments defined according to the parameters specific to this RL task.
+    def _get_priority_queue(self):
+        """Initiate priority queue over goal space"""
+        return GoalPriorityQueue(
+                    goal_names=self.environment.goal_names,
+                    queue_resume=self.params.get(["resume", "priority_queue"]),
+                    counts_resume=self.params.get(["resume", "queue_counts"]),
+                    sample_type=self.params.get(["priority_queue", "sample_type"]),
+                    block_sizes=self.params.get(["priority_queue", "block_sizes_{}".format(self.task_type)]),
+                    param_ranges=self.goal_bounds,
+                    initial_value=self.params.get(["priority_queue", "initial_value"]),
+                    epsilon_start=self.params.get(["priority_queue", "epsilon_start"]),
+                    epsilon_final=self.params.get(["priority_queue", "epsilon_final"]),
+                    epsilon_decay_start=self.params.get(["priority_queue", "epsilon_decay_start"]),
+                    epsilon_decay_rate=self.params.get(["priority_queue", "epsilon_decay_rate"]),
+                    burn_in=self.params.get(["priority_queue", "burn_in"]),
+                    save_path=self.checkpoint_path,
+                    rng=self.random_streams.generator("queue_init")
+                    )
+
+    def _sample_task(self, batch_size, validate=False, step_count=None):
         """
-        raise NotImplementedError
+        Sample goals of batch_size tasks, uniformly from goal bounds or from priority queue over goal space
 
+        :return tasks: goal of each task
+        :return task_indices: indices of priority queue associated with batch of tasks
+        :return task_probabilities: probabilities of tasks sampled being chosen a priori
+        """
         tasks = []
+        task_probabilities = []
         all_max_indices = [] if self.priority_sample else None
 
-        for _ in range(batch_size):
+        # generator of each task slot of step
+        task_generators = self.random_streams.generators("validation_task" if validate else "task", step_count or 0, range(batch_size))
+
+        for rng in task_generators:
 
-            # sample a task from task distribution and generate x, y tensors for that task
             if self.priority_sample and not validate:
 
-                # query queue for next task parameters
-                max_indices, task_parameters = self.priority_queue.query(step=step_count)
+                # query queue for next goal
+                max_indices, task_parameters, task_probability = self.priority_queue.query(step=step_count, rng=rng)
                 all_max_indices.append(max_indices)
-
-                # get epsilon value
-                epsilon = self.priority_queue.get_epsilon()
-
-                # get task from parameters returned from query
-                amplitude = task_parameters[0]
-                phase = task_parameters[1]
-                if self.task_type == 'sin3d':
-                    frequency_scaling = task_parameters[2]
-                else:
-                    frequency_scaling = 1.
-                task = self._get_task_from_params(amplitude=amplitude, phase=phase, frequency_scaling=frequency_scaling)
+                task_probabilities.append(task_probability)
 
                 # compute metrics for tb logging
-                queue_count_loss_correlation = self.priority_queue.compute_count_loss_correlation()
-                queue_mean = np.mean(self.priority_queue.get_queue())
-                queue_std = np.std(self.priority_queue.get_queue())
-
-                # write to tensorboard
+                epsilon = self.priority_queue.get_epsilon()
                 if epsilon:
                     self.writer.add_scalar('queue_metrics/epsilon', epsilon, step_count)
-                self.writer.add_scalar('queue_metrics/queue_correlation', queue_count_loss_correlation, step_count)
-                self.writer.add_scalar('queue_metrics/queue_mean', queue_mean, step_count)
-                self.writer.add_scalar('queue_metrics/queue_std', queue_std, step_count)
+                self.writer.add_scalar('queue_metrics/queue_correlation', self.priority_queue.compute_count_loss_correlation(), step_count)
+                self.writer.add_scalar('queue_metrics/queue_mean', np.mean(self.priority_queue.get_queue()), step_count)
+                self.writer.add_scalar('queue_metrics/queue_std', np.std(self.priority_queue.get_queue()), step_count)
 
             else:
-                
                 # sample randomly (vanilla maml)
-                amplitude = random.uniform(self.amplitude_bounds[0], self.amplitude_bounds[1])
-                phase = random.uniform(self.phase_bounds[0], self.phase_bounds[1])
-                
-                if self.task_type == 'sin3d':
-                    frequency_scaling = random.uniform(self.frequency_bounds[0], self.frequency_bounds[1])
-                else:
-                    frequency_scaling = 1.
-                
-                task = self._get_task_from_params(amplitude=amplitude, phase=phase, frequency_scaling=frequency_scaling)
-                
-            tasks.append(task)
-    
-        return tasks, all_max_indices
-
-    def _get_task_from_params(self, amplitude: float, phase: float, frequency_scaling: float=1.) -> Any:
-        """
-        Return sine function defined by parameters given
+                task_parameters = [rng.uniform(bounds[0], bounds[1]) for bounds in self.goal_bounds]
+                task_probabilities.append(1.)
+
+            tasks.append(self._get_task_from_params(task_parameters))
 
-        :param parameters: parameters defining the specific sin task in the distribution
+        return tasks, all_max_indices, task_probabilities
 
-        :return modified_sin: sin function
+    def _get_task_from_params(self, parameters: List) -> Any:
+        """goal of task (array of goal dimension)"""
+        return np.asarray(parameters, dtype=self.parameter_dtype)
 
-        (method differs from _sample_task in that it is not a random sample but
-        defined by parameters given)
+    def _generate_batch(self, tasks: List, rngs: List=None, num_rollouts: int=None):
         """
-        def modified_sin(x):
-            return amplitude * np.sin(phase + frequency_scaling * x)
-        return modified_sin
+        Obtain goals and rollout keys of tasks (rollouts are sampled on device, in the loss)
+
+        :param tasks: goal of each task
+        :param rngs: random generator of each task (default global numpy generator)
+        :param num_rollouts: number of rollouts of each task (default inner_update_k)
 
-    def visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
+        :return x_batch: goal of each task (tasks x goal dimension)
+        :return y_batch: PRNG key of each rollout of each task (tasks x rollouts x 2)
         """
-        Gif of episode rollout?
+        if rngs is None:
+            rngs = [np.random] * len(tasks)
+        x_batch = np.stack(tasks).astype(self.parameter_dtype)
+        y_batch = np.stack([rng.randint(0, 2 ** 32, size=(num_rollouts or self.inner_update_k, 2), dtype=np.uint32) for rng in rngs])
+        return x_batch, y_batch
+
+    def _get_example_batch(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        x_batch = np.zeros((batch_size, len(self.goal_bounds)), dtype=self.parameter_dtype)
+        y_batch = np.zeros((batch_size, self.inner_update_k, 2), dtype=np.uint32)
+        return x_batch, y_batch
+
+    def _rollouts(self, parameters: List, goal: jnp.ndarray, keys: jnp.ndarray) -> Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray]:
         """
-        raise NotImplementedError
+        Rollouts of gaussian policy in environment of goal, scanned over horizon and vmapped over rollouts
 
-    def _generate_batch(self, tasks: List, plot=False): # Change batch generation to be done in pure PyTorch
+        :param parameters: parameters of policy
+        :param goal: goal of task
+        :param keys: PRNG key of each rollout (rollouts x 2)
+
+        :return log_probabilities: log probability of each action under policy (rollouts x horizon)
+        :return rewards: reward of each step (rollouts x horizon)
+        :return states: state after each step (rollouts x horizon x state dimension)
         """
-        Samples trajectories for set of RL tasks provided. 
+        action_dimension = self.environment.action_dimension
+
+        def rollout(key):
+            def environment_step(state, step_key):
+                outputs = self._forward(parameters, self.environment.observe(state))
+                mean, log_std = outputs[:action_dimension], outputs[action_dimension:]
+                # actions are samples (no gradient), gradient flows through their log probability (REINFORCE)
+                action = lax.stop_gradient(mean + jnp.exp(log_std) * jax_random.normal(step_key, mean.shape, dtype=mean.dtype))
+                log_probability = jnp.sum(-0.5 * ((action - mean) / jnp.exp(log_std)) ** 2 - log_std - 0.5 * np.log(2 * np.pi))
+                next_state, reward = self.environment.step(state, action, goal)
+                return next_state, (log_probability, reward, next_state)
+            _, trajectory = lax.scan(environment_step, self.environment.reset(self.parameter_dtype), jax_random.split(key, self.horizon))
+            return trajectory
+
+        return vmap(rollout)(keys)
+
+    def _compute_loss(self, parameters, inputs, ground_truth):
         """
-        raise NotImplementedError
+        Computes loss of policy on task from rollouts sampled on device
 
-    def _get_fixed_validation_tasks(self):
+        :param parameters: current weights of policy
+        :param inputs: goal of task
+        :param ground_truth: PRNG key of each rollout
+
+        :return loss: negative mean return of rollouts, with gradient of REINFORCE surrogate loss
+                      (discounted returns-to-go with mean over rollouts at each step as baseline, normalised)
         """
-        If using fixed validation this method returns a set of tasks that are 
-        'representative' of the task distribution in some meaningful way. 
+        # (single task, leading axis of size one as in single task validation executables of base class)
+        goal = inputs.reshape(-1)
+        keys = ground_truth.reshape(-1, 2)
+
+        log_probabilities, rewards, _ = self._rollouts(parameters, goal, keys)
+
+        returns_to_go = rewards @ self.discount_matrix.astype(rewards.dtype)
+        advantages = returns_to_go - jnp.mean(returns_to_go, axis=0)
+        advantages = advantages / (jnp.std(advantages) + 1e-8)
+
+        surrogate_loss = -jnp.mean(jnp.sum(log_probabilities * lax.stop_gradient(advantages), axis=1))
+        negative_return = -jnp.mean(jnp.sum(rewards, axis=1))
+
+        return surrogate_loss - lax.stop_gradient(surrogate_loss) + lax.stop_gradient(negative_return)
 
-        In the case of sinusoidal regression we split the parameter space equally.
+    def _adapted_task_losses(
+        self, parameters: List, goals: jnp.ndarray, support_keys: jnp.ndarray, query_keys: jnp.ndarray, num_steps: jnp.ndarray
+        ):
         """
-        # mesh of equally partitioned state space
-        if self.task_type == 'sin3d':
-            amplitude_spectrum, phase_spectrum, frequency_spectrum = np.mgrid[
-                self.amplitude_bounds[0]:self.amplitude_bounds[1]:self.validation_block_sizes[0],
-                self.phase_bounds[0]:self.phase_bounds[1]:self.validation_block_sizes[1],
-                self.frequency_bounds[0]:self.frequency_bounds[1]:self.validation_block_sizes[2]
-                ]
-            parameter_space_tuples = np.vstack((amplitude_spectrum.flatten(), phase_spectrum.flatten(), frequency_spectrum.flatten())).T
-        else:
-            amplitude_spectrum, phase_spectrum = np.mgrid[
-                self.amplitude_bounds[0]:self.amplitude_bounds[1]:self.validation_block_sizes[0],
-                self.phase_bounds[0]:self.phase_bounds[1]:self.validation_block_sizes[1]
-                ]
-            parameter_space_tuples = np.vstack((amplitude_spectrum.flatten(), phase_spectrum.flatten())).T
-
-        fixed_validation_tasks = []
-
-        def generate_sin(amplitude, phase, frequency=1):
-            def modified_sin(x):
-                return amplitude * np.sin(phase + frequency * x)
-            return modified_sin
-
-        for param_pair in parameter_space_tuples:
-            if self.task_type == 'sin3d':
-                fixed_validation_tasks.append(generate_sin(amplitude=param_pair[0], phase=param_pair[1], frequency=param_pair[2]))
-            else:
-                fixed_validation_tasks.append(generate_sin(amplitude=param_pair[0], phase=param_pair[1]))
+        Losses (negative mean returns) of tasks before and after fine-tuning, vmapped over tasks
 
-        return parameter_space_tuples, fixed_validation_tasks
+        :param goals: goal of each task
+        :param support_keys: rollout keys of fine-tuning of each task (tasks x rollouts x 2, rollouts of every step use the same keys)
+        :param query_keys: rollout keys of evaluation of each task
 
-    def _compute_loss(self, parameters, inputs, ground_truth):
+        :return pre_adaptation_losses: losses of meta parameters on query rollouts
+        :return losses: losses of fine-tuned parameters on query rollouts
+        :return adapted_parameters: fine-tuned parameters of each task (stacked along first axis)
+        """
+        adapted_parameters = self._adapt(parameters, goals, support_keys, num_steps)
+        pre_adaptation_losses = vmap(lambda goal, keys: self._compute_loss(parameters, goal, keys))(goals, query_keys)
+        losses = vmap(self._compute_loss)(adapted_parameters, goals, query_keys)
+        return pre_adaptation_losses, losses, adapted_parameters
+
+    def _get_warm_up_executables(self, parameters: List) -> Dict[str, Tuple]:
+        executables = MAML._get_warm_up_executables(self, parameters)
+
+        # validation fine-tunes all tasks in one vmapped call (see validate)
+        del executables["inner_loop_update"], executables["compute_loss"]
+        num_validation_tasks = len(self._get_validation_tasks()[1])
+        goals, _ = self._get_example_batch(num_validation_tasks)
+        support_keys = np.zeros((num_validation_tasks, self.validation_k, 2), dtype=np.uint32)
+        query_keys = np.zeros((num_validation_tasks, self.test_k, 2), dtype=np.uint32)
+        num_steps = np.full(num_validation_tasks, self.validation_num_inner_updates, dtype=np.int32)
+        executables["adapted_task_losses"] = (self._jit_adapted_task_losses, (parameters, goals, support_keys, query_keys, num_steps))
+
+        return executables
+
+    def validate(self, step_count: int, visualise: bool=True) -> None:
         """
-        Computes loss of network
+        Fine-tune on validation tasks (validation_k rollouts per step, all tasks in one vmapped call) and log
+        negative mean return of test_k rollouts before and after fine-tuning
 
-        :param parameters: current weights of model
-        :param inputs: x data
-        :param ground_truth: y_data
+        :param step_count: number of steps in training undergone
+        :param visualise: whether or not to visualise rollouts of first validation task
+        """
+        with self.profiler.phase('validation/fine_tune'):
+            validation_parameter_tuples, validation_tasks = self._get_validation_tasks(step_count=step_count)
+            slots = range(len(validation_tasks))
+            goals, support_keys = self._generate_batch(
+                validation_tasks, rngs=self.random_streams.generators("validation_support", step_count, slots), num_rollouts=self.validation_k
+                )
+            _, query_keys = self._generate_batch(
+                validation_tasks, rngs=self.random_streams.generators("validation_query", step_count, slots), num_rollouts=self.test_k
+                )
+
+            network_parameters = self.get_params_from_optimiser(self.optimiser_state)
+            num_steps = np.full(len(goals), self.validation_num_inner_updates, dtype=np.int32)
+            pre_adaptation_losses, validation_losses, adapted_parameters = self._jit_adapted_task_losses(
+                network_parameters, goals, support_keys, query_keys, num_steps
+                )
+            pre_adaptation_losses = np.asarray(pre_adaptation_losses, dtype=np.float64)
+            validation_losses = np.asarray(validation_losses, dtype=np.float64)
+
+        self.last_validation_loss = float(np.mean(validation_losses))
+
+        with self.profiler.phase('validation/figures'):
+            if visualise:
+                first_task_parameters = jax.tree_util.tree_map(lambda p: p[0], adapted_parameters)
+                save_name = 'validation_step_{}.png'.format(step_count)
+                self.writer.add_figure(
+                    "vadliation_plots/task_0",
+                    self._visualise([network_parameters, first_task_parameters], validation_tasks[0], goals[0], query_keys[0], save_name), step_count
+                    )
+
+            self.writer.add_figure("validation_loss_distribution", self._get_validation_loss_distribution_plot(validation_losses), step_count)
+
+            print('--- validation loss @ step {}: {} (before fine-tuning {})'.format(step_count, self.last_validation_loss, np.mean(pre_adaptation_losses)))
+            self.writer.add_scalar('meta_metrics/validation_loss_mean', self.last_validation_loss, step_count)
+            self.writer.add_scalar('meta_metrics/validation_loss_std', float(np.std(validation_losses)), step_count)
+            self.writer.add_scalar('meta_metrics/validation_pre_adaptation_loss_mean', float(np.mean(pre_adaptation_losses)), step_count)
+
+            # get validation loss heatmap as function of goal
+            if self.fixed_validation and len(self.goal_bounds) == 2:
+                self.writer.add_figure("validation_loss_heatmap", self._get_validation_loss_heatmap(validation_parameter_tuples, validation_losses), step_count)
+            elif self.fixed_validation:
+                fig = plt.figure()
+                plt.plot(validation_parameter_tuples[:, 0], validation_losses)
+                plt.xlabel(self.environment.goal_names[0])
+                plt.ylabel("validation loss")
+                self.writer.add_figure("validation_loss_heatmap", fig, step_count)
+
+            if self.priority_sample:
+                self._log_priority_queue_figures(step_count)
 
-        :return loss: loss on ground truth vs output of network applied to inputs
+    def _visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
         """
-        predictions = self.network_forward(parameters, inputs)
-        loss = np.mean((ground_truth - predictions) ** 2)
-        return loss
-
-class SinePriorityQueue(PriorityQueue):
-
-    def __init__(self, 
-                block_sizes: Dict[str, float], param_ranges: List[Tuple[float, float]], 
-                sample_type: str, epsilon_start: float, epsilon_final: float, epsilon_decay_rate: float, epsilon_decay_start: int,
-                queue_resume: str, counts_resume: str, save_path: str, burn_in: int=None, initial_value: float=None
-                ):
-
-        # convert phase bounds/ phase block_size from degrees to radians
-        phase_ranges = [
-            param_ranges[1][0] * (2 * np.pi) / 360, param_ranges[1][1] * (2 * np.pi) / 360
-            ]
-        phase_block_size = block_sizes[1] * (2 * np.pi) / 360
-
-        param_ranges[1] = phase_ranges
-        block_sizes[1] = phase_block_size
-        
-        super().__init__(
-            block_sizes=block_sizes, param_ranges=param_ranges, sample_type=sample_type, epsilon_start=epsilon_start,
-            epsilon_final=epsilon_final, epsilon_decay_rate=epsilon_decay_rate, epsilon_decay_start=epsilon_decay_start, queue_resume=queue_resume,
-            counts_resume=counts_resume, save_path=save_path, burn_in=burn_in, initial_value=initial_value
-        )
-
-        self.figure_locsx, self.figure_locsy, self.figure_labelsx, self.figure_labelsy = self._get_figure_labels()
-
-    def _get_figure_labels(self):
-        xlocs = np.arange(0, self.queue.shape[1])
-        ylocs = np.arange(0, self.queue.shape[0])
-        xlabels = np.arange(self.param_ranges[1][0], self.param_ranges[1][1], self.block_sizes[1])
-        ylabels = np.arange(self.param_ranges[0][0], self.param_ranges[0][1], self.block_sizes[0])
-        return xlocs, ylocs, xlabels, ylabels
+        Rollouts of policy before and after fine-tuning on a task
+
+        :param model_iterations: parameters of policy before and after fine-tuning
+        :param task: goal of task
+        :param validation_x: goal of task (as array)
+        :param validation_y: PRNG keys of rollouts
+        :param save_name: name of file to be saved
+        :param visualise_all: unused (rollouts of first and last parameters are shown)
+        """
+        fig, axes = plt.subplots(1, 2, figsize=(10, 4), sharex=True, sharey=True)
+        for ax, parameters, title in zip(axes, [model_iterations[0], model_iterations[-1]], ["Meta policy", "Fine-tuned policy"]):
+            _, rewards, states = self._jit_rollouts(parameters, validation_x, validation_y)
+            self.environment.plot_rollouts(ax, np.asarray(states, dtype=np.float32), np.asarray(task, dtype=np.float32))
+            ax.set_title("{} (mean return {:.2f})".format(title, float(np.mean(np.sum(rewards, axis=1)))))
+        axes[0].legend()
+        plt.close()
 
-    def visualise_priority_queue(self, feature='losses'):
+        return fig
+
+    def _get_fixed_validation_tasks(self):
+        """
+        If using fixed validation this method returns a set of tasks that are
+        equally spread across the task distribution space (grid over goal bounds).
         """
-        Produces plot of priority queue (losses or counts) 
+        spectra = np.mgrid[tuple(slice(bounds[0], bounds[1], block) for bounds, block in zip(self.goal_bounds, self.validation_block_sizes))]
+        parameter_space_tuples = np.vstack([spectrum.flatten() for spectrum in spectra]).T
+        fixed_validation_tasks = [self._get_task_from_params(goal) for goal in parameter_space_tuples]
 
-        Discrete vs continuous, 2d heatmap vs 3d.
+        return parameter_space_tuples, fixed_validation_tasks
+
+
+class GoalPriorityQueue(PriorityQueue):
+    """Priority queue over goal space of RL tasks (losses are negative returns)"""
+    def __init__(self, goal_names: List[str], **kwargs):
+        self.goal_names = goal_names
+        super().__init__(**kwargs)
+
+    def visualise_priority_queue(self, feature='losses'):
+        """
+        Produces plot of priority queue (losses or counts): line over 1D goal space, heatmap over 2D goal space
 
         :param feature: which aspect of queue to visualise. 'losses' or 'counts'
-        :retrun fig: matplotlib figure showing heatmap of priority queue feature
+        :return fig: matplotlib figure showing priority queue feature
         """
-        if type(self.queue) == np.ndarray:
-            if len(self.queue.shape) == 2:
-                fig = plt.figure()
-                if feature == 'losses':
-                    plt.imshow(self.queue)
-                elif feature == 'counts':
-                    plt.imshow(self.sample_counts)
-                else:
-                    raise ValueError("feature type not recognised. Use 'losses' or 'counts'")
-                plt.colorbar()
-                plt.xlabel("Phase")
-                plt.ylabel("Amplitude")
-
-                # set labels to sine specific parameter ranges
-                # plt.xticks(
-                #     locs=self.figure_locsx, 
-                #     labels=self.figure_labelsx
-                #     )
-                # plt.yticks(
-                #     locs=self.figure_locsy, 
-                #     labels=self.figure_labelsy
-                #     )
-
-                return fig
-            else:
-                warnings.warn("Visualisation with parameter space dimension > 2 not supported", Warning)   
-                return None
+        if feature == 'losses':
+            values = self.get_queue()
+        elif feature == 'counts':
+            values = self.sample_counts
+        else:
+            raise ValueError("feature type not recognised. Use 'losses' or 'counts'")
+
+        fig = plt.figure()
+        if values.ndim == 1:
+            plt.plot(self.param_ranges[0][0] + self.block_sizes[0] * (np.arange(len(values)) + 0.5), values)
+            plt.xlabel(self.goal_names[0])
+        elif values.ndim == 2:
+            plt.imshow(values)
+            plt.colorbar()
+            plt.xlabel(self.goal_names[1])
+            plt.ylabel(self.goal_names[0])
         else:
-            raise NotImplementedError("Visualisation for dictionary queue not implemented")
+            warnings.warn("Visualisation with parameter space dimension > 2 not supported", Warning)
+            plt.close(fig)
+            return None
+        return fig
 
     def visualise_priority_queue_loss_distribution(self):
         """
         Produces probability distribution plot of losses in the priority queue
         """
-        all_losses = self.queue.flatten()
+        all_losses = self.get_queue().flatten()
 
-        hist, bin_edges = np.histogram(all_losses, bins=int(0.1 * len(all_losses)))
+        hist, bin_edges = np.histogram(all_losses, bins=max(int(0.1 * len(all_losses)), 1))
         bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
 
         fig = plt.figure()
@@ -0,0 +1,307 @@
+from .jax_model import MAML
+from utils.priority import PriorityQueue
+from utils.series import SeriesDataset, SPLITS
+
+import numpy as np
+import matplotlib.pyplot as plt
+import warnings
+
+from typing import Any, List, Tuple
+
+from jax.experimental import stax # neural network library
+from jax.experimental import optimizers
+from jax.experimental.stax import Dense, Relu
+
+import jax.numpy as jnp
+
+
+class SeriesMAML(MAML):
+    """
+    MAML for forecasting of recorded series of a series dataset (utils.series), e.g. time-series segments too large
+    to fit in memory. Each task is a series of the dataset, its examples are windows of it: context_length samples
+    as input and the forecast_length samples following them as target. Series are sampled uniformly from the train
+    split, or by metadata bucket from a priority queue over the buckets; validation tasks are series of the
+    validation split.
+
+    Windows of the inner and meta update of all tasks of a step are read from the memory-mapped shards in one gather,
+    so the cost of a step does not depend on the size of the dataset; with prefetching (prefetch config) this
+    read is hidden behind the previous steps, at most prefetch depth batches being held in memory.
+    """
+    def __init__(self, params, device):
+        self.device = device
+        self.task_type = params.get('task_type')
+
+        # extract relevant task-specific parameters
+        self.dataset = SeriesDataset(
+            params.get(['series', 'dataset_path']), context_length=params.get(['series', 'context_length']),
+            forecast_length=params.get(['series', 'forecast_length']), max_open_shards=params.get(['series', 'max_open_shards'])
+            )
+        self.normalise = params.get(['series', 'normalise'])
+        self.fixed_validation_series = params.get(['series', 'fixed_val_series'])
+
+        if params.get('priority_sample') and (self.dataset.bucket_counts("train") == 0).any():
+            raise ValueError(
+                "Priority queue over buckets needs training series of every bucket, buckets {} have none".format(
+                    np.flatnonzero(self.dataset.bucket_counts("train") == 0).tolist()
+                    )
+                )
+
+        MAML.__init__(self, params)
+
+    def _get_input_shape(self) -> Tuple[int, ...]:
+        return (-1, self.dataset.context_length * self.dataset.channels)
+
+    def _get_model(self):
+        """
+        Return jax network initialisation and forward method (forecast of all channels, flattened).
+        """
+        layers = []
+
+        # inner / hidden network layers + non-linearities
+        for l in self.network_layers:
+            layers.append(Dense(l))
+            layers.append(Relu)
+
+        # output layer (no non-linearity)
+        layers.append(Dense(self.dataset.forecast_length * self.dataset.channels))
+
+        # make jax stax object
+        model = stax.serial(*layers)
+
+        return model
+
+    def _get_optimiser(self):
+        """
+        Return jax optimiser: initialisation, update method and parameter getter method.
+        Optimiser learning rate is given by config (meta_lr).
+        """
+        return optimizers.adam(step_size=self.meta_lr)
+
+    def _get_priority_queue(self):
+        """Initiate priority queue over metadata buckets of series (one block per bucket)"""
+        return SeriesPriorityQueue(
+                    queue_resume=self.params.get(["resume", "priority_queue"]),
+                    counts_resume=self.params.get(["resume", "queue_counts"]),
+                    sample_type=self.params.get(["priority_queue", "sample_type"]),
+                    block_sizes=[1],
+                    param_ranges=[[0, self.dataset.num_buckets]],
+                    initial_value=self.params.get(["priority_queue", "initial_value"]),
+                    epsilon_start=self.params.get(["priority_queue", "epsilon_start"]),
+                    epsilon_final=self.params.get(["priority_queue", "epsilon_final"]),
+                    epsilon_decay_start=self.params.get(["priority_queue", "epsilon_decay_start"]),
+                    epsilon_decay_rate=self.params.get(["priority_queue", "epsilon_decay_rate"]),
+                    burn_in=self.params.get(["priority_queue", "burn_in"]),
+                    save_path=self.checkpoint_path,
+                    rng=self.random_streams.generator("queue_init")
+                    )
+
+    def _sample_task(self, batch_size, validate=False, step_count=None):
+        """
+        Sample series of batch_size tasks, uniformly from train split (validation split if validate), or from
+        bucket given by priority queue
+
+        :param batch_size: number of tasks to sample
+        :param validate: whether or not tasks are being used for validation
+        :param step_count: step count during training
+
+        :return tasks: series of each task (rows of episode index)
+        :return task_indices: indices of priority queue (buckets) associated with batch of tasks
+        :return task_probabilities: probabilities of tasks sampled being chosen a priori
+        """
+        task_generators = self.random_streams.generators("validation_task" if validate else "task", step_count or 0, range(batch_size))
+
+        if self.priority_sample and not validate:
+            all_max_indices = []
+            task_probabilities = []
+            for rng in task_generators:
+                # query queue for bucket of next task
+                max_indices, _, task_probability = self.priority_queue.query(step=step_count, rng=rng)
+                all_max_indices.append(max_indices)
+                task_probabilities.append(task_probability)
+
+            # compute metrics for tb logging
+            epsilon = self.priority_queue.get_epsilon()
+            if epsilon:
+                self.writer.add_scalar('queue_metrics/epsilon', epsilon, step_count)
+            self.writer.add_scalar('queue_metrics/queue_correlation', self.priority_queue.compute_count_loss_correlation(), step_count)
+            self.writer.add_scalar('queue_metrics/queue_mean', np.mean(self.priority_queue.get_queue()), step_count)
+            self.writer.add_scalar('queue_metrics/queue_std', np.std(self.priority_queue.get_queue()), step_count)
+
+            series = self.dataset.sample_series(task_generators, split="train", buckets=[indices[0] for indices in all_max_indices])
+            return list(series), all_max_indices, task_probabilities
+
+        # sample randomly (vanilla maml)
+        series = self.dataset.sample_series(task_generators, split="validation" if validate else "train")
+        return list(series), None, [1.] * batch_size
+
+    def _get_task_from_params(self, parameters: List) -> Any:
+        """series of validation split given by bucket and position of series in bucket"""
+        bucket, position = parameters
+        return int(self.dataset.bucket_offsets[SPLITS.index("validation"), int(bucket)] + int(position))
+
+    def _generate_batch(self, tasks: List, rngs: List=None, num_shots: int=None):
+        """
+        Obtain batch of windows of series of tasks (windows of all tasks in one read)
+
+        :param tasks: series of each task
+        :param rngs: random generator of each task (default global numpy generator)
+        :param num_shots: windows per task (default inner_update_k)
+
+        :return x_batch: context of windows (tasks x k x context_length * channels)
+        :return y_batch: forecast targets of windows (tasks x k x forecast_length * channels)
+        """
+        if rngs is None:
+            rngs = [np.random] * len(tasks)
+        (x_batch, y_batch), = self.dataset.sample_episodes(rngs, np.asarray(tasks), [num_shots or self.inner_update_k], normalise=self.normalise)
+        return x_batch.astype(self.compute_dtype), y_batch.astype(self.compute_dtype)
+
+    def _prepare_training_batch(self, step_count: int) -> Tuple[Tuple, List]:
+        """
+        Sample series of training step, with windows of inner and meta update gathered in one read
+
+        :param step_count: training step of batch
+
+        :return batch: inner update inputs and targets, meta update inputs and targets and task importance weights (None if not used)
+        :return max_indices: priority queue indices (buckets) of sampled tasks (None if not priority sampling)
+        """
+        with self.profiler.phase('sample'):
+            series, max_indices, task_probabilities = self._sample_task(batch_size=self.task_batch_size, step_count=step_count)
+
+            if self.priority_sample and 'importance' in self.sample_type:
+                standard_task_probability = 1. / np.prod(self.priority_queue.get_queue().shape)
+                task_importance_weights = (standard_task_probability / np.array(task_probabilities)).astype(self.parameter_dtype)
+            else:
+                task_importance_weights = None
+
+        with self.profiler.phase('batch'):
+            rngs = self.random_streams.generators("support", step_count, range(self.task_batch_size))
+            (x_train, y_train), (x_meta, y_meta) = self.dataset.sample_episodes(
+                rngs, np.asarray(series), [self.inner_update_k, self.inner_update_k], normalise=self.normalise
+                )
+
+        return (
+            x_train.astype(self.compute_dtype), y_train.astype(self.compute_dtype), x_meta.astype(self.compute_dtype),
+            y_meta.astype(self.compute_dtype), task_importance_weights
+            ), max_indices
+
+    def _get_example_batch(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        x_batch = np.zeros((batch_size, self.inner_update_k, self.dataset.context_length * self.dataset.channels), dtype=self.compute_dtype)
+        y_batch = np.zeros((batch_size, self.inner_update_k, self.dataset.forecast_length * self.dataset.channels), dtype=self.compute_dtype)
+        return x_batch, y_batch
+
+    def _compute_loss(self, parameters, inputs, ground_truth):
+        """
+        Computes loss of network
+
+        :param parameters: current weights of model
+        :param inputs: context of windows
+        :param ground_truth: forecast targets of windows
+
+        :return loss: mean squared error of forecast
+        """
+        predictions = self._forward(parameters, inputs)
+        loss = jnp.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2)
+        return loss
+
+    def _compute_point_losses(self, parameters, inputs, ground_truth):
+        """squared error of forecast of each window (k), mean of which is _compute_loss"""
+        predictions = self._forward(parameters, inputs)
+        return jnp.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2, axis=-1)
+
+    def _visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
+        """
+        Visualise qualitative run: context of first fine-tuning window and its forecast (first channel)
+
+        :param model_iterations: parameters of model after successive fine-tuning steps
+        :param task: series being evaluated
+        :param validation_x: context of windows fed to model for fine-tuning
+        :param validation_y: forecast targets of windows
+        :param save_name: name of file to be saved
+        :param visualise_all: whether to visualise all fine-tuning steps or just final
+        """
+        channels = self.dataset.channels
+        context = np.asarray(validation_x, dtype=np.float32).reshape(-1, self.dataset.context_length, channels)[0, :, 0]
+        target = np.asarray(validation_y, dtype=np.float32).reshape(-1, self.dataset.forecast_length, channels)[0, :, 0]
+        context_steps = np.arange(-self.dataset.context_length, 0)
+        forecast_steps = np.arange(self.dataset.forecast_length)
+
+        context_x = np.asarray(validation_x, dtype=self.compute_dtype).reshape(-1, validation_x.shape[-1])[:1]
+
+        def forecast(parameters):
+            prediction = self.network_forward(parameters, context_x)
+            return np.asarray(prediction, dtype=np.float32).reshape(self.dataset.forecast_length, channels)[:, 0]
+
+        fig = plt.figure()
+        plt.plot(context_steps, context, label="Context")
+        plt.plot(forecast_steps, target, label="Ground Truth")
+        plt.plot(forecast_steps, forecast(model_iterations[-1]), linestyle='dashed', linewidth=3.0, label='Fine-tuned MAML final update')
+        plt.plot(forecast_steps, forecast(model_iterations[0]), linestyle='dashed', linewidth=3.0, label='Untuned MAML prediction')
+
+        if visualise_all:
+            for model_iteration in model_iterations[1:-1]:
+                plt.plot(forecast_steps, forecast(model_iteration), linestyle='dashed')
+
+        row = self.dataset.index[task]
+        plt.title("Validation of forecasting (series {}, bucket {})".format(task, row["bucket"]))
+        plt.xlabel("t")
+        plt.legend()
+
+        plt.close()
+
+        return fig
+
+    def _get_fixed_validation_tasks(self):
+        """
+        If using fixed validation this method returns the first fixed_val_series series of each bucket of the
+        validation split (as many of each bucket, so that losses form a grid of bucket and position).
+        """
+        series_per_bucket = min(self.fixed_validation_series, self.dataset.bucket_counts("validation").min())
+        if series_per_bucket == 0:
+            raise ValueError("Fixed validation needs validation series of every bucket")
+
+        parameter_space_tuples = [(bucket, position) for bucket in range(self.dataset.num_buckets) for position in range(series_per_bucket)]
+        fixed_validation_tasks = [self._get_task_from_params(parameters) for parameters in parameter_space_tuples]
+
+        return parameter_space_tuples, fixed_validation_tasks
+
+
+class SeriesPriorityQueue(PriorityQueue):
+    """Priority queue over metadata buckets of series dataset"""
+
+    def visualise_priority_queue(self, feature='losses'):
+        """
+        Produces bar plot of priority queue (losses or counts) over buckets
+
+        :param feature: which aspect of queue to visualise. 'losses' or 'counts'
+        :return fig: matplotlib figure showing priority queue feature
+        """
+        if feature == 'losses':
+            values = self.get_queue()
+        elif feature == 'counts':
+            values = self.sample_counts
+        else:
+            raise ValueError("feature type not recognised. Use 'losses' or 'counts'")
+
+        if values.ndim != 1:
+            warnings.warn("Visualisation of bucket priority queue expects 1 dimension, got {}".format(values.ndim), Warning)
+            return None
+
+        fig = plt.figure()
+        plt.bar(np.arange(len(values)), values)
+        plt.xlabel("Bucket")
+        plt.ylabel(feature)
+
+        return fig
+
+    def visualise_priority_queue_loss_distribution(self):
+        """
+        Produces probability distribution plot of losses in the priority queue
+        """
+        all_losses = self.get_queue().flatten()
+
+        hist, bin_edges = np.histogram(all_losses, bins=max(int(0.1 * len(all_losses)), 1))
+        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+        fig = plt.figure()
+        plt.plot(bin_centers, hist)
+        return fig
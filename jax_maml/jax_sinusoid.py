@@ -1,15 +1,18 @@
 from .jax_model import MAML
+from .jax_population import PopulationMAML
 from utils.priority import PriorityQueue
 
 import copy
 import math
-import random
 import numpy as np
 import matplotlib.pyplot as plt
 import warnings
 
 from typing import Any, Dict, List, Tuple
 
+import jax.numpy as jnp
+
+from jax import random as jax_random
 from jax.experimental import stax # neural network library
 from jax.experimental import optimizers
 from jax.experimental.stax import Conv, Dense, MaxPool, Relu, Flatten, LogSoftmax
@@ -36,8 +39,8 @@ class SineMAML(MAML):
             degree_phase_bounds[0] * (2 * np.pi) / 360, degree_phase_bounds[1] * (2 * np.pi) / 360
             ]
         
-        block_sizes[1] = block_sizes[1] * (2 * np.pi) / 360
-        self.validation_block_sizes = block_sizes
+        # (copied so that the configuration, saved for resumption, keeps degrees)
+        self.validation_block_sizes = [block_sizes[0], block_sizes[1] * (2 * np.pi) / 360] + list(block_sizes[2:])
 
         MAML.__init__(self, params)
 
@@ -87,7 +90,8 @@ class SineMAML(MAML):
                     epsilon_decay_start=self.params.get(["priority_queue", "epsilon_decay_start"]),
                     epsilon_decay_rate=self.params.get(["priority_queue", "epsilon_decay_rate"]),
                     burn_in=self.params.get(["priority_queue", "burn_in"]),
-                    save_path=self.checkpoint_path
+                    save_path=self.checkpoint_path,
+                    rng=self.random_streams.generator("queue_init")
                     )
 
     def _sample_task(self, batch_size, validate=False, step_count=None):
@@ -111,13 +115,16 @@ class SineMAML(MAML):
         task_probabilities = []
         all_max_indices = [] if self.priority_sample else None
 
-        for _ in range(batch_size):
+        # generator of each task slot of step
+        task_generators = self.random_streams.generators("validation_task" if validate else "task", step_count or 0, range(batch_size))
+
+        for rng in task_generators:
 
             # sample a task from task distribution and generate x, y tensors for that task
             if self.priority_sample and not validate:
 
                 # query queue for next task parameters
-                max_indices, task_parameters, task_probability = self.priority_queue.query(step=step_count)
+                max_indices, task_parameters, task_probability = self.priority_queue.query(step=step_count, rng=rng)
                 all_max_indices.append(max_indices)
                 task_probabilities.append(task_probability)
 
@@ -149,11 +156,11 @@ class SineMAML(MAML):
             else:
                 
                 # sample randomly (vanilla maml)
-                amplitude = random.uniform(self.amplitude_bounds[0], self.amplitude_bounds[1])
-                phase = random.uniform(self.phase_bounds[0], self.phase_bounds[1])
+                amplitude = rng.uniform(self.amplitude_bounds[0], self.amplitude_bounds[1])
+                phase = rng.uniform(self.phase_bounds[0], self.phase_bounds[1])
                 
                 if self.task_type == 'sin3d':
-                    frequency_scaling = random.uniform(self.frequency_bounds[0], self.frequency_bounds[1])
+                    frequency_scaling = rng.uniform(self.frequency_bounds[0], self.frequency_bounds[1])
                 else:
                     frequency_scaling = 1.
                 
@@ -182,19 +189,58 @@ class SineMAML(MAML):
             return amplitude * np.sin(phase + frequency_scaling * x)
         return modified_sin
 
-    def _generate_batch(self, tasks: List): 
+    def _generate_batch(self, tasks: List, rngs: List=None): 
         """
         Obtain batch of training examples from a list of tasks
 
         :param tasks: list of tasks for which data points need to be sampled
+        :param rngs: random generator of each task (default global numpy generator)
         
         :return x_batch: x points sampled from data
         :return y_batch: y points associated with x_batch
         """
-        x_batch = np.stack([np.random.uniform(low=self.domain_bounds[0], high=self.domain_bounds[1], size=(self.inner_update_k, 1)) for _ in range(len(tasks))])
+        if rngs is None:
+            rngs = [np.random] * len(tasks)
+        x_batch = np.stack([rng.uniform(low=self.domain_bounds[0], high=self.domain_bounds[1], size=(self.inner_update_k, 1)) for rng in rngs])
         y_batch = np.stack([[tasks[t](x) for x in x_batch[t]] for t in range(len(tasks))])
 
-        return x_batch, y_batch
+        return x_batch.astype(self.compute_dtype), y_batch.astype(self.compute_dtype)
+
+    def _generate_task_batch(self, key, task_parameters: jnp.ndarray, num_points: int=None) -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+        num_points (default inner_update_k) points uniformly sampled on device from domain of each task (tasks x k x 1)
+        and sine values at them. Task parameters are amplitude, phase and frequency (tasks x 1 x 3).
+        """
+        if num_points is None:
+            num_points = self.inner_update_k
+        x_batch = jax_random.uniform(
+            key, (task_parameters.shape[0], num_points, 1), minval=self.domain_bounds[0], maxval=self.domain_bounds[1], dtype=self.parameter_dtype
+            )
+        amplitude, phase, frequency_scaling = task_parameters[..., 0:1], task_parameters[..., 1:2], task_parameters[..., 2:3]
+        y_batch = amplitude * jnp.sin(phase + frequency_scaling * x_batch)
+        return x_batch.astype(self.compute_dtype), y_batch.astype(self.compute_dtype)
+
+    def get_task_parameter_grid(self, resolution: List[int]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Dense grid of sine tasks spanning the task distribution (bounds inclusive)
+
+        :param resolution: number of grid points along each task parameter axis (amplitude, phase and, for sin3d, frequency)
+
+        :return axes: grid values along each task parameter axis (phase in radians), keyed by parameter name
+        :return task_parameters: amplitude, phase and frequency of every task of grid (tasks x 3, in C order of axes)
+        """
+        bounds = {"amplitude": self.amplitude_bounds, "phase": self.phase_bounds}
+        if self.task_type == 'sin3d':
+            bounds["frequency"] = self.frequency_bounds
+        if len(resolution) != len(bounds):
+            raise ValueError("Grid of {} tasks needs a resolution for each of {}".format(self.task_type, ", ".join(bounds.keys())))
+
+        axes = {name: np.linspace(bound[0], bound[1], num_points) for (name, bound), num_points in zip(bounds.items(), resolution)}
+        meshes = np.meshgrid(*axes.values(), indexing='ij')
+        task_parameters = np.stack([mesh.flatten() for mesh in meshes], axis=1)
+        if self.task_type != 'sin3d':
+            task_parameters = np.hstack((task_parameters, np.ones((len(task_parameters), 1))))
+        return axes, task_parameters
 
     def _compute_loss(self, parameters, inputs, ground_truth):
         """
@@ -206,10 +252,15 @@ class SineMAML(MAML):
 
         :return loss: loss on ground truth vs output of network applied to inputs
         """
-        predictions = self.network_forward(parameters, inputs)
-        loss = np.mean((ground_truth - predictions) ** 2)
+        predictions = self._forward(parameters, inputs)
+        loss = np.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2)
         return loss
 
+    def _compute_point_losses(self, parameters, inputs, ground_truth):
+        """squared error of network at each input (k), mean of which is _compute_loss"""
+        predictions = self._forward(parameters, inputs)
+        return jnp.mean((ground_truth.astype(self.parameter_dtype) - predictions) ** 2, axis=-1)
+
     def _visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
         """
         Visualise qualitative run.
@@ -241,7 +292,7 @@ class SineMAML(MAML):
                 plot_y_prediction = self.network_forward(model_iteration, plot_x.reshape(len(plot_x), 1))
                 plt.plot(plot_x, plot_y_prediction, linestyle='dashed') #, label='Fine-tuned MAML {} update'.format(i))
 
-        plt.scatter(validation_x, validation_y, marker='o', label='K Points')
+        plt.scatter(validation_x.astype(np.float32), validation_y.astype(np.float32), marker='o', label='K Points')
 
         plt.title("Validation of Sinusoid Meta-Regression")
         plt.xlabel(r"x")
@@ -288,12 +339,24 @@ class SineMAML(MAML):
 
         return parameter_space_tuples, fixed_validation_tasks
 
+class SinePopulationMAML(PopulationMAML, SineMAML):
+    """SineMAML meta-trained for a population of seeds and learning rates at once (see PopulationMAML)"""
+
+    def _get_member_optimiser(self, meta_lr):
+        """
+        Return jax optimiser of member (as of SineMAML): initialisation, update method and parameter getter method.
+
+        :param meta_lr: learning rate of optimiser (traced value of member inside vmapped step)
+        """
+        return optimizers.adam(step_size=meta_lr)
+
 class SinePriorityQueue(PriorityQueue):
 
     def __init__(self, 
                 block_sizes: Dict[str, float], param_ranges: List[Tuple[float, float]], 
                 sample_type: str, epsilon_start: float, epsilon_final: float, epsilon_decay_rate: float, epsilon_decay_start: int,
-                queue_resume: str, counts_resume: str, save_path: str, burn_in: int=None, initial_value: float=None
+                queue_resume: str, counts_resume: str, save_path: str, burn_in: int=None, initial_value: float=None,
+                rng: np.random.RandomState=None
                 ):
 
         # convert phase bounds/ phase block_size from degrees to radians
@@ -302,13 +365,13 @@ class SinePriorityQueue(PriorityQueue):
             ]
         phase_block_size = block_sizes[1] * (2 * np.pi) / 360
 
-        param_ranges[1] = phase_ranges
-        block_sizes[1] = phase_block_size
+        param_ranges = [param_ranges[0], phase_ranges] + list(param_ranges[2:])
+        block_sizes = [block_sizes[0], phase_block_size] + list(block_sizes[2:])
         
         super().__init__(
             block_sizes=block_sizes, param_ranges=param_ranges, sample_type=sample_type, epsilon_start=epsilon_start,
             epsilon_final=epsilon_final, epsilon_decay_rate=epsilon_decay_rate, epsilon_decay_start=epsilon_decay_start, queue_resume=queue_resume,
-            counts_resume=counts_resume, save_path=save_path, burn_in=burn_in, initial_value=initial_value
+            counts_resume=counts_resume, save_path=save_path, burn_in=burn_in, initial_value=initial_value, rng=rng
         )
 
         self.figure_locsx, self.figure_locsy, self.figure_labelsx, self.figure_labelsy = self._get_figure_labels()
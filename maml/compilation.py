@@ -0,0 +1,58 @@
+import time
+import warnings
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+def _time_calls(function: Callable, arguments: Tuple, repeats: int) -> float:
+    """median wall time (seconds) of repeats calls of function on arguments"""
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+def compile_function(function: Callable, example_arguments: Tuple, repeats: int=10, mode: Optional[str]=None) -> Tuple[Callable, Dict[str, Any]]:
+    """
+    Compile function with torch.compile by calling it on example inputs of the shapes/dtypes used
+    during training, and compare steady-state time of compiled and eager calls. Falls back to the
+    eager function (with a warning) if compilation is unavailable or fails.
+
+    :param function: function to compile (pure function of its tensor arguments)
+    :param example_arguments: example arguments with which to compile and time function
+    :param repeats: number of calls over which steady-state times are measured
+    :param mode: torch.compile mode (e.g. 'reduce-overhead', 'max-autotune'), default if None
+
+    :return function: compiled function (or function given if compilation failed)
+    :return report: compile time, eager and compiled step times and speedup (or error)
+    """
+    if not hasattr(torch, "compile"):
+        warnings.warn("torch.compile not supported by installed torch version, running eagerly", Warning)
+        return function, {"compiled": False, "error": "torch.compile unavailable"}
+
+    compiled_function = torch.compile(function, mode=mode, dynamic=False)
+    t0 = time.perf_counter()
+    try:
+        compiled_function(*example_arguments)
+    except Exception as e:
+        warnings.warn("Compilation failed ({}: {}), running eagerly".format(type(e).__name__, e), Warning)
+        return function, {"compiled": False, "error": "{}: {}".format(type(e).__name__, e)}
+    compile_time = time.perf_counter() - t0
+
+    eager_step_time = _time_calls(function, example_arguments, repeats)
+    compiled_step_time = _time_calls(compiled_function, example_arguments, repeats)
+
+    report = {
+        "compiled": True,
+        "compile_time": compile_time,
+        "eager_step_time": eager_step_time,
+        "compiled_step_time": compiled_step_time,
+        "speedup": eager_step_time / compiled_step_time,
+        # number of steps after which compilation has paid for itself
+        "break_even_steps": compile_time / max(eager_step_time - compiled_step_time, 1e-12) if eager_step_time > compiled_step_time else float("inf")
+        }
+    return compiled_function, report
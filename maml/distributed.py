@@ -0,0 +1,121 @@
+import os
+import random
+
+from typing import Any, List, Optional, Tuple, Type
+
+from utils import run_state
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def get_rank() -> int:
+    """rank of this process in distributed training (0 if not distributed)"""
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+def get_world_size() -> int:
+    """number of processes in distributed training (1 if not distributed)"""
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+def launch(model_class: Type, params, device: torch.device, world_size: int, master_port: int, final_validation: bool=False) -> None:
+    """
+    Train model with world_size processes on this machine (gloo backend, localhost rendezvous).
+    Each rank adapts a shard of every task batch, meta gradients are all-reduced before each meta update.
+    Rank 0 writes metrics of the completed run to metrics.json of the results folder.
+
+    :param model_class: MAML class to instantiate in each process (e.g. maml.sinusoid.SineMAML)
+    :param params: experiment parameters
+    :param device: device on which to train
+    :param world_size: number of processes
+    :param master_port: localhost port used for rendezvous
+    :param final_validation: whether rank 0 validates (without visualisation) once more at the end of training
+    """
+    mp.spawn(_train_worker, args=(world_size, master_port, model_class, params, device, final_validation), nprocs=world_size, join=True)
+
+def _train_worker(rank: int, world_size: int, master_port: int, model_class: Type, params, device: torch.device, final_validation: bool) -> None:
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(master_port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    # share cores between ranks rather than each rank using all of them for intra-op parallelism
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    # only rank 0 writes checkpoints/validation, other ranks log (e.g. profiling) to own sub-folder
+    if rank != 0:
+        params.ammend_property("checkpoint_path", os.path.join(params.get("checkpoint_path"), "rank_{}".format(rank), ""))
+
+    seed_value = params.get("seed") + rank
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+    torch.manual_seed(seed_value)
+
+    model = None
+    try:
+        model = model_class(params, device)
+        if rank == 0:
+            run_state.train_and_write_metrics(model, params.get("checkpoint_path"), final_validation)
+        else:
+            model.train()
+    finally:
+        # flush tensorboard event writer before process exits
+        if model is not None:
+            model.writer.close()
+        dist.destroy_process_group()
+
+def broadcast_parameters(parameters: List[torch.Tensor], src: int=0) -> None:
+    """overwrite (in place) parameters on all ranks with those of rank src"""
+    with torch.no_grad():
+        for parameter in parameters:
+            dist.broadcast(parameter.data, src=src)
+
+def broadcast_tensor(
+    tensor: Optional[torch.Tensor], shape: Optional[Tuple[int]]=None, dtype: Optional[torch.dtype]=None, src: int=0
+    ) -> torch.Tensor:
+    """
+    Broadcast tensor from rank src to all ranks
+
+    :param tensor: tensor to broadcast (only used on rank src)
+    :param shape: shape of tensor if known on all ranks, otherwise (with dtype) also broadcast
+    :param dtype: dtype of tensor if known on all ranks, otherwise (with shape) also broadcast
+    :param src: rank from which to broadcast
+
+    :return tensor: broadcast tensor on every rank
+    """
+    if shape is None or dtype is None:
+        metadata_list = [(tuple(tensor.shape), tensor.dtype) if get_rank() == src else None]
+        dist.broadcast_object_list(metadata_list, src=src)
+        shape, dtype = metadata_list[0]
+    if get_rank() != src:
+        tensor = torch.empty(shape, dtype=dtype)
+    dist.broadcast(tensor, src=src)
+    return tensor
+
+def all_reduce_mean(tensors: Tuple[torch.Tensor]) -> Tuple[torch.Tensor]:
+    """mean of tensors over ranks (reduced as one flat buffer to limit number of collectives)"""
+    flat_buffer = torch.cat([tensor.reshape(-1) for tensor in tensors])
+    dist.all_reduce(flat_buffer, op=dist.ReduceOp.SUM)
+    flat_buffer /= get_world_size()
+    return tuple(chunk.view_as(tensor) for chunk, tensor in zip(flat_buffer.split([t.numel() for t in tensors]), tensors))
+
+def gather(tensor: torch.Tensor, dst: int=0) -> Optional[torch.Tensor]:
+    """concatenation (along first dimension, in rank order) of equally shaped tensors of all ranks on rank dst (None on other ranks)"""
+    if get_rank() == dst:
+        gather_list = [torch.empty_like(tensor) for _ in range(get_world_size())]
+        dist.gather(tensor, gather_list=gather_list, dst=dst)
+        return torch.cat(gather_list)
+    dist.gather(tensor, dst=dst)
+    return None
+
+def gather_object(obj: Any, dst: int=0) -> Optional[List[Any]]:
+    """(picklable) objects of all ranks in rank order on rank dst (None on other ranks)"""
+    object_list = [None] * get_world_size() if get_rank() == dst else None
+    dist.gather_object(obj, object_list, dst=dst)
+    return object_list
+
+def any_rank(flag: bool) -> bool:
+    """whether flag is set on any rank"""
+    flag_tensor = torch.tensor([int(flag)])
+    dist.all_reduce(flag_tensor, op=dist.ReduceOp.MAX)
+    return bool(flag_tensor.item())
@@ -3,10 +3,11 @@ import copy
 import time
 import os
 import datetime
+import warnings
 
 from tensorboardX import SummaryWriter
 
-from typing import Any, Tuple, List, Dict
+from typing import Any, Tuple, List, Dict, Optional
 
 from abc import ABC, abstractmethod
 
@@ -16,8 +17,17 @@ import matplotlib.pyplot as plt
 import torch
 from torch import optim
 from torch import nn
+from torch import func
 
 from utils.priority import PriorityQueue
+from utils.profiler import PhaseProfiler
+from utils.precision import PrecisionPolicy
+from utils.async_validation import AsyncValidator
+from utils.prng import RandomStreams
+from utils import run_state
+
+from .compilation import compile_function
+from . import distributed
 
 class ModelNetwork(nn.Module):
     
@@ -52,6 +62,16 @@ class ModelNetwork(nn.Module):
         """
         raise NotImplementedError("Base class abstract method")
 
+    def functional_forward(self, parameters: Tuple[torch.Tensor], x: torch.Tensor) -> torch.Tensor:
+        """
+        Perform forward pass of x through network with given (rather than stored) parameters.
+        Pure function of its inputs so can be transformed with torch.func (grad, vmap).
+
+        :param parameters: weights followed by biases (ordered as in self.weights + self.biases)
+        :param x: tensor to be fed through network
+        """
+        raise NotImplementedError("Functional forward not implemented for this network")
+
     def _reset_parameters(self) -> None:
         """
         Reset all parameters in network using unifrom Gaussian initialisation
@@ -62,8 +82,38 @@ class ModelNetwork(nn.Module):
             self.biases[l].data.uniform_(-std, std)
 
 
+def _adam_update(
+    parameters: Tuple[torch.Tensor], gradients: Tuple[torch.Tensor], first_moments: List[torch.Tensor], second_moments: List[torch.Tensor], 
+    step: int, lr: float, betas: Tuple[float, float]=(0.9, 0.999), eps: float=1e-8
+    ) -> Tuple[torch.Tensor]:
+    """
+    Single Adam step (same update and defaults as torch.optim.Adam) on functional parameters. Moments are updated in place.
+
+    :param step: index of this step (starting from 1, used for bias correction)
+
+    :return parameters: updated parameters
+    """
+    beta1, beta2 = betas
+    updated_parameters = []
+    for parameter, gradient, first_moment, second_moment in zip(parameters, gradients, first_moments, second_moments):
+        first_moment.mul_(beta1).add_(gradient, alpha=1 - beta1)
+        second_moment.mul_(beta2).addcmul_(gradient, gradient, value=1 - beta2)
+        denominator = (second_moment / (1 - beta2 ** step)).sqrt_().add_(eps)
+        updated_parameters.append(parameter - lr / (1 - beta1 ** step) * first_moment / denominator)
+    return tuple(updated_parameters)
+
+
 class MAML(ABC):
 
+    @staticmethod
+    def configure_process(params) -> None:
+        """
+        Apply process-wide settings required by models of given parameters (none for pytorch models,
+        see jax_maml MAML.configure_process)
+
+        :param params: parameters of run
+        """
+
     def __init__(self, params):
         self.params = params
 
@@ -84,13 +134,50 @@ class MAML(ABC):
         self.validation_task_batch_size = self.params.get("validation_task_batch_size")
         self.fixed_validation = self.params.get("fixed_validation")
         self.priority_sample = self.params.get("priority_sample")
+        self.functional = self.params.get(["pytorch", "functional"])
+
+        # rank 0 samples tasks (and owns priority queue, checkpoints and validation) in distributed training
+        self.rank = distributed.get_rank()
+        self.world_size = distributed.get_world_size()
+        if self.world_size > 1:
+            if not self.functional:
+                raise ValueError("Distributed training only supported for functional pytorch backend")
+            if self.task_batch_size % self.world_size != 0:
+                raise ValueError("task_batch_size ({}) must be divisible by world_size ({})".format(self.task_batch_size, self.world_size))
+        self._task_batch_shape, self._task_batch_dtype = None, None
+
+        # dtypes of parameters, computation and data
+        self.precision = PrecisionPolicy.from_params(self.params)
+        self.parameter_dtype = getattr(torch, self.precision.parameter_dtype)
+        self.compute_dtype = getattr(torch, self.precision.compute_dtype)
+        self.loss_scale = self.precision.loss_scale
+        if self.precision.mixed and not self.functional:
+            raise ValueError("Mixed precision ({}) only supported for functional pytorch backend".format(self.precision.precision))
+
+        # seeded generator used for task sampling and batch generation (different stream for each rank)
+        self.generator = torch.Generator(device=self.device)
+        if self.params.get("seed") is not None:
+            self.generator.manual_seed(self.params.get("seed") + self.rank)
+
+        # priority queue sampling (rank 0) from counter-based streams of run seed, indexed by step and task slot
+        self.random_streams = RandomStreams(self.params.get("seed"))
 
         # initialise tensorboard writer
         self.writer = SummaryWriter(self.checkpoint_path)
         # 'results/{}/{}'.format(self.params.get("experiment_name"), self.params.get("experiment_timestamp"))
 
+        # initialise profiler for phases of training loop (no-op unless enabled in config)
+        self.profiler = PhaseProfiler(
+            enabled=self.params.get(["profiling", "enabled"]),
+            summary_frequency=self.params.get(["profiling", "summary_frequency"]),
+            trace=self.params.get(["profiling", "trace"]),
+            save_path=self.checkpoint_path,
+            writer=self.writer,
+            synchronise_fn=self._synchronise_device
+            )
+
         # if using priority queue for inner loop sampling, initialise 
-        if self.params.get("priority_sample"):
+        if self.params.get("priority_sample") and self.rank == 0:
             self.priority_queue = self._get_priority_queue()
 
             if self.params.get(["priority_queue", "burn_in"]) is not None:
@@ -109,9 +196,24 @@ class MAML(ABC):
                 raise FileNotFoundError("Resume checkpoint specified in config does not exist.")
         else:
             self.start_iteration = 0
+
+        with torch.no_grad():
+            for parameter in self.model_inner.weights + self.model_inner.biases:
+                parameter.data = parameter.data.to(self.parameter_dtype)
+
+        # mean loss of most recent in-process validation (None until first validation, not updated by asynchronous
+        # validation, whose losses only reach the event log; see utils.run_state.train_and_write_metrics)
+        self.last_validation_loss = None
+
+        # heatmap of validation losses is only drawn for 2d fixed validation grids (warned once otherwise)
+        self._validation_heatmap_warned = False
         
         self.model_outer = copy.deepcopy(self.model_inner).to(self.device)
 
+        # all ranks start from meta parameters of rank 0
+        if self.world_size > 1:
+            distributed.broadcast_parameters(self.model_outer.weights + self.model_outer.biases)
+
         self.meta_optimiser = optim.Adam(
             self.model_outer.weights + self.model_outer.biases, lr=self.meta_lr
             )
@@ -119,9 +221,29 @@ class MAML(ABC):
         if self.params.get(["resume", "model"]):
             self.meta_optimiser.load_state_dict(checkpoint['optimizer_state_dict'])
 
+        # function computing meta gradient of task batch (replaced by compiled version if compiling)
+        self._meta_gradient = self._functional_meta_gradient
+        if self.params.get(["pytorch", "compile"]):
+            if self.functional:
+                self.compile_meta_gradient()
+            else:
+                warnings.warn("Compilation only supported for functional pytorch backend, running eagerly", Warning)
+
         # write copy of config_yaml in model_checkpoint_folder
         self.params.save_configuration(self.checkpoint_path)
 
+        # restore full run state (parameters, optimiser, rngs, queue and step) of pre-empted run
+        resume_path = run_state.get_resume_path(self.params)
+        if resume_path is not None:
+            self.set_run_state(run_state.load_run_state(resume_path))
+
+        # write run state periodically and when terminated (e.g. pre-emption of spot instance)
+        self.run_state_frequency = self.params.get(["run_state", "save_frequency"])
+        self.preemption_handler = run_state.PreemptionHandler()
+
+        # validate parameter snapshots in separate process (during train) rather than pausing training
+        self.async_validation = self.params.get(["async_validation", "enabled"])
+
     @abstractmethod
     def _get_priority_queue(self):
         """Initiate priority queue"""
@@ -137,6 +259,17 @@ class MAML(ABC):
         """
         raise NotImplementedError("Base class abstract method")
 
+    def _sample_tasks(self, num_tasks: int) -> Any:
+        """
+        Sample number of tasks from defined distribution of tasks (can be overriden
+        by task families that sample in one vectorised op)
+
+        :param num_tasks: number of tasks to sample
+
+        Return type dependent of task family (iterable of tasks)
+        """
+        return [self._sample_task() for _ in range(num_tasks)]
+
     @abstractmethod
     def _get_task_from_params(self) -> Any:
         """
@@ -176,6 +309,9 @@ class MAML(ABC):
         """
         Outer loop of MAML algorithm, consists of multiple inner loops and a meta update step
         """
+        if self.functional:
+            return self.functional_outer_training_loop(step_count)
+
         # get copies of meta network parameters
         weight_copies = [w.clone() for w in self.model_outer.weights]
         bias_copies = [b.clone() for b in self.model_outer.biases]
@@ -183,30 +319,35 @@ class MAML(ABC):
         # initialise cumulative gradient to be used in meta update step
         meta_update_gradient = [0 for _ in range(len(weight_copies) + len(bias_copies))]
 
-        for _ in range(self.task_batch_size):
-            task_meta_gradient = self.inner_training_loop(step_count, weight_copies, bias_copies)  
+        for task_slot in range(self.task_batch_size):
+            task_meta_gradient = self.inner_training_loop(step_count, weight_copies, bias_copies, task_slot=task_slot)
             for i in range(len(weight_copies) + len(bias_copies)):
                 meta_update_gradient[i] += task_meta_gradient[i].detach()
 
-        # meta update
-        # zero previously collected gradients
-        self.meta_optimiser.zero_grad()
+        with self.profiler.phase('device_step'):
+            # meta update
+            # zero previously collected gradients
+            self.meta_optimiser.zero_grad()
 
-        for i in range(len(self.model_outer.weights)):
-            self.model_outer.weights[i].grad = meta_update_gradient[i] / self.task_batch_size
-            meta_update_gradient[i] = 0
-        for j in range(len(self.model_outer.biases)):
-            self.model_outer.biases[j].grad = meta_update_gradient[i + j + 1] / self.task_batch_size
-            meta_update_gradient[i + j + 1] = 0
+            for i in range(len(self.model_outer.weights)):
+                self.model_outer.weights[i].grad = meta_update_gradient[i] / self.task_batch_size
+                meta_update_gradient[i] = 0
+            for j in range(len(self.model_outer.biases)):
+                self.model_outer.biases[j].grad = meta_update_gradient[i + j + 1] / self.task_batch_size
+                meta_update_gradient[i + j + 1] = 0
 
-        self.meta_optimiser.step()
+            self.meta_optimiser.step()
+            self.profiler.synchronise(self.model_outer.weights)
 
-    def inner_training_loop(self, step_count: int, weight_copies: List[torch.Tensor], bias_copies: List[torch.Tensor]) -> torch.Tensor:
+    def inner_training_loop(
+        self, step_count: int, weight_copies: List[torch.Tensor], bias_copies: List[torch.Tensor], task_slot: int=0
+        ) -> torch.Tensor:
         """
         Inner loop of MAML algorithm, consists of optimisation steps on sampled tasks
 
         :param weight_copies: copy of weights in network of outer loop
         :param bias_copies: copy of biases in network of outer loop
+        :param task_slot: index of task in batch of step (selects random stream of priority queue query)
 
         :return meta_update_grad: gradient to be fed to meta update
         """
@@ -217,195 +358,535 @@ class MAML(ABC):
 
         # sample a task from task distribution and generate x, y tensors for that task
         if self.priority_sample:
-            # query queue for next task parameters
-            max_indices, task_parameters = self.priority_queue.query(step=step_count)
+            with self.profiler.phase('sample'):
+                # query queue for next task parameters
+                max_indices, task_parameters, _ = self.priority_queue.query(
+                    step=step_count, rng=self.random_streams.generator("task", step_count, task_slot)
+                    )
 
-            # get epsilon value
-            epsilon = self.priority_queue.get_epsilon()
+                # get task from parameters returned from query
+                task = self._get_task_from_params(task_parameters)
 
-            # get task from parameters returned from query
-            task = self._get_task_from_params(task_parameters)
+            with self.profiler.phase('logging'):
+                self._log_queue_metrics(step_count)
+        else:
+            with self.profiler.phase('sample'):
+                task = self._sample_task()
 
-            # compute metrics for tb logging
-            queue_count_loss_correlation = self.priority_queue.compute_count_loss_correlation()
-            queue_mean = np.mean(self.priority_queue.get_queue())
-            queue_std = np.std(self.priority_queue.get_queue())
+        with self.profiler.phase('batch'):
+            x_batch, y_batch = self._generate_batch(task=task, batch_size=self.inner_update_k)
 
-            # write to tensorboard
-            self.writer.add_scalar('queue_metrics/epsilon', epsilon, step_count)
-            self.writer.add_scalar('queue_metrics/queue_correlation', queue_count_loss_correlation, step_count)
-            self.writer.add_scalar('queue_metrics/queue_mean', queue_mean, step_count)
-            self.writer.add_scalar('queue_metrics/queue_std', queue_std, step_count)
-        else:
-            task = self._sample_task()
-        x_batch, y_batch = self._generate_batch(task=task, batch_size=self.inner_update_k)
+            # generate x, y tensors for meta update task sample
+            meta_update_samples_x, meta_update_samples_y = self._generate_batch(task=task, batch_size=self.inner_update_k)
 
-        for _ in range(self.num_inner_updates):
+        with self.profiler.phase('device_step'):
+            for _ in range(self.num_inner_updates):
 
-            # forward pass
-            prediction = self.model_inner(x_batch)
+                # forward pass
+                prediction = self.model_inner(x_batch)
 
-            # compute loss
-            loss = self._compute_loss(prediction, y_batch)
+                # compute loss
+                loss = self._compute_loss(prediction, y_batch)
 
-            # compute gradients wrt inner model copy
-            inner_trainable_parameters = [w for w in self.model_inner.weights] + [b for b in self.model_inner.biases]
-            gradients = torch.autograd.grad(loss, inner_trainable_parameters, create_graph=True, retain_graph=True)
+                # compute gradients wrt inner model copy
+                inner_trainable_parameters = [w for w in self.model_inner.weights] + [b for b in self.model_inner.biases]
+                gradients = torch.autograd.grad(loss, inner_trainable_parameters, create_graph=True, retain_graph=True)
 
-            # update inner model using current model 
-            for i in range(len(self.model_inner.weights)):
-                self.model_inner.weights[i] = self.model_inner.weights[i] - self.inner_update_lr * gradients[i]
-            for j in range(len(self.model_inner.biases)):
-                self.model_inner.biases[j] = self.model_inner.biases[j] - self.inner_update_lr * gradients[i + j + 1]
+                # update inner model using current model 
+                for i in range(len(self.model_inner.weights)):
+                    self.model_inner.weights[i] = self.model_inner.weights[i] - self.inner_update_lr * gradients[i]
+                for j in range(len(self.model_inner.biases)):
+                    self.model_inner.biases[j] = self.model_inner.biases[j] - self.inner_update_lr * gradients[i + j + 1]
 
-        # generate x, y tensors for meta update task sample
-        meta_update_samples_x, meta_update_samples_y = self._generate_batch(task=task, batch_size=self.inner_update_k)
+            # forward pass for meta update
+            meta_update_prediction = self.model_inner(meta_update_samples_x)
 
-        # forward pass for meta update
-        meta_update_prediction = self.model_inner(meta_update_samples_x)
+            # compute loss
+            meta_update_loss = self._compute_loss(meta_update_prediction, meta_update_samples_y)
 
-        # compute loss
-        meta_update_loss = self._compute_loss(meta_update_prediction, meta_update_samples_y)
+            # compute gradients wrt outer model (meta network)
+            meta_update_grad = torch.autograd.grad(meta_update_loss, self.model_outer.weights + self.model_outer.biases)
+            self.profiler.synchronise(meta_update_grad)
 
         if self.priority_sample:
-            # print("----------- max_indices", max_indices)
-            # print("----------- task_parameters", task_parameters)
-            # print("----------- meta_update_loss", meta_update_loss)
-            self.priority_queue.insert(key=max_indices, data=meta_update_loss)
-
-        # compute gradients wrt outer model (meta network)
-        meta_update_grad = torch.autograd.grad(meta_update_loss, self.model_outer.weights + self.model_outer.biases)
+            with self.profiler.phase('queue_update'):
+                self.priority_queue.insert(key=max_indices, data=float(meta_update_loss.detach()))
 
         return meta_update_grad
 
-    def train(self) -> None:
+    def functional_outer_training_loop(self, step_count: int) -> None:
         """
-        Training orchestration method, calls outer loop and validation methods
+        Outer loop of MAML algorithm with inner loops of whole task batch adapted in one vectorised
+        pass (torch.func.vmap) and meta gradient of batch computed in one backward (torch.func.grad)
         """
-        for step_count in range(self.start_iteration, self.start_iteration + self.training_iterations):
-            if step_count % self.validation_frequency == 0:# and step_count != 0:
-                if self.checkpoint_path:
-                    self.checkpoint_model(step_count=step_count)
-                    if self.priority_sample:
-                        self.priority_queue.save_queue(step_count=step_count)
-                if step_count % self.visualisation_frequency == 0:
-                    vis = True
-                else:
-                    vis = False
-                self.validate(step_count=step_count, visualise=vis)
-            # t0 = time.time()
-            self.outer_training_loop(step_count)
-            # print(time.time() - t0)
+        with self.profiler.phase('sample'):
+            if self.rank == 0:
+                tasks, task_indices = self._sample_task_batch(step_count)
+            if self.world_size > 1:
+                tasks = self._shard_task_batch(tasks if self.rank == 0 else None)
+
+        with self.profiler.phase('batch'):
+            x_batch, y_batch = self._generate_task_batch(tasks, batch_size=self.inner_update_k)
+            meta_update_samples_x, meta_update_samples_y = self._generate_task_batch(tasks, batch_size=self.inner_update_k)
+
+        with self.profiler.phase('device_step'):
+            meta_parameters = self.model_outer.weights + self.model_outer.biases
+            meta_update_grad, meta_update_losses = self._meta_gradient(
+                tuple(p.detach() for p in meta_parameters), x_batch, y_batch, meta_update_samples_x, meta_update_samples_y
+                )
+
+            if self.world_size > 1:
+                # mean of shard means over (equally sized) shards is mean over task batch
+                meta_update_grad = distributed.all_reduce_mean(meta_update_grad)
+
+            self.meta_optimiser.zero_grad()
+            for parameter, gradient in zip(meta_parameters, meta_update_grad):
+                parameter.grad = gradient
+            self.meta_optimiser.step()
+            self.profiler.synchronise(meta_parameters)
 
-    def validate(self, step_count: int, visualise: bool=True) -> None:
+        if self.priority_sample:
+            if self.world_size > 1:
+                with self.profiler.phase('communication'):
+                    meta_update_losses = distributed.gather(meta_update_losses)
+
+        if self.priority_sample and self.rank == 0:
+            with self.profiler.phase('queue_update'):
+                for max_indices, meta_update_loss in zip(task_indices, meta_update_losses.tolist()):
+                    self.priority_queue.insert(key=max_indices, data=meta_update_loss)
+
+    def _shard_task_batch(self, tasks: Optional[Any]) -> torch.Tensor:
         """
-        Performs a validation step for loss during training
+        Broadcast task batch sampled on rank 0 (tasks must be parameter tensors) and return shard of this rank
 
-        :param step_count: number of steps in training undergone (used for pring statement)
-        :param visualise: whether or not to visualise validation run
+        :param tasks: task batch (on rank 0, ignored on other ranks)
+        :return task_shard: task_batch_size / world_size tasks adapted by this rank
         """
+        if tasks is not None and not torch.is_tensor(tasks):
+            tasks = torch.stack(list(tasks))
+        tasks = distributed.broadcast_tensor(tasks, shape=self._task_batch_shape, dtype=self._task_batch_dtype)
+        self._task_batch_shape, self._task_batch_dtype = tuple(tasks.shape), tasks.dtype
+        return tasks.chunk(self.world_size)[self.rank]
 
-        validation_losses = []
-        validation_figures = []
+    def _sample_task_batch(self, step_count: int) -> Tuple[List[Any], List[Any]]:
+        """
+        Sample batch of tasks (from priority queue if used) for one outer loop step
 
-        validation_parameter_tuples, validation_tasks = self._get_validation_tasks()
+        :param step_count: iteration number of training (meta-steps)
 
-        for r, val_task in enumerate(validation_tasks):
+        :return tasks: tasks of length task_batch_size
+        :return task_indices: list of priority queue indices of tasks (None if not priority sampling)
+        """
+        if not self.priority_sample:
+            return self._sample_tasks(self.task_batch_size), [None for _ in range(self.task_batch_size)]
 
-            # initialise list of model iterations (used for visualisation of fine-tuning)
-            validation_model_iterations = []
+        tasks, task_indices = [], []
+        for rng in self.random_streams.generators("task", step_count, range(self.task_batch_size)):
+            max_indices, task_parameters, _ = self.priority_queue.query(step=step_count, rng=rng)
+            tasks.append(self._get_task_from_params(task_parameters))
+            task_indices.append(max_indices)
 
-            # make copies of outer network for use in validation
-            validation_network = copy.deepcopy(self.model_outer).to(self.device)
-            validation_optimiser = optim.Adam(validation_network.weights + validation_network.biases, lr=self.inner_update_lr)
+        with self.profiler.phase('logging'):
+            self._log_queue_metrics(step_count)
 
-            # sample a task for validation fine-tuning
-            validation_x_batch, validation_y_batch = self._generate_batch(task=val_task, batch_size=self.validation_k)
+        return tasks, task_indices
 
-            validation_model_iterations.append(([w.clone() for w in validation_network.weights], [b.clone() for b in validation_network.biases]))
+    def _log_queue_metrics(self, step_count: int) -> None:
+        """write priority queue metrics (epsilon, count-loss correlation, queue statistics) to tensorboard"""
+        epsilon = self.priority_queue.get_epsilon()
+        queue_count_loss_correlation = self.priority_queue.compute_count_loss_correlation()
+        queue_mean = np.mean(self.priority_queue.get_queue())
+        queue_std = np.std(self.priority_queue.get_queue())
 
-            # inner loop update
-            for _ in range(self.validation_num_inner_updates):
+        if epsilon:
+            self.writer.add_scalar('queue_metrics/epsilon', epsilon, step_count)
+        self.writer.add_scalar('queue_metrics/queue_correlation', queue_count_loss_correlation, step_count)
+        self.writer.add_scalar('queue_metrics/queue_mean', queue_mean, step_count)
+        self.writer.add_scalar('queue_metrics/queue_std', queue_std, step_count)
 
-                # prediction of validation batch
-                validation_prediction = validation_network(validation_x_batch)
+    def _generate_task_batch(self, tasks: List[Any], batch_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Obtain batches of training examples for each of a list of tasks (can be overriden
+        by task families that generate all batches in one vectorised op)
 
-                # compute loss
-                validation_loss = self._compute_loss(validation_prediction, validation_y_batch)
+        :param tasks: specific tasks from which to sample x, y pairs
+        :param batch_size: number of x, y pairs to sample per task
 
-                # find gradients of validation loss wrt inner model weights
-                validation_update_grad = torch.autograd.grad(validation_loss, validation_network.weights + validation_network.biases)
+        :return x_batch: tensor of shape (len(tasks), batch_size, input_dimension)
+        :return y_batch: tensor of shape (len(tasks), batch_size, output_dimension)
+        """
+        task_batches = [self._generate_batch(task=task, batch_size=batch_size) for task in tasks]
+        x_batch = torch.stack([x for x, _ in task_batches])
+        y_batch = torch.stack([y for _, y in task_batches])
+        return x_batch, y_batch
+
+    def _functional_loss(self, parameters: Tuple[torch.Tensor], x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        """loss of network with given parameters on x, y (forward pass in compute dtype, loss in parameter dtype)"""
+        compute_parameters = tuple(p.to(self.compute_dtype) for p in parameters)
+        prediction = self.model_outer.functional_forward(compute_parameters, x.to(self.compute_dtype))
+        return self._compute_loss(prediction.to(self.parameter_dtype), y.to(self.parameter_dtype))
+
+    def _functional_loss_gradient(self, parameters: Tuple[torch.Tensor], x: torch.Tensor, y: torch.Tensor) -> Tuple[torch.Tensor]:
+        """gradient of loss w.r.t. parameters (differentiated with loss scaling, gradients unscaled)"""
+        gradients = func.grad(lambda *args: self.loss_scale * self._functional_loss(*args))(parameters, x, y)
+        return tuple(g / self.loss_scale for g in gradients)
+
+    def _functional_task_meta_loss(
+        self, parameters: Tuple[torch.Tensor], x_batch: torch.Tensor, y_batch: torch.Tensor, 
+        meta_update_samples_x: torch.Tensor, meta_update_samples_y: torch.Tensor
+        ) -> torch.Tensor:
+        """
+        Inner loop of MAML algorithm for a single task as a pure function of the meta parameters
 
-                # zero gradients of validation optimiser
-                validation_optimiser.zero_grad()
+        :param parameters: meta network parameters (weights followed by biases)
+        :param x_batch: inputs used for inner loop updates
+        :param y_batch: targets used for inner loop updates
+        :param meta_update_samples_x: inputs used for meta loss
+        :param meta_update_samples_y: targets used for meta loss
 
-                # update inner model gradients 
-                for i in range(len(validation_network.weights)):
-                    validation_network.weights[i].grad = validation_update_grad[i].detach()
-                for j in range(len(validation_network.biases)):
-                    validation_network.biases[j].grad = validation_update_grad[i + j + 1].detach()
+        :return meta_update_loss: loss of adapted parameters on meta update samples
+        """
+        for _ in range(self.num_inner_updates):
+            gradients = self._functional_loss_gradient(parameters, x_batch, y_batch)
+            parameters = tuple(p - self.inner_update_lr * g for p, g in zip(parameters, gradients))
+        return self._functional_loss(parameters, meta_update_samples_x, meta_update_samples_y)
+
+    def _functional_batch_meta_loss(
+        self, parameters: Tuple[torch.Tensor], x_batch: torch.Tensor, y_batch: torch.Tensor, 
+        meta_update_samples_x: torch.Tensor, meta_update_samples_y: torch.Tensor
+        ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Mean meta loss over task batch (leading dimension of data tensors), tasks adapted in parallel via vmap
 
-                # make step in validation optimiser
-                validation_optimiser.step()
+        :return meta_loss: mean meta update loss over tasks (multiplied by loss scale)
+        :return meta_update_losses: meta update loss of each task (auxiliary output, used for priority queue)
+        """
+        meta_update_losses = func.vmap(self._functional_task_meta_loss, in_dims=(None, 0, 0, 0, 0))(
+            parameters, x_batch, y_batch, meta_update_samples_x, meta_update_samples_y
+            )
+        return self.loss_scale * meta_update_losses.mean(), meta_update_losses.detach()
 
-                current_weights = [w.clone() for w in validation_network.weights]
-                current_biases = [b.clone() for b in validation_network.biases]
-                validation_model_iterations.append((current_weights, current_biases))
-            
-            # sample a new batch from same validation task for testing fine-tuned model
-            test_x_batch, test_y_batch = self._generate_batch(task=val_task, batch_size=self.test_k)
+    def _functional_meta_gradient(
+        self, parameters: Tuple[torch.Tensor], x_batch: torch.Tensor, y_batch: torch.Tensor, 
+        meta_update_samples_x: torch.Tensor, meta_update_samples_y: torch.Tensor
+        ) -> Tuple[Tuple[torch.Tensor], torch.Tensor]:
+        """
+        Meta gradient of mean meta loss over task batch w.r.t. meta parameters
 
-            test_prediction = validation_network(test_x_batch)
-            test_loss = self._compute_loss(test_prediction, test_y_batch)
+        :return meta_update_grad: gradient of each parameter (weights followed by biases)
+        :return meta_update_losses: meta update loss of each task
+        """
+        meta_update_grad, (_, meta_update_losses) = func.grad_and_value(self._functional_batch_meta_loss, has_aux=True)(
+            parameters, x_batch, y_batch, meta_update_samples_x, meta_update_samples_y
+            )
+        return tuple(g / self.loss_scale for g in meta_update_grad), meta_update_losses
 
-            validation_losses.append(float(test_loss))
+    def _get_example_batch(self, batch_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Tensors with the shape and dtype of the output of _generate_task_batch for batch_size tasks
+        (used to compile ahead of training). Override if task family differs.
 
-            if visualise:
-                save_name = 'validation_step_{}_rep_{}.png'.format(step_count, r)
-                validation_fig = self.visualise(
-                    validation_model_iterations, val_task, validation_x_batch, validation_y_batch, save_name=save_name, visualise_all=self.visualise_all
-                    )
-                validation_figures.append(validation_fig)
+        :param batch_size: number of tasks in batch
+        :return x_batch: example input batch
+        :return y_batch: example ground truth batch
+        """
+        x_batch = torch.zeros((batch_size, self.inner_update_k, self.params.get("input_dimension")), dtype=self.compute_dtype, device=self.device)
+        y_batch = torch.zeros((batch_size, self.inner_update_k, self.params.get("output_dimension")), dtype=self.compute_dtype, device=self.device)
+        return x_batch, y_batch
+
+    def compile_meta_gradient(self) -> None:
+        """
+        Compile full adapt-then-meta-loss step (inner updates, meta loss and meta gradient of task batch)
+        with torch.compile ahead of training and report compile time against steady-state speedup.
+        """
+        parameters = tuple(p.detach() for p in self.model_outer.weights + self.model_outer.biases)
+        x_batch, y_batch = self._get_example_batch(self.task_batch_size)
+
+        self._meta_gradient, report = compile_function(
+            self._functional_meta_gradient, (parameters, x_batch, y_batch, x_batch, y_batch), 
+            repeats=self.params.get(["pytorch", "compile_timing_repeats"]), mode=self.params.get(["pytorch", "compile_mode"])
+            )
+
+        if report["compiled"]:
+            print("Compiled meta gradient step in {:.2f}s: {:.2f}ms/step eager vs {:.2f}ms/step compiled ({:.2f}x speedup, break even after {:.0f} steps)".format(
+                report["compile_time"], 1000 * report["eager_step_time"], 1000 * report["compiled_step_time"], report["speedup"], report["break_even_steps"]
+                ))
+            self.writer.add_scalar('compilation/compile_time', report["compile_time"], self.start_iteration)
+            self.writer.add_scalar('compilation/speedup', report["speedup"], self.start_iteration)
+
+    def train(self) -> None:
+        """
+        Training orchestration method, calls outer loop and validation methods
+        """
+        async_validator = None
+        if self.async_validation and self.rank == 0:
+            async_validator = AsyncValidator(
+                type(self), self.params, self.device, max_pending=self.params.get(["async_validation", "max_pending"])
+                )
+
+        step_count = self.start_iteration
+        try:
+            for step_count in range(self.start_iteration, self.start_iteration + self.training_iterations):
+                if step_count % self.validation_frequency == 0 and self.rank == 0:# and step_count != 0:
+                    if self.checkpoint_path:
+                        with self.profiler.phase('checkpoint'):
+                            self.checkpoint_model(step_count=step_count)
+                            if self.priority_sample:
+                                self.priority_queue.save_queue(step_count=step_count)
+                    if step_count % self.visualisation_frequency == 0:
+                        vis = True
+                    else:
+                        vis = False
+                    with self.profiler.phase('validation'):
+                        if async_validator is not None:
+                            async_validator.submit(step_count, self.get_validation_snapshot(), visualise=vis)
+                        else:
+                            self.validate(step_count=step_count, visualise=vis)
+                self.outer_training_loop(step_count)
+                self.profiler.step(step_count)
+
+                stop_requested = self.preemption_handler.requested
+                if self.world_size > 1:
+                    # all ranks stop after same step
+                    stop_requested = distributed.any_rank(stop_requested)
+                if stop_requested:
+                    # (also on ranks not signalled themselves, so that rank 0 writes no metrics of the unfinished run)
+                    self.preemption_handler.requested = True
+                    self.save_run_state(step_count=step_count + 1)
+                    print("Run state saved after step {}, stopping".format(step_count))
+                    break
+                if self.run_state_frequency and (step_count + 1) % self.run_state_frequency == 0:
+                    with self.profiler.phase('checkpoint'):
+                        self.save_run_state(step_count=step_count + 1)
+            else:
+                self.save_run_state(step_count=self.start_iteration + self.training_iterations)
+        except BaseException:
+            # do not leave validation process running (e.g. when runs of a benchmark fail)
+            if async_validator is not None:
+                async_validator.close(wait=False)
+            raise
+
+        if async_validator is not None:
+            # finish outstanding validations, unless pre-empted
+            async_validator.close(wait=not self.preemption_handler.requested)
+
+        self.profiler.summarise(step_count)
+        self.profiler.close()
+
+    def get_validation_snapshot(self) -> Dict[str, Any]:
+        """state needed to validate current meta parameters in another process (see utils.async_validation)"""
+        snapshot = {"network_parameters": [p.detach().cpu() for p in self.model_outer.weights + self.model_outer.biases]}
+        if self.priority_sample:
+            snapshot["priority_queue"] = self.priority_queue.get_state()
+        return snapshot
+
+    def set_validation_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        """load meta parameters (and priority queue) of snapshot returned by get_validation_snapshot"""
+        with torch.no_grad():
+            for parameter, saved_parameter in zip(self.model_outer.weights + self.model_outer.biases, snapshot["network_parameters"]):
+                parameter.data = saved_parameter.to(device=parameter.device, dtype=parameter.dtype)
+        if self.priority_sample:
+            self.priority_queue.set_state(snapshot["priority_queue"])
+
+    def get_run_state(self, step_count: int) -> Dict[str, Any]:
+        """
+        Full state of run needed to resume training exactly: meta parameters, optimiser state, 
+        all random number generator states, priority queue state and step counter. In distributed
+        training, called on every rank (random number generator states of all ranks are gathered on rank 0).
+
+        :param step_count: next training step to run
+        :return state: dictionary of run state (random number generator states of other ranks only on rank 0)
+        """
+        state = {
+            "framework": "pytorch",
+            "step": step_count,
+            "network_parameters": [p.detach().cpu() for p in self.model_outer.weights + self.model_outer.biases],
+            "optimiser_state": self.meta_optimiser.state_dict()
+            }
+        state.update(self._get_rng_states())
+        if self.world_size > 1:
+            state["rank_rng_states"] = distributed.gather_object(self._get_rng_states())
+        if self.priority_sample and self.rank == 0:
+            state["priority_queue"] = self.priority_queue.get_state()
+        return state
+
+    def set_run_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore run from state returned by get_run_state. Training continues from saved step
+        (the total number of training iterations is unchanged).
+
+        :param state: dictionary of run state
+        """
+        if state["framework"] != "pytorch":
+            raise ValueError("Run state saved by {} model cannot be restored in pytorch model".format(state["framework"]))
+        with torch.no_grad():
+            for parameter, saved_parameter in zip(self.model_outer.weights + self.model_outer.biases, state["network_parameters"]):
+                parameter.data = saved_parameter.to(device=parameter.device, dtype=parameter.dtype)
+        self.meta_optimiser.load_state_dict(state["optimiser_state"])
+        # each rank resumes its own (seed + rank) streams
+        rank_rng_states = state.get("rank_rng_states")
+        if self.world_size > 1 and rank_rng_states is not None and len(rank_rng_states) == self.world_size:
+            self._set_rng_states(rank_rng_states[self.rank])
+        elif self.rank == 0:
+            self._set_rng_states(state)
+        else:
+            warnings.warn(
+                "Run state holds no random number generator states of rank {}, rank continues with its seeded streams".format(self.rank), Warning
+                )
+        if self.priority_sample and self.rank == 0:
+            self.priority_queue.set_state(state["priority_queue"])
+        self.training_iterations = max(self.start_iteration + self.training_iterations - state["step"], 0)
+        self.start_iteration = state["step"]
+        print("Resuming training from run state @ step {}".format(self.start_iteration))
+
+    def _get_rng_states(self) -> Dict[str, Any]:
+        """states of global (python, numpy, torch) random number generators and task generator of this rank"""
+        return {
+            "rng_states": run_state.get_rng_states(),
+            "torch_rng_state": torch.get_rng_state(),
+            "generator_state": self.generator.get_state()
+            }
+
+    def _set_rng_states(self, states: Dict[str, Any]) -> None:
+        """restore random number generator states returned by _get_rng_states"""
+        run_state.set_rng_states(states["rng_states"])
+        torch.set_rng_state(states["torch_rng_state"])
+        self.generator.set_state(states["generator_state"])
+
+    def save_run_state(self, step_count: int) -> None:
+        """
+        Write run state bundle to checkpoint path (rank 0 only, but called on every rank)
+
+        :param step_count: next training step to run
+        """
+        if self.world_size > 1 or (self.checkpoint_path and self.rank == 0):
+            state = self.get_run_state(step_count)
+            if self.checkpoint_path and self.rank == 0:
+                run_state.save_run_state(self.checkpoint_path, state)
+
+    def _synchronise_device(self, tensors) -> None:
+        """blocks until queued (asynchronous) device kernels have completed"""
+        if torch.cuda.is_available() and str(self.device).startswith("cuda"):
+            torch.cuda.synchronize()
+
+    def validate(self, step_count: int, visualise: bool=True) -> None:
+        """
+        Performs a validation step for loss during training
+
+        :param step_count: number of steps in training undergone (used for pring statement)
+        :param visualise: whether or not to visualise validation run
+        """
+
+        validation_figures = []
+
+        validation_parameter_tuples, validation_tasks = self._get_validation_tasks()
+
+        with self.profiler.phase('validation/fine_tune'):
+            # fine-tune all validation tasks together on stacked (one copy per task) functional parameters
+            validation_x_batch, validation_y_batch = self._generate_task_batch(validation_tasks, batch_size=self.validation_k)
+            validation_parameters, validation_model_iterations = self._functional_fine_tune(
+                validation_x_batch, validation_y_batch, num_updates=self.validation_num_inner_updates, keep_iterations=visualise
+                )
+
+            # sample a new batch from same validation tasks for testing fine-tuned models
+            test_x_batch, test_y_batch = self._generate_task_batch(validation_tasks, batch_size=self.test_k)
+            test_losses = func.vmap(self._functional_loss)(validation_parameters, test_x_batch, test_y_batch)
+
+            validation_losses = test_losses.tolist()
+
+        if visualise:
+            with self.profiler.phase('validation/visualise'):
+                num_layers = len(self.model_outer.weights)
+                for r, val_task in enumerate(validation_tasks):
+                    # unstack trajectory of task r into (weights, biases) per update
+                    task_model_iterations = [
+                        ([p[r] for p in iteration[:num_layers]], [p[r] for p in iteration[num_layers:]]) for iteration in validation_model_iterations
+                        ]
+                    save_name = 'validation_step_{}_rep_{}.png'.format(step_count, r)
+                    validation_fig = self.visualise(
+                        task_model_iterations, val_task, validation_x_batch[r], validation_y_batch[r], save_name=save_name, visualise_all=self.visualise_all
+                        )
+                    validation_figures.append(validation_fig)
 
         mean_validation_loss = np.mean(validation_losses)
         var_validation_loss = np.std(validation_losses)
+        self.last_validation_loss = float(mean_validation_loss)
 
-        print('--- validation loss @ step {}: {}'.format(step_count, mean_validation_loss))
-        self.writer.add_scalar('meta_metrics/meta_validation_loss_mean', mean_validation_loss, step_count)
-        self.writer.add_scalar('meta_metrics/meta_validation_loss_std', var_validation_loss, step_count)
+        with self.profiler.phase('validation/figures'):
+            print('--- validation loss @ step {}: {}'.format(step_count, mean_validation_loss))
+            self.writer.add_scalar('meta_metrics/meta_validation_loss_mean', mean_validation_loss, step_count)
+            self.writer.add_scalar('meta_metrics/meta_validation_loss_std', var_validation_loss, step_count)
 
-        # generate heatmap of validation losses 
-        if self.fixed_validation:
+            # generate heatmap of validation losses 
+            if self.fixed_validation and len(validation_parameter_tuples[0]) == 2:
 
-            unique_parameter_range_lens = []
-            num_parameters = len(validation_parameter_tuples[0])
-            for i in range(num_parameters):
-                unique_parameter_range_lens.append(len(np.unique([p[i] for p in validation_parameter_tuples])))
-            validation_losses_grid = np.array(validation_losses).reshape(tuple(unique_parameter_range_lens))
+                unique_parameter_range_lens = []
+                num_parameters = len(validation_parameter_tuples[0])
+                for i in range(num_parameters):
+                    unique_parameter_range_lens.append(len(np.unique([p[i] for p in validation_parameter_tuples])))
+                validation_losses_grid = np.array(validation_losses).reshape(tuple(unique_parameter_range_lens))
 
-            fig = plt.figure()
-            plt.imshow(validation_losses_grid)
-            plt.colorbar()
+                fig = plt.figure()
+                plt.imshow(validation_losses_grid)
+                plt.colorbar()
             
-            self.writer.add_figure("validation_losses", fig, step_count)
+                self.writer.add_figure("validation_losses", fig, step_count)
+            elif self.fixed_validation and not self._validation_heatmap_warned:
+                warnings.warn("Visualisation of validation losses with parameter space dimension > 2 not supported", Warning)
+                self._validation_heatmap_warned = True
 
-        if visualise:
-            for f, fig in enumerate(validation_figures):
-                self.writer.add_figure("vadliation_plots/repeat_{}".format(f), fig, step_count)
-        if self.priority_sample:
-            priority_queue_fig = self.priority_queue.visualise_priority_queue()
-            priority_queue_count_fig = self.priority_queue.visualise_sample_counts()
-            priority_queue_loss_dist_fig = self.priority_queue.visualise_priority_queue_loss_distribution()
-            self.writer.add_figure("priority_queue", priority_queue_fig, step_count)
-            self.writer.add_figure("queue_counts", priority_queue_count_fig, step_count)
-            self.writer.add_figure("queue_loss_dist", priority_queue_loss_dist_fig, step_count)
+            if visualise:
+                for f, fig in enumerate(validation_figures):
+                    self.writer.add_figure("vadliation_plots/repeat_{}".format(f), fig, step_count)
+            if self.priority_sample:
+                priority_queue_fig = self.priority_queue.visualise_priority_queue()
+                priority_queue_count_fig = self.priority_queue.visualise_sample_counts()
+                priority_queue_loss_dist_fig = self.priority_queue.visualise_priority_queue_loss_distribution()
+                if priority_queue_fig:
+                    self.writer.add_figure("priority_queue", priority_queue_fig, step_count)
+                if priority_queue_count_fig:
+                    self.writer.add_figure("queue_counts", priority_queue_count_fig, step_count)
+                self.writer.add_figure("queue_loss_dist", priority_queue_loss_dist_fig, step_count)
+
+    def _functional_fine_tune(
+        self, x_batch: torch.Tensor, y_batch: torch.Tensor, num_updates: int, keep_iterations: bool=False
+        ) -> Tuple[Tuple[torch.Tensor], List[Tuple[torch.Tensor]]]:
+        """
+        Fine-tune copies of meta network parameters on a batch of tasks with Adam (applied elementwise
+        to parameters stacked over tasks, equivalent to an independent optimiser per task)
+
+        :param x_batch: inputs of shape (num_tasks, k, input_dimension)
+        :param y_batch: targets of shape (num_tasks, k, output_dimension)
+        :param num_updates: number of fine-tuning steps
+        :param keep_iterations: whether to store parameters after each step (used for visualisation)
+
+        :return parameters: fine-tuned parameters, each of shape (num_tasks, *parameter_shape)
+        :return model_iterations: parameters before and after each step (empty if keep_iterations is False)
+        """
+        num_tasks = x_batch.shape[0]
+        parameters = tuple(
+            p.detach().unsqueeze(0).expand(num_tasks, *p.shape).clone() for p in self.model_outer.weights + self.model_outer.biases
+            )
+        first_moments = [torch.zeros_like(p) for p in parameters]
+        second_moments = [torch.zeros_like(p) for p in parameters]
+
+        batch_gradient = func.vmap(self._functional_loss_gradient)
+
+        model_iterations = [parameters] if keep_iterations else []
+        for step in range(1, num_updates + 1):
+            gradients = batch_gradient(parameters, x_batch, y_batch)
+            parameters = _adam_update(parameters, gradients, first_moments, second_moments, step=step, lr=self.inner_update_lr)
+            if keep_iterations:
+                model_iterations.append(parameters)
+
+        return parameters, model_iterations
 
     def _get_validation_tasks(self):
         """produces set of tasks for use in validation"""
         if self.fixed_validation:
             return self._get_fixed_validation_tasks()
         else:
-            return None, [self._sample_task() for _ in range(self.validation_task_batch_size)]
+            return None, self._sample_tasks(self.validation_task_batch_size)
 
     @abstractmethod
     def _get_fixed_validation_tasks(self):
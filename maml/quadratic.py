@@ -18,33 +18,51 @@ class QuadraticMAML(MAML):
         MAML.__init__(self, args)
 
     def _sample_task(self, quadratic_bounds=(-2, 2), linear_bounds=(-2, 2), constant_bounds=(-2, 2), domain_bounds=(-5, 5), plot=False):
-        quadratic_term = random.uniform(quadratic_bounds[0], quadratic_bounds[1])
-        linear_term = random.uniform(linear_bounds[0], linear_bounds[1])
-        constant_term = random.uniform(constant_bounds[0], constant_bounds[1])
-        def quadratic_function(x):
-            return quadratic_term * x ** 2 + linear_term * x + constant_term
+        task = self._sample_tasks(1, quadratic_bounds=quadratic_bounds, linear_bounds=linear_bounds, constant_bounds=constant_bounds)[0]
 
         if plot:
             fig = plt.figure()
-            x = np.linspace(domain_bounds[0], domain_bounds[1], 100)
-            y = [quadratic_function(xi) for xi in x]
-            plt.plot(x, y)
+            x = torch.linspace(domain_bounds[0], domain_bounds[1], 100).unsqueeze(-1)
+            plt.plot(x.numpy(), self._evaluate_task(task, x).numpy())
             fig.savefig('quadratic_batch_test.png')
             plt.close()
-        return quadratic_function
+        return task
+
+    def _sample_tasks(self, num_tasks, quadratic_bounds=(-2, 2), linear_bounds=(-2, 2), constant_bounds=(-2, 2)):
+        """
+        samples coefficients of num_tasks quadratic functions in one op
+
+        :return task_parameters: tensor of shape (num_tasks, 3) of quadratic, linear and constant terms of each task
+        """
+        bounds = torch.tensor([quadratic_bounds, linear_bounds, constant_bounds], dtype=torch.float32)
+        uniform_samples = torch.rand((num_tasks, 3), generator=self.generator)
+        return bounds[:, 0] + (bounds[:, 1] - bounds[:, 0]) * uniform_samples
+
+    @staticmethod
+    def _evaluate_task(task, x):
+        """
+        evaluates quadratic function(s) with coefficients task (shape (..., 3)) at x (shape (..., N, 1))
+        """
+        task = task.unsqueeze(-2)
+        return task[..., 0:1] * x ** 2 + task[..., 1:2] * x + task[..., 2:3]
 
     def _generate_batch(self, task, domain_bounds=(-5, 5), batch_size=10):
         """
-        returns sin function squashed in x direction by a phase parameter sampled randomly between phase_bounds
-        enlarged in the y direction by an apmplitude parameter sampled randomly between amplitude_bounds
+        generates an array, x_batch, of B datapoints sampled randomly between domain_bounds
+        and computes the quadratic function of each point in x_batch to produce y_batch.
+        """
+        x_batch, y_batch = self._generate_task_batch(task.unsqueeze(0), domain_bounds=domain_bounds, batch_size=batch_size)
+        return x_batch[0], y_batch[0]
+
+    def _generate_task_batch(self, tasks, batch_size, domain_bounds=(-5, 5)):
+        """
+        generates x, y batches of shape (T, batch_size, 1) for all T tasks in one op
         """
-        x_batch = [random.uniform(domain_bounds[0], domain_bounds[1]) for _ in range(batch_size)]
-        y_batch = [task(x) for x in x_batch]
-        x_batch_tensor = torch.tensor([[x] for x in x_batch])
-        y_batch_tensor = torch.tensor([[y] for y in y_batch])
-        # print(x_batch_tensor, y_batch_tensor)
-        # print(x_batch_tensor.shape, y_batch_tensor.shape)
-        return x_batch_tensor, y_batch_tensor
+        if isinstance(tasks, (list, tuple)):
+            tasks = torch.stack(tasks)
+        uniform_samples = torch.rand((tasks.shape[0], batch_size, 1), generator=self.generator)
+        x_batch = domain_bounds[0] + (domain_bounds[1] - domain_bounds[0]) * uniform_samples
+        return x_batch, self._evaluate_task(tasks, x_batch)
 
     def _compute_loss(self, prediction, ground_truth):
         loss_function = nn.MSELoss()
@@ -11,6 +11,7 @@ import math
 import random
 import numpy as np
 import matplotlib.pyplot as plt
+import warnings
 
 from typing import Any, Dict, List, Tuple
 
@@ -18,31 +19,48 @@ class SineMAML(MAML):
 
     def __init__(self, params, device):
         self.device = device
+        self.task_type = params.get('task_type')
 
         # extract relevant task-specific parameters
-        self.amplitude_bounds = params.get(['sin', 'amplitude_bounds'])
-        self.domain_bounds = params.get(['sin', 'domain_bounds'])
-        degree_phase_bounds = params.get(['sin', 'phase_bounds']) # phase given in degrees
-        block_sizes = params.get(['sin', 'fixed_val_blocks']) 
+        task_config = 'sin3d' if self.task_type == 'sin3d' else 'sin2d'
+        self.amplitude_bounds = params.get([task_config, 'amplitude_bounds'])
+        self.domain_bounds = params.get([task_config, 'domain_bounds'])
+        degree_phase_bounds = params.get([task_config, 'phase_bounds']) # phase given in degrees
+        block_sizes = params.get([task_config, 'fixed_val_blocks'])
+
+        if self.task_type == 'sin3d':
+            self.frequency_bounds = params.get(['sin3d', 'frequency_bounds'])
 
         # convert phase bounds/ fixed_val_interval from degrees to radians
         self.phase_bounds = [
             degree_phase_bounds[0] * (2 * np.pi) / 360, degree_phase_bounds[1] * (2 * np.pi) / 360
             ]
         
-        self.block_sizes = [block_sizes[0], block_sizes[1] * (2 * np.pi) / 360]
+        self.block_sizes = [block_sizes[0], block_sizes[1] * (2 * np.pi) / 360] + list(block_sizes[2:])
+
+        # bounds of (amplitude, phase, frequency scaling) used for vectorised task sampling
+        frequency_bounds = self.frequency_bounds if self.task_type == 'sin3d' else [1., 1.]
+        self.task_parameter_bounds = torch.tensor(
+            [self.amplitude_bounds, self.phase_bounds, frequency_bounds], dtype=torch.float32, device=self.device
+            )
 
         self.model_inner = SinusoidalNetwork(params).to(self.device)
 
         MAML.__init__(self, params)
 
     def _get_priority_queue(self):
+        if self.task_type == 'sin3d':
+            param_ranges = self.params.get(["priority_queue", "param_ranges_3d"])
+            block_sizes = self.params.get(["priority_queue", "block_sizes_3d"])
+        else:
+            param_ranges = self.params.get(["priority_queue", "param_ranges_2d"])
+            block_sizes = self.params.get(["priority_queue", "block_sizes_2d"])
         return  SinePriorityQueue(
                     queue_resume=self.params.get(["resume", "priority_queue"]),
                     counts_resume=self.params.get(["resume", "queue_counts"]),
                     sample_type=self.params.get(["priority_queue", "sample_type"]),
-                    block_sizes=self.params.get(["priority_queue", "block_sizes"]),
-                    param_ranges=self.params.get(["priority_queue", "param_ranges"]),
+                    block_sizes=block_sizes,
+                    param_ranges=param_ranges,
                     initial_value=self.params.get(["priority_queue", "initial_value"]),
                     epsilon_start=self.params.get(["priority_queue", "epsilon_start"]),
                     epsilon_final=self.params.get(["priority_queue", "epsilon_final"]),
@@ -54,29 +72,50 @@ class SineMAML(MAML):
 
     def _sample_task(self, plot=False):
         """
-        returns sin function squashed in x direction by a phase parameter sampled randomly between phase_bounds
-        enlarged in the y direction by an apmplitude parameter sampled randomly between amplitude_bounds
+        returns parameters of sin function squashed in x direction by a phase parameter sampled randomly between phase_bounds
+        enlarged in the y direction by an apmplitude parameter sampled randomly between amplitude_bounds.
+        For 3d sine option, function is also squeezed in x direction by frequency parameter.
         """
-        amplitude = random.uniform(self.amplitude_bounds[0], self.amplitude_bounds[1])
-        phase = random.uniform(self.phase_bounds[0], self.phase_bounds[1])
-        def modified_sin(x):
-            return amplitude * np.sin(phase + x)
-        return modified_sin
+        return self._sample_tasks(1)[0]
 
-    def _get_task_from_params(self, parameters: List[float]) -> Any:
+    def _sample_tasks(self, num_tasks):
         """
-        Return sine function defined by parameters given
+        samples parameters of num_tasks sin functions in one op
+
+        :param num_tasks: number of tasks to sample
+        :return task_parameters: tensor of shape (num_tasks, 3) of amplitude, phase and frequency scaling of each task
+        """
+        lower_bounds, upper_bounds = self.task_parameter_bounds[:, 0], self.task_parameter_bounds[:, 1]
+        uniform_samples = torch.rand((num_tasks, 3), generator=self.generator, device=self.device)
+        return lower_bounds + (upper_bounds - lower_bounds) * uniform_samples
+
+    def _get_task_from_params(self, parameters: List[float]) -> torch.Tensor:
+        """
+        Return sine function (parameters) defined by parameters given
 
         :param parameters: parameters defining the specific sin task in the distribution
+                           (amplitude, phase and optionally frequency scaling)
 
-        :return modified_sin: sin function
+        :return task_parameters: tensor of amplitude, phase and frequency scaling
 
         (method differs from _sample_task in that it is not a random sample but
         defined by parameters given)
         """
-        def modified_sin(x):
-            return parameters[0] * np.sin(parameters[1] + x)
-        return modified_sin
+        frequency_scaling = parameters[2] if len(parameters) > 2 else 1.
+        return torch.tensor([parameters[0], parameters[1], frequency_scaling], dtype=torch.float32, device=self.device)
+
+    @staticmethod
+    def _evaluate_task(task, x):
+        """
+        evaluates sin function(s) at x
+
+        :param task: tensor of task parameters of shape (..., 3)
+        :param x: tensor of inputs of shape (..., N, 1)
+        :return y: tensor of outputs of shape (..., N, 1)
+        """
+        task = task.unsqueeze(-2)
+        amplitude, phase, frequency_scaling = task[..., 0:1], task[..., 1:2], task[..., 2:3]
+        return amplitude * torch.sin(phase + frequency_scaling * x)
 
     def visualise(self, model_iterations, task, validation_x, validation_y, save_name, visualise_all=True):
 
@@ -84,8 +123,8 @@ class SineMAML(MAML):
 
         # ground truth
         plot_x = np.linspace(self.domain_bounds[0], self.domain_bounds[1], 100)
-        plot_x_tensor = torch.tensor([[x] for x in plot_x]).to(self.device)
-        plot_y_ground_truth = [task(xi) for xi in plot_x]
+        plot_x_tensor = torch.tensor(plot_x, dtype=self.parameter_dtype, device=self.device).unsqueeze(-1)
+        plot_y_ground_truth = self._evaluate_task(task.to(self.parameter_dtype), plot_x_tensor).cpu().numpy()
 
         fig = plt.figure()
         plt.plot(plot_x, plot_y_ground_truth, label="Ground Truth")
@@ -105,7 +144,7 @@ class SineMAML(MAML):
                 plot_y_prediction = dummy_model(plot_x_tensor)
                 plt.plot(plot_x, plot_y_prediction.cpu().detach().numpy(), linestyle='dashed', label='Fine-tuned MAML {} update'.format(i))
 
-        plt.scatter(validation_x.cpu(), validation_y.cpu(), marker='o', label='K Points')
+        plt.scatter(validation_x.cpu().float(), validation_y.cpu().float(), marker='o', label='K Points')
 
         plt.title("Validation of Sinusoid Meta-Regression")
         plt.xlabel(r"x")
@@ -117,27 +156,39 @@ class SineMAML(MAML):
 
         return fig
 
-    def _generate_batch(self, task, batch_size=10, plot=False): # Change batch generation to be done in pure PyTorch
+    def _generate_batch(self, task, batch_size=10, plot=False):
         """
         generates an array, x_batch, of B datapoints sampled randomly between domain_bounds
         and computes the sin of each point in x_batch to produce y_batch.
         """
-        x_batch = [random.uniform(self.domain_bounds[0], self.domain_bounds[1]) for _ in range(batch_size)]
-        y_batch = [task(x) for x in x_batch]
-        x_batch_tensor = torch.tensor([[x] for x in x_batch]).to(self.device)
-        y_batch_tensor = torch.tensor([[y] for y in y_batch]).to(self.device)
-        # print(x_batch_tensor, y_batch_tensor)
-        # print(x_batch_tensor.shape, y_batch_tensor.shape)
-        # print(x_batch_tensor.dtype)       
+        x_batch, y_batch = self._generate_task_batch(task.unsqueeze(0), batch_size=batch_size)
 
         if plot:
             fig = plt.figure()
-            x = np.linspace(self.domain_bounds[0], self.domain_bounds[1], 100)
-            y = [task(xi) for xi in x]
-            plt.plot(x, y)
+            x = torch.linspace(self.domain_bounds[0], self.domain_bounds[1], 100, device=self.device).unsqueeze(-1)
+            plt.plot(x.cpu().numpy(), self._evaluate_task(task, x).cpu().numpy())
             fig.savefig('sin_batch_test.png')
             plt.close()
-        return x_batch_tensor, y_batch_tensor
+        return x_batch[0], y_batch[0]
+
+    def _generate_task_batch(self, tasks, batch_size):
+        """
+        generates x, y batches for all tasks in one op: x sampled uniformly between domain_bounds
+        and y computed from sin function of each task.
+
+        :param tasks: tensor of task parameters of shape (T, 3) (or list of T parameter tensors)
+        :param batch_size: number of x, y pairs to sample per task
+
+        :return x_batch: tensor of shape (T, batch_size, 1)
+        :return y_batch: tensor of shape (T, batch_size, 1)
+        """
+        if isinstance(tasks, (list, tuple)):
+            tasks = torch.stack(tasks)
+        tasks = tasks.to(self.parameter_dtype)
+        uniform_samples = torch.rand((tasks.shape[0], batch_size, 1), generator=self.generator, dtype=self.parameter_dtype, device=self.device)
+        x_batch = self.domain_bounds[0] + (self.domain_bounds[1] - self.domain_bounds[0]) * uniform_samples
+        y_batch = self._evaluate_task(tasks, x_batch)
+        return x_batch.to(self.compute_dtype), y_batch.to(self.compute_dtype)
 
     def _get_fixed_validation_tasks(self):
         """
@@ -147,22 +198,21 @@ class SineMAML(MAML):
         In the case of sinusoidal regression we split the parameter space equally.
         """
         # mesh of equally partitioned state space
-        amplitude_spectrum, phase_spectrum = np.mgrid[
-            self.amplitude_bounds[0]:self.amplitude_bounds[1]:self.block_sizes[0],
-            self.phase_bounds[0]:self.phase_bounds[1]:self.block_sizes[1]
-            ]
-
-        parameter_space_tuples = np.vstack((amplitude_spectrum.flatten(), phase_spectrum.flatten())).T
-
-        fixed_validation_tasks = []
-
-        def generate_sin(amplitude, phase):
-            def modified_sin(x):
-                return amplitude * np.sin(phase + x)
-            return modified_sin
+        if self.task_type == 'sin3d':
+            amplitude_spectrum, phase_spectrum, frequency_spectrum = np.mgrid[
+                self.amplitude_bounds[0]:self.amplitude_bounds[1]:self.block_sizes[0],
+                self.phase_bounds[0]:self.phase_bounds[1]:self.block_sizes[1],
+                self.frequency_bounds[0]:self.frequency_bounds[1]:self.block_sizes[2]
+                ]
+            parameter_space_tuples = np.vstack((amplitude_spectrum.flatten(), phase_spectrum.flatten(), frequency_spectrum.flatten())).T
+        else:
+            amplitude_spectrum, phase_spectrum = np.mgrid[
+                self.amplitude_bounds[0]:self.amplitude_bounds[1]:self.block_sizes[0],
+                self.phase_bounds[0]:self.phase_bounds[1]:self.block_sizes[1]
+                ]
+            parameter_space_tuples = np.vstack((amplitude_spectrum.flatten(), phase_spectrum.flatten())).T
 
-        for param_pair in parameter_space_tuples:
-            fixed_validation_tasks.append(generate_sin(amplitude=param_pair[0], phase=param_pair[1]))
+        fixed_validation_tasks = torch.stack([self._get_task_from_params(parameter_tuple) for parameter_tuple in parameter_space_tuples])
 
         return parameter_space_tuples, fixed_validation_tasks
 
@@ -210,12 +260,17 @@ class SinusoidalNetwork(ModelNetwork):
         self._reset_parameters()
 
     def forward(self, x):
+        return self.functional_forward(tuple(self.weights) + tuple(self.biases), x)
+
+    def functional_forward(self, parameters, x):
+        num_layers = len(parameters) // 2
+        weights, biases = parameters[:num_layers], parameters[num_layers:]
 
-        for l in range(len(self.weights) - 1):
-            x = F.linear(x, self.weights[l].t(), self.biases[l])
+        for l in range(num_layers - 1):
+            x = F.linear(x, weights[l].t(), biases[l])
             x = F.relu(x)
     
-        y = F.linear(x, self.weights[-1].t(), self.biases[-1]) # no relu on output layer
+        y = F.linear(x, weights[-1].t(), biases[-1]) # no relu on output layer
 
         return y
 
@@ -233,8 +288,8 @@ class SinePriorityQueue(PriorityQueue):
             ]
         phase_block_size = block_sizes[1] * (2 * np.pi) / 360
 
-        param_ranges = [param_ranges[0], phase_ranges]
-        block_sizes = [block_sizes[0], phase_block_size]
+        param_ranges = [param_ranges[0], phase_ranges] + list(param_ranges[2:])
+        block_sizes = [block_sizes[0], phase_block_size] + list(block_sizes[2:])
         
         super().__init__(
             block_sizes=block_sizes, param_ranges=param_ranges, sample_type=sample_type, epsilon_start=epsilon_start,
@@ -245,8 +300,8 @@ class SinePriorityQueue(PriorityQueue):
         self.figure_locsx, self.figure_locsy, self.figure_labelsx, self.figure_labelsy = self._get_figure_labels()
 
     def _get_figure_labels(self):
-        xlocs = np.arange(0, self.queue.shape[1])
-        ylocs = np.arange(0, self.queue.shape[0])
+        xlocs = np.arange(0, self._queue.shape[1])
+        ylocs = np.arange(0, self._queue.shape[0])
         xlabels = np.arange(self.param_ranges[1][0], self.param_ranges[1][1], self.block_sizes[1])
         ylabels = np.arange(self.param_ranges[0][0], self.param_ranges[0][1], self.block_sizes[0])
         return xlocs, ylocs, xlabels, ylabels
@@ -257,10 +312,10 @@ class SinePriorityQueue(PriorityQueue):
 
         Discrete vs continuous, 2d heatmap vs 3d.
         """
-        if type(self.queue) == np.ndarray:
-            if len(self.queue.shape) == 2:
+        if type(self._queue) == np.ndarray:
+            if len(self._queue.shape) == 2:
                 fig = plt.figure()
-                plt.imshow(self.queue)
+                plt.imshow(self._queue)
                 plt.colorbar()
                 plt.xlabel("Phase")
                 plt.ylabel("Amplitude")
@@ -277,7 +332,8 @@ class SinePriorityQueue(PriorityQueue):
 
                 return fig
             else:
-                raise ValueError("Visualisation with parameter space dimension > 2 not supported")
+                warnings.warn("Visualisation with parameter space dimension > 2 not supported", Warning)
+                return None
         else:
             raise NotImplementedError("Visualisation for dictionary queue not implemented")
 
@@ -285,7 +341,7 @@ class SinePriorityQueue(PriorityQueue):
         """
         Produces probability distribution plot of losses in the priority queue
         """
-        all_losses = self.queue.flatten()
+        all_losses = self._queue.flatten()
 
         hist, bin_edges = np.histogram(all_losses, bins=int(0.1 * len(all_losses)))
         bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
@@ -298,6 +354,9 @@ class SinePriorityQueue(PriorityQueue):
         """
         Produces plot of priority queue sampling counts 
         """
+        if len(self.sample_counts.shape) != 2:
+            warnings.warn("Visualisation with parameter space dimension > 2 not supported", Warning)
+            return None
         fig = plt.figure()
         plt.imshow(self.sample_counts)
         plt.colorbar()
@@ -2,6 +2,6 @@ import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# import maml
+import maml
 import utils
 import jax_maml
\ No newline at end of file
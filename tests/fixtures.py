@@ -0,0 +1,58 @@
+import os
+import sys
+import yaml
+import tempfile
+import importlib.util
+
+from typing import Any, Dict, Tuple
+
+from context import utils
+
+TEST_BASE_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "test_configs", "test_base_config.yaml")
+EXPERIMENTS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'experiments'))
+
+
+def make_parameters(updates: Dict[str, Any]) -> Tuple[utils.parameters.MAMLParameters, str]:
+    """
+    Parameters of test base config updated with updates, writing to a new temporary checkpoint folder
+
+    :param updates: (nested) parameters overriding those of test base config
+    :return maml_parameters: parameters of model
+    :return checkpoint_path: temporary folder of run (to be deleted by caller, e.g. in tearDownClass)
+    """
+    with open(TEST_BASE_CONFIG_PATH, 'r') as base_yaml_file:
+        base_params = yaml.load(base_yaml_file, yaml.SafeLoader)
+
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), '')
+    maml_parameters = utils.parameters.MAMLParameters(base_params)
+    maml_parameters.update(dict(updates, checkpoint_path=checkpoint_path))
+    return maml_parameters, checkpoint_path
+
+def make_model(model_class, updates: Dict[str, Any], device: str="cpu") -> Tuple[Any, str]:
+    """
+    Model of given class (e.g. jax_maml.SineMAML) on parameters of test base config updated with updates
+
+    :param model_class: class of model, constructed with parameters and device
+    :param updates: (nested) parameters overriding those of test base config
+    :param device: device of model
+
+    :return model: constructed model
+    :return checkpoint_path: temporary folder of run (to be deleted by caller, e.g. in tearDownClass)
+    """
+    maml_parameters, checkpoint_path = make_parameters(updates)
+    return model_class(maml_parameters, device), checkpoint_path
+
+def load_experiment_module(name: str):
+    """
+    Import script of experiments folder (e.g. benchmark) as module, without running it
+
+    :param name: file name of script without extension
+    :return module: imported module
+    """
+    # scripts import each other (e.g. asha imports sweep)
+    if EXPERIMENTS_PATH not in sys.path:
+        sys.path.append(EXPERIMENTS_PATH)
+    spec = importlib.util.spec_from_file_location("experiments_{}".format(name), os.path.join(EXPERIMENTS_PATH, "{}.py".format(name)))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,137 @@
+from context import utils
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+from fixtures import TEST_BASE_CONFIG_PATH, load_experiment_module
+
+asha = load_experiment_module("asha")
+
+class TestAshaScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.asha_dir = tempfile.mkdtemp()
+        self.asha_params = {
+            "config": TEST_BASE_CONFIG_PATH, "seed": 0, "num_trials": 9,
+            "min_iterations": 10, "max_iterations": 90, "reduction_factor": 3,
+            "search_space": {"meta_lr": {"uniform": [0., 1.]}}
+            }
+        self.scheduler = self._make_scheduler()
+        self.commands = []
+
+    def tearDown(self):
+        shutil.rmtree(self.asha_dir)
+
+    def _make_scheduler(self):
+        scheduler = asha.AshaScheduler(self.asha_dir, base_config=TEST_BASE_CONFIG_PATH, asha_params=self.asha_params, workers=1, cores_per_job=1)
+        scheduler.run_process = self._fake_run_process
+        return scheduler
+
+    def _fake_run_process(self, job_id, command, job_dir, return_code=0, write_metrics=True):
+        """trains 'instantly', validation loss of trial is its meta_lr (scaled down with budget)"""
+        self.commands.append(command)
+        trial_id = os.path.basename(os.path.normpath(job_dir))
+        budget = int(command[command.index("-training_iterations") + 1])
+        if write_metrics:
+            loss = self.scheduler._ledger["trials"][trial_id]["configuration"]["meta_lr"] / budget
+            with open(os.path.join(job_dir, "metrics.json"), 'w') as f:
+                json.dump({"final_validation_loss": loss}, f)
+        return return_code
+
+    def test_rung_budgets(self):
+        self.assertEqual(asha.get_rung_budgets(10, 90, 3), [10, 30, 90])
+        self.assertEqual(asha.get_rung_budgets(10, 100, 3), [10, 30, 90, 100])
+        self.assertEqual(asha.get_rung_budgets(1000, 27000, 3), [1000, 3000, 9000, 27000])
+        self.assertEqual(asha.get_rung_budgets(10, 10, 3), [10])
+
+    def test_promotable_trial(self):
+        """paused trial in best third of losses at its rung is promoted, highest rung first"""
+        trials = self.scheduler._ledger["trials"]
+        for i, loss in enumerate([0.5, 0.1, 0.3]):
+            trials["trial_{}".format(i)] = {"trial_id": "trial_{}".format(i), "configuration": {}, "rung": 0, "losses": [loss], "status": asha.PAUSED}
+        self.assertEqual(self.scheduler._get_promotable_trial(), (trials["trial_1"], 1))
+
+        # already promoted (running) trial is not promoted again, no further trial in best third
+        trials["trial_1"]["status"] = asha.RUNNING
+        self.assertIsNone(self.scheduler._get_promotable_trial())
+
+        trials["trial_1"].update(rung=1, losses=[0.1, 0.05], status=asha.PAUSED)
+        self.assertIsNone(self.scheduler._get_promotable_trial())
+        for i, loss in enumerate([0.2, 0.4], 3):
+            trials["trial_{}".format(i)] = {"trial_id": "trial_{}".format(i), "configuration": {}, "rung": 1, "losses": [0.01, loss], "status": asha.PAUSED}
+        self.assertEqual(self.scheduler._get_promotable_trial(), (trials["trial_1"], 2))
+
+    def test_get_job(self):
+        """interrupted trials first, then promotions, then new trials until num_trials are started"""
+        jobs = [self.scheduler._get_job() for _ in range(3)]
+        self.assertEqual([(trial["trial_id"], rung) for trial, rung in jobs], [("trial_0", 0), ("trial_1", 0), ("trial_2", 0)])
+
+        for trial, loss in zip([trial for trial, _ in jobs], [0.5, 0.1, 0.3]):
+            trial.update(rung=0, losses=[loss])
+        jobs[2][0]["status"] = asha.INTERRUPTED
+        self.assertEqual(self.scheduler._get_job(), (jobs[2][0], 1))
+
+        jobs[2][0]["status"] = asha.PAUSED
+        self.assertEqual(self.scheduler._get_job(), (jobs[1][0], 1))
+
+        jobs[1][0]["status"] = asha.RUNNING
+        self.assertEqual(self.scheduler._get_job()[0]["trial_id"], "trial_3")
+
+        self.scheduler.num_trials = 4
+        self.assertIsNone(self.scheduler._get_job())
+
+    def test_search(self):
+        """best trial is trained to last rung, others paused at earlier rungs, search resumed from ledger samples the same configurations"""
+        self.scheduler._worker()
+
+        trials = self.scheduler._ledger["trials"]
+        self.assertEqual(len(trials), 9)
+        best_trial = min(trials.values(), key=lambda trial: trial["configuration"]["meta_lr"])
+        self.assertEqual(best_trial["status"], asha.COMPLETED)
+        self.assertEqual(len(best_trial["losses"]), 3)
+        self.assertTrue(all(trial["status"] in (asha.PAUSED, asha.COMPLETED) for trial in trials.values()))
+        self.assertGreaterEqual(sum(trial["rung"] >= 1 for trial in trials.values()), 3)
+        self.assertEqual(len(self.commands), sum(trial["rung"] + 1 for trial in trials.values()))
+        self.assertEqual(self.scheduler.iterations_trained(), sum(self.scheduler.budgets[trial["rung"]] for trial in trials.values()))
+
+        with open(os.path.join(self.asha_dir, asha.LEDGER_FILE), 'r') as f:
+            self.assertEqual(json.load(f)["trials"], trials)
+
+        # configurations sampled by fresh search equal those of ledger
+        configurations = [trial["configuration"] for trial in trials.values()]
+        shutil.rmtree(self.asha_dir)
+        os.makedirs(self.asha_dir)
+        self.scheduler = self._make_scheduler()
+        self.assertEqual([self.scheduler._get_job()[0]["configuration"] for _ in range(9)], configurations)
+
+    def test_trial_status(self):
+        """trial without metrics fails unless search was stopped, running trials of resumed search are interrupted"""
+        trial, rung = self.scheduler._get_job()
+
+        self.scheduler.run_process = lambda *args: self._fake_run_process(*args, write_metrics=False)
+        self.scheduler._run_trial(trial, rung)
+        self.assertEqual(trial["status"], asha.FAILED)
+
+        self.scheduler.run_process = lambda *args: None
+        self.scheduler._run_trial(trial, rung)
+        self.assertEqual(trial["status"], asha.INTERRUPTED)
+
+        self.scheduler.stop_requested = True
+        self.scheduler.run_process = lambda *args: self._fake_run_process(*args, return_code=-15, write_metrics=False)
+        self.scheduler._run_trial(trial, rung)
+        self.assertEqual(trial["status"], asha.INTERRUPTED)
+
+        self.scheduler.stop_requested = False
+        self.scheduler.run_process = self._fake_run_process
+        self.scheduler._run_trial(trial, rung)
+        self.assertEqual((trial["status"], trial["rung"]), (asha.PAUSED, 0))
+
+        trial["status"] = asha.RUNNING
+        self.scheduler._write()
+        self.assertEqual(self._make_scheduler()._ledger["trials"][trial["trial_id"]]["status"], asha.INTERRUPTED)
+
+if __name__ == '__main__':
+    unittest.main()
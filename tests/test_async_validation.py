@@ -0,0 +1,118 @@
+from context import utils, jax_maml
+
+import unittest
+import multiprocessing
+import threading
+import shutil
+import json
+import time
+import os
+
+from tensorboardX import SummaryWriter
+
+import utils.async_validation
+import utils.run_state
+
+from fixtures import make_model, make_parameters
+
+RELEASE_FILE = "release"
+
+class RecordingModel(object):
+    """
+    Stand-in for model of validation process: records validated snapshots in checkpoint folder. Construction
+    waits for release file, so that snapshots can be queued while the process is busy.
+    """
+    @staticmethod
+    def configure_process(params) -> None:
+        pass
+
+    def __init__(self, params, device):
+        self.checkpoint_path = params.get("checkpoint_path")
+        while not os.path.exists(os.path.join(self.checkpoint_path, RELEASE_FILE)):
+            time.sleep(0.01)
+        self.writer = SummaryWriter(self.checkpoint_path)
+
+    def set_validation_snapshot(self, snapshot):
+        self.snapshot = snapshot
+
+    def validate(self, step_count, visualise):
+        with open(os.path.join(self.checkpoint_path, "validated_{}.json".format(step_count)), 'w') as f:
+            json.dump({"value": self.snapshot["value"], "visualise": visualise}, f)
+
+
+class TestAsyncValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.parameters, self.checkpoint_path = make_parameters({})
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_path)
+
+    def _validated_steps(self):
+        return sorted(int(name.split("_")[1].split(".")[0]) for name in os.listdir(self.checkpoint_path) if name.startswith("validated_"))
+
+    def test_validation(self):
+        """submitted snapshots are validated (under their step) and deleted"""
+        open(os.path.join(self.checkpoint_path, RELEASE_FILE), 'w').close()
+        validator = utils.async_validation.AsyncValidator(RecordingModel, self.parameters, "cpu", max_pending=2)
+        validator.submit(10, {"value": 1.}, visualise=True)
+        validator.submit(20, {"value": 2.}, visualise=False)
+        validator.close()
+
+        self.assertEqual(self._validated_steps(), [10, 20])
+        with open(os.path.join(self.checkpoint_path, "validated_20.json"), 'r') as f:
+            self.assertEqual(json.load(f), {"value": 2., "visualise": False})
+        self.assertEqual(os.listdir(os.path.join(self.checkpoint_path, utils.async_validation.SNAPSHOT_FOLDER)), [])
+
+    def test_max_pending(self):
+        """if more than max_pending snapshots await validation, the oldest are skipped (and deleted)"""
+        validator = utils.async_validation.AsyncValidator(RecordingModel, self.parameters, "cpu", max_pending=2)
+        for step in [10, 20, 30, 40]:
+            validator.submit(step, {"value": float(step)}, visualise=False)
+        # all snapshots are queued before validation process is ready
+        time.sleep(0.5)
+        open(os.path.join(self.checkpoint_path, RELEASE_FILE), 'w').close()
+        validator.close()
+
+        self.assertEqual(self._validated_steps(), [30, 40])
+        self.assertEqual(os.listdir(os.path.join(self.checkpoint_path, utils.async_validation.SNAPSHOT_FOLDER)), [])
+
+    def test_final_validation(self):
+        """run validated asynchronously is validated in-process at end of training for its metrics"""
+        model, checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {
+            "task_type": "sin", "priority_sample": False, "training_iterations": 3, "validation_frequency": 2,
+            "visualisation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 10,
+            "async_validation": {"enabled": True}
+            })
+        try:
+            utils.run_state.train_and_write_metrics(model, checkpoint_path, final_validation=False)
+            model.writer.close()
+
+            with open(os.path.join(checkpoint_path, utils.run_state.METRICS_FILE), 'r') as f:
+                metrics = json.load(f)
+            self.assertIsNotNone(metrics["final_validation_loss"])
+            self.assertEqual(os.listdir(os.path.join(checkpoint_path, utils.async_validation.SNAPSHOT_FOLDER)), [])
+        finally:
+            shutil.rmtree(checkpoint_path)
+    def test_training_error(self):
+        """validation process and prefetch thread are stopped when training fails"""
+        model, checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {
+            "task_type": "sin", "priority_sample": False, "training_iterations": 4, "validation_frequency": 100,
+            "fixed_validation": False, "async_validation": {"enabled": True}, "prefetch": {"enabled": True, "depth": 2}
+            })
+        def failing_log_training_step(step_count, *args):
+            if step_count == 1:
+                raise RuntimeError("step failed")
+        model._log_training_step = failing_log_training_step
+        try:
+            with self.assertRaises(RuntimeError):
+                model.train()
+            self.assertEqual(multiprocessing.active_children(), [])
+            self.assertFalse(any(thread.name == "batch_prefetcher" for thread in threading.enumerate()))
+            self.assertIsNone(model._prefetcher)
+        finally:
+            model.writer.close()
+            shutil.rmtree(checkpoint_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from context import utils
+
+import unittest
+
+import utils.parameters
+
+from fixtures import load_experiment_module
+
+benchmark = load_experiment_module("benchmark")
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_expand_grid(self):
+        """every combination of grid values, keyed by (dotted) configuration key"""
+        runs = utils.parameters.expand_grid({"framework": ["jax", "pytorch"], "precision.dtype": ["fp32"], "num_inner_updates": [1, 5]})
+
+        self.assertEqual(len(runs), 4)
+        self.assertIn({"framework": "pytorch", "precision.dtype": "fp32", "num_inner_updates": 5}, runs)
+        self.assertEqual(len({benchmark.get_run_id(run) for run in runs}), 4)
+        self.assertEqual(
+            utils.parameters.nested_dict_from_dotted(runs[0]), {"framework": "jax", "precision": {"dtype": "fp32"}, "num_inner_updates": 1}
+            )
+
+    def test_check_regressions(self):
+        """runs slower than baseline by more than tolerance are flagged, failed or new runs are not compared"""
+        baseline = [
+            {"run_id": "a", "status": "ok", "steady_steps_per_second": 100.},
+            {"run_id": "b", "status": "ok", "steady_steps_per_second": 100.},
+            {"run_id": "c", "status": "error"}
+            ]
+        results = [
+            {"run_id": "a", "status": "ok", "steady_steps_per_second": 95.},
+            {"run_id": "b", "status": "ok", "steady_steps_per_second": 80.},
+            {"run_id": "c", "status": "ok", "steady_steps_per_second": 10.},
+            {"run_id": "d", "status": "ok", "steady_steps_per_second": 10.}
+            ]
+        regressions = benchmark.check_regressions(results, baseline, tolerance=0.1)
+
+        self.assertEqual([regression["run_id"] for regression in regressions], ["b"])
+        self.assertAlmostEqual(regressions[0]["ratio"], 0.8)
+        self.assertAlmostEqual(results[0]["baseline_ratio"], 0.95)
+        self.assertNotIn("baseline_ratio", results[3])
+
+if __name__ == '__main__':
+    unittest.main()
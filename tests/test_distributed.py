@@ -0,0 +1,126 @@
+from context import maml, utils
+
+import unittest
+import tempfile
+import shutil
+import socket
+import json
+import os
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+import maml.distributed
+import maml.sinusoid
+
+from fixtures import make_parameters
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _collectives_worker(rank: int, world_size: int, master_port: int, result_path: str) -> None:
+    """runs collectives of maml.distributed on each rank, results are written to one file per rank"""
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(master_port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        results = {"rank": maml.distributed.get_rank(), "world_size": maml.distributed.get_world_size()}
+
+        # shape and dtype of tensor are only known on source rank
+        source_tensor = torch.arange(6, dtype=torch.int64).reshape(2, 3) * 10 if rank == 0 else None
+        broadcast = maml.distributed.broadcast_tensor(source_tensor)
+        results["broadcast"] = (broadcast.tolist(), str(broadcast.dtype))
+
+        source_tensor = torch.full((3,), 0.1, dtype=torch.float64) if rank == 0 else None
+        broadcast = maml.distributed.broadcast_tensor(source_tensor, shape=(3,), dtype=torch.float64)
+        results["broadcast_known"] = (broadcast.tolist(), str(broadcast.dtype))
+
+        tensors = (torch.full((2, 2), float(rank)), torch.full((3,), 10. * rank))
+        results["all_reduce_mean"] = [tensor.tolist() for tensor in maml.distributed.all_reduce_mean(tensors)]
+
+        gathered = maml.distributed.gather(torch.tensor([rank, rank + 0.5]))
+        results["gather"] = gathered.tolist() if gathered is not None else None
+
+        results["gather_object"] = maml.distributed.gather_object({"rank": rank})
+
+        results["any_rank"] = [maml.distributed.any_rank(rank == 1), maml.distributed.any_rank(False)]
+
+        with open(os.path.join(result_path, "rank_{}.json".format(rank)), 'w') as f:
+            json.dump(results, f)
+    finally:
+        dist.destroy_process_group()
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+        self.result_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.result_path)
+
+    def test_collectives(self):
+        mp.spawn(_collectives_worker, args=(2, get_free_port(), self.result_path), nprocs=2, join=True)
+
+        for rank in range(2):
+            with open(os.path.join(self.result_path, "rank_{}.json".format(rank)), 'r') as f:
+                results = json.load(f)
+            self.assertEqual((results["rank"], results["world_size"]), (rank, 2))
+            self.assertEqual(results["broadcast"], [[[0, 10, 20], [30, 40, 50]], "torch.int64"])
+            self.assertEqual(results["broadcast_known"], [[0.1, 0.1, 0.1], "torch.float64"])
+            self.assertEqual(results["all_reduce_mean"], [[[0.5, 0.5], [0.5, 0.5]], [5., 5., 5.]])
+            self.assertEqual(results["gather"], [0., 0.5, 1., 1.5] if rank == 0 else None)
+            self.assertEqual(results["gather_object"], [{"rank": 0}, {"rank": 1}] if rank == 0 else None)
+            self.assertEqual(results["any_rank"], [True, False])
+
+    def test_launch(self):
+        """ranks train on shards of task batch, rank 0 writes metrics of run"""
+        parameters, checkpoint_path = make_parameters({
+            "device": "cpu", "task_type": "sin2d", "training_iterations": 2, "task_batch_size": 4, "priority_sample": False,
+            "validation_frequency": 100, "visualisation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 2,
+            "pytorch": {"functional": True, "world_size": 2}
+            })
+        try:
+            maml.distributed.launch(maml.sinusoid.SineMAML, parameters, torch.device("cpu"), world_size=2, master_port=get_free_port(), final_validation=True)
+
+            with open(os.path.join(checkpoint_path, utils.run_state.METRICS_FILE), 'r') as f:
+                metrics = json.load(f)
+            self.assertEqual(metrics["training_iterations"], 2)
+            self.assertIsNotNone(metrics["final_validation_loss"])
+            self.assertFalse(os.path.exists(os.path.join(checkpoint_path, "rank_1", utils.run_state.METRICS_FILE)))
+        finally:
+            shutil.rmtree(checkpoint_path)
+
+    def _launch(self, updates):
+        parameters, checkpoint_path = make_parameters(dict({
+            "device": "cpu", "task_type": "sin2d", "task_batch_size": 4, "priority_sample": False,
+            "validation_frequency": 100, "visualisation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 2,
+            "pytorch": {"functional": True, "world_size": 2}
+            }, **updates))
+        self.checkpoint_paths.append(checkpoint_path)
+        maml.distributed.launch(maml.sinusoid.SineMAML, parameters, torch.device("cpu"), world_size=2, master_port=get_free_port())
+        return checkpoint_path
+
+    def test_resume(self):
+        """every rank resumes its own random number generator streams, so resumed training continues exactly"""
+        self.checkpoint_paths = []
+        try:
+            state = utils.run_state.load_run_state(self._launch({"training_iterations": 4}))
+            interrupted_path = self._launch({"training_iterations": 2})
+            resumed_state = utils.run_state.load_run_state(self._launch({"training_iterations": 4, "resume": {"run_state": interrupted_path}}))
+
+            self.assertEqual(resumed_state["step"], 4)
+            self.assertEqual(len(resumed_state["rank_rng_states"]), 2)
+            for parameter, resumed_parameter in zip(state["network_parameters"], resumed_state["network_parameters"]):
+                self.assertTrue(torch.equal(parameter, resumed_parameter))
+            for rank_states, resumed_rank_states in zip(state["rank_rng_states"], resumed_state["rank_rng_states"]):
+                self.assertTrue(torch.equal(rank_states["generator_state"], resumed_rank_states["generator_state"]))
+        finally:
+            for checkpoint_path in self.checkpoint_paths:
+                shutil.rmtree(checkpoint_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+from context import utils
+
+import unittest
+import tempfile
+import shutil
+
+import numpy as np
+
+import utils.episodes
+import utils.prng
+
+class TestEpisodeDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        utils.episodes.make_synthetic_dataset(self.path, num_classes=12, examples_per_class=6, image_size=8, seed=1)
+        self.dataset = utils.episodes.EpisodeDataset(self.path)
+        self.streams = utils.prng.RandomStreams(seed=0)
+
+    def tearDown(self):
+        del self.dataset
+        shutil.rmtree(self.path)
+
+    def test_classes(self):
+        """episodes have distinct classes from those given"""
+        classes = np.arange(4, 12)
+        episode_classes = self.dataset.sample_classes(self.streams.generators("task", 0, range(10)), 3, classes)
+
+        self.assertEqual(episode_classes.shape, (10, 3))
+        self.assertTrue(np.isin(episode_classes, classes).all())
+        self.assertTrue(all(len(set(episode)) == 3 for episode in episode_classes))
+
+    def test_disjoint_splits(self):
+        """splits of an episode are disjoint images of its classes, labelled by position of class"""
+        episode_classes = self.dataset.sample_classes(self.streams.generators("task", 0, range(4)), 3, np.arange(12))
+        rngs = self.streams.generators("support", 0, range(4))
+        support_indices, query_indices = self.dataset.sample_indices(rngs, episode_classes, [2, 4])
+
+        self.assertEqual(support_indices.shape, (4, 3, 2))
+        self.assertEqual(query_indices.shape, (4, 3, 4))
+        all_indices = np.concatenate([support_indices, query_indices], axis=-1)
+        np.testing.assert_array_equal(all_indices // 6, np.broadcast_to(episode_classes[..., None], all_indices.shape))
+        self.assertTrue(all(len(np.unique(episode)) == episode.size for episode in all_indices))
+
+        (support_x, support_y), (query_x, query_y) = self.dataset.sample_episodes(
+            self.streams.generators("support", 0, range(4)), episode_classes, [2, 4]
+            )
+        self.assertEqual(support_x.shape, (4, 6, 8, 8, 1))
+        self.assertEqual(query_x.dtype, np.float32)
+        np.testing.assert_array_equal(support_y[0], [0, 0, 1, 1, 2, 2])
+        np.testing.assert_array_equal(query_x[1, 4], self.dataset.images[query_indices[1, 1, 0]] / 255.)
+
+    def test_too_many_shots(self):
+        episode_classes = np.array([[0, 1]])
+        with self.assertRaises(ValueError):
+            self.dataset.sample_indices([np.random.RandomState(0)], episode_classes, [3, 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+from context import utils, jax_maml
+
+import unittest
+import shutil
+import time
+
+import numpy as np
+
+import jax_maml.jax_inference
+
+from fixtures import make_model
+
+
+class TestAdaptedParameterCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {"task_type": "sin", "priority_sample": False})
+        cls.parameters = cls.model.get_params_from_optimiser(cls.model.optimiser_state)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def _entry(self, size):
+        """parameter set of size bytes"""
+        return [np.zeros(size // 8, dtype=np.float32), np.zeros(size // 8, dtype=np.float32)]
+
+    def test_lru_order(self):
+        """least recently used (not least recently put) entry is evicted first"""
+        cache = jax_maml.jax_inference.AdaptedParameterCache(max_entries=2, max_bytes=10 ** 6)
+        cache.put("a", self._entry(80))
+        cache.put("b", self._entry(80))
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", self._entry(80))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+        # replacing entry counts as use, size is not counted twice
+        cache.put("a", self._entry(80))
+        cache.put("d", self._entry(80))
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get_statistics()["cache_bytes"], 160)
+
+    def test_byte_bound(self):
+        """entries are evicted until total size is within bound, entries larger than bound are not cached"""
+        cache = jax_maml.jax_inference.AdaptedParameterCache(max_entries=100, max_bytes=400)
+        for key in ["a", "b", "c"]:
+            cache.put(key, self._entry(160))
+        statistics = cache.get_statistics()
+        self.assertEqual((statistics["cache_entries"], statistics["cache_bytes"], statistics["cache_evictions"]), (2, 320, 1))
+        self.assertIsNone(cache.get("a"))
+
+        cache.put("large", self._entry(480))
+        self.assertIsNone(cache.get("large"))
+        self.assertEqual(cache.get_statistics()["cache_entries"], 2)
+
+        cache.put("d", self._entry(320))
+        self.assertEqual(cache.get_statistics()["cache_entries"], 1)
+        self.assertIsNotNone(cache.get("d"))
+
+    def test_statistics(self):
+        """hits, misses, evictions and invalidations are counted until reset"""
+        cache = jax_maml.jax_inference.AdaptedParameterCache(max_entries=1, max_bytes=10 ** 6)
+        cache.put("a", self._entry(80))
+        cache.put("b", self._entry(80))
+        cache.get("a")
+        cache.get("b")
+        cache.get("b")
+        self.assertEqual(cache.clear(), 1)
+
+        statistics = cache.get_statistics(reset=True)
+        self.assertEqual(
+            [statistics[key] for key in ["cache_hits", "cache_misses", "cache_evictions", "cache_invalidations", "cache_entries"]], [2, 1, 1, 1, 0]
+            )
+        self.assertAlmostEqual(statistics["cache_hit_rate"], 2 / 3)
+        statistics = cache.get_statistics()
+        self.assertEqual((statistics["cache_hits"], statistics["cache_evictions"], statistics["cache_hit_rate"]), (0, 0, None))
+
+    def _wait_for_entries(self, adapter, num_entries):
+        """adapted parameters are cached (by worker) after predictions are returned"""
+        deadline = time.perf_counter() + 10.
+        while adapter.get_statistics()["cache_entries"] < num_entries and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(adapter.get_statistics()["cache_entries"], num_entries)
+
+    def test_invalidation(self):
+        """adapted parameters are cached per meta parameters, replacing them invalidates the cache"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_batch_size=4, batch_timeout=0.001, cache_entries=8)
+        try:
+            support_x = np.linspace(-4, 4, 5).reshape(5, 1)
+            query_x = np.linspace(-5, 5, 3).reshape(3, 1)
+
+            adapted_prediction = adapter.predict(support_x, np.sin(support_x), query_x, num_steps=3)
+            self._wait_for_entries(adapter, 1)
+            np.testing.assert_allclose(adapter.predict(support_x, np.sin(support_x), query_x, num_steps=3), adapted_prediction, rtol=1e-5, atol=1e-6)
+            statistics = adapter.get_statistics()
+            self.assertEqual((statistics["cache_hits"], statistics["cache_entries"]), (1, 1))
+
+            # different number of steps is a different entry
+            adapter.predict(support_x, np.sin(support_x), query_x, num_steps=4)
+            self._wait_for_entries(adapter, 2)
+
+            fingerprint = adapter.parameters_fingerprint
+            shifted_parameters = [tuple(p + 0.1 for p in layer) for layer in self.parameters]
+            self.assertEqual(adapter.set_network_parameters(shifted_parameters), 2)
+            self.assertNotEqual(adapter.parameters_fingerprint, fingerprint)
+            statistics = adapter.get_statistics()
+            self.assertEqual((statistics["cache_entries"], statistics["cache_invalidations"]), (0, 2))
+
+            # adapted afresh from new meta parameters
+            shifted_prediction = adapter.predict(support_x, np.sin(support_x), query_x, num_steps=3)
+            self.assertEqual(adapter.get_statistics()["cache_hits"], 1)
+            self.assertFalse(np.allclose(shifted_prediction, adapted_prediction))
+        finally:
+            adapter.close()
+
+class TestBatchedAdapter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {"task_type": "sin", "priority_sample": False})
+        cls.parameters = cls.model.get_params_from_optimiser(cls.model.optimiser_state)
+
+        rng = np.random.RandomState(0)
+        cls.support_x = [rng.uniform(-5, 5, size=(k, 1)).astype(np.float32) for k in [3, 7, 10, 5]]
+        cls.support_y = [np.sin(x) for x in cls.support_x]
+        cls.query_x = [rng.uniform(-5, 5, size=(n, 1)).astype(np.float32) for n in [5, 1, 8, 3]]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def _expected_prediction(self, i, num_steps):
+        """prediction of request i adapted on its own (unpadded) support set"""
+        adapted_parameters = self.parameters
+        for _ in range(num_steps):
+            adapted_parameters = self.model._inner_loop_update(adapted_parameters, self.support_x[i], self.support_y[i])
+        return np.asarray(self.model._forward(adapted_parameters, self.query_x[i]))
+
+    def _submit_batch(self, adapter, indices, num_steps):
+        """submit requests together, so that they are adapted in one batch"""
+        return [adapter.submit(self.support_x[i], self.support_y[i], self.query_x[i], num_steps=n) for i, n in zip(indices, num_steps)]
+
+    def test_batched_predictions(self):
+        """predictions of batch equal those of requests adapted one at a time"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_batch_size=4, batch_timeout=10.)
+        try:
+            batched = [future.result(timeout=60) for future in self._submit_batch(adapter, range(4), [5] * 4)]
+            self.assertEqual(adapter.get_statistics()["mean_batch_size"], 4.)
+
+            adapter.max_batch_size = 1
+            for i in range(4):
+                sequential = adapter.predict(self.support_x[i], self.support_y[i], self.query_x[i], num_steps=5)
+                np.testing.assert_allclose(batched[i], sequential, rtol=1e-4, atol=1e-5)
+                np.testing.assert_allclose(batched[i], self._expected_prediction(i, 5), rtol=1e-4, atol=1e-5)
+        finally:
+            adapter.close()
+
+    def test_mixed_num_steps(self):
+        """requests of one batch are fine-tuned for their own number of steps"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_batch_size=4, batch_timeout=10.)
+        try:
+            num_steps = [0, 1, 5, 12]
+            predictions = [future.result(timeout=60) for future in self._submit_batch(adapter, range(4), num_steps)]
+            self.assertEqual(adapter.get_statistics()["mean_batch_size"], 4.)
+            for i, n in enumerate(num_steps):
+                np.testing.assert_allclose(predictions[i], self._expected_prediction(i, n), rtol=1e-4, atol=1e-5)
+        finally:
+            adapter.close()
+
+    def test_padding(self):
+        """batch, support and query sizes are padded (to powers of two), predictions are those of unpadded requests"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_batch_size=8, batch_timeout=0.2)
+        try:
+            # batch of 3 padded to 4, support sets of 3, 7 and 5 to 8, query sets of 5, 1 and 3 to 8
+            indices = [0, 1, 3]
+            predictions = [future.result(timeout=60) for future in self._submit_batch(adapter, indices, [3, 3, 3])]
+            self.assertEqual(adapter.get_statistics()["mean_batch_size"], 3.)
+            for i, prediction in zip(indices, predictions):
+                self.assertEqual(prediction.shape, (len(self.query_x[i]), 1))
+                np.testing.assert_allclose(prediction, self._expected_prediction(i, 3), rtol=1e-4, atol=1e-5)
+        finally:
+            adapter.close()
+
+    def test_invalid_request(self):
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_num_steps=10)
+        try:
+            with self.assertRaises(ValueError):
+                adapter.submit(self.support_x[0], self.support_y[1], self.query_x[0], num_steps=1)
+            with self.assertRaises(ValueError):
+                adapter.submit(self.support_x[0], self.support_y[0], self.query_x[0], num_steps=11)
+            with self.assertRaises(ValueError):
+                adapter.submit(self.support_x[0], self.support_y[0], np.zeros((0, 1)), num_steps=1)
+        finally:
+            adapter.close()
+
+    def test_exception(self):
+        """exception raised in adaptation of batch is set on futures of its requests, later batches are still adapted"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters, max_batch_size=2, batch_timeout=10.)
+        try:
+            adapt_batch = adapter._adapt_batch
+            def failing_adapt_batch(batch):
+                adapter._adapt_batch = adapt_batch
+                raise RuntimeError("adaptation failed")
+            adapter._adapt_batch = failing_adapt_batch
+
+            futures = self._submit_batch(adapter, [0, 1], [1, 1])
+            for future in futures:
+                with self.assertRaisesRegex(RuntimeError, "adaptation failed"):
+                    future.result(timeout=60)
+
+            predictions = [future.result(timeout=60) for future in self._submit_batch(adapter, [0, 1], [1, 1])]
+            np.testing.assert_allclose(predictions[0], self._expected_prediction(0, 1), rtol=1e-4, atol=1e-5)
+        finally:
+            adapter.close()
+    def test_closed(self):
+        """requests submitted after close are rejected, closing again has no effect"""
+        adapter = jax_maml.jax_inference.BatchedAdapter(self.model, self.parameters)
+        adapter.close()
+        with self.assertRaises(RuntimeError):
+            adapter.submit(self.support_x[0], self.support_y[0], self.query_x[0], num_steps=1)
+        adapter.close()
+
+if __name__ == '__main__':
+    unittest.main()
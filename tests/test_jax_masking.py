@@ -0,0 +1,68 @@
+from context import utils, jax_maml
+
+import unittest
+
+import shutil
+
+import numpy as np
+
+from fixtures import make_model
+
+
+class TestRaggedAdaptation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {
+            "task_type": "sin", "priority_sample": False,
+            "validation_task_batch_size": 20
+            })
+        cls.parameters = cls.model.get_params_from_optimiser(cls.model.optimiser_state)
+
+        rng = np.random.RandomState(0)
+        cls.k_values = [3, 7, 10]
+        cls.support_x = [rng.uniform(-5, 5, size=(k, 1)).astype(np.float32) for k in cls.k_values]
+        cls.support_y = [np.sin(x) for x in cls.support_x]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_pad_sets(self):
+        """sets are zero padded to common size, mask marks their examples"""
+        padded, mask = jax_maml.jax_model.pad_sets(self.support_x, 16)
+
+        self.assertEqual(padded.shape, (3, 16, 1))
+        np.testing.assert_array_equal(mask.sum(axis=1), self.k_values)
+        np.testing.assert_array_equal(padded[0, :3], self.support_x[0])
+        self.assertTrue(np.all(padded[0, 3:] == 0))
+
+    def test_masked_loss(self):
+        """masked loss of padded set equals loss of set without padding"""
+        padded_x, mask = jax_maml.jax_model.pad_sets(self.support_x)
+        padded_y, _ = jax_maml.jax_model.pad_sets(self.support_y)
+
+        for i in range(len(self.k_values)):
+            masked_loss = self.model._compute_masked_loss(self.parameters, padded_x[i], padded_y[i], mask[i])
+            loss = self.model._compute_loss(self.parameters, self.support_x[i], self.support_y[i])
+            np.testing.assert_allclose(masked_loss, loss, rtol=1e-5)
+
+    def test_ragged_adaptation(self):
+        """adaptation of tasks of different k in one padded batch equals adaptation of each task on its own"""
+        padded_x, mask = jax_maml.jax_model.pad_sets(self.support_x, 16)
+        padded_y, _ = jax_maml.jax_model.pad_sets(self.support_y, 16)
+        query_x = np.linspace(-5, 5, 8, dtype=np.float32).reshape(1, 8, 1).repeat(3, axis=0)
+        num_steps = np.array([5, 5, 5], dtype=np.int32)
+
+        query_y, _ = self.model._jit_adapt_and_predict(self.parameters, padded_x, padded_y, query_x, num_steps, mask)
+
+        for i in range(len(self.k_values)):
+            adapted_parameters = self.parameters
+            for _ in range(5):
+                adapted_parameters = self.model._inner_loop_update(adapted_parameters, self.support_x[i], self.support_y[i])
+            expected = self.model._forward(adapted_parameters, query_x[i])
+            np.testing.assert_allclose(query_y[i], expected, rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+from context import utils, jax_maml
+
+import unittest
+
+import shutil
+
+import numpy as np
+
+from jax import random
+
+from fixtures import make_model
+
+
+class TestQuadraticMAML(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_quadratic.QuadraticMAML, {
+            "task_type": "quadratic", "priority_sample": True,
+            "priority_queue": {"sample_type": "sample_under_pdf", "epsilon_decay_start": 0}
+            })
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_sampled_tasks(self):
+        """tasks from priority queue over the three coefficients lie in their bounds, examples are quadratic values"""
+        self.assertEqual(self.model.priority_queue.get_queue().shape, (8, 8, 8))
+
+        tasks, max_indices, _ = self.model._sample_task(batch_size=5, step_count=1)
+        self.assertEqual(len(max_indices), 5)
+        for task in tasks:
+            self.assertTrue(all(bounds[0] <= p <= bounds[1] for p, bounds in zip(task, self.model.parameter_bounds)))
+
+        x_batch, y_batch = self.model._generate_batch(tasks, rngs=self.model.random_streams.generators("support", 1, range(5)))
+        self.assertEqual(x_batch.shape, (5, self.model.inner_update_k, 1))
+        a, b, c = tasks[2]
+        np.testing.assert_allclose(y_batch[2], a * x_batch[2] ** 2 + b * x_batch[2] + c, rtol=1e-5, atol=1e-5)
+
+    def test_task_batch_on_device(self):
+        """examples generated on device from parameter arrays are values of the quadratics"""
+        task_parameters = np.array([[[1., -2., 0.5]], [[-0.5, 0., 2.]]], dtype=np.float32)
+        x_batch, y_batch = self.model._generate_task_batch(random.PRNGKey(0), task_parameters, num_points=7)
+
+        self.assertEqual(x_batch.shape, (2, 7, 1))
+        self.assertTrue(np.all(np.abs(np.asarray(x_batch)) <= 2))
+        np.testing.assert_allclose(y_batch[1], -0.5 * np.asarray(x_batch[1]) ** 2 + 2., rtol=1e-5, atol=1e-5)
+
+    def test_fixed_validation_grid(self):
+        parameter_tuples, tasks = self.model._get_fixed_validation_tasks()
+        self.assertEqual(parameter_tuples.shape, (64, 3))
+        self.assertEqual(len(tasks), 64)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from context import utils, jax_maml
+
+import unittest
+
+import shutil
+
+import numpy as np
+
+import jax
+import jax.numpy as jnp
+
+from fixtures import make_model
+
+
+class TestRLMAML(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_rl.RLMAML, {
+            "task_type": "point_navigation", "priority_sample": False,
+            "inner_update_k": 4, "rl": {"horizon": 12, "discount": 0.9, "initial_log_std": 0.}
+            })
+        cls.parameters = cls.model.get_params_from_optimiser(cls.model.optimiser_state)
+
+        streams = utils.prng.RandomStreams(seed=0)
+        cls.goals, cls.keys = cls.model._generate_batch(
+            [np.array([0.3, -0.2]), np.array([-0.4, 0.1])], rngs=streams.generators("support", 0, range(2))
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_rollouts(self):
+        """rollouts are determined by their keys, one per rollout, over horizon"""
+        log_probabilities, rewards, states = self.model._rollouts(self.parameters, self.goals[0], self.keys[0])
+        _, repeated_rewards, _ = self.model._rollouts(self.parameters, self.goals[0], self.keys[0])
+
+        self.assertEqual(self.keys.shape, (2, 4, 2))
+        self.assertEqual(rewards.shape, (4, 12))
+        self.assertEqual(states.shape, (4, 12, 2))
+        np.testing.assert_array_equal(rewards, repeated_rewards)
+        self.assertTrue(np.all(np.abs(np.diff(states, axis=1)) <= 0.1 + 1e-6))
+        np.testing.assert_allclose(rewards, -np.linalg.norm(np.asarray(states) - self.goals[0], axis=-1), rtol=1e-5)
+
+    def test_loss_and_policy_gradient(self):
+        """loss is negative mean return, its gradient that of the REINFORCE surrogate with returns-to-go"""
+        goal, keys = self.goals[0], self.keys[0]
+        log_probabilities, rewards, _ = self.model._rollouts(self.parameters, goal, keys)
+        rewards = np.asarray(rewards, dtype=np.float64)
+
+        loss = self.model._compute_loss(self.parameters, goal, keys)
+        self.assertAlmostEqual(float(loss), -rewards.sum(axis=1).mean(), places=4)
+
+        returns_to_go = np.zeros_like(rewards)
+        future_return = np.zeros(len(rewards))
+        for t in reversed(range(rewards.shape[1])):
+            future_return = rewards[:, t] + 0.9 * future_return
+            returns_to_go[:, t] = future_return
+        advantages = returns_to_go - returns_to_go.mean(axis=0)
+        advantages = jnp.asarray(advantages / (advantages.std() + 1e-8), dtype=jnp.float32)
+
+        def surrogate_loss(parameters):
+            log_probabilities, _, _ = self.model._rollouts(parameters, goal, keys)
+            return -jnp.mean(jnp.sum(log_probabilities * advantages, axis=1))
+
+        gradients = jax.grad(self.model._compute_loss)(self.parameters, goal, keys)
+        expected_gradients = jax.grad(surrogate_loss)(self.parameters)
+        for gradient, expected_gradient in zip(jax.tree_util.tree_leaves(gradients), jax.tree_util.tree_leaves(expected_gradients)):
+            np.testing.assert_allclose(gradient, expected_gradient, rtol=1e-3, atol=1e-5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+from context import utils, jax_maml
+
+import unittest
+import shutil
+import json
+import os
+
+import numpy as np
+
+from fixtures import make_model, make_parameters
+
+UPDATES = {
+    "task_type": "sin", "priority_sample": False, "task_batch_size": 5, "training_iterations": 3, "validation_frequency": 100,
+    "fixed_validation": False, "validation_task_batch_size": 10
+    }
+
+class TestPopulation(unittest.TestCase):
+
+    def setUp(self):
+        self.checkpoint_paths = []
+
+    def tearDown(self):
+        for checkpoint_path in self.checkpoint_paths:
+            shutil.rmtree(checkpoint_path)
+
+    def _train(self, model_class, updates):
+        model, checkpoint_path = make_model(model_class, dict(UPDATES, **updates))
+        self.checkpoint_paths.append(checkpoint_path)
+        model.train()
+        model.validate(step_count=model.start_iteration + model.training_iterations, visualise=False)
+        return model
+
+    def _member_parameters(self, model, member_index=None):
+        parameters = jax_maml.jax_model.jax.tree_util.tree_leaves(model.get_params_from_optimiser(model.optimiser_state))
+        return [np.asarray(p) if member_index is None else np.asarray(p)[member_index] for p in parameters]
+
+    def _assert_member_matches(self, population, member_index, single):
+        """member of population is trained and validated as single model of its seed and learning rates"""
+        for member_parameter, parameter in zip(self._member_parameters(population, member_index), self._member_parameters(single)):
+            np.testing.assert_allclose(member_parameter, parameter, rtol=1e-5, atol=1e-7)
+        self.assertAlmostEqual(population.last_validation_losses[member_index], single.last_validation_loss, places=5)
+
+    def test_population_of_one(self):
+        single = self._train(jax_maml.jax_sinusoid.SineMAML, {"seed": 0, "meta_lr": 0.01, "inner_update_lr": 0.01})
+        population = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, {
+            "seed": 0, "population": {"seeds": [0], "meta_lr": [0.01], "inner_update_lr": [0.01]}
+            })
+        self.assertEqual(population.population_size, 1)
+        self._assert_member_matches(population, 0, single)
+        self.assertEqual(population.last_validation_loss, population.last_validation_losses[0])
+
+    def test_members(self):
+        """members of different seeds and learning rates, validated on tasks of run seed, written to population_validation.json"""
+        single = self._train(jax_maml.jax_sinusoid.SineMAML, {"seed": 1, "meta_lr": 0.001, "inner_update_lr": 0.02})
+        population = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, {
+            "seed": 1, "population": {"seeds": [0, 1], "meta_lr": [0.01, 0.001], "inner_update_lr": [0.02]}
+            })
+        self.assertEqual([(m["seed"], m["meta_lr"]) for m in population.members], [(0, 0.01), (0, 0.001), (1, 0.01), (1, 0.001)])
+        self._assert_member_matches(population, 3, single)
+
+        with open(os.path.join(population.checkpoint_path, "population_validation.json"), 'r') as f:
+            validation = json.load(f)
+        self.assertEqual([member["validation_loss"] for member in validation["members"]], population.last_validation_losses)
+        self.assertTrue(all(os.path.isdir(os.path.join(population.checkpoint_path, population._get_member_name(m))) for m in range(4)))
+
+    def test_prefetch(self):
+        """batches of members prepared in background thread are those prepared in training thread"""
+        updates = {"population": {"seeds": [0, 1], "meta_lr": [0.01], "inner_update_lr": [0.01]}}
+        population = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, updates)
+        prefetched = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, dict(updates, prefetch={"enabled": True, "depth": 2}))
+        for parameter, prefetched_parameter in zip(self._member_parameters(population), self._member_parameters(prefetched)):
+            np.testing.assert_array_equal(parameter, prefetched_parameter)
+
+    def test_resume(self):
+        """population resumed from run state continues exactly"""
+        updates = {"population": {"seeds": [0, 1], "meta_lr": [0.01], "inner_update_lr": [0.01]}}
+        population = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, dict(updates, training_iterations=4))
+        interrupted = self._train(jax_maml.jax_sinusoid.SinePopulationMAML, dict(updates, training_iterations=2))
+        resumed = self._train(
+            jax_maml.jax_sinusoid.SinePopulationMAML, dict(updates, training_iterations=4, resume={"run_state": interrupted.checkpoint_path})
+            )
+        self.assertEqual(resumed.start_iteration, 2)
+        for parameter, resumed_parameter in zip(self._member_parameters(population), self._member_parameters(resumed)):
+            np.testing.assert_array_equal(parameter, resumed_parameter)
+
+    def test_priority_sample(self):
+        parameters, checkpoint_path = make_parameters(dict(UPDATES, priority_sample=True, task_type="sin2d"))
+        self.checkpoint_paths.append(checkpoint_path)
+        with self.assertRaises(NotImplementedError):
+            jax_maml.jax_sinusoid.SinePopulationMAML(parameters, "cpu")
+
+if __name__ == '__main__':
+    unittest.main()
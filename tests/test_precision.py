@@ -0,0 +1,52 @@
+from context import utils, jax_maml
+
+import unittest
+import shutil
+
+import jax
+
+import utils.precision
+
+from fixtures import make_parameters
+
+class TestPrecision(unittest.TestCase):
+
+    def setUp(self):
+        self.parameters, self.checkpoint_path = make_parameters({"task_type": "sin2d"})
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_path)
+
+    def test_from_params(self):
+        """precision section is optional (fp32 without loss scaling)"""
+        self.parameters.update({"precision": {"dtype": "bf16", "loss_scale": 128}})
+        policy = utils.precision.PrecisionPolicy.from_params(self.parameters)
+        self.assertEqual((policy.parameter_dtype, policy.compute_dtype, policy.loss_scale, policy.mixed), ("float32", "bfloat16", 128., True))
+
+        self.parameters._config["precision"] = {"dtype": None, "loss_scale": None}
+        self.assertEqual(utils.precision.PrecisionPolicy.from_params(self.parameters).precision, "fp32")
+
+        self.parameters._config.pop("precision")
+        policy = utils.precision.PrecisionPolicy.from_params(self.parameters)
+        self.assertEqual((policy.precision, policy.loss_scale), ("fp32", 1.))
+
+        with self.assertRaises(ValueError):
+            utils.precision.PrecisionPolicy("fp16")
+
+    def test_x64_mode(self):
+        """x64 mode is set by configure_process only, models of other precision raise"""
+        self.parameters.update({"precision": {"dtype": "fp64"}})
+        with self.assertRaises(ValueError):
+            jax_maml.jax_sinusoid.SineMAML(self.parameters, "cpu")
+        self.assertFalse(jax.config.read("jax_enable_x64"))
+
+        try:
+            jax_maml.jax_model.MAML.configure_process(self.parameters)
+            self.assertTrue(jax.config.read("jax_enable_x64"))
+        finally:
+            self.parameters.update({"precision": {"dtype": "fp32"}})
+            jax_maml.jax_model.MAML.configure_process(self.parameters)
+        self.assertFalse(jax.config.read("jax_enable_x64"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from context import utils
+
+import unittest
+import time
+
+import utils.prefetch
+
+class TestBatchPrefetcher(unittest.TestCase):
+
+    def test_batches_in_order(self):
+        """batches are returned in order of steps, staged by stage function"""
+        prefetcher = utils.prefetch.BatchPrefetcher(lambda step: step, 3, 8, depth=2, stage_fn=lambda batch: 2 * batch)
+        batches = [prefetcher.get(step) for step in range(3, 8)]
+        prefetcher.close()
+
+        self.assertEqual(batches, [6, 8, 10, 12, 14])
+
+    def test_staleness(self):
+        """batch of step t sees exactly the updates of steps up to t - 1 - max_staleness"""
+        updates = []
+        prefetcher = utils.prefetch.BatchPrefetcher(lambda step: list(updates), 0, 6, depth=4, max_staleness=1)
+        for step in range(6):
+            seen_updates = prefetcher.get(step)
+            self.assertEqual(seen_updates, list(range(step - 1)))
+            with prefetcher.updating(step):
+                updates.append(step)
+        prefetcher.close()
+
+    def test_staleness_timing(self):
+        """updates seen by batches do not depend on timing of threads (steps of no cost, slow staging)"""
+        for max_staleness, depth, stage_time in [(0, 2, 0.), (1, 2, 0.), (1, 1, 0.), (2, 1, 0.), (3, 4, 0.), (1, 2, 0.001)]:
+            updates = []
+            prefetcher = utils.prefetch.BatchPrefetcher(
+                lambda step: len(updates), 0, 300, depth=depth, max_staleness=max_staleness, stage_fn=lambda batch: time.sleep(stage_time) or batch
+                )
+            for step in range(300):
+                self.assertEqual(prefetcher.get(step), max(step - max_staleness, 0))
+                with prefetcher.updating(step):
+                    updates.append(step)
+            prefetcher.close()
+
+    def test_invalid_staleness(self):
+        with self.assertRaises(ValueError):
+            utils.prefetch.BatchPrefetcher(lambda step: step, 0, 10, depth=1, max_staleness=3)
+
+    def test_error_raised_on_get(self):
+        """errors of preparation are raised in the calling thread"""
+        def prepare(step):
+            if step == 1:
+                raise KeyError("no batch")
+            return step
+
+        prefetcher = utils.prefetch.BatchPrefetcher(prepare, 0, 4)
+        self.assertEqual(prefetcher.get(0), 0)
+        with self.assertRaises(KeyError):
+            prefetcher.get(1)
+        prefetcher.close()
+
+    def test_close_while_waiting(self):
+        """closing stops preparation waiting for an update"""
+        prefetcher = utils.prefetch.BatchPrefetcher(lambda step: step, 0, 10, max_staleness=0)
+        self.assertEqual(prefetcher.get(0), 0)
+        prefetcher.close()
+
+        self.assertFalse(prefetcher._thread.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
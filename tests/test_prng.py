@@ -0,0 +1,39 @@
+from context import utils
+
+import unittest
+
+import numpy as np
+
+import utils.prng
+
+class TestRandomStreams(unittest.TestCase):
+
+    def setUp(self):
+        self.streams = utils.prng.RandomStreams(seed=3)
+
+    def test_slots_independent_of_order(self):
+        """draws of a slot do not depend on which other slots are drawn, nor in which order"""
+        all_slots = [rng.uniform(size=4) for rng in self.streams.generators("support", 7, range(8))]
+        shard = [rng.uniform(size=4) for rng in self.streams.generators("support", 7, [5, 2])]
+
+        np.testing.assert_array_equal(shard[0], all_slots[5])
+        np.testing.assert_array_equal(shard[1], all_slots[2])
+        np.testing.assert_array_equal(self.streams.generator("support", 7, 2).uniform(size=4), all_slots[2])
+
+    def test_streams_and_steps_differ(self):
+        """different streams, steps, slots and seeds give different draws"""
+        draws = [
+            self.streams.generator("support", 7, 0).uniform(),
+            self.streams.generator("query", 7, 0).uniform(),
+            self.streams.generator("support", 8, 0).uniform(),
+            self.streams.generator("support", 7, 1).uniform(),
+            utils.prng.RandomStreams(seed=4).generator("support", 7, 0).uniform()
+            ]
+        self.assertEqual(len(set(draws)), len(draws))
+
+    def test_unknown_stream(self):
+        with self.assertRaises(ValueError):
+            self.streams.generator("unknown")
+
+if __name__ == '__main__':
+    unittest.main()
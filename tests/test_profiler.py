@@ -0,0 +1,76 @@
+from context import utils
+
+import unittest
+
+import os
+import json
+import shutil
+import tempfile
+
+class TestPhaseProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.save_path = tempfile.mkdtemp()
+        self.profiler = utils.profiler.PhaseProfiler(enabled=True, summary_frequency=2, trace=True, save_path=self.save_path)
+
+    def tearDown(self):
+        self.profiler.close()
+        self.profiler = None
+        shutil.rmtree(self.save_path)
+
+    def test_phase_statistics(self):
+        """phases timed within an interval are accumulated per name"""
+        for _ in range(3):
+            with self.profiler.phase('sample'):
+                pass
+        with self.profiler.phase('device_step'):
+            pass
+
+        statistics = self.profiler.get_interval_statistics()
+
+        self.assertEqual(statistics['sample']['calls'], 3)
+        self.assertEqual(statistics['device_step']['calls'], 1)
+        self.assertGreaterEqual(statistics['sample']['max'], 0.)
+
+    def test_summary_resets_interval(self):
+        """statistics are reset after summary_frequency steps"""
+        for step in range(2):
+            with self.profiler.phase('sample'):
+                pass
+            self.profiler.step(step)
+
+        self.assertEqual(self.profiler.get_interval_statistics(), {})
+
+    def test_trace_format(self):
+        """trace file is a (streamed) chrome trace json array of complete events"""
+        with self.profiler.phase('sample'):
+            with self.profiler.phase('batch'):
+                pass
+        self.profiler.close()
+
+        with open(os.path.join(self.save_path, "profile_trace.json"), "r") as f:
+            trace = f.read()
+        events = json.loads(trace.rstrip().rstrip(",") + "]")
+
+        self.assertEqual([e["name"] for e in events], ['batch', 'sample'])
+        self.assertTrue(all(e["ph"] == "X" for e in events))
+
+    def test_disabled(self):
+        """disabled profiler records nothing and writes no trace"""
+        save_path = tempfile.mkdtemp()
+        profiler = utils.profiler.PhaseProfiler(enabled=False, save_path=save_path)
+        with profiler.phase('sample'):
+            pass
+        profiler.step(0)
+        profiler.close()
+
+        self.assertEqual(profiler.get_interval_statistics(), {})
+        self.assertFalse(os.path.exists(os.path.join(save_path, "profile_trace.json")))
+        shutil.rmtree(save_path)
+
+if __name__ == '__main__':
+    test_cases = (TestPhaseProfiler,)
+    suite = unittest.TestSuite()
+    for test_class in test_cases:
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(test_class))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,164 @@
+from context import maml
+
+import unittest
+import warnings
+import shutil
+
+import numpy as np
+import torch
+
+import maml.model
+import maml.sinusoid
+
+from fixtures import make_model
+
+class TestFunctionalMetaGradient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(maml.sinusoid.SineMAML, {
+            "device": "cpu", "task_batch_size": 4, "num_inner_updates": 2, "priority_sample": False,
+            "pytorch": {"functional": False}, "precision": {"dtype": "fp64"}
+            })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.writer.close()
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_meta_gradient(self):
+        """meta gradient of vectorised (vmap/grad) implementation equals that of loop over tasks on the same batch"""
+        tasks = self.model._sample_tasks(self.model.task_batch_size)
+        x_batch, y_batch = self.model._generate_task_batch(tasks, batch_size=self.model.inner_update_k)
+        meta_update_samples_x, meta_update_samples_y = self.model._generate_task_batch(tasks, batch_size=self.model.inner_update_k)
+
+        meta_parameters = tuple(p.detach().clone() for p in self.model.model_outer.weights + self.model.model_outer.biases)
+        functional_grad, functional_losses = self.model._functional_meta_gradient(
+            meta_parameters, x_batch, y_batch, meta_update_samples_x, meta_update_samples_y
+            )
+
+        # loop implementation draws tasks one at a time and support then query batch of each task
+        task_iterator = iter(tasks)
+        batch_iterator = iter([batch for t in range(len(tasks)) for batch in [
+            (x_batch[t], y_batch[t]), (meta_update_samples_x[t], meta_update_samples_y[t])
+            ]])
+        self.model._sample_task = lambda: next(task_iterator)
+        self.model._generate_batch = lambda task, batch_size: next(batch_iterator)
+        try:
+            self.model.outer_training_loop(step_count=0)
+        finally:
+            del self.model._sample_task, self.model._generate_batch
+
+        loop_grad = [p.grad for p in self.model.model_outer.weights + self.model.model_outer.biases]
+        self.assertEqual(len(loop_grad), len(functional_grad))
+        for loop_gradient, functional_gradient in zip(loop_grad, functional_grad):
+            np.testing.assert_allclose(loop_gradient.numpy(), functional_gradient.numpy(), rtol=1e-10, atol=1e-12)
+        self.assertEqual(functional_losses.shape, (4,))
+
+class TestFunctionalFineTune(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(maml.sinusoid.SineMAML, {
+            "device": "cpu", "task_type": "sin3d", "fixed_validation": True, "priority_sample": False, "precision": {"dtype": "fp64"}
+            })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.writer.close()
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_adam_update(self):
+        """functional Adam steps equal those of torch.optim.Adam"""
+        generator = torch.Generator().manual_seed(0)
+        parameters = tuple(torch.randn(shape, generator=generator, dtype=torch.float64) for shape in [(3, 4), (4,)])
+        gradients = [[torch.randn(p.shape, generator=generator, dtype=torch.float64) for p in parameters] for _ in range(5)]
+
+        optimiser_parameters = [p.clone().requires_grad_(True) for p in parameters]
+        optimiser = torch.optim.Adam(optimiser_parameters, lr=0.01)
+        first_moments = [torch.zeros_like(p) for p in parameters]
+        second_moments = [torch.zeros_like(p) for p in parameters]
+        for step, step_gradients in enumerate(gradients, 1):
+            for p, g in zip(optimiser_parameters, step_gradients):
+                p.grad = g.clone()
+            optimiser.step()
+            parameters = maml.model._adam_update(parameters, step_gradients, first_moments, second_moments, step=step, lr=0.01)
+
+            for parameter, optimiser_parameter in zip(parameters, optimiser_parameters):
+                np.testing.assert_allclose(parameter.numpy(), optimiser_parameter.detach().numpy(), rtol=1e-12, atol=1e-14)
+
+    def test_fine_tune(self):
+        """fine-tuning task batch together equals fine-tuning each task with its own torch.optim.Adam"""
+        _, tasks = self.model._get_fixed_validation_tasks()
+        x_batch, y_batch = self.model._generate_task_batch(tasks[:3], batch_size=self.model.validation_k)
+        fine_tuned_parameters, model_iterations = self.model._functional_fine_tune(x_batch, y_batch, num_updates=4, keep_iterations=True)
+        self.assertEqual(len(model_iterations), 5)
+
+        for r in range(3):
+            task_parameters = [p.detach().clone().requires_grad_(True) for p in self.model.model_outer.weights + self.model.model_outer.biases]
+            optimiser = torch.optim.Adam(task_parameters, lr=self.model.inner_update_lr)
+            for _ in range(4):
+                optimiser.zero_grad()
+                self.model._functional_loss(task_parameters, x_batch[r], y_batch[r]).backward()
+                optimiser.step()
+
+            for fine_tuned_parameter, task_parameter in zip(fine_tuned_parameters, task_parameters):
+                np.testing.assert_allclose(fine_tuned_parameter[r].numpy(), task_parameter.detach().numpy(), rtol=1e-10, atol=1e-12)
+
+    def test_validation_warning(self):
+        """missing heatmap of 3d validation grid is warned about once, not on every validation"""
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter("always")
+            self.model.validate(step_count=0, visualise=False)
+            self.model.validate(step_count=1, visualise=False)
+        self.assertEqual(sum("dimension > 2" in str(warning.message) for warning in caught_warnings), 1)
+        self.assertIsNotNone(self.model.last_validation_loss)
+
+class TestPriorityQueueSampling(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(maml.sinusoid.SineMAML, {
+            "device": "cpu", "task_type": "sin2d", "task_batch_size": 4, "priority_sample": True,
+            "priority_queue": {"sample_type": "epsilon_greedy", "epsilon_start": 0.5, "epsilon_decay_start": 100}
+            })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.model.writer.close()
+        shutil.rmtree(cls.checkpoint_path)
+
+    def _queried_indices(self, sample_fn, global_seed):
+        """queue indices queried by sample_fn (from same queue state) after seeding global numpy generator"""
+        queue_state = self.model.priority_queue.get_state()
+        queried_indices = []
+        query = self.model.priority_queue.query
+        def recording_query(*args, **kwargs):
+            max_indices, task_parameters, task_probability = query(*args, **kwargs)
+            queried_indices.append(list(max_indices))
+            return max_indices, task_parameters, task_probability
+        self.model.priority_queue.query = recording_query
+        np.random.seed(global_seed)
+        try:
+            sample_fn()
+        finally:
+            del self.model.priority_queue.query
+            self.model.priority_queue.set_state(queue_state)
+        return queried_indices
+
+    def test_task_streams(self):
+        """queries of batch and of loop over tasks use generators of (step, task slot), not global numpy generator"""
+        sample_batch = lambda: self.model._sample_task_batch(step_count=5)
+        indices = self._queried_indices(sample_batch, global_seed=0)
+        self.assertEqual(len(indices), 4)
+        self.assertEqual(self._queried_indices(sample_batch, global_seed=1), indices)
+
+        weight_copies = [w.clone() for w in self.model.model_outer.weights]
+        bias_copies = [b.clone() for b in self.model.model_outer.biases]
+        def loop_over_tasks():
+            for task_slot in range(4):
+                self.model.inner_training_loop(5, weight_copies, bias_copies, task_slot=task_slot)
+        self.assertEqual(self._queried_indices(loop_over_tasks, global_seed=2), indices)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+from context import maml, utils, jax_maml
+
+import unittest
+import random
+import shutil
+
+import numpy as np
+import torch
+
+import utils.run_state
+
+from fixtures import make_model, make_parameters
+
+class TestRunState(unittest.TestCase):
+
+    def setUp(self):
+        self.checkpoint_paths = []
+
+    def tearDown(self):
+        for checkpoint_path in self.checkpoint_paths:
+            shutil.rmtree(checkpoint_path)
+
+    def _train(self, model_class, updates, training_iterations, resume_path=None, preempt_step=None):
+        """
+        model trained for training_iterations (total, including those of run resumed from resume_path),
+        pre-emption requested in training step preempt_step (if given)
+        """
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        updates = dict(updates, training_iterations=training_iterations, resume={"run_state": resume_path})
+        model, checkpoint_path = make_model(model_class, updates)
+        self.checkpoint_paths.append(checkpoint_path)
+        if preempt_step is not None:
+            log_training_step = model._log_training_step
+            def preempting_log_training_step(step_count, *args):
+                log_training_step(step_count, *args)
+                if step_count == preempt_step:
+                    model.preemption_handler.requested = True
+            model._log_training_step = preempting_log_training_step
+        model.train()
+        model.writer.close()
+        return model, checkpoint_path
+
+    def _assert_resumed_exactly(self, model_class, updates, state_fn, preempt=False):
+        """
+        training N steps equals training k steps, saving run state, resuming and training the remaining steps
+        (run pre-empted after k steps if preempt, e.g. with batches of later steps already prefetched)
+        """
+        model, _ = self._train(model_class, updates, training_iterations=6)
+        if preempt:
+            _, interrupted_path = self._train(model_class, updates, training_iterations=6, preempt_step=2)
+        else:
+            _, interrupted_path = self._train(model_class, updates, training_iterations=3)
+        resumed_model, _ = self._train(model_class, updates, training_iterations=6, resume_path=interrupted_path)
+
+        self.assertEqual(resumed_model.start_iteration, 3)
+        parameters, queue_state = state_fn(model)
+        resumed_parameters, resumed_queue_state = state_fn(resumed_model)
+        self.assertEqual(len(parameters), len(resumed_parameters))
+        for parameter, resumed_parameter in zip(parameters, resumed_parameters):
+            np.testing.assert_array_equal(parameter, resumed_parameter)
+        for key in ["queue", "sample_counts", "queue_delta"]:
+            np.testing.assert_array_equal(queue_state[key], resumed_queue_state[key])
+        self.assertEqual(queue_state["epsilon"], resumed_queue_state["epsilon"])
+
+    def test_resume_path(self):
+        """missing or empty resume key is no path"""
+        parameters, checkpoint_path = make_parameters({})
+        self.checkpoint_paths.append(checkpoint_path)
+        self.assertIsNone(utils.run_state.get_resume_path(parameters))
+        parameters.update({"resume": {"run_state": "some/run/"}})
+        self.assertEqual(utils.run_state.get_resume_path(parameters), "some/run/")
+        parameters._config["resume"].pop("run_state")
+        self.assertEqual(parameters.get(["resume", "run_state"]), "Unknown Key")
+        self.assertIsNone(utils.run_state.get_resume_path(parameters))
+
+    def test_resume_jax(self):
+        def state_fn(model):
+            # meta parameters, both moments of adam (and its step) are leaves of optimiser state
+            leaves = [np.asarray(leaf) for leaf in jax_maml.jax_model.jax.tree_util.tree_leaves(model.optimiser_state)]
+            return leaves, model.priority_queue.get_state()
+
+        self._assert_resumed_exactly(jax_maml.jax_sinusoid.SineMAML, {
+            "task_type": "sin2d", "task_batch_size": 5, "validation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 2,
+            "priority_sample": True, "priority_queue": {"sample_type": "epsilon_greedy", "epsilon_decay_start": 0, "epsilon_decay_rate": 0.01}
+            }, state_fn)
+
+    def test_resume_jax_prefetch(self):
+        """queue queries of batches prefetched but not yet trained when pre-empted are not applied twice"""
+        def state_fn(model):
+            leaves = [np.asarray(leaf) for leaf in jax_maml.jax_model.jax.tree_util.tree_leaves(model.optimiser_state)]
+            return leaves, model.priority_queue.get_state()
+
+        self._assert_resumed_exactly(jax_maml.jax_sinusoid.SineMAML, {
+            "task_type": "sin2d", "task_batch_size": 5, "validation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 2,
+            "priority_sample": True, "priority_queue": {"sample_type": "epsilon_greedy", "epsilon_decay_start": 0, "epsilon_decay_rate": 0.01},
+            "prefetch": {"enabled": True, "depth": 2, "max_staleness": 1}
+            }, state_fn, preempt=True)
+
+    def test_resume_pytorch(self):
+        def state_fn(model):
+            parameters = [p.detach().numpy() for p in model.model_outer.weights + model.model_outer.biases]
+            for parameter_state in model.meta_optimiser.state_dict()["state"].values():
+                parameters.extend(np.asarray(parameter_state[key]) for key in sorted(parameter_state.keys()))
+            return parameters, model.priority_queue.get_state()
+
+        self._assert_resumed_exactly(maml.sinusoid.SineMAML, {
+            "device": "cpu", "task_type": "sin2d", "task_batch_size": 5, "validation_frequency": 100, "fixed_validation": False, "validation_task_batch_size": 2,
+            "visualisation_frequency": 100, "priority_sample": True, "priority_queue": {"sample_type": "epsilon_greedy", "epsilon_decay_start": 0, "epsilon_decay_rate": 0.01}
+            }, state_fn)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from context import utils
+
+import unittest
+import tempfile
+import shutil
+
+import numpy as np
+
+import utils.series
+import utils.prng
+
+class TestSeriesDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        utils.series.make_synthetic_series_dataset(
+            self.path, num_series=200, length_range=(50, 80), num_buckets=4, channels=2, shard_size=1000, validation_fraction=0.25, seed=1
+            )
+        self.dataset = utils.series.SeriesDataset(self.path, context_length=12, forecast_length=4, max_open_shards=2)
+        self.streams = utils.prng.RandomStreams(seed=0)
+
+    def tearDown(self):
+        del self.dataset
+        shutil.rmtree(self.path)
+
+    def test_index(self):
+        """series are split over shards and index is sorted by split and bucket"""
+        self.assertGreater(self.dataset.metadata["num_shards"], 2)
+        self.assertEqual(self.dataset.bucket_offsets[-1, -1], 200)
+        self.assertEqual(self.dataset.bucket_counts("train").sum() + self.dataset.bucket_counts("validation").sum(), 200)
+        for split in range(2):
+            for bucket in range(4):
+                rows = self.dataset.index[self.dataset.bucket_offsets[split, bucket]:self.dataset.bucket_offsets[split, bucket + 1]]
+                self.assertTrue((rows["bucket"] == bucket).all())
+
+    def test_sample_series(self):
+        """series are sampled from split, and from given buckets"""
+        rngs = self.streams.generators("task", 0, range(8))
+        series = self.dataset.sample_series(rngs, split="validation", buckets=[0, 1, 2, 3, 0, 1, 2, 3])
+        validation_rows = np.arange(self.dataset.bucket_offsets[1, 0], self.dataset.bucket_offsets[1, -1])
+        self.assertTrue(np.isin(series, validation_rows).all())
+        np.testing.assert_array_equal(self.dataset.index["bucket"][series], [0, 1, 2, 3, 0, 1, 2, 3])
+
+    def test_windows(self):
+        """windows are samples of their series (across shards, with evicted shards remapped)"""
+        series = self.dataset.sample_series(self.streams.generators("task", 0, range(6)))
+        starts = self.dataset.sample_windows(self.streams.generators("support", 0, range(6)), series, 5)
+        windows = self.dataset.gather(series, starts)
+
+        self.assertEqual(windows.shape, (6, 5, 16, 2))
+        self.assertTrue((starts + 16 <= self.dataset.index["length"][series][:, None]).all())
+        for i, row in enumerate(self.dataset.index[series]):
+            shard = np.load(self.path + "/" + utils.series.SHARD_FILE.format(row["shard"]))
+            np.testing.assert_array_equal(windows[i, 2], shard[row["offset"] + starts[i, 2]:row["offset"] + starts[i, 2] + 16])
+
+        (support_x, support_y), (query_x, query_y) = self.dataset.sample_episodes(
+            self.streams.generators("support", 0, range(6)), series, [3, 2]
+            )
+        self.assertEqual(support_x.shape, (6, 3, 24))
+        self.assertEqual(query_y.shape, (6, 2, 8))
+        np.testing.assert_allclose(support_x.reshape(6, 3, 12, 2).mean(axis=2), 0., atol=1e-4)
+
+    def test_window_too_long(self):
+        with self.assertRaises(ValueError):
+            utils.series.SeriesDataset(self.path, context_length=40, forecast_length=20)
+
+if __name__ == '__main__':
+    unittest.main()
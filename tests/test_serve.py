@@ -0,0 +1,49 @@
+from context import utils
+
+import unittest
+import threading
+import json
+
+from http.client import HTTPConnection
+
+from fixtures import load_experiment_module
+
+serve = load_experiment_module("serve")
+
+class FailingAdapter(object):
+    """stand-in for adaptation service whose predictions fail"""
+    def __init__(self, error):
+        self.error = error
+
+    def predict(self, support_x, support_y, query_x, num_steps):
+        raise self.error
+
+
+class TestServe(unittest.TestCase):
+
+    def _post(self, adapter, path, content):
+        """status and json response of request to server of adapter"""
+        server = serve.AdaptationServer(("127.0.0.1", 0), adapter, default_num_steps=1)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            connection = HTTPConnection(*server.server_address, timeout=10)
+            connection.request("POST", path, body=json.dumps(content), headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            status, body = response.status, json.loads(response.read())
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        return status, body
+
+    def test_errors(self):
+        """invalid requests are answered with 400, any other failure with 500 (both with json error)"""
+        request = {"support_x": [0.], "support_y": [0.], "query_x": [0.]}
+        self.assertEqual(self._post(FailingAdapter(ValueError("bad request")), "/predict", request), (400, {"error": "ValueError: bad request"}))
+        self.assertEqual(self._post(FailingAdapter(RuntimeError("closed")), "/predict", request), (500, {"error": "RuntimeError: closed"}))
+        self.assertEqual(self._post(FailingAdapter(ValueError()), "/predict", {})[0], 400)
+        self.assertEqual(self._post(FailingAdapter(ValueError()), "/unknown", request)[0], 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from context import utils
+
+import unittest
+import subprocess
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+from fixtures import TEST_BASE_CONFIG_PATH, load_experiment_module
+
+sweep = load_experiment_module("sweep")
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.sweep_dir = tempfile.mkdtemp()
+        self.sweep_params = {"configs": [TEST_BASE_CONFIG_PATH], "frameworks": ["jax"], "seeds": [0, 1], "grid": {"meta_lr": [0.1, 0.01]}}
+        self.jobs = sweep.expand_jobs(self.sweep_params)
+        self.ledger = sweep.SweepLedger(self.sweep_dir, self.sweep_params, self.jobs)
+
+    def tearDown(self):
+        shutil.rmtree(self.sweep_dir)
+
+    def _make_runner(self, run_process):
+        runner = sweep.SweepRunner(self.sweep_dir, base_config=TEST_BASE_CONFIG_PATH, ledger=self.ledger, workers=1, cores_per_job=1, final_validation=True)
+        runner.run_process = run_process
+        return runner
+
+    def _fake_run_process(self, job_id, command, job_dir):
+        """job 'trains' instantly, jobs with meta_lr 0.01 exit without metrics"""
+        job = self.ledger.get(job_id)
+        if job["run"]["meta_lr"] == 0.01:
+            return 0
+        with open(os.path.join(job_dir, "metrics.json"), 'w') as f:
+            json.dump({"final_validation_loss": 1. + job["seed"], "training_time": 2.}, f)
+        return 0
+
+    def test_expand_jobs(self):
+        self.assertEqual(len(self.jobs), 4)
+        self.assertEqual(len({job["job_id"] for job in self.jobs}), 4)
+        self.assertTrue(all(job["status"] == sweep.PENDING for job in self.ledger.jobs()))
+
+    def test_ledger_resume(self):
+        """statuses are kept when ledger is reloaded, jobs added to sweep are pending"""
+        self.ledger.update(self.jobs[0]["job_id"], status=sweep.DONE, metrics={"final_validation_loss": 1.})
+        self.ledger.update(self.jobs[1]["job_id"], status=sweep.RUNNING)
+
+        self.sweep_params["seeds"].append(2)
+        jobs = sweep.expand_jobs(self.sweep_params)
+        ledger = sweep.SweepLedger(self.sweep_dir, self.sweep_params, jobs)
+
+        self.assertEqual(len(ledger.jobs()), 6)
+        self.assertEqual(ledger.get(self.jobs[0]["job_id"]), self.ledger.get(self.jobs[0]["job_id"]))
+        self.assertEqual(ledger.get(self.jobs[1]["job_id"])["status"], sweep.RUNNING)
+        self.assertEqual([job["status"] for job in ledger.jobs()].count(sweep.PENDING), 4)
+
+        # entries returned by ledger are copies
+        ledger.get(self.jobs[0]["job_id"])["status"] = sweep.FAILED
+        self.assertEqual(ledger.get(self.jobs[0]["job_id"])["status"], sweep.DONE)
+
+    def test_job_status(self):
+        """jobs with metrics are done, others failed (or interrupted if sweep was stopped), done jobs are skipped on resume"""
+        runner = self._make_runner(self._fake_run_process)
+        for job in self.jobs:
+            runner.run_job(job)
+
+        statuses = {job["job_id"]: self.ledger.get(job["job_id"])["status"] for job in self.jobs}
+        for job in self.jobs:
+            self.assertEqual(statuses[job["job_id"]], sweep.DONE if job["run"]["meta_lr"] == 0.1 else sweep.FAILED)
+        self.assertIn("-final_validation", self.ledger.get(self.jobs[0]["job_id"])["command"])
+
+        summary = {entry["run"]["meta_lr"]: entry for entry in sweep.summarise(self.ledger.jobs())}
+        self.assertEqual((summary[0.1]["num_done"], summary[0.1]["final_validation_loss_mean"], summary[0.1]["final_validation_loss_std"]), (2, 1.5, 0.5))
+        self.assertEqual((summary[0.01]["num_done"], summary[0.01]["final_validation_loss_mean"]), (0, None))
+
+        # resumed sweep runs only jobs not done, jobs stopped by sweep are interrupted
+        started = []
+        def stopped_run_process(job_id, command, job_dir):
+            started.append(job_id)
+            runner._handle_signal(15, None)
+            return -15
+
+        runner = self._make_runner(stopped_run_process)
+        runner.install_signal_handlers = lambda: None
+        runner.run(self.jobs)
+        self.assertEqual(started, [job["job_id"] for job in self.jobs if statuses[job["job_id"]] != sweep.DONE][:1])
+        self.assertEqual(self.ledger.get(started[0])["status"], sweep.INTERRUPTED)
+
+    @unittest.skipUnless(hasattr(os, "sched_setaffinity"), "core affinity not supported on this platform")
+    def test_run_process(self):
+        """job process is pinned to its core set (before it runs), output is written to log of job"""
+        runner = sweep.SweepRunner(self.sweep_dir, base_config=TEST_BASE_CONFIG_PATH, ledger=self.ledger, workers=1, cores_per_job=1, final_validation=True)
+        cores = runner._core_slots.queue[0]
+
+        return_code = runner.run_process("affinity", [sys.executable, "-c", "import os; print(sorted(os.sched_getaffinity(0)))"], self.sweep_dir)
+        self.assertEqual(return_code, 0)
+        with open(os.path.join(self.sweep_dir, "log.txt"), 'r') as f:
+            self.assertEqual(f.read().strip(), str(cores))
+
+    def test_pinned_command(self):
+        """pinned command is executed with its arguments unchanged"""
+        command = [sys.executable, "-c", "import sys; print(sys.argv[1:])", "a b", "-c"]
+        output = subprocess.check_output(sweep.get_pinned_command(command, sweep.get_available_cores()[:1]))
+        self.assertEqual(output.decode().strip(), str(["a b", "-c"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+from context import utils, jax_maml
+
+import unittest
+
+import shutil
+
+import numpy as np
+
+from fixtures import make_model
+
+
+class TestTaskGrid(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.checkpoint_path = make_model(jax_maml.jax_sinusoid.SineMAML, {"task_type": "sin2d", "priority_sample": False})
+        cls.parameters = cls.model.get_params_from_optimiser(cls.model.optimiser_state)
+        _, cls.task_parameters = cls.model.get_task_parameter_grid([4, 5])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.checkpoint_path)
+
+    def test_grid(self):
+        axes, task_parameters = self.model.get_task_parameter_grid([4, 5])
+        self.assertEqual(task_parameters.shape, (20, 3))
+        self.assertEqual([len(axis) for axis in axes.values()], [4, 5])
+        with self.assertRaises(ValueError):
+            self.model.get_task_parameter_grid([4, 5, 6])
+
+    def test_chunk_size(self):
+        """losses do not depend on how grid is chunked (last chunk of 7 is padded)"""
+        losses = self.model.evaluate_task_grid(self.parameters, self.task_parameters, chunk_size=20, num_inner_updates=2)
+        chunked_losses = self.model.evaluate_task_grid(self.parameters, self.task_parameters, chunk_size=7, num_inner_updates=2)
+
+        self.assertEqual(losses.shape, (20,))
+        self.assertTrue(np.all(np.isfinite(losses)))
+        np.testing.assert_allclose(chunked_losses, losses, rtol=1e-5, atol=1e-6)
+
+    def test_support_counts(self):
+        """tasks of different k share chunks, losses of tasks with all validation_k examples equal those of unmasked evaluation"""
+        task_parameters = np.concatenate([self.task_parameters, self.task_parameters])
+        task_indices = np.concatenate([np.arange(20), np.arange(20)])
+        support_counts = np.array([3] * 20 + [self.model.validation_k] * 20)
+        losses = self.model.evaluate_task_grid(
+            self.parameters, task_parameters, chunk_size=16, num_inner_updates=2, support_counts=support_counts, task_indices=task_indices
+            )
+
+        full_losses = self.model.evaluate_task_grid(self.parameters, self.task_parameters, chunk_size=20, num_inner_updates=2)
+        np.testing.assert_allclose(losses[20:], full_losses, rtol=1e-5, atol=1e-6)
+        self.assertFalse(np.allclose(losses[:20], losses[20:]))
+
+if __name__ == '__main__':
+    unittest.main()
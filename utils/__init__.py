@@ -1,2 +1,4 @@
 from .parameters import MAMLParameters
-from .priority import PriorityQueue
\ No newline at end of file
+from .priority import PriorityQueue
+from .profiler import PhaseProfiler
+from .precision import PrecisionPolicy
\ No newline at end of file
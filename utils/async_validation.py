@@ -0,0 +1,142 @@
+import os
+import copy
+import glob
+import pickle
+import queue
+import warnings
+import multiprocessing
+
+from typing import Any, Dict, Type
+
+from .parameters import MAMLParameters
+
+SNAPSHOT_FOLDER = "validation_snapshots"
+
+# parameters of model built by validation worker: no nested worker, no resumption and no training-only work
+WORKER_PARAMETERS = {
+    "async_validation": {"enabled": False},
+    "resume": {"model": None, "priority_queue": None, "queue_counts": None, "run_state": None},
+    "profiling": {"enabled": False},
+    "compilation": {"warm_up": False},
+    "pytorch": {"compile": False, "world_size": 1}
+    }
+
+
+class _WorkerParameters(MAMLParameters):
+    """parameters of validation worker model, configuration of run is saved by trainer only"""
+    def save_configuration(self, save_path: str) -> None:
+        pass
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, Any]) -> None:
+    """write snapshot in full before it appears under its name (the worker may read it at any time)"""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+def _validation_worker(model_class: Type, params: MAMLParameters, device, snapshot_queue, max_pending: int) -> None:
+    """
+    Validation process: builds model of same class and configuration as trainer and validates snapshots
+    (step, path) received on snapshot_queue until None is received or the trainer process has exited.
+    Figures and losses are written to the event log of the run under the step of the snapshot.
+    """
+    worker_params = _WorkerParameters(copy.deepcopy(params._config))
+    worker_params.update(WORKER_PARAMETERS)
+    # (spawned) process does not inherit process-wide settings of trainer
+    model_class.configure_process(worker_params)
+    model = model_class(worker_params, device)
+
+    # own event file in log directory of run (tensorboard merges event files of a run)
+    from tensorboardX import SummaryWriter
+    model.writer.close()
+    model.writer = SummaryWriter(model.checkpoint_path, filename_suffix=".validation")
+
+    parent = multiprocessing.parent_process()
+    finished = False
+    while not finished:
+        try:
+            snapshots = [snapshot_queue.get(timeout=1.)]
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        # collect all snapshots submitted meanwhile, if validation falls behind only newest are validated
+        while True:
+            try:
+                snapshots.append(snapshot_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in snapshots:
+            finished = True
+            snapshots = snapshots[:snapshots.index(None)]
+        if len(snapshots) > max_pending:
+            skipped_steps = [step for step, _ in snapshots[:-max_pending]]
+            warnings.warn("Validation falling behind training, skipping snapshots of steps {}".format(skipped_steps), Warning)
+            for _, path in snapshots[:-max_pending]:
+                os.remove(path)
+            snapshots = snapshots[-max_pending:]
+
+        for step_count, path in snapshots:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+            model.set_validation_snapshot(snapshot)
+            model.validate(step_count=step_count, visualise=snapshot["visualise"])
+            model.writer.flush()
+            os.remove(path)
+
+    model.writer.close()
+
+
+class AsyncValidator(object):
+    """
+    Trainer side of asynchronous validation: snapshots of parameters (and priority queue) are written to the
+    checkpoint path and validated by a separate local process, so that training does not wait for validation.
+    """
+    def __init__(self, model_class: Type, params: MAMLParameters, device, max_pending: int=2):
+        """
+        :param model_class: MAML class of trainer (instantiated in validation process with same configuration)
+        :param params: experiment parameters of trainer
+        :param device: device on which to validate
+        :param max_pending: number of snapshots awaiting validation beyond which the oldest are skipped
+        """
+        self.snapshot_dir = os.path.join(params.get("checkpoint_path"), SNAPSHOT_FOLDER)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        # snapshots left by a previous (pre-empted) run of this folder are stale
+        for path in glob.glob(os.path.join(self.snapshot_dir, "*")):
+            os.remove(path)
+
+        # jax (and torch threads) are not fork-safe
+        context = multiprocessing.get_context("spawn")
+        self._queue = context.Queue()
+        self._process = context.Process(
+            target=_validation_worker, args=(model_class, params, device, self._queue, max_pending), daemon=True
+            )
+        self._process.start()
+
+    def submit(self, step_count: int, snapshot: Dict[str, Any], visualise: bool) -> None:
+        """
+        Write snapshot and queue it for validation
+
+        :param step_count: training step of snapshot (step under which validation is logged)
+        :param snapshot: state needed for validation (as returned by get_validation_snapshot of model)
+        :param visualise: whether to make visualisations of fine-tuning in validation
+        """
+        if not self._process.is_alive():
+            warnings.warn("Validation process has exited (exit code {}), snapshot of step {} not validated".format(self._process.exitcode, step_count), Warning)
+            return
+        path = os.path.join(self.snapshot_dir, "snapshot_{}.pkl".format(step_count))
+        _write_snapshot(path, dict(snapshot, visualise=visualise))
+        self._queue.put((step_count, path))
+
+    def close(self, wait: bool=True) -> None:
+        """
+        Stop validation process
+
+        :param wait: whether to validate remaining snapshots first (otherwise process is terminated)
+        """
+        if wait and self._process.is_alive():
+            self._queue.put(None)
+        elif self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
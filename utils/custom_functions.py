@@ -2,12 +2,13 @@ import numpy as np
 
 from typing import List
 
-def sample_nd_array(nd_array: np.array) -> [List[int], float]:
+def sample_nd_array(nd_array: np.array, rng=None) -> [List[int], float]:
     """
     For a given n-dimensional array, this method returns an index of
     the array with probability in proportion to it's value.
 
     param nd_array: n-dimensional numpy array
+    param rng: random generator to sample with (np.random.RandomState, default global numpy generator)
 
     return indices: the index of the array
     return probability: the probability that this index was chosen
@@ -16,14 +17,16 @@ def sample_nd_array(nd_array: np.array) -> [List[int], float]:
     normalised_probabilities = nd_array / np.sum(nd_array)
     normalised_flattened_probabilities = normalised_probabilities.flatten()
 
+    if rng is None:
+        rng = np.random
+
     # import pdb; pdb.set_trace()
-    sample_probability = np.random.choice(normalised_flattened_probabilities, p=normalised_flattened_probabilities)
+    sample_probability = rng.choice(normalised_flattened_probabilities, p=normalised_flattened_probabilities)
 
     indices = np.where(normalised_probabilities == sample_probability)
 
-    if len(indices) > 1:
-        # case of duplicate entries
-        random_choice = np.random.randint(len(indices[0]))
-        indices = [int(i[random_choice]) for i in indices]
+    # one of the entries with sampled value (case of duplicate entries, also for 1D arrays)
+    random_choice = rng.randint(len(indices[0]))
+    indices = [int(i[random_choice]) for i in indices]
 
     return indices, sample_probability
@@ -0,0 +1,186 @@
+import os
+import json
+
+import numpy as np
+
+from typing import List, Sequence, Tuple
+
+IMAGES_FILE = "images.npy"
+CLASS_INDEX_FILE = "class_index.npy"
+METADATA_FILE = "metadata.json"
+
+
+def write_episode_dataset(path: str, images: np.ndarray, labels: np.ndarray, metadata: dict=None) -> None:
+    """
+    Store labelled images as episode dataset: one uint8 array of all images sorted by class (memory-mapped when
+    read) and a class index table of (offset, count) of each class in it
+
+    :param path: folder of dataset
+    :param images: images (number of images x height x width x channels), uint8
+    :param labels: class of each image (integers 0 to number of classes - 1)
+    :param metadata: further information to store with dataset (e.g. source)
+    """
+    images = np.asarray(images)
+    labels = np.asarray(labels)
+    if images.dtype != np.uint8 or images.ndim != 4:
+        raise ValueError("Images must be uint8 array of shape (images, height, width, channels), got {} {}".format(images.dtype, images.shape))
+    if len(images) != len(labels):
+        raise ValueError("Number of images ({}) and labels ({}) differ".format(len(images), len(labels)))
+
+    os.makedirs(path, exist_ok=True)
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=labels.max() + 1)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    np.save(os.path.join(path, IMAGES_FILE), images[order])
+    np.save(os.path.join(path, CLASS_INDEX_FILE), np.stack([offsets, counts], axis=1).astype(np.int64))
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump(dict(metadata or {}, num_images=len(images), num_classes=len(counts), image_shape=list(images.shape[1:])), f, indent=2)
+
+def _render_strokes(starts: np.ndarray, ends: np.ndarray, image_size: int, thickness: float) -> np.ndarray:
+    """
+    Binary images of line strokes
+
+    :param starts: start points of strokes in [0, 1]^2 (images x strokes x 2)
+    :param ends: end points of strokes (images x strokes x 2)
+
+    :return images: stroke images (images x image_size x image_size), uint8 (255 for ink)
+    """
+    coordinates = (np.arange(image_size, dtype=np.float32) + 0.5) / image_size
+    pixels = np.stack(np.meshgrid(coordinates, coordinates, indexing="ij"), axis=-1).reshape(1, 1, -1, 2)
+    starts, ends = starts[:, :, None], ends[:, :, None]
+    direction = ends - starts
+    t = np.clip(np.sum((pixels - starts) * direction, axis=-1) / np.maximum(np.sum(direction ** 2, axis=-1), 1e-8), 0., 1.)
+    distances = np.linalg.norm(pixels - (starts + t[..., None] * direction), axis=-1).min(axis=1)
+    return (255 * (distances < thickness)).astype(np.uint8).reshape(-1, image_size, image_size)
+
+def make_synthetic_dataset(
+    path: str, num_classes: int=1623, examples_per_class: int=20, image_size: int=28, num_strokes: int=3, jitter: float=0.04, seed: int=0
+    ) -> None:
+    """
+    Write Omniglot-shaped synthetic episode dataset: each class is a random glyph of line strokes, each example
+    of it the glyph drawn with jittered stroke end points (e.g. for tests and benchmarks without the real dataset)
+
+    :param path: folder of dataset
+    :param num_classes: number of classes (Omniglot: 1623 characters)
+    :param examples_per_class: number of images per class (Omniglot: 20 drawers)
+    :param image_size: height and width of images (Omniglot commonly resized to 28)
+    :param num_strokes: number of strokes of each glyph
+    :param jitter: standard deviation of stroke end points of examples around those of glyph (fraction of image size)
+    :param seed: seed of glyphs and examples
+    """
+    rng = np.random.RandomState(seed)
+    glyph_points = rng.uniform(0.15, 0.85, size=(num_classes, num_strokes, 2, 2)).astype(np.float32)
+
+    images = np.empty((num_classes * examples_per_class, image_size, image_size, 1), dtype=np.uint8)
+    # rendered in chunks of classes (bounded memory)
+    chunk_size = 128
+    for start in range(0, num_classes, chunk_size):
+        points = np.repeat(glyph_points[start:start + chunk_size], examples_per_class, axis=0)
+        points = np.clip(points + rng.normal(0., jitter, size=points.shape).astype(np.float32), 0., 1.)
+        rows = slice(start * examples_per_class, start * examples_per_class + len(points))
+        images[rows, ..., 0] = _render_strokes(points[:, :, 0], points[:, :, 1], image_size, thickness=1.2 / image_size)
+
+    labels = np.repeat(np.arange(num_classes), examples_per_class)
+    write_episode_dataset(path, images, labels, metadata={"source": "synthetic", "seed": seed})
+
+
+class EpisodeDataset(object):
+    """
+    Image dataset (see write_episode_dataset) from which N-way K-shot episodes are sampled. Images stay on disk
+    (memory-mapped), only those of sampled episodes are read, with one gather for a whole batch of episodes.
+    """
+    def __init__(self, path: str, mmap: bool=True):
+        """
+        :param path: folder of dataset
+        :param mmap: whether to memory-map images (otherwise loaded into memory)
+        """
+        if not os.path.isfile(os.path.join(path, IMAGES_FILE)):
+            raise FileNotFoundError("No episode dataset in {} (see utils.episodes.write_episode_dataset)".format(path))
+        self.images = np.load(os.path.join(path, IMAGES_FILE), mmap_mode="r" if mmap else None)
+        class_index = np.load(os.path.join(path, CLASS_INDEX_FILE))
+        self.class_offsets = class_index[:, 0]
+        self.class_counts = class_index[:, 1]
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.class_counts)
+
+    @property
+    def image_shape(self) -> Tuple[int, int, int]:
+        return tuple(self.images.shape[1:])
+
+    def sample_classes(self, rngs: List[np.random.RandomState], n_way: int, classes: np.ndarray) -> np.ndarray:
+        """
+        Classes of each episode, n_way distinct classes in random order (order gives labels of episode)
+
+        :param rngs: random generator of each episode
+        :param n_way: number of classes per episode
+        :param classes: classes from which to sample (e.g. meta-training or validation classes)
+
+        :return episode_classes: classes of each episode (episodes x n_way)
+        """
+        if n_way > len(classes):
+            raise ValueError("Cannot sample {}-way episodes from {} classes".format(n_way, len(classes)))
+        keys = np.stack([rng.random_sample(len(classes)) for rng in rngs])
+        # n_way smallest keys (partition, linear in number of classes), ordered by key
+        selected = np.argpartition(keys, n_way - 1, axis=1)[:, :n_way]
+        selected = np.take_along_axis(selected, np.argsort(np.take_along_axis(keys, selected, axis=1), axis=1), axis=1)
+        return np.asarray(classes)[selected]
+
+    def sample_indices(self, rngs: List[np.random.RandomState], episode_classes: np.ndarray, shots: Sequence[int]) -> List[np.ndarray]:
+        """
+        Indices of images of each class of each episode, for several disjoint splits (e.g. support and query)
+
+        :param rngs: random generator of each episode
+        :param episode_classes: classes of each episode (episodes x n_way)
+        :param shots: number of images per class of each split
+
+        :return split_indices: image indices of each split (episodes x n_way x shots)
+        """
+        counts = self.class_counts[episode_classes]
+        if counts.min() < sum(shots):
+            raise ValueError("Classes with {} images cannot provide {} disjoint images".format(counts.min(), sum(shots)))
+        keys = np.stack([rng.random_sample((episode_classes.shape[1], counts.max())) for rng in rngs])
+        keys[np.arange(counts.max()) >= counts[..., None]] = np.inf
+        positions = np.argsort(keys, axis=-1)[..., :sum(shots)]
+        indices = self.class_offsets[episode_classes][..., None] + positions
+        return np.split(indices, np.cumsum(shots)[:-1], axis=-1)
+
+    def gather(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Images at indices (read in ascending order, each once) as floats in [0, 1]
+
+        :param indices: image indices (any shape)
+        :return images: images (shape of indices x image shape), float32
+        """
+        unique_indices, inverse = np.unique(indices, return_inverse=True)
+        images = np.asarray(self.images[unique_indices])[inverse.reshape(-1)]
+        # one pass uint8 -> float32 (rather than cast then divide)
+        return (images * np.float32(1. / 255.)).reshape(indices.shape + self.image_shape)
+
+    def sample_episodes(
+        self, rngs: List[np.random.RandomState], episode_classes: np.ndarray, shots: Sequence[int]
+        ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Images and labels of batch of episodes, for disjoint splits of each episode (e.g. support and query)
+
+        :param rngs: random generator of each episode
+        :param episode_classes: classes of each episode (episodes x n_way), label of class is its position
+        :param shots: number of images per class of each split
+
+        :return splits: (images, labels) of each split, images (episodes x n_way * shots x image shape),
+                        labels (episodes x n_way * shots), int32
+        """
+        split_indices = self.sample_indices(rngs, episode_classes, shots)
+        images = self.gather(np.concatenate(split_indices, axis=-1))
+        num_episodes, n_way = episode_classes.shape
+
+        splits = []
+        start = 0
+        for num_shots in shots:
+            split_images = images[:, :, start:start + num_shots].reshape((num_episodes, n_way * num_shots) + self.image_shape)
+            labels = np.broadcast_to(np.repeat(np.arange(n_way, dtype=np.int32), num_shots), (num_episodes, n_way * num_shots))
+            splits.append((split_images, np.ascontiguousarray(labels)))
+            start += num_shots
+        return splits
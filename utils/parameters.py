@@ -1,7 +1,8 @@
-from typing import Any, List, Union
+from typing import Any, Dict, List, Union
 
 import yaml
 import os
+import itertools
 import collections
 import six
 
@@ -98,4 +99,32 @@ class MAMLParameters(object):
             return original_dictionary
         
         self._config = update_dict(self._config, specific_params)
-            
+
+
+def nested_dict_from_dotted(dotted_parameters: Dict[str, Any]) -> Dict:
+    """
+    Convert flat dictionary with dotted keys (e.g. 'priority_queue.sample_type') into nested
+    dictionary of the form used in the configuration files (e.g. for use with MAMLParameters.update)
+
+    :param dotted_parameters: mapping from (possibly dotted) configuration keys to values
+    :return nested_parameters: nested dictionary
+    """
+    nested_parameters = {}
+    for dotted_key, value in dotted_parameters.items():
+        keys = dotted_key.split('.')
+        sub_dict = nested_parameters
+        for key in keys[:-1]:
+            sub_dict = sub_dict.setdefault(key, {})
+        sub_dict[keys[-1]] = value
+    return nested_parameters
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Expand a grid specification into the list of all combinations (cartesian product)
+
+    :param grid: mapping from (dotted) configuration key to list of values to try
+    :return combinations: list of mappings from configuration key to a single value
+    """
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
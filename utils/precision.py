@@ -0,0 +1,37 @@
+class PrecisionPolicy(object):
+    """
+    Dtypes used for parameters, computation (activations) and data under a given precision setting.
+
+    For bf16, parameters (and optimiser state) are kept in float32 and cast to bfloat16 for the forward
+    pass (mixed precision). Data is generated in the compute dtype and losses are reduced in the
+    parameter dtype. Dtypes are given by name so that each backend can map them to its own types.
+    """
+    DTYPES = {
+        "bf16": ("float32", "bfloat16"),
+        "fp32": ("float32", "float32"),
+        "fp64": ("float64", "float64")
+        }
+
+    def __init__(self, precision: str="fp32", loss_scale: float=None):
+        """
+        :param precision: one of bf16, fp32 or fp64
+        :param loss_scale: factor by which losses are multiplied before differentiation (gradients are divided by it after)
+        """
+        if precision not in self.DTYPES:
+            raise ValueError("Precision {} not recognised. Use one of {}".format(precision, ", ".join(self.DTYPES.keys())))
+        self.precision = precision
+        self.parameter_dtype, self.compute_dtype = self.DTYPES[precision]
+        self.loss_scale = float(loss_scale) if loss_scale else 1.
+
+    @property
+    def mixed(self) -> bool:
+        """whether computation is done in lower precision than parameters are stored in"""
+        return self.parameter_dtype != self.compute_dtype
+
+    @classmethod
+    def from_params(cls, params):
+        """policy given by precision section of experiment parameters (fp32 without loss scaling if section or dtype is missing)"""
+        precision_params = params.get("precision")
+        if not isinstance(precision_params, dict):
+            return cls()
+        return cls(precision=precision_params.get("dtype") or "fp32", loss_scale=precision_params.get("loss_scale"))
@@ -0,0 +1,162 @@
+import queue
+import threading
+import contextlib
+
+from typing import Any, Callable, Optional, Tuple
+
+
+class BatchPrefetcher(object):
+    """
+    Prepares training batches of upcoming steps in a background thread (sampling tasks and generating examples
+    on the host, then staging them on the device) while the current step runs, so that data preparation is
+    hidden behind computation. At most depth batches are prepared ahead of the step being trained.
+
+    If batches depend on state updated after each step (e.g. priority queue updated with the losses of the step),
+    max_staleness is the number of these updates the batch of a step misses: the batch of step t is prepared once the
+    update of step t - 1 - max_staleness has been made, and the update of step t - max_staleness is made only once the
+    batch of step t has been prepared (see updating), so that batches do not depend on timing of threads. Preparation
+    of batches and updates are serialised by lock.
+
+    Preparing a batch may itself change that state (e.g. sample counts of priority queue). To resume a run exactly,
+    the state before a batch was prepared is kept (snapshot_fn) until the batch is used (see get_snapshot).
+    """
+    def __init__(
+        self, prepare_fn: Callable[[int], Any], start_step: int, end_step: int, depth: int=2, max_staleness: Optional[int]=None,
+        stage_fn: Optional[Callable[[Any], Any]]=None, snapshot_fn: Optional[Callable[[], Any]]=None,
+        last_update: Optional[int]=None
+        ):
+        """
+        :param prepare_fn: returns batch of given step (called in background thread)
+        :param start_step: first step for which a batch is prepared
+        :param end_step: step before which preparation stops
+        :param depth: maximum number of batches prepared ahead
+        :param max_staleness: number of most recent updates a batch may miss (None if batches do not depend on updates)
+        :param stage_fn: applied to each prepared batch in background thread (e.g. transfer to device)
+        :param snapshot_fn: returns state batches depend on, called before each batch is prepared (None for no snapshots)
+        :param last_update: step of last update made before start_step (default start_step - 1, e.g. if a resumed run
+                            replays later updates)
+        """
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1, got {}".format(depth))
+        if max_staleness is not None and max_staleness < 0:
+            raise ValueError("Maximum staleness must be non-negative, got {}".format(max_staleness))
+        # (updates wait for batches max_staleness steps ahead, which must fit in queue of prepared batches)
+        if max_staleness is not None and max_staleness > depth + 1:
+            raise ValueError("Maximum staleness must be at most prefetch depth + 1, got {} for depth {}".format(max_staleness, depth))
+        self.prepare_fn = prepare_fn
+        self.stage_fn = stage_fn
+        self.snapshot_fn = snapshot_fn
+        self.max_staleness = max_staleness
+
+        # held while a batch is prepared and while state it depends on is updated
+        self.lock = threading.RLock()
+        self._updated = threading.Condition(self.lock)
+        self._last_update = start_step - 1 if last_update is None else last_update
+        self._last_prepared = start_step - 1
+        self._end_step = end_step
+        self._finished = False
+        # step of batch -> (step of last update, state) before batch was prepared, until batch is used
+        self._snapshots = {}
+
+        self._batches = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(start_step, end_step), name="batch_prefetcher", daemon=True)
+        self._thread.start()
+
+    def _run(self, start_step: int, end_step: int) -> None:
+        try:
+            for step in range(start_step, end_step):
+                try:
+                    with self._updated:
+                        if self.max_staleness is not None:
+                            self._updated.wait_for(lambda: self._stopped.is_set() or self._last_update >= step - 1 - self.max_staleness)
+                        if self._stopped.is_set():
+                            return
+                        if self.snapshot_fn is not None:
+                            self._snapshots[step] = (self._last_update, self.snapshot_fn())
+                        batch = self.prepare_fn(step)
+                        self._last_prepared = step
+                        self._updated.notify_all()
+                    if self.stage_fn is not None:
+                        batch = self.stage_fn(batch)
+                except Exception as e:
+                    # raised in training thread on get (updates waiting for later batches are released first)
+                    self._finish()
+                    self._put((step, None, e))
+                    return
+                if not self._put((step, batch, None)):
+                    return
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        """no further batches are prepared, updates need not wait for them"""
+        with self._updated:
+            self._finished = True
+            self._updated.notify_all()
+
+    def _put(self, item) -> bool:
+        """queue item once there is space, False if stopped meanwhile"""
+        while not self._stopped.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, step: int) -> Any:
+        """
+        Batch of step (waits until prepared)
+
+        :param step: training step of batch, steps must be requested in order
+        :return batch: prepared (and staged) batch
+        """
+        while True:
+            try:
+                batch_step, batch, error = self._batches.get(timeout=1.)
+                break
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    raise RuntimeError("Batch prefetcher stopped before batch of step {} was prepared".format(step))
+        if error is not None:
+            raise error
+        if batch_step != step:
+            raise ValueError("Prefetched batch of step {} requested for step {}".format(batch_step, step))
+        with self.lock:
+            self._snapshots.pop(step, None)
+        return batch
+
+    def get_snapshot(self, step: int) -> Optional[Tuple[int, Any]]:
+        """
+        State before batch of step was prepared, if it has been prepared but not yet used
+
+        :param step: training step of batch
+        :return snapshot: step of last update made before batch was prepared and state returned by snapshot_fn
+                          (None if batch not prepared, already used or no snapshot_fn)
+        """
+        with self.lock:
+            return self._snapshots.get(step)
+
+    @contextlib.contextmanager
+    def updating(self, step: int):
+        """
+        context in which state batches depend on is updated after step: waits until batch of step + max_staleness
+        (last batch not to see update) has been prepared, and for batch being prepared
+        """
+        with self._updated:
+            if self.max_staleness is not None:
+                last_unaffected_step = min(step + self.max_staleness, self._end_step - 1)
+                self._updated.wait_for(lambda: self._finished or self._last_prepared >= last_unaffected_step)
+            yield
+            self._last_update = step
+            self._updated.notify_all()
+
+    def close(self) -> None:
+        """stop preparing batches (batches prepared but not yet used are dropped)"""
+        self._stopped.set()
+        with self._updated:
+            self._updated.notify_all()
+        self._thread.join()
+        while not self._batches.empty():
+            self._batches.get_nowait()
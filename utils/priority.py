@@ -1,5 +1,4 @@
 import operator
-import random
 import numpy as np
 import matplotlib.pyplot as plt
 import datetime
@@ -20,7 +19,8 @@ class PriorityQueue(ABC):
     def __init__(self, 
                 block_sizes: Dict[str, float], param_ranges: Dict[str, Tuple[float, float]], 
                 sample_type: str, epsilon_start: float, epsilon_final: float, epsilon_decay_rate: float, epsilon_decay_start: int,
-                queue_resume: str, counts_resume: str, save_path: str, burn_in: int=None, initial_value: float=None
+                queue_resume: str, counts_resume: str, save_path: str, burn_in: int=None, initial_value: float=None,
+                rng: np.random.RandomState=None
                 ):
         self.queue_resume = queue_resume
         self.counts_resume = counts_resume
@@ -39,6 +39,8 @@ class PriorityQueue(ABC):
 
         self.burn_in = burn_in
         self.save_path = save_path
+        # generator of random initialisation of queue (default global numpy generator)
+        self.rng = rng if rng is not None else np.random
 
         self._queue, self.sample_counts, self._queue_delta = self._initialise_queue() 
 
@@ -85,9 +87,9 @@ class PriorityQueue(ABC):
                 parameter_grid = self.initial_value * np.zeros(tuple(pranges))
                 queue_delta = parameter_grid - parameter_grid_init
             else:
-                parameter_grid_init = np.abs(np.random.normal(0, 1, tuple(pranges)))
-                parameter_grid = np.abs(np.random.normal(0, 1, tuple(pranges)))
-                queue_delta = np.abs(np.random.normal(0, 30, tuple(pranges)))
+                parameter_grid_init = np.abs(self.rng.normal(0, 1, tuple(pranges)))
+                parameter_grid = np.abs(self.rng.normal(0, 1, tuple(pranges)))
+                queue_delta = np.abs(self.rng.normal(0, 30, tuple(pranges)))
 
             counts = np.zeros(tuple(pranges))
 
@@ -106,6 +108,32 @@ class PriorityQueue(ABC):
         np.savez(queue_path, self._queue)
         np.savez(counts_path, self.sample_counts)
   
+    def get_state(self) -> Dict:
+        """
+        Full state of queue (losses, sample counts, loss deltas and current epsilon) for resuming training
+
+        :return state: dictionary of queue state
+        """
+        return {
+            "queue": self._queue.copy(), 
+            "sample_counts": self.sample_counts.copy(), 
+            "queue_delta": self._queue_delta.copy(), 
+            "epsilon": self.epsilon
+            }
+
+    def set_state(self, state: Dict) -> None:
+        """
+        Restore queue from state returned by get_state
+
+        :param state: dictionary of queue state
+        """
+        if state["queue"].shape != self._queue.shape:
+            raise ValueError("Shape of saved queue {} does not match queue shape {}".format(state["queue"].shape, self._queue.shape))
+        self._queue = state["queue"].copy()
+        self.sample_counts = state["sample_counts"].copy()
+        self._queue_delta = state["queue_delta"].copy()
+        self.epsilon = state["epsilon"]
+
     def insert(self, key: List, data: float) -> None:
         """
         inserts element into queue.
@@ -118,7 +146,7 @@ class PriorityQueue(ABC):
         self._queue[tuple(key)] = data
         self._queue_delta[tuple(key)] = abs(data_delta)
   
-    def query(self, step: int):
+    def query(self, step: int, rng: np.random.RandomState=None):
         """
         queries priority queue and returns value based on priority heuristic. 
         if max, highest value is returned
@@ -129,6 +157,7 @@ class PriorityQueue(ABC):
         if importance is added to above, task probabilities are tracked for use in reweighting later
 
         :param step: step count of training
+        :param rng: random generator of query (np.random.RandomState), e.g. of task slot of step (default global numpy generator)
 
         :return indices: indices of priority queue
         :return parameter_values: values of parameters for task (obtained from indices)
@@ -136,6 +165,10 @@ class PriorityQueue(ABC):
         """
         queue_copy = copy.deepcopy(self._queue)
 
+        if rng is None:
+            # global generator (seeded by experiment script)
+            rng = np.random
+
         if type(self._queue) != np.ndarray:
             raise ValueError("Incorrect type for priority queue, must be numpy array")
 
@@ -143,24 +176,24 @@ class PriorityQueue(ABC):
             raise NotImplementedError("Currently not supported - need a way to fill buffer before this would make sense to use")
 
         elif self.sample_type == 'epsilon_greedy':
-            if random.random() < self.epsilon: # select randomly
-                indices = [np.random.randint(d) for d in self._queue.shape]
+            if rng.random_sample() < self.epsilon: # select randomly
+                indices = [rng.randint(d) for d in self._queue.shape]
             else: # select greedily
                 max_indices = np.array(np.where(self._queue == np.amax(self._queue))).T
                 if len(max_indices) > 1:
-                    indices = random.choice(max_indices).tolist()
+                    indices = max_indices[rng.randint(len(max_indices))].tolist()
                 else:
                     indices = max_indices[0].tolist()
             task_probability = 1.
 
         elif 'sample_under_pdf' in self.sample_type:
 
-            indices, task_probability = utils.custom_functions.sample_nd_array(nd_array=self._queue)
+            indices, task_probability = utils.custom_functions.sample_nd_array(nd_array=self._queue, rng=rng)
             if "importance" not in self.sample_type:
                 task_probability = 1.
 
         elif 'sample_delta' in self.sample_type:
-            indices, task_probability = utils.custom_functions.sample_nd_array(nd_array=self._queue_delta)
+            indices, task_probability = utils.custom_functions.sample_nd_array(nd_array=self._queue_delta, rng=rng)
             if "importance" not in self.sample_type:
                 task_probability = 1.
 
@@ -192,7 +225,7 @@ class PriorityQueue(ABC):
         self.sample_counts[tuple(indices)] += 1
         
         # convert samples/max indices to parameter values (i.e. scale by parameter ranges)
-        parameter_values = [p[0] + i * b + random.uniform(0, b) for (p, i, b) in zip(self.param_ranges, indices, self.block_sizes)]
+        parameter_values = [p[0] + i * b + rng.uniform(0, b) for (p, i, b) in zip(self.param_ranges, indices, self.block_sizes)]
 
         # anneal epsilon
         if self.epsilon and (self.epsilon > self.epsilon_final) and (step > self.epsilon_decay_start):
@@ -0,0 +1,60 @@
+import numpy as np
+
+from typing import Iterable, List
+
+# purposes of random draws, each an independent stream (append new streams, indices must not change)
+STREAMS = (
+    "init", "task", "support", "query", "queue_init", "validation_task", "validation_support", "validation_query"
+    )
+
+
+class RandomStreams(object):
+    """
+    Counter-based random numbers of a run: every draw comes from a generator determined by the seed of the run,
+    the purpose of the draw (stream, see STREAMS) and its position (e.g. training step and task slot in batch),
+    rather than from global generators whose state depends on all draws made before. Draws of a step are then
+    the same in whatever order, thread or process tasks are sampled (e.g. prefetching, sharded sampling, resumption).
+
+    Generators are numpy RandomState objects (same methods as np.random) on Philox bit generators: the key is
+    derived from (seed, stream, step) and each task slot starts at its own block of the counter.
+    """
+    def __init__(self, seed: int):
+        """
+        :param seed: seed of run
+        """
+        self.seed = int(seed or 0)
+
+    def _stream_index(self, stream: str) -> int:
+        if stream not in STREAMS:
+            raise ValueError("Unknown random stream {}, choose from {}".format(stream, ", ".join(STREAMS)))
+        return STREAMS.index(stream)
+
+    def generators(self, stream: str, step: int, slots: Iterable[int]) -> List[np.random.RandomState]:
+        """
+        Generator of each slot (e.g. task of batch) of step
+
+        :param stream: purpose of draws
+        :param step: step of draws (e.g. training step)
+        :param slots: indices of slots (e.g. range(task_batch_size), or part of it for a shard of the batch)
+
+        :return generators: one generator per slot
+        """
+        key = np.random.SeedSequence([self.seed, self._stream_index(stream), int(step)]).generate_state(2, np.uint64)
+        return [np.random.RandomState(np.random.Philox(key=key, counter=[0, int(slot), 0, 0])) for slot in slots]
+
+    def generator(self, stream: str, step: int=0, slot: int=0) -> np.random.RandomState:
+        """generator of single slot of step (same as of generators)"""
+        return self.generators(stream, step, [slot])[0]
+
+    def jax_key(self, stream: str, *counters: int):
+        """
+        jax PRNG key of stream (e.g. network initialisation), folded with counters (e.g. step)
+
+        :param stream: purpose of draws
+        :param counters: non-negative integers further identifying draws
+        """
+        from jax import random
+        key = random.fold_in(random.PRNGKey(self.seed), self._stream_index(stream))
+        for counter in counters:
+            key = random.fold_in(key, counter)
+        return key
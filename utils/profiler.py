@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import collections
+
+from typing import Any, Callable, Dict, List
+
+
+class PhaseProfiler(object):
+    """
+    Wall-clock profiler for the phases of the MAML training loop (sampling, batch generation,
+    compilation, device step, queue update, logging, checkpointing, validation).
+
+    Phases are timed with the phase context manager. Work dispatched asynchronously to a device
+    can be attributed to the phase that launched it by calling synchronise on the phase output
+    before leaving the context. Every summary_frequency steps a summary table of the interval is
+    printed (and written to tensorboard if a writer is given). If trace is set, every timed phase
+    is also appended to a chrome trace-format timeline (open in chrome://tracing or ui.perfetto.dev).
+
+    When disabled, phase returns a shared null context and all other methods return immediately.
+    """
+    def __init__(
+        self, enabled: bool, summary_frequency: int=100, trace: bool=True, save_path: str=None,
+        writer=None, synchronise_fn: Callable[[Any], None]=None
+        ):
+        self.enabled = bool(enabled)
+        self.summary_frequency = summary_frequency or 100
+        self.trace = bool(trace) and save_path is not None
+        self.writer = writer
+        self.synchronise_fn = synchronise_fn
+
+        self._null_context = contextlib.nullcontext()
+
+        self._origin = time.perf_counter()
+        self._interval_start = self._origin
+        self._interval_steps = 0
+
+        # per-phase statistics accumulated over current summary interval: [total time, calls, max time]
+        self._interval_statistics = collections.OrderedDict()
+
+        # trace events not yet written to disk
+        self._trace_events = []
+        self._trace_path = os.path.join(save_path, "profile_trace.json") if save_path else None
+        self._trace_started = False
+
+        # statistics of most recently summarised interval (e.g. for use by benchmarks)
+        self.last_summary = None
+
+        self._lock = threading.Lock()
+
+    def phase(self, name: str):
+        """
+        Context manager timing the enclosed block as the given phase.
+
+        :param name: name of phase (e.g. 'sample', 'device_step')
+        """
+        if not self.enabled:
+            return self._null_context
+        return self._timed_phase(name)
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter())
+
+    def synchronise(self, value: Any) -> Any:
+        """
+        Block until asynchronously dispatched computation producing value has finished
+        (no-op if profiling is disabled or no synchronisation function was given).
+
+        :param value: output of device computation (e.g. jax pytree or torch tensor)
+        :return value: same value, for convenience
+        """
+        if self.enabled and self.synchronise_fn is not None:
+            self.synchronise_fn(value)
+        return value
+
+    def _record(self, name: str, start: float, end: float) -> None:
+        duration = end - start
+        with self._lock:
+            statistics = self._interval_statistics.setdefault(name, [0., 0, 0.])
+            statistics[0] += duration
+            statistics[1] += 1
+            statistics[2] = max(statistics[2], duration)
+
+            if self.trace:
+                self._trace_events.append({
+                    "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                    "ts": (start - self._origin) * 1e6, "dur": duration * 1e6
+                    })
+
+    def step(self, step_count: int) -> None:
+        """
+        Mark the end of a training step. Produces summary (and flushes trace) at end of each interval.
+
+        :param step_count: iteration number of training (meta-steps)
+        """
+        if not self.enabled:
+            return
+        self._interval_steps += 1
+        if self._interval_steps >= self.summary_frequency:
+            self.summarise(step_count)
+
+    def get_interval_statistics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Statistics of each phase timed in the current interval
+
+        :return statistics: mapping from phase name to total (s), calls, mean (s) and max (s)
+        """
+        with self._lock:
+            return {
+                name: {"total": total, "calls": calls, "mean": total / calls, "max": maximum}
+                for name, (total, calls, maximum) in self._interval_statistics.items()
+                }
+
+    def summarise(self, step_count: int) -> None:
+        """
+        Print summary table of current interval, write per-phase means to tensorboard, flush
+        trace events and start a new interval.
+
+        :param step_count: iteration number of training (meta-steps)
+        """
+        if not self.enabled:
+            return
+        wall_time = time.perf_counter() - self._interval_start
+        statistics = self.get_interval_statistics()
+
+        self.last_summary = {"step": step_count, "steps": self._interval_steps, "wall_time": wall_time, "phases": statistics}
+
+        if statistics:
+            lines = [
+                "--- profile @ step {} ({} steps, {:.3f}s wall)".format(step_count, self._interval_steps, wall_time),
+                "{:<28}{:>12}{:>12}{:>12}{:>10}{:>9}".format("phase", "total (s)", "mean (ms)", "max (ms)", "calls", "% wall")
+                ]
+            for name, phase_statistics in sorted(statistics.items(), key=lambda item: -item[1]["total"]):
+                lines.append("{:<28}{:>12.3f}{:>12.3f}{:>12.3f}{:>10d}{:>9.1f}".format(
+                    name, phase_statistics["total"], 1000 * phase_statistics["mean"], 1000 * phase_statistics["max"],
+                    phase_statistics["calls"], 100 * phase_statistics["total"] / max(wall_time, 1e-12)
+                    ))
+            print("\n".join(lines))
+
+            if self.writer is not None:
+                for name, phase_statistics in statistics.items():
+                    self.writer.add_scalar('profiling/{}_mean_ms'.format(name), 1000 * phase_statistics["mean"], step_count)
+                if self._interval_steps:
+                    self.writer.add_scalar('profiling/steps_per_second', self._interval_steps / max(wall_time, 1e-12), step_count)
+
+        self._flush_trace()
+
+        with self._lock:
+            self._interval_statistics = collections.OrderedDict()
+        self._interval_steps = 0
+        self._interval_start = time.perf_counter()
+
+    def _flush_trace(self) -> None:
+        """
+        Append buffered events to trace file. Chrome's JSON array trace format does not
+        require the closing bracket so the file can be streamed to.
+        """
+        if not self.trace:
+            return
+        with self._lock:
+            events, self._trace_events = self._trace_events, []
+        if not events and self._trace_started:
+            return
+        os.makedirs(os.path.dirname(self._trace_path), exist_ok=True)
+        with open(self._trace_path, "a" if self._trace_started else "w") as f:
+            if not self._trace_started:
+                f.write("[\n")
+                self._trace_started = True
+            for event in events:
+                f.write(json.dumps(event) + ",\n")
+
+    def close(self) -> None:
+        """
+        Write out remaining trace events (call at end of training)
+        """
+        if self.enabled:
+            self._flush_trace()
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import pickle
+import random
+import signal
+import warnings
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+RUN_STATE_FILE = "run_state.pkl"
+METRICS_FILE = "metrics.json"
+
+
+def get_rng_states() -> Dict[str, Any]:
+    """states of python and numpy global random number generators"""
+    return {"python": random.getstate(), "numpy": np.random.get_state()}
+
+def set_rng_states(rng_states: Dict[str, Any]) -> None:
+    """restore states of python and numpy global random number generators (as returned by get_rng_states)"""
+    random.setstate(rng_states["python"])
+    np.random.set_state(rng_states["numpy"])
+
+def save_run_state(run_dir: str, run_state: Dict[str, Any]) -> str:
+    """
+    Write run state bundle to run directory. File is written in full before replacing the previous
+    bundle, so that a run pre-empted while saving still has a complete (older) bundle.
+
+    :param run_dir: directory of run (checkpoint path)
+    :param run_state: dictionary of (picklable) run state
+
+    :return path: path of run state bundle
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, RUN_STATE_FILE)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(run_state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    return path
+
+def load_run_state(path: str) -> Dict[str, Any]:
+    """
+    Load run state bundle
+
+    :param path: path of run state bundle or of run directory containing it
+    :return run_state: dictionary of run state
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, RUN_STATE_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError("No run state found at {}".format(path))
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def get_resume_path(params) -> Optional[str]:
+    """
+    Run state bundle to resume from (resume.run_state of configuration), if one is set. Empty or missing
+    keys (read as "Unknown Key" by MAMLParameters) do not count as a path.
+
+    :param params: parameters of run
+    :return path: path of run state bundle or of run directory containing it (None if not resuming)
+    """
+    path = params.get(["resume", "run_state"])
+    if not isinstance(path, str) or not path or path == "Unknown Key":
+        return None
+    return path
+
+def train_and_write_metrics(model, checkpoint_path: str, final_validation: bool) -> None:
+    """
+    Train model and, unless pre-empted, write metrics of completed run (e.g. collected by sweep.py) to metrics.json.
+    With asynchronous validation the trainer holds no validation loss, the run is then always validated once more.
+
+    :param model: MAML model
+    :param checkpoint_path: results folder of run
+    :param final_validation: whether to validate (without visualisation) once more at the end of training
+    """
+    t0 = time.time()
+    model.train()
+    if not model.preemption_handler.requested:
+        if final_validation or getattr(model, "async_validation", False):
+            model.validate(step_count=model.start_iteration + model.training_iterations, visualise=False)
+        metrics = {
+            "final_validation_loss": model.last_validation_loss, 
+            "training_time": time.time() - t0, 
+            "training_iterations": model.start_iteration + model.training_iterations
+            }
+        # final validation loss of each member of population training (jax)
+        if getattr(model, "members", None):
+            metrics["members"] = [dict(member, validation_loss=loss) for member, loss in zip(model.members, model.last_validation_losses or [])]
+        with open(os.path.join(checkpoint_path, METRICS_FILE), 'w') as f:
+            json.dump(metrics, f, indent=2)
+
+
+class PreemptionHandler(object):
+    """
+    Records receipt of termination signal (e.g. SIGTERM sent before pre-emption of a spot instance) so that
+    the training loop can write its run state and stop at the end of the current step.
+    """
+    def __init__(self, signals=(signal.SIGTERM,)):
+        self.requested = False
+        for signal_number in signals:
+            try:
+                signal.signal(signal_number, self._handle)
+            except ValueError:
+                # signal handlers can only be installed from main thread of main interpreter
+                warnings.warn("Could not install handler for signal {}, run state only saved periodically".format(signal_number), Warning)
+
+    def _handle(self, signal_number, frame) -> None:
+        print("Received signal {}, saving run state and stopping after current step".format(signal_number))
+        self.requested = True
@@ -0,0 +1,285 @@
+import os
+import json
+import collections
+
+import numpy as np
+from scipy import signal
+
+from typing import List, Sequence, Tuple
+
+SHARD_FILE = "shard_{:05d}.npy"
+EPISODE_INDEX_FILE = "episode_index.npy"
+BUCKET_OFFSETS_FILE = "bucket_offsets.npy"
+METADATA_FILE = "metadata.json"
+
+# row of episode index: shard file, position of first sample in shard, number of samples and metadata bucket of series
+EPISODE_INDEX_DTYPE = np.dtype([("shard", np.int32), ("offset", np.int64), ("length", np.int32), ("bucket", np.int32)])
+
+# splits of series, rows of bucket offsets table
+SPLITS = ("train", "validation")
+
+
+class SeriesShardWriter(object):
+    """
+    Writes recorded series (e.g. time-series segments) as series dataset, streaming: series are appended to a
+    buffer that is written as a shard file (float32 array of concatenated series, samples x channels) once it holds
+    shard_size samples, so at most one shard is held in memory. On close, the episode index (shard, offset, length
+    and bucket of each series, sorted by split and bucket) and the table of offsets of each bucket in it are written.
+
+    Each series is assigned to the train or validation split at random (with validation_fraction), so that both
+    splits cover the buckets.
+    """
+    def __init__(self, path: str, channels: int, num_buckets: int, shard_size: int=2 ** 22, validation_fraction: float=0.1, seed: int=0):
+        """
+        :param path: folder of dataset
+        :param channels: number of channels of series
+        :param num_buckets: number of metadata buckets (e.g. sensor type or recording condition), series have bucket 0 to num_buckets - 1
+        :param shard_size: number of samples after which a shard is written (longer series are written as shard of their own)
+        :param validation_fraction: probability of series being held out for validation
+        :param seed: seed of split assignment
+        """
+        if not 0. <= validation_fraction < 1.:
+            raise ValueError("Validation fraction must be in [0, 1), got {}".format(validation_fraction))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.channels = channels
+        self.num_buckets = num_buckets
+        self.shard_size = shard_size
+        self.validation_fraction = validation_fraction
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+
+        self._buffer = []
+        self._buffer_samples = 0
+        self._num_shards = 0
+        self._rows = []
+        self._splits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+
+    def add(self, series: np.ndarray, bucket: int) -> None:
+        """
+        :param series: samples of series (length x channels, or length for single channel)
+        :param bucket: metadata bucket of series
+        """
+        series = np.asarray(series, dtype=np.float32)
+        if series.ndim == 1:
+            series = series[:, None]
+        if series.ndim != 2 or series.shape[1] != self.channels:
+            raise ValueError("Series must have shape (length, {}), got {}".format(self.channels, series.shape))
+        if not 0 <= bucket < self.num_buckets:
+            raise ValueError("Bucket must be between 0 and {}, got {}".format(self.num_buckets - 1, bucket))
+
+        if self._buffer and self._buffer_samples + len(series) > self.shard_size:
+            self._write_shard()
+        self._rows.append((self._num_shards, self._buffer_samples, len(series), bucket))
+        self._splits.append(int(self.rng.random_sample() < self.validation_fraction))
+        self._buffer.append(series)
+        self._buffer_samples += len(series)
+
+    def _write_shard(self) -> None:
+        np.save(os.path.join(self.path, SHARD_FILE.format(self._num_shards)), np.concatenate(self._buffer))
+        self._num_shards += 1
+        self._buffer = []
+        self._buffer_samples = 0
+
+    def close(self) -> None:
+        """write last shard, episode index, bucket offsets and metadata"""
+        if self._buffer:
+            self._write_shard()
+        if not self._rows:
+            raise ValueError("Series dataset has no series")
+
+        index = np.array(self._rows, dtype=EPISODE_INDEX_DTYPE)
+        splits = np.array(self._splits)
+        order = np.lexsort((index["bucket"], splits))
+        counts = np.zeros((len(SPLITS), self.num_buckets), dtype=np.int64)
+        np.add.at(counts, (splits, index["bucket"]), 1)
+        # bucket b of split s spans rows bucket_offsets[s, b] to bucket_offsets[s, b + 1] of index
+        bucket_offsets = np.concatenate([[0], np.cumsum(counts)])[:-1].reshape(counts.shape)
+        bucket_offsets = np.concatenate([bucket_offsets, bucket_offsets[:, -1:] + counts[:, -1:]], axis=1)
+
+        np.save(os.path.join(self.path, EPISODE_INDEX_FILE), index[order])
+        np.save(os.path.join(self.path, BUCKET_OFFSETS_FILE), bucket_offsets)
+        with open(os.path.join(self.path, METADATA_FILE), "w") as f:
+            json.dump(dict(
+                num_series=len(index), num_shards=self._num_shards, channels=self.channels, num_buckets=self.num_buckets,
+                min_length=int(index["length"].min()), validation_fraction=self.validation_fraction, seed=self.seed
+                ), f, indent=2)
+        self._rows = []
+
+def make_synthetic_series_dataset(
+    path: str, num_series: int=10000, length_range: Tuple[int, int]=(200, 400), num_buckets: int=8, channels: int=1,
+    shard_size: int=2 ** 22, validation_fraction: float=0.1, seed: int=0
+    ) -> None:
+    """
+    Write synthetic series dataset: each series is a sum of a sinusoid (frequency in the band of its bucket,
+    random amplitude and phase) and AR(1) noise, e.g. for tests and benchmarks without recorded data
+
+    :param path: folder of dataset
+    :param num_series: number of series
+    :param length_range: range of series lengths (inclusive)
+    :param num_buckets: number of buckets (frequency bands of equal width, from 0.005 to 0.1 cycles per sample)
+    :param channels: number of channels (same frequency, random phase of each)
+    :param shard_size: number of samples per shard
+    :param validation_fraction: probability of series being held out for validation
+    :param seed: seed of series
+    """
+    rng = np.random.RandomState(seed)
+    band_edges = np.linspace(0.005, 0.1, num_buckets + 1)
+
+    with SeriesShardWriter(path, channels, num_buckets, shard_size=shard_size, validation_fraction=validation_fraction, seed=seed) as writer:
+        for _ in range(num_series):
+            bucket = rng.randint(num_buckets)
+            length = rng.randint(length_range[0], length_range[1] + 1)
+            frequency = rng.uniform(band_edges[bucket], band_edges[bucket + 1])
+            amplitude = rng.uniform(0.5, 2.)
+            phases = rng.uniform(0., 2. * np.pi, size=channels)
+            sinusoid = amplitude * np.sin(2. * np.pi * frequency * np.arange(length)[:, None] + phases)
+
+            noise = signal.lfilter([1.], [1., -0.8], rng.normal(0., 0.1, size=(length, channels)), axis=0)
+            writer.add(sinusoid + noise, bucket)
+
+
+class SeriesDataset(object):
+    """
+    Series dataset (see SeriesShardWriter) from which regression episodes are sampled: each series is a task,
+    its examples are windows of context_length samples (inputs) followed by forecast_length samples (targets).
+
+    Shards stay on disk (memory-mapped, at most max_open_shards at a time), only the samples of sampled windows are
+    read, with one gather per shard touched by a batch. Sampling a series (also within a bucket, through the bucket
+    offsets table) and its windows takes constant time, so the cost of a batch does not grow with the dataset.
+    """
+    def __init__(self, path: str, context_length: int, forecast_length: int, max_open_shards: int=4096):
+        """
+        :param path: folder of dataset
+        :param context_length: number of samples of window given as input
+        :param forecast_length: number of samples of window following context to be predicted
+        :param max_open_shards: number of shards kept memory-mapped (least recently used unmapped first)
+        """
+        if not os.path.isfile(os.path.join(path, EPISODE_INDEX_FILE)):
+            raise FileNotFoundError("No series dataset in {} (see utils.series.SeriesShardWriter)".format(path))
+        with open(os.path.join(path, METADATA_FILE), "r") as f:
+            self.metadata = json.load(f)
+        self.path = path
+        self.index = np.load(os.path.join(path, EPISODE_INDEX_FILE))
+        self.bucket_offsets = np.load(os.path.join(path, BUCKET_OFFSETS_FILE))
+
+        self.context_length = context_length
+        self.forecast_length = forecast_length
+        if self.window_length > self.metadata["min_length"]:
+            raise ValueError("Windows of {} samples longer than shortest series ({} samples)".format(self.window_length, self.metadata["min_length"]))
+
+        self.max_open_shards = max_open_shards
+        self._shards = collections.OrderedDict()
+
+    @property
+    def window_length(self) -> int:
+        return self.context_length + self.forecast_length
+
+    @property
+    def channels(self) -> int:
+        return self.metadata["channels"]
+
+    @property
+    def num_buckets(self) -> int:
+        return self.metadata["num_buckets"]
+
+    def bucket_counts(self, split: str="train") -> np.ndarray:
+        """number of series of each bucket in split"""
+        return np.diff(self.bucket_offsets[SPLITS.index(split)])
+
+    def _shard(self, shard: int) -> np.ndarray:
+        if shard in self._shards:
+            self._shards.move_to_end(shard)
+        else:
+            if len(self._shards) >= self.max_open_shards:
+                self._shards.popitem(last=False)
+            # plain array view of memory map (indexing np.memmap subclass has per-call overhead)
+            self._shards[shard] = np.asarray(np.load(os.path.join(self.path, SHARD_FILE.format(shard)), mmap_mode="r"))
+        return self._shards[shard]
+
+    def sample_series(self, rngs: List[np.random.RandomState], split: str="train", buckets: Sequence[int]=None) -> np.ndarray:
+        """
+        Series (rows of episode index) of each episode, uniform over split or over given buckets of split
+
+        :param rngs: random generator of each episode
+        :param split: 'train' or 'validation'
+        :param buckets: bucket of each episode (default: any bucket)
+
+        :return series: series of each episode
+        """
+        offsets = self.bucket_offsets[SPLITS.index(split)]
+        if buckets is None:
+            starts, ends = np.full(len(rngs), offsets[0]), np.full(len(rngs), offsets[-1])
+        else:
+            buckets = np.asarray(buckets)
+            starts, ends = offsets[buckets], offsets[buckets + 1]
+        if (ends <= starts).any():
+            raise ValueError("No series of {} split to sample from (buckets {})".format(split, buckets))
+        return np.array([start + rng.randint(end - start) for rng, start, end in zip(rngs, starts, ends)])
+
+    def sample_windows(self, rngs: List[np.random.RandomState], series: np.ndarray, num_windows: int) -> np.ndarray:
+        """
+        Start of num_windows windows (uniform over positions at which window fits in series) of each episode
+
+        :param rngs: random generator of each episode
+        :param series: series of each episode
+        :param num_windows: number of windows per episode
+
+        :return starts: start of each window in its series (episodes x num_windows)
+        """
+        num_positions = self.index["length"][series] - self.window_length + 1
+        return np.stack([rng.randint(positions, size=num_windows) for rng, positions in zip(rngs, num_positions)])
+
+    def gather(self, series: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """
+        Samples of windows, read with one gather per shard
+
+        :param series: series of each episode
+        :param starts: start of windows of each episode (episodes x windows)
+
+        :return windows: samples of windows (episodes x windows x window_length x channels), float32
+        """
+        rows = self.index[series]
+        positions = (rows["offset"][:, None] + starts).reshape(-1)
+        shards = np.repeat(rows["shard"], starts.shape[1])
+        window_offsets = np.arange(self.window_length)
+
+        # windows grouped by shard (one sort rather than a pass over windows per shard)
+        order = np.argsort(shards, kind="stable")
+        windows = np.empty((len(positions), self.window_length, self.channels), dtype=np.float32)
+        for selected in np.split(order, np.flatnonzero(np.diff(shards[order])) + 1):
+            windows[selected] = self._shard(shards[selected[0]])[positions[selected, None] + window_offsets]
+        return windows.reshape(starts.shape + (self.window_length, self.channels))
+
+    def sample_episodes(
+        self, rngs: List[np.random.RandomState], series: np.ndarray, shots: Sequence[int], normalise: bool=True
+        ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Inputs (context) and targets (forecast) of windows of batch of episodes, for several splits of each episode
+        (e.g. support and query), windows of all splits gathered in one read
+
+        :param rngs: random generator of each episode
+        :param series: series of each episode
+        :param shots: number of windows of each split
+        :param normalise: whether to standardise each window by mean and standard deviation of its context
+
+        :return splits: (inputs, targets) of each split, inputs (episodes x shots x context_length * channels),
+                        targets (episodes x shots x forecast_length * channels), float32
+        """
+        windows = self.gather(series, self.sample_windows(rngs, series, sum(shots)))
+        if normalise:
+            context = windows[:, :, :self.context_length]
+            windows = (windows - context.mean(axis=2, keepdims=True)) / (context.std(axis=2, keepdims=True) + np.float32(1e-6))
+
+        num_episodes = len(series)
+        inputs = windows[:, :, :self.context_length].reshape(num_episodes, sum(shots), -1)
+        targets = windows[:, :, self.context_length:].reshape(num_episodes, sum(shots), -1)
+        split_points = np.cumsum(shots)[:-1]
+        return list(zip(np.split(inputs, split_points, axis=1), np.split(targets, split_points, axis=1)))